@@ -51,6 +51,7 @@ MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'data_cleaning_app.metrics.RequestMetricsMiddleware', # Inside the session middleware, so its own save is not timed
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -135,4 +136,138 @@ CORS_ALLOW_CREDENTIALS = True
 
 # File upload settings 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# On-disk store for session DataFrames (see data_cleaning_app/storage.py).
+# Use 'data_cleaning_app.storage.ParquetDatasetStore' to trade read speed for disk space.
+DATASET_STORE = {
+    'BACKEND': 'data_cleaning_app.storage.ArrowDatasetStore',
+    'ROOT': os.path.join(BASE_DIR, 'datasets'),
+}
+
+# Per-worker LRU cache of live DataFrames (see data_cleaning_app/cache.py).
+DATAFRAME_CACHE = {
+    'MAX_BYTES': 512 * 1024 * 1024,
+}
+
+# Per-worker LRU cache of the parsed column forms filters compare against
+# (numbers, dates, text codes), so repeated filters on a column skip parsing it.
+COLUMN_VIEW_CACHE = {
+    'MAX_BYTES': 256 * 1024 * 1024,
+}
+
+# Undo/redo history per dataset (see data_cleaning_app/history.py).
+DATASET_HISTORY = {
+    'MAX_DEPTH': 50,                        # versions kept on the undo/redo timeline
+    'MAX_BYTES': 2 * 1024 * 1024 * 1024,    # disk per dataset, including snapshots
+    'SNAPSHOT_INTERVAL': 10,                # steps between snapshots, bounds replay cost
+}
+
+# How a session's lazy dataset is evaluated (see data_cleaning_app/outofcore.py): 'memory',
+# 'out-of-core' (CHUNK_ROWS rows at a time, for datasets larger than RAM), the dotted path
+# of a LazyFrame subclass, or 'auto' for out of core once a version reads OUT_OF_CORE_BYTES.
+DATASET_ENGINE = {
+    'ENGINE': 'auto',
+    'OUT_OF_CORE_BYTES': 2 * 1024 * 1024 * 1024,
+    'CHUNK_ROWS': 250_000,
+}
+
+# Lifetime of stored datasets (see data_cleaning_app/lifecycle.py). Sweeps run in the background
+# after uploads, every SWEEP_INTERVAL seconds per process (0: only `manage.py sweep_datasets`).
+DATASET_LIFECYCLE = {
+    'IDLE_TTL': 7 * 24 * 60 * 60,                   # seconds a dataset may go unopened
+    'ORPHAN_GRACE': 60 * 60,                        # seconds before deleting one whose session is gone
+    'SESSION_MAX_BYTES': 4 * 1024 * 1024 * 1024,    # disk per session; larger uploads are refused
+    'MAX_BYTES': 50 * 1024 * 1024 * 1024,           # disk for the whole store, least recently used evicted first
+    'SWEEP_INTERVAL': 15 * 60,
+}
+
+# Chunked CSV ingestion (see data_cleaning_app/ingest.py). Upload progress is kept in
+# the default cache; with several worker processes it must be a shared backend.
+DATASET_INGEST = {
+    'CSV_CHUNK_ROWS': 100_000,
+    'EXCEL_ENGINE': 'auto',         # 'calamine' (pip install python-calamine), 'openpyxl', or 'auto' for calamine if installed
+    'EXCEL_CHUNK_ROWS': 50_000,
+    'EXCEL_SHEET_WORKERS': 4,       # processes parsing sheets when several are loaded at once; 1 parses them in turn
+    'SAMPLE_ROWS': 1000,            # rows in the quick preview of a sample=true upload
+    'PROGRESS_TTL': 60 * 60,    # seconds
+}
+
+# Sampling mode for exploring large uploads (see data_cleaning_app/sampling.py): an upload with
+# sampling=reservoir or sampling=stratified (plus stratify_by) works on SAMPLE_ROWS rows until committed.
+DATASET_SAMPLING = {
+    'SAMPLE_ROWS': 100_000,
+    'SEED': None,   # an integer draws the same sample of the same file every time
+}
+
+# Uploads deduplicated by content hash (see data_cleaning_app/uploads.py): identical files
+# share one parsed data file through hard links. Entries no dataset uses any more are
+# deleted after UNUSED_TTL seconds, or sooner beyond MAX_UNUSED_BYTES.
+UPLOAD_CACHE = {
+    'ENABLED': True,
+    'MAX_UNUSED_BYTES': 4 * 1024 * 1024 * 1024,
+    'UNUSED_TTL': 24 * 60 * 60,    # seconds
+}
+
+# Memory-lean column types picked at upload (see data_cleaning_app/dtypes.py)
+DATASET_DTYPES = {
+    'OPTIMIZE': True,
+    'CATEGORY_MAX_UNIQUE': 1000,    # text columns with more distinct values stay strings
+    'CATEGORY_MAX_RATIO': 0.5,      # ...as do those where distinct values exceed this share of rows
+}
+
+# Column statistics behind the profile endpoint (see data_cleaning_app/stats.py)
+DATASET_STATS = {
+    'TOP_VALUES': 5,
+    'QUANTILES': [0.25, 0.5, 0.75],
+    'APPROXIMATE_ROWS': 1_000_000,  # above this, distinct counts and quantiles are estimated
+    'SAMPLE_ROWS': 100_000,         # rows sampled for approximate quantiles and top values
+    'HLL_PRECISION': 14,
+}
+
+# Background jobs for operations called with ?async=true (see data_cleaning_app/jobs.py)
+BACKGROUND_JOBS = {
+    'ROOT': os.path.join(BASE_DIR, 'jobs'),
+    'MAX_WORKERS': 2,
+    'RESULT_TTL': 24 * 60 * 60,  # seconds a finished job's record and result are kept
+}
+
+# Streaming downloads (see data_cleaning_app/export.py)
+DATASET_EXPORT = {
+    'CHUNK_ROWS': 50_000,   # rows evaluated and encoded at a time
+    'CHUNK_CELLS': 5_000_000,   # ...fewer for wide frames, so a chunk holds at most this many values
+}
+
+# Per-request phase timings behind the metrics endpoint (see data_cleaning_app/metrics.py)
+REQUEST_METRICS = {
+    'SECONDS_BUCKETS': [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300],
+    'BYTES_BUCKETS': [1024 * 4 ** i for i in range(12)],    # 1 KiB to 4 GiB
+    'ROWS_BUCKETS': [1_000, 10_000, 100_000, 1_000_000, 5_000_000, 10_000_000, 100_000_000],
+    'COLUMNS_BUCKETS': [5, 10, 25, 50, 100, 250, 1000, 10_000],
+    'LOG_REQUESTS': True,   # one structured log line per request
+}
+
+# Thread pools the views run on under ASGI (and WSGI); see data_cleaning_app/executors.py.
+# Uploads, operations, profiles and downloads share the heavy workers; previews, history
+# and job status use the light ones. Requests beyond a QUEUE_LIMIT get a 503 with Retry-After.
+VIEW_EXECUTORS = {
+    'HEAVY_WORKERS': 2,
+    'HEAVY_QUEUE_LIMIT': 32,
+    'LIGHT_WORKERS': 8,
+    'LIGHT_QUEUE_LIMIT': 256,
+}
+
+# Structured (JSON) log lines from the app; the views log here instead of printing
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'structured': {'()': 'data_cleaning_app.metrics.StructuredFormatter'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'structured'},
+    },
+    'loggers': {
+        'data_cleaning_app': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class DataCleaningAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'data_cleaning_app'
+
+    def ready(self):
+        import pandas as pd
+        # Lets cached versions of a dataset share the columns they have in common
+        pd.set_option('mode.copy_on_write', True)
+        # Text columns stored as strings load back Arrow-backed (see dtypes.py)
+        pd.set_option('mode.string_storage', 'pyarrow')
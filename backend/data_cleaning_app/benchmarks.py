@@ -0,0 +1,501 @@
+"""
+End-to-end benchmarks of every endpoint, over synthetic datasets.
+
+Datasets are generated CSVs in a few shapes (narrow or wide, numeric- or
+text-heavy, with nulls injected into every column) and sizes from 10k to
+5M rows. For each one, a fresh session uploads the file and then calls
+every URL in urls.py in a realistic order through Django's test client:
+previews, profiles, each operation, history moves, every download format
+and a background job, then uploads an .xlsx copy of datasets up to 100k
+rows (sample first, then in full). Run it with ``manage.py benchmark``;
+``--engine out-of-core`` runs every dataset through the out-of-core engine
+(see outofcore.py) whatever its size.
+
+Each request is timed end to end and split into phases by timing the
+functions the views call, exclusive of nested phases:
+
+- ``client``: encoding the request body in the test client
+- ``parse``: reading an upload into the dataset store
+- ``load``: opening the session's version and reading stored columns
+- ``op``: evaluating the lazy pipeline (filters, fills, encodings)
+- ``save``: recording steps and writing snapshots
+- ``stats``: computing column statistics
+- ``preview``: building preview rows
+- ``export``: encoding downloads
+- ``other``: the rest (request handling, response rendering)
+
+Peak memory is the process's resident set size, sampled in a background
+thread while the request runs (falling back to the lifetime peak where
+/proc is not available). Results are written as JSON together with the
+commit and library versions, and two result files can be compared
+endpoint by endpoint.
+"""
+import collections
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import openpyxl
+import pandas as pd
+from django.conf import settings
+from django.test import Client, override_settings
+from django.test import client as test_client
+from django.urls import reverse
+
+from . import urls, views
+from .cache import get_column_view_cache, get_dataframe_cache
+from .metrics import PhaseTimer
+from .outofcore import OutOfCoreFrame
+from .pipeline import LazyFrame
+from .storage import SESSION_DATASET_ID_KEY, SnapshotSource, get_dataset_store
+from .uploads import UploadCache, get_upload_cache
+
+SIZES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000, '5m': 5_000_000}
+# (numeric columns, text columns); every shape also has one date column
+SHAPES = {
+    'narrow-numeric': (8, 2),
+    'narrow-text': (2, 8),
+    'wide-numeric': (90, 10),
+    'wide-text': (20, 80),
+}
+NULL_FRACTION = 0.05
+GENERATE_CHUNK_ROWS = 250_000
+XLSX_MAX_ROWS = 1_048_575 # A sheet's row limit, minus the header
+EXCEL_UPLOAD_MAX_ROWS = 100_000 # Writing bigger workbooks to upload takes minutes
+JOB_TIMEOUT = 600
+
+WORDS = np.array([
+    'alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel', 'india', 'juliet', 'kilo', 'lima',
+])
+
+
+# -----------------------------------------
+# Datasets
+# -----------------------------------------
+
+def dataset_columns(shape):
+    numeric, text = SHAPES[shape]
+    return [f"num_{i}" for i in range(numeric)] + [f"txt_{i}" for i in range(text)] + ['date_0']
+
+
+def _dataset_chunk(shape, start, rows, rng):
+    """Rows ``start`` to ``start + rows`` of a dataset: even text columns have a dozen values, odd ones are near-unique."""
+    numeric, text = SHAPES[shape]
+    data = {}
+    for i in range(numeric):
+        data[f"num_{i}"] = rng.normal(size=rows) if i % 2 == 0 else rng.integers(0, 1000, rows).astype(float)
+    for i in range(text):
+        if i % 2 == 0:
+            data[f"txt_{i}"] = WORDS[rng.integers(0, len(WORDS), rows)]
+        else:
+            data[f"txt_{i}"] = np.char.add('id-', rng.integers(0, 10 * (start + rows), rows).astype(str))
+    data['date_0'] = pd.Timestamp('2020-01-01') + pd.to_timedelta(start + np.arange(rows), unit='min')
+    df = pd.DataFrame(data).astype(object)
+    for name in df.columns:
+        df.loc[rng.random(rows) < NULL_FRACTION, name] = None
+    return df
+
+
+def generate_dataset(shape, rows, path, seed=0):
+    """Write a ``shape`` dataset of ``rows`` rows as CSV to ``path``, chunk by chunk."""
+    rng = np.random.default_rng(seed)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', newline='') as f:
+        for start in range(0, rows, GENERATE_CHUNK_ROWS):
+            chunk = _dataset_chunk(shape, start, min(GENERATE_CHUNK_ROWS, rows - start), rng)
+            chunk.to_csv(f, index=False, header=start == 0)
+    os.replace(tmp_path, path)
+
+
+def dataset_path(data_dir, shape, size, seed=0):
+    """The CSV of a dataset, generated on first use and reused after that so runs compare like with like."""
+    path = os.path.join(data_dir, f"{shape}-{size}-seed{seed}.csv")
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        generate_dataset(shape, SIZES[size], path, seed)
+    return path
+
+
+def excel_dataset_path(csv_path):
+    """An .xlsx copy of a dataset's CSV, written on first use."""
+    path = f"{os.path.splitext(csv_path)[0]}.xlsx"
+    if not os.path.exists(path):
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        header = True
+        for chunk in pd.read_csv(csv_path, chunksize=GENERATE_CHUNK_ROWS, parse_dates=['date_0']):
+            if header:
+                sheet.append(list(chunk.columns))
+                header = False
+            for row in chunk.astype(object).where(chunk.notna(), None).itertuples(index=False):
+                sheet.append(list(row))
+        workbook.save(f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+    return path
+
+
+# -----------------------------------------
+# Measuring
+# -----------------------------------------
+
+# (phase, owner, attribute) of the functions each phase is timed by
+PHASE_FUNCTIONS = [
+    ('client', test_client, 'encode_multipart'),
+    ('parse', views, 'ingest_session_csv'),
+    ('parse', views, 'ingest_session_excel'),
+    ('parse', views, 'read_sample'),
+    ('parse', views, 'list_upload_sheets'),
+    ('load', views, 'get_session_frame'),
+    ('load', views, 'load_session_dataset'),
+    ('load', SnapshotSource, 'read'),
+    ('load', SnapshotSource, 'take'),
+    ('op', LazyFrame, 'collect'),
+    ('op', LazyFrame, 'head'),
+    ('op', LazyFrame, 'window'),
+    ('op', LazyFrame, '__len__'),
+    ('op', OutOfCoreFrame, 'then'),
+    ('op', OutOfCoreFrame, 'window'),
+    ('op', OutOfCoreFrame, '__len__'),
+    ('save', views, 'append_session_step'),
+    ('save', views, 'append_session_steps'),
+    ('save', views, 'save_session_dataset'),
+    ('stats', views, 'session_column_stats'),
+    ('preview', views.Helpers, '_prepare_preview_response'),
+    ('preview', views.Helpers, '_json_rows'),
+]
+ITERATOR_PHASE_FUNCTIONS = [
+    ('export', views, 'export_blocks'),
+]
+
+
+@contextlib.contextmanager
+def instrumented(timer):
+    """Time the functions in PHASE_FUNCTIONS while the block runs; the originals are restored after."""
+    originals = []
+    try:
+        for wrap, functions in ((timer.wrap, PHASE_FUNCTIONS), (timer.wrap_iterator, ITERATOR_PHASE_FUNCTIONS)):
+            for phase, owner, name in functions:
+                original = owner.__dict__[name] if isinstance(owner, type) else getattr(owner, name)
+                originals.append((owner, name, original))
+                setattr(owner, name, wrap(phase, original))
+        yield timer
+    finally:
+        for owner, name, original in reversed(originals):
+            setattr(owner, name, original)
+
+
+def _rss_bytes():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+class PeakMemory:
+    """Peak resident set size while the block runs, sampled every ``interval`` seconds."""
+    interval = 0.002
+
+    def __init__(self):
+        self.start_bytes = self.peak_bytes = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        try:
+            self.start_bytes = self.peak_bytes = _rss_bytes()
+        except OSError:
+            return self # No /proc: fall back to the lifetime peak on exit
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_bytes = max(self.peak_bytes, _rss_bytes())
+
+    def __exit__(self, *exc):
+        if self._thread is None:
+            scale = 1 if sys.platform == 'darwin' else 1024 # ru_maxrss is in bytes on macOS, KiB elsewhere
+            self.peak_bytes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+            return
+        self._stop.set()
+        self._thread.join()
+        self.peak_bytes = max(self.peak_bytes, _rss_bytes())
+
+
+# -----------------------------------------
+# Running
+# -----------------------------------------
+
+def _client_host():
+    hosts = [h.lstrip('.') for h in settings.ALLOWED_HOSTS if h != '*']
+    return hosts[0] if hosts else 'localhost'
+
+
+class EndpointRunner:
+    """Calls endpoints on one session and records a result per request."""
+
+    def __init__(self, dataset, run, timer, cold=False, skip=()):
+        self.dataset = dataset
+        self.run = run
+        self.timer = timer
+        self.cold = cold
+        self.skip = set(skip)
+        self.client = Client(HTTP_HOST=_client_host())
+        self.results = []
+        self.covered = set()
+
+    def call(self, url_name, method='get', data=None, url_kwargs=None, query='', label=None, **extra):
+        """Request ``url_name`` and record it; returns the response, or None if skipped."""
+        label = label or url_name
+        self.covered.add(url_name)
+        if url_name in self.skip or label in self.skip:
+            return None
+        path = reverse(url_name, kwargs=url_kwargs) + query
+        if method != 'get' and not extra.pop('multipart', False):
+            extra.setdefault('content_type', 'application/json')
+        if data is not None:
+            extra['data'] = data
+        if self.cold:
+            get_dataframe_cache().clear()
+            get_column_view_cache().clear()
+        self.timer.reset()
+        with PeakMemory() as memory:
+            start = time.perf_counter()
+            response = getattr(self.client, method)(path, **extra)
+            size = sum(len(block) for block in response.streaming_content) if response.streaming else len(response.content)
+            seconds = time.perf_counter() - start
+        phases = {name: round(value, 6) for name, value in self.timer.totals.items() if value > 0}
+        phases['other'] = round(max(0.0, seconds - sum(self.timer.totals.values())), 6)
+        self.results.append({
+            'dataset': self.dataset, 'run': self.run, 'endpoint': label, 'url_name': url_name,
+            'method': method.upper(), 'path': path, 'status': response.status_code,
+            'seconds': round(seconds, 6), 'phases': phases, 'response_bytes': size,
+            'peak_rss_mb': round(memory.peak_bytes / 2 ** 20, 1),
+            'rss_growth_mb': round((memory.peak_bytes - (memory.start_bytes or memory.peak_bytes)) / 2 ** 20, 1),
+        })
+        return response
+
+    def json(self, response):
+        return {} if response is None or response.streaming else response.json()
+
+
+def _wait_for_job(runner, job_id):
+    deadline = time.monotonic() + JOB_TIMEOUT
+    while time.monotonic() < deadline:
+        response = runner.call('job-status', url_kwargs={'job_id': job_id})
+        if response is None or runner.json(response).get('status') in ('succeeded', 'failed', 'cancelled'):
+            return
+        time.sleep(0.05)
+
+
+def _forget_upload(path, kind='csv'):
+    upload_cache = get_upload_cache()
+    if upload_cache is not None:
+        with open(path, 'rb') as f:
+            digest = hashlib.file_digest(f, 'sha256').hexdigest()
+        upload_cache.discard(UploadCache.key(digest, kind))
+
+
+def run_scenario(runner, csv_path, shape, num_rows):
+    """Upload ``csv_path`` and call every endpoint once, in the order a user would."""
+    numeric = [f"num_{i}" for i in range(SHAPES[shape][0])]
+    upload_id = f"benchmark-{os.getpid()}-{runner.run}"
+    _forget_upload(csv_path) # So that 'upload' always includes parsing
+    with open(csv_path, 'rb') as f:
+        runner.call('manage-dataframe', 'post', {'file': f, 'upload_id': upload_id}, label='upload', multipart=True)
+    with open(csv_path, 'rb') as f:
+        runner.call('manage-dataframe', 'post', {'file': f}, label='upload-dedup', multipart=True)
+    runner.call('upload-progress', query=f"?upload_id={upload_id}")
+    runner.call('manage-dataframe', label='preview-full')
+    runner.call('preview', query=f"?offset={num_rows // 2}&limit=100")
+    runner.call('preview', query="?limit=100&sort_by=num_0", label='preview-sorted')
+    runner.call('profile')
+    runner.call('memory-report')
+    runner.call('cache-stats')
+    runner.call('upload-cache-stats')
+    runner.call('column-view-cache-stats')
+    runner.call('metrics')
+    runner.call('executors')
+    runner.covered.add('storage') # Staff only; the benchmark client is anonymous
+
+    runner.call('op-filter-rows', 'post', {'column_name': 'num_0', 'operator': '>', 'value': '-1'})
+    # Filters that keep every row, twice on the same text column; the second reuses its typed views
+    runner.call('op-filter-rows', 'post', {'column_name': 'txt_1', 'operator': '!=', 'value': '~'}, label='op-filter-rows-text')
+    runner.call('op-filter-rows', 'post', {'column_name': 'txt_1', 'operator': 'not_contains', 'value': '~'}, label='op-filter-rows-text-again')
+    runner.call('op-replace-missing-rows', 'post', {'fill_strategy': 'mean', 'columns_to_fill': numeric[:5]})
+    runner.call('op-drop-missing', 'post', {'strat': 'all'})
+    runner.call('op-encode', 'post', {'encoding_strategy': 'one-hot', 'columns_to_encode': ['txt_0']})
+    runner.call('manage-dataframe', 'put', {'column_name': numeric[1]}, label='drop-column')
+    runner.call('op-drop-duplicates', 'post', {'columns': ['txt_1'], 'dry_run': True}, label='op-drop-duplicates-dry-run')
+    runner.call('op-drop-duplicates', 'post', {'columns': [numeric[0], 'txt_1']})
+    runner.call('op-batch', 'post', {'operations': [
+        {'operation': 'filter-rows', 'column_name': 'num_0', 'operator': '<', 'value': '2'},
+        {'operation': 'replace-missing-rows', 'fill_strategy': 'mode', 'columns_to_fill': ['txt_1']},
+    ]})
+
+    versions = runner.json(runner.call('history')).get('versions') or []
+    runner.call('history-undo', 'post')
+    runner.call('history-redo', 'post')
+    if len(versions) > 1:
+        runner.call('history-jump', 'post', {'version': versions[1]['version']})
+        runner.call('history-jump', 'post', {'version': versions[-1]['version']}, label='history-jump-back')
+
+    for url_name in ('download-csv', 'download-csv-gz', 'download-parquet', 'download-xlsx', 'download-recipe'):
+        if url_name == 'download-xlsx' and num_rows > XLSX_MAX_ROWS:
+            runner.covered.add(url_name)
+            continue
+        runner.call(url_name)
+
+    # Sampling mode: explore a 1% sample, discard it, then sample again and commit to the full data
+    sampling = {'sampling': 'stratified', 'stratify_by': 'txt_0', 'sample_rows': max(num_rows // 100, 100)}
+    with open(csv_path, 'rb') as f:
+        runner.call('manage-dataframe', 'post', {'file': f, **sampling}, label='upload-sampling', multipart=True)
+    runner.call('sampling')
+    runner.call('op-filter-rows', 'post', {'column_name': 'num_0', 'operator': '>', 'value': '-1'}, label='op-filter-rows-sampled')
+    runner.call('sampling-discard', 'post')
+    with open(csv_path, 'rb') as f:
+        runner.call('manage-dataframe', 'post', {'file': f, **sampling, 'sampling': 'reservoir'}, label='upload-sampling-reservoir', multipart=True)
+    runner.call('op-replace-missing-rows', 'post', {'fill_strategy': 'mean', 'columns_to_fill': numeric[:5]}, label='op-replace-missing-rows-sampled')
+    runner.call('op-filter-rows', 'post', {'column_name': 'num_0', 'operator': '>', 'value': '-1'}, label='op-filter-rows-sampled')
+    runner.call('sampling-commit', 'post')
+
+    response = runner.call('op-filter-rows', 'post', {'column_name': 'num_0', 'operator': '>', 'value': '0'}, query='?async=true', label='op-filter-rows-async')
+    job_id = runner.json(response).get('job_id')
+    if job_id:
+        _wait_for_job(runner, job_id)
+        runner.call('job-result', url_kwargs={'job_id': job_id})
+        runner.call('job-cancel', 'post', url_kwargs={'job_id': job_id})
+    else:
+        runner.covered.update({'job-status', 'job-result', 'job-cancel'})
+
+    if num_rows > EXCEL_UPLOAD_MAX_ROWS:
+        runner.covered.add('excel-sheets')
+        return
+    xlsx_path = excel_dataset_path(csv_path)
+    with open(xlsx_path, 'rb') as f:
+        runner.call('excel-sheets', 'post', {'file': f}, multipart=True)
+    _forget_upload(xlsx_path, 'xlsx')
+    with open(xlsx_path, 'rb') as f:
+        response = runner.call('manage-dataframe', 'post', {'file': f, 'sample': 'true'}, label='upload-xlsx-sample', multipart=True)
+    job_id = runner.json(response).get('job_id')
+    if job_id:
+        _wait_for_job(runner, job_id)
+    _forget_upload(xlsx_path, 'xlsx')
+    with open(xlsx_path, 'rb') as f:
+        runner.call('manage-dataframe', 'post', {'file': f}, label='upload-xlsx', multipart=True)
+
+
+def _retire_session(runner):
+    dataset_id = runner.client.session.get(SESSION_DATASET_ID_KEY)
+    if dataset_id:
+        get_dataset_store().delete(dataset_id)
+        get_dataframe_cache().discard_dataset(dataset_id)
+        get_column_view_cache().discard_dataset(dataset_id)
+
+
+def uncovered_endpoints(covered):
+    return sorted(p.name for p in urls.urlpatterns if p.name not in covered)
+
+
+def run_benchmarks(shapes, sizes, data_dir, repeat=1, cold=False, skip=(), progress=None, engine=None):
+    """
+    Benchmark every endpoint over each (shape, size) dataset ``repeat`` times;
+    returns the result records. ``engine`` overrides DATASET_ENGINE['ENGINE'].
+    """
+    results, covered = [], set()
+    timer = PhaseTimer()
+    engine_settings = contextlib.nullcontext()
+    if engine is not None:
+        engine_settings = override_settings(DATASET_ENGINE={**getattr(settings, 'DATASET_ENGINE', {}), 'ENGINE': engine})
+    logging.disable(logging.INFO) # Per-request log lines would drown the progress output
+    try:
+        with engine_settings, instrumented(timer):
+            for size in sizes:
+                for shape in shapes:
+                    csv_path = dataset_path(data_dir, shape, size)
+                    dataset = f"{shape}-{size}"
+                    for run in range(repeat):
+                        runner = EndpointRunner(dataset, run, timer, cold=cold, skip=skip)
+                        try:
+                            run_scenario(runner, csv_path, shape, SIZES[size])
+                        finally:
+                            _retire_session(runner)
+                        results.extend(runner.results)
+                        covered |= runner.covered
+                        if progress:
+                            progress(dataset, run, runner.results)
+    finally:
+        logging.disable(logging.NOTSET)
+    return results, uncovered_endpoints(covered)
+
+
+# -----------------------------------------
+# Reports
+# -----------------------------------------
+
+def _git(*args):
+    try:
+        return subprocess.run(['git', *args], cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment():
+    import django
+    import pyarrow
+    return {
+        'commit': _git('rev-parse', 'HEAD') or None,
+        'dirty': bool(_git('status', '--porcelain', '--untracked-files=no')),
+        'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+        'django': django.get_version(), 'pandas': pd.__version__, 'numpy': np.__version__, 'pyarrow': pyarrow.__version__,
+        'dataset_store': getattr(settings, 'DATASET_STORE', {}).get('BACKEND'),
+        'dataset_engine': getattr(settings, 'DATASET_ENGINE', {}).get('ENGINE'),
+    }
+
+
+def median_seconds(results):
+    """{(dataset, endpoint): median seconds over the runs} of the successful requests."""
+    runs = collections.defaultdict(list)
+    for result in results:
+        if result['status'] < 400:
+            runs[(result['dataset'], result['endpoint'])].append(result['seconds'])
+    return {key: statistics.median(values) for key, values in runs.items()}
+
+
+def compare(baseline, current, threshold=0.2):
+    """
+    Rows of ``(dataset, endpoint, baseline seconds, current seconds, ratio,
+    regressed)`` for the requests both result files have; ``regressed``
+    when the current median is more than ``threshold`` slower.
+    """
+    before, after = median_seconds(baseline['results']), median_seconds(current['results'])
+    rows = []
+    for key in sorted(before.keys() & after.keys()):
+        ratio = after[key] / before[key] if before[key] else float('inf')
+        rows.append((*key, before[key], after[key], ratio, ratio > 1 + threshold))
+    return rows
+
+
+def build_report(config, results, uncovered):
+    return {'benchmark': 1, 'created_at': time.time(), 'environment': environment(), 'config': config,
+            'uncovered_endpoints': uncovered, 'results': results}
+
+
+def write_report(path, report):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=1)
+
+
+def read_report(path):
+    with open(path) as f:
+        return json.load(f)
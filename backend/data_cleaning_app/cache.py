@@ -0,0 +1,120 @@
+"""
+Per-worker in-memory cache of live DataFrames.
+
+Entries are keyed by (session key, dataset id, version) and evicted in LRU
+order once the total ``df.memory_usage(deep=True)`` exceeds the configured
+budget. The dataset store stays the source of truth; the cache only saves
+deserialization for consecutive requests that land on the same worker.
+
+A second cache, with its own budget, keeps the typed forms of columns that
+filters compare against (see ColumnViews in pipeline.py), keyed by (kind,
+dataset id, version, column), so repeated filters on a column don't parse it
+again.
+"""
+import functools
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+from django.conf import settings
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_COLUMN_VIEW_MAX_BYTES = 256 * 1024 * 1024
+
+
+def dataframe_nbytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class DataFrameCache:
+    nbytes = staticmethod(dataframe_nbytes)
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # key -> (df, nbytes), least recently used first
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, count=True):
+        """Return the cached frame or None. ``count=False`` keeps the lookup out of the hit/miss stats."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += count
+                return None
+            self._entries.move_to_end(key)
+            self.hits += count
+            return entry[0]
+
+    def put(self, key, df):
+        nbytes = self.nbytes(df)
+        with self._lock:
+            self._pop(key)
+            if nbytes > self.max_bytes:
+                return # Would evict everything else and still not fit
+            self._entries[key] = (df, nbytes)
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._pop(oldest_key)
+                self.evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def discard_dataset(self, dataset_id):
+        """Drop every cached version of ``dataset_id``."""
+        with self._lock:
+            for key in [k for k in self._entries if k[1] == dataset_id]:
+                self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[1]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "current_bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": (self.hits / lookups) if lookups else None,
+            }
+
+
+@functools.lru_cache(maxsize=None)
+def get_dataframe_cache():
+    config = getattr(settings, 'DATAFRAME_CACHE', {})
+    return DataFrameCache(max_bytes=config.get('MAX_BYTES', DEFAULT_MAX_BYTES))
+
+
+def column_view_nbytes(view):
+    if isinstance(view, pd.Series):
+        return int(view.memory_usage(index=False)) # Views of numbers, dates or flags; text is kept as codes
+    codes, values = view
+    return int(codes.nbytes + values.memory_usage(deep=True))
+
+
+class ColumnViewCache(DataFrameCache):
+    """Typed column views keyed by (kind, dataset id, version, column); see the module docstring."""
+    nbytes = staticmethod(column_view_nbytes)
+
+
+@functools.lru_cache(maxsize=None)
+def get_column_view_cache():
+    config = getattr(settings, 'COLUMN_VIEW_CACHE', {})
+    return ColumnViewCache(max_bytes=config.get('MAX_BYTES', DEFAULT_COLUMN_VIEW_MAX_BYTES))
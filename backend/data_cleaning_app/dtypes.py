@@ -0,0 +1,161 @@
+"""
+Memory-lean column types, chosen once when a dataset is ingested.
+
+pandas reads every text column as ``object`` and every number as 64 bits.
+At ingest each column is profiled (over all chunks of a CSV) and given the
+smallest type that holds its values exactly:
+
+- text with few distinct values: ``category``, categories sorted
+- other text: Arrow-backed ``string``
+- integers: the narrowest signed int; nullable ``Int8``..``Int64`` when
+  values are missing (read_csv would have made those float64)
+- floats: ``float32`` when every value survives the round trip
+- booleans with missing values: nullable ``boolean``
+
+The stored Arrow files carry pandas metadata, so these types come back on
+every load and the pipeline steps work on them as they are. The pandas-
+default memory of each column is recorded next to the dataset so the
+savings can be reported later.
+"""
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from django.conf import settings
+
+from .storage import _to_arrow_table
+
+DEFAULT_DTYPES = {
+    'OPTIMIZE': True,
+    'CATEGORY_MAX_UNIQUE': 1000,
+    'CATEGORY_MAX_RATIO': 0.5,
+}
+
+_INT_BITS = (8, 16, 32, 64)
+
+
+def _config():
+    return {**DEFAULT_DTYPES, **getattr(settings, 'DATASET_DTYPES', {})}
+
+
+class ColumnProfile:
+    """What is known about one column after seeing some of its chunks."""
+
+    def __init__(self, max_unique):
+        self.max_unique = max_unique
+        self.type = None
+        self.num_rows = 0
+        self.null_count = 0
+        self.min = None
+        self.max = None
+        self.integral = True # Every float value is a whole number
+        self.float32_exact = True
+        self.uniques = set() # None once there are more than max_unique
+
+    def update(self, array):
+        self.type = array.type
+        self.num_rows += len(array)
+        self.null_count += array.null_count
+        if array.null_count == len(array):
+            return
+        values = array.drop_null()
+
+        if pa.types.is_string(array.type) or pa.types.is_large_string(array.type):
+            if self.uniques is not None:
+                self.uniques.update(pc.unique(values).to_pylist())
+                if len(self.uniques) > self.max_unique:
+                    self.uniques = None
+        elif pa.types.is_integer(array.type) or pa.types.is_floating(array.type):
+            bounds = pc.min_max(values).as_py()
+            self.min = bounds['min'] if self.min is None else min(self.min, bounds['min'])
+            self.max = bounds['max'] if self.max is None else max(self.max, bounds['max'])
+            if pa.types.is_floating(array.type):
+                if self.integral:
+                    whole = pc.and_(pc.is_finite(values), pc.equal(pc.floor(values), values))
+                    self.integral = pc.all(whole).as_py()
+                if self.float32_exact:
+                    round_trip = values.cast(pa.float32(), safe=False).cast(array.type)
+                    self.float32_exact = pc.all(pc.equal(round_trip, values)).as_py()
+
+    def _int_dtype(self, nullable):
+        for bits in _INT_BITS:
+            info = np.iinfo(f'int{bits}')
+            if info.min <= self.min and self.max <= info.max:
+                return pd.api.types.pandas_dtype(f'Int{bits}' if nullable else f'int{bits}')
+        return None
+
+    def target_dtype(self, config):
+        """The pandas dtype to store the column as, or None to keep the one it has."""
+        present = self.num_rows - self.null_count
+        if self.type is None or present == 0:
+            return None
+        if pa.types.is_string(self.type) or pa.types.is_large_string(self.type):
+            if self.uniques is not None and len(self.uniques) <= config['CATEGORY_MAX_RATIO'] * present:
+                return pd.CategoricalDtype(sorted(self.uniques))
+            return pd.StringDtype('pyarrow')
+        if pa.types.is_boolean(self.type):
+            return pd.BooleanDtype() if self.null_count else None
+        if pa.types.is_integer(self.type) or (pa.types.is_floating(self.type) and self.integral):
+            dtype = self._int_dtype(nullable=self.null_count > 0)
+            if dtype is not None:
+                return dtype
+        if pa.types.is_floating(self.type) and self.float32_exact:
+            return np.dtype('float32')
+        return None
+
+
+def profile_tables(tables, names):
+    """A ColumnProfile per column of ``names``, fed with every table in ``tables``."""
+    max_unique = _config()['CATEGORY_MAX_UNIQUE']
+    profiles = {name: ColumnProfile(max_unique) for name in names}
+    for table in tables:
+        for name, profile in profiles.items():
+            profile.update(table.column(name))
+    return profiles
+
+
+def target_dtypes(profiles):
+    """{column: pandas dtype} for the columns whose type should change."""
+    config = _config()
+    if not config['OPTIMIZE']:
+        return {}
+    targets = {name: profile.target_dtype(config) for name, profile in profiles.items()}
+    return {name: dtype for name, dtype in targets.items() if dtype is not None}
+
+
+def optimized_schema(schema, dtypes):
+    """The Arrow schema (with pandas metadata) of a ``schema`` table converted to ``dtypes``."""
+    empty = schema.empty_table().to_pandas().astype(dtypes)
+    return pa.Schema.from_pandas(empty, preserve_index=False)
+
+
+def convert_table(table, dtypes, schema):
+    """``table`` with its columns converted to ``dtypes``, as a table of ``schema``."""
+    df = table.to_pandas().astype(dtypes)
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+
+def optimize_frame(df):
+    """``df`` with every column converted to its memory-lean type."""
+    table = _to_arrow_table(df, preserve_index=False)
+    dtypes = target_dtypes(profile_tables([table], table.column_names))
+    return table.to_pandas().astype(dtypes)
+
+
+def column_memory(df):
+    """{column: (dtype name, bytes in memory)}."""
+    usage = df.memory_usage(index=False, deep=True)
+    return {str(name): (str(df[name].dtype), int(usage[name])) for name in df.columns}
+
+
+def merge_column_memory(total, part):
+    """Add the ``column_memory`` of another chunk of the same frame to ``total``."""
+    for name, (dtype, nbytes) in part.items():
+        if name not in total:
+            total[name] = (dtype, nbytes)
+            continue
+        seen_dtype, seen_bytes = total[name]
+        if seen_dtype != dtype: # What a whole-file read would have settled on
+            seen_dtype = 'float64' if {seen_dtype, dtype} <= {'int64', 'float64'} else 'object'
+        total[name] = (seen_dtype, seen_bytes + nbytes)
+    return total
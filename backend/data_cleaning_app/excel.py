@@ -0,0 +1,180 @@
+"""
+Reading .xlsx workbooks: listing their sheets and reading a sheet in chunks.
+
+``pd.read_excel`` with openpyxl wraps every cell of the sheet in a cell
+object and holds the whole sheet before building the frame. Sheets are
+read here by one of two engines instead:
+
+- ``calamine``: the Rust reader of python-calamine, through pandas; used
+  when it is installed
+- ``openpyxl``: openpyxl's read-only mode, streaming plain cell values row
+  by row, a chunk of rows at a time
+
+The ``auto`` engine picks calamine when it is installed. Either engine
+yields the sheet as DataFrame chunks with the column names and missing
+values ``read_excel`` would give. ingest.py types and stores those chunks
+like CSV chunks.
+"""
+import importlib.util
+import json
+
+import openpyxl
+import pandas as pd
+
+ENGINES = ('calamine', 'openpyxl')
+ALL_SHEETS = '*'
+
+# The strings read_csv and read_excel read as missing values
+NA_STRINGS = frozenset([
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+])
+
+
+class SheetError(ValueError):
+    pass
+
+
+def resolve_engine(engine='auto'):
+    if engine == 'auto':
+        return 'calamine' if importlib.util.find_spec('python_calamine') else 'openpyxl'
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown Excel engine {engine!r}; expected 'auto' or one of {', '.join(ENGINES)}.")
+    return engine
+
+
+def _open_workbook(path):
+    return openpyxl.load_workbook(path, read_only=True, data_only=True, keep_links=False)
+
+
+def list_sheets(path, engine='auto'):
+    """
+    The workbook's sheets as ``{'index', 'name', 'rows', 'columns'}``; rows
+    (below the header) and columns are as recorded in the file, or None.
+    """
+    if resolve_engine(engine) == 'calamine':
+        names = pd.ExcelFile(path, engine='calamine').sheet_names
+        return [{'index': i, 'name': name, 'rows': None, 'columns': None} for i, name in enumerate(names)]
+    workbook = _open_workbook(path)
+    try:
+        return [{
+            'index': i, 'name': sheet.title,
+            'rows': max(sheet.max_row - 1, 0) if sheet.max_row is not None else None,
+            'columns': sheet.max_column,
+        } for i, sheet in enumerate(workbook.worksheets)]
+    finally:
+        workbook.close()
+
+
+def parse_sheet_selection(value):
+    """
+    A sheet selection from a request: a sheet name, a 0-based index, ``*`` for
+    every sheet or a JSON list of names and indexes. None means the first sheet.
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, str) and value.startswith('['):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            raise SheetError(f"Invalid sheet list: {value}")
+        if not isinstance(value, list) or not value:
+            raise SheetError("The sheet list must be a non-empty JSON list.")
+    return value
+
+
+def select_sheets(names, selection):
+    """The sheet names ``selection`` (see ``parse_sheet_selection``) picks out of ``names``."""
+    if not names:
+        raise SheetError("The workbook has no sheets.")
+    if selection is None:
+        return names[:1]
+    if selection == ALL_SHEETS:
+        return list(names)
+    chosen = []
+    for item in (selection if isinstance(selection, list) else [selection]):
+        if str(item) in names:
+            name = str(item)
+        elif str(item).lstrip('-').isdigit() and 0 <= int(item) < len(names):
+            name = names[int(item)]
+        else:
+            raise SheetError(f"No sheet {item!r} in this workbook; its sheets are: {', '.join(names)}")
+        if name not in chosen:
+            chosen.append(name)
+    return chosen
+
+
+def sheet_names(path, engine='auto'):
+    return [sheet['name'] for sheet in list_sheets(path, engine)]
+
+
+def header_names(values):
+    """Column names for a header row, as read_excel makes them: ``Unnamed: i`` for blanks, ``.1`` suffixes for repeats."""
+    names, seen = [], {}
+    for i, value in enumerate(values):
+        name = f"Unnamed: {i}" if value is None or value == '' else str(value)
+        base = name
+        while name in seen:
+            seen[base] += 1
+            name = f"{base}.{seen[base]}"
+        seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _frame(rows, columns):
+    df = pd.DataFrame.from_records(rows, columns=columns) if rows else pd.DataFrame(columns=columns, dtype=object)
+    for column in df.columns[df.dtypes == object]:
+        values = df[column]
+        missing = values.isin(NA_STRINGS)
+        if missing.any():
+            df[column] = values.mask(missing).infer_objects()
+    return df
+
+
+def _openpyxl_chunks(path, sheet, chunk_rows, nrows):
+    workbook = _open_workbook(path)
+    try:
+        rows = workbook[sheet].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            raise pd.errors.EmptyDataError(f"Sheet {sheet!r} is empty.")
+        width = len(header)
+        columns = header_names(header)
+        chunk, blanks, count, yielded = [], [], 0, False
+        for row in rows:
+            if nrows is not None and count >= nrows:
+                break
+            row = tuple(row[:width]) + (None,) * (width - len(row))
+            if all(v is None for v in row):
+                blanks.append(row) # Kept only if more data follows, as read_excel does
+                continue
+            chunk.extend(blanks)
+            chunk.append(row)
+            count += len(blanks) + 1
+            blanks = []
+            if len(chunk) >= chunk_rows:
+                yield _frame(chunk, columns)
+                chunk, yielded = [], True
+        if nrows is not None:
+            chunk = chunk[:max(nrows - (count - len(chunk)), 0)]
+        if chunk or not yielded:
+            yield _frame(chunk, columns)
+    finally:
+        workbook.close()
+
+
+def _calamine_chunks(path, sheet, chunk_rows, nrows):
+    df = pd.read_excel(path, engine='calamine', sheet_name=sheet, nrows=nrows)
+    if not len(df.columns):
+        raise pd.errors.EmptyDataError(f"Sheet {sheet!r} is empty.")
+    df.columns = [str(c) for c in df.columns]
+    for start in range(0, max(len(df), 1), chunk_rows):
+        yield df.iloc[start:start + chunk_rows].copy()
+
+
+def sheet_chunks(path, sheet, chunk_rows, engine='auto', nrows=None):
+    """The rows of ``sheet`` below its header as DataFrames of up to ``chunk_rows`` rows; only ``nrows`` rows if given."""
+    if resolve_engine(engine) == 'calamine':
+        return _calamine_chunks(path, sheet, chunk_rows, nrows)
+    return _openpyxl_chunks(path, sheet, chunk_rows, nrows)
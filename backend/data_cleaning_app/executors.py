@@ -0,0 +1,156 @@
+"""
+Async views: the synchronous DRF views run on bounded thread pools.
+
+Under ASGI, Django runs a synchronous view on a thread of its own per
+request with no limit, so a few large uploads or encodings can starve
+everything else of CPU and memory. ``async_view`` turns a view into an
+async one that hands the request to a named BoundedExecutor instead:
+
+- ``heavy``: uploads, operations, profiles and downloads; HEAVY_WORKERS
+  threads, so only that many pandas jobs run at once
+- ``light``: previews, history moves, job status and the like;
+  LIGHT_WORKERS threads, so cheap requests never wait behind heavy ones
+
+Requests wait in an executor's queue for a free thread. Once QUEUE_LIMIT
+requests are waiting, new ones are turned away with a 503 and a
+Retry-After header rather than piling up. The time spent waiting is
+reported as the ``queued`` phase of the request metrics, and queue depths
+are served by the executors endpoint and as gauges next to the metrics.
+
+Under ASGI, downloads are also streamed from the heavy executor, one
+block at a time (Django would otherwise read a synchronous iterator to
+the end before sending anything). Under WSGI the wrapped views work too,
+with the same bounds, in the server's request threads.
+
+Pandas, NumPy and Arrow release the GIL for most of their work, so
+threads run in parallel well enough here. Fully separate processes are
+what ``?async=true`` background jobs are for.
+"""
+import concurrent.futures
+import functools
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+from django.http import JsonResponse
+
+from .metrics import record_phase, render_gauges
+
+DEFAULT_EXECUTORS = {
+    'HEAVY_WORKERS': 2,
+    'HEAVY_QUEUE_LIMIT': 32,
+    'LIGHT_WORKERS': 8,
+    'LIGHT_QUEUE_LIMIT': 256,
+}
+EXECUTOR_NAMES = ('heavy', 'light')
+
+
+class ExecutorBusy(Exception):
+    pass
+
+
+def _config():
+    return {**DEFAULT_EXECUTORS, **getattr(settings, 'VIEW_EXECUTORS', {})}
+
+
+class BoundedExecutor:
+    """A thread pool with a bounded queue in front of it and counters for reporting."""
+
+    def __init__(self, name, workers, queue_limit):
+        self.name = name
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.queued = self.running = self.completed = self.rejected = 0
+        self._lock = threading.Lock()
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"views-{name}")
+
+    def _call(self, submitted, func, *args, **kwargs):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        record_phase('queued', time.perf_counter() - submitted)
+        close_old_connections() # Django does this around each request in its own threads
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+
+    async def run(self, func, *args, bounded=True, **kwargs):
+        """Call ``func`` on the pool. Raises ExecutorBusy if ``bounded`` and the queue is full."""
+        with self._lock:
+            if bounded and self.queued >= self.queue_limit:
+                self.rejected += 1
+                raise ExecutorBusy(f"The server is busy ({self.queued} {self.name} requests waiting). Please retry shortly.")
+            self.queued += 1
+        # Not thread-sensitive: any pool thread will do, and the request's context variables come along
+        call = sync_to_async(self._call, thread_sensitive=False, executor=self._pool)
+        return await call(time.perf_counter(), func, *args, **kwargs)
+
+    async def stream(self, blocks):
+        """Produce each block of the synchronous iterator ``blocks`` on the pool."""
+        blocks = iter(blocks)
+        while (block := await self.run(next, blocks, None, bounded=False)) is not None:
+            yield block
+
+    def stats(self):
+        with self._lock:
+            return {
+                'name': self.name, 'workers': self.workers, 'queue_limit': self.queue_limit,
+                'queued': self.queued, 'running': self.running, 'completed': self.completed, 'rejected': self.rejected,
+            }
+
+
+@functools.lru_cache(maxsize=None)
+def get_executor(name):
+    if name not in EXECUTOR_NAMES:
+        raise KeyError(f"Unknown executor {name!r}; expected one of {', '.join(EXECUTOR_NAMES)}.")
+    config = _config()
+    prefix = name.upper()
+    return BoundedExecutor(name, config[f"{prefix}_WORKERS"], config[f"{prefix}_QUEUE_LIMIT"])
+
+
+def executor_stats():
+    return [get_executor(name).stats() for name in EXECUTOR_NAMES]
+
+
+def render_executor_metrics():
+    stats = executor_stats()
+    return '\n'.join(
+        render_gauges(f"data_cleaning_executor_{key}", description, [({'executor': s['name']}, s[key]) for s in stats])
+        for key, description in (
+            ('queued', "Requests waiting for a thread."),
+            ('running', "Requests being handled."),
+            ('workers', "Threads in the executor."),
+            ('completed', "Requests handled since the process started."),
+            ('rejected', "Requests turned away because the queue was full."),
+        )
+    ) + '\n'
+
+
+def async_view(view, executor='heavy', methods=None):
+    """
+    An async view running the synchronous ``view`` on the ``executor``
+    pool (``methods`` maps HTTP methods to another executor name).
+    """
+    methods = methods or {}
+
+    @functools.wraps(view)
+    async def offloaded(request, *args, **kwargs):
+        pool = get_executor(methods.get(request.method, executor))
+        try:
+            response = await pool.run(view, request, *args, **kwargs)
+        except ExecutorBusy as e:
+            response = JsonResponse({"error": str(e)}, status=503)
+            response['Retry-After'] = '1'
+            return response
+        if response.streaming and not response.is_async and isinstance(request, ASGIRequest):
+            response.streaming_content = get_executor('heavy').stream(response.streaming_content)
+        return response
+
+    return offloaded
@@ -0,0 +1,157 @@
+"""
+Streaming file exports of a session's LazyFrame.
+
+The frame is evaluated CHUNK_ROWS rows (at most CHUNK_CELLS values) at a
+time (see ``LazyFrame.iter_chunks``) and every chunk is encoded and handed to the
+response before the next one is read, so a download never holds more
+than a chunk of rows plus the encoder's buffers:
+
+- csv / csv.gz: ``to_csv`` per chunk, header on the first one only; gzip
+  is applied incrementally.
+- parquet: one row group per chunk, drained from the writer as it goes.
+- xlsx: an openpyxl write-only workbook, which spools sheet rows to a
+  temporary file; the finished file is then streamed from disk.
+"""
+import io
+import tempfile
+import zlib
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.conf import settings
+from openpyxl import Workbook
+
+from .ingest import _cast_table
+from .jobs import report_progress
+from .storage import _to_arrow_table
+
+DEFAULT_EXPORT = {
+    'CHUNK_ROWS': 50_000,
+    'CHUNK_CELLS': 5_000_000,
+}
+
+FILE_BLOCK_SIZE = 1024 * 1024
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'csv.gz': 'application/gzip',
+    'parquet': 'application/vnd.apache.parquet',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+def _config():
+    return {**DEFAULT_EXPORT, **getattr(settings, 'DATASET_EXPORT', {})}
+
+
+def _chunks(frame):
+    config = _config()
+    # Wide frames (one-hot output) get fewer rows per chunk; sparse columns are densified a chunk at a time
+    chunk_rows = max(1, min(config['CHUNK_ROWS'], config['CHUNK_CELLS'] // max(1, len(frame.columns))))
+    rows_written = 0
+    for chunk in frame.iter_chunks(chunk_rows):
+        yield chunk
+        rows_written += len(chunk)
+        report_progress(rows_written=rows_written) # When exporting in a background job
+
+
+# -----------------------------------------
+# Encoders, each a generator of bytes
+# -----------------------------------------
+
+def _csv_blocks(frame):
+    header = True
+    for chunk in _chunks(frame):
+        yield chunk.to_csv(index=False, header=header).encode('utf-8')
+        header = False
+    if header: # No rows at all; still send the header line
+        yield frame.head(0).to_csv(index=False).encode('utf-8')
+
+
+def _gzip_blocks(blocks):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) # gzip container
+    for block in blocks:
+        compressed = compressor.compress(block)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+class _DrainableSink(io.RawIOBase):
+    """A write-only file that hands its contents over on ``drain()``."""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def _parquet_blocks(frame):
+    sink = _DrainableSink()
+    writer, schema = None, None
+    for chunk in _chunks(frame):
+        table = _to_arrow_table(chunk, preserve_index=False, sparse_as='dense')
+        if writer is None:
+            # Object columns that are all missing in the first chunk hold text in later ones
+            schema = pa.schema([pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f for f in table.schema])
+            schema = schema.with_metadata(table.schema.metadata)
+            writer = pq.ParquetWriter(sink, schema, compression='zstd')
+        if table.schema != schema:
+            table = _cast_table(table, schema)
+        writer.write_table(table)
+        yield sink.drain()
+    if writer is None:
+        writer = pq.ParquetWriter(sink, _to_arrow_table(frame.head(0), preserve_index=False, sparse_as='dense').schema, compression='zstd')
+    writer.close()
+    yield sink.drain()
+
+
+def _xlsx_value(value):
+    if value is None or value is pd.NaT or (isinstance(value, float) and value != value):
+        return None
+    if value is pd.NA:
+        return None
+    return value
+
+
+def _xlsx_blocks(frame):
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Sheet1')
+    sheet.append([str(c) for c in frame.columns])
+    for chunk in _chunks(frame):
+        for row in chunk.astype(object).itertuples(index=False, name=None):
+            sheet.append([_xlsx_value(v) for v in row])
+    with tempfile.TemporaryFile() as f:
+        workbook.save(f)
+        f.seek(0)
+        while block := f.read(FILE_BLOCK_SIZE):
+            yield block
+
+
+def export_blocks(frame, download_format):
+    """Bytes of ``frame`` encoded as ``download_format``, as an iterator of blocks."""
+    if download_format == 'csv':
+        return _csv_blocks(frame)
+    if download_format == 'csv.gz':
+        return _gzip_blocks(_csv_blocks(frame))
+    if download_format == 'parquet':
+        return _parquet_blocks(frame)
+    if download_format == 'xlsx':
+        return _xlsx_blocks(frame)
+    raise ValueError(f"Unsupported download format: {download_format!r}")
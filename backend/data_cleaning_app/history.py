@@ -0,0 +1,358 @@
+"""
+Versioned history of a session's dataset: undo, redo, jump-to-version.
+
+Every operation adds a version whose step record points at its parent, so
+the versions from the root up to the session's current one form a
+timeline. Undone versions stay on it, after the current one, until a new
+operation replaces them.
+
+Some versions are also snapshotted as column-level copy-on-write deltas
+against the nearest older snapshot: only the columns written by the steps
+in between are stored again, and row filters are stored as row positions
+into the older data files. Dropping a column or filtering rows never
+copies the columns that did not change.
+
+History is bounded by the DATASET_HISTORY setting: MAX_DEPTH versions on a
+timeline, MAX_BYTES of disk per dataset (or the per-session quota of
+DATASET_LIFECYCLE, if lower), and a snapshot every SNAPSHOT_INTERVAL steps
+so that replays stay short.
+"""
+import itertools
+
+import numpy as np
+import pyarrow as pa
+from django.conf import settings
+
+from .ingest import _cast_table
+from .lifecycle import session_max_bytes
+from .outofcore import open_frame
+from .pipeline import step_from_dict
+from .storage import (
+    SESSION_DATASET_ID_KEY, SESSION_DATASET_REDO_KEY, SESSION_DATASET_VERSION_KEY,
+    SnapshotSource, _to_arrow_table, cache_session_dataset, cache_when_collected, get_dataset_store,
+)
+
+DEFAULT_HISTORY = {
+    'MAX_DEPTH': 50,
+    'MAX_BYTES': 2 * 1024 * 1024 * 1024,
+    'SNAPSHOT_INTERVAL': 10,
+}
+
+
+class HistoryError(Exception):
+    pass
+
+
+def _config():
+    return {**DEFAULT_HISTORY, **getattr(settings, 'DATASET_HISTORY', {})}
+
+
+# -----------------------------------------
+# Snapshots
+# -----------------------------------------
+
+def _steps_since_snapshot(store, dataset_id, version):
+    """The nearest snapshotted ancestor of ``version`` and the steps from it to ``version``."""
+    steps = []
+    while not store.has_snapshot(dataset_id, version):
+        record = store.load_step(dataset_id, version)
+        steps.append(step_from_dict(record['step']))
+        version = record['parent']
+    steps.reverse()
+    return version, steps
+
+
+def _narrow_positions(positions):
+    return positions.astype(np.int32 if len(positions) < 2 ** 31 else np.int64)
+
+
+def _save_chunks(store, dataset_id, version, chunks):
+    """
+    Stream the DataFrame ``chunks`` into the data file of ``version``, one at
+    a time. Returns the concatenated index of the chunks.
+    """
+    chunks = iter(chunks)
+    first = next(chunks)
+    index = [first.index.to_numpy()]
+    table = _to_arrow_table(first.reset_index(drop=True), preserve_index=False, sparse_as=store.sparse_as)
+    # Object columns that are all missing in the first chunk hold text in later ones
+    schema = pa.schema([pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f for f in table.schema])
+    schema = schema.with_metadata(table.schema.metadata)
+
+    def tables():
+        for chunk in itertools.chain([first], chunks):
+            if chunk is not first:
+                index.append(chunk.index.to_numpy())
+            table = _to_arrow_table(chunk.reset_index(drop=True), preserve_index=False, sparse_as=store.sparse_as)
+            yield table if table.schema == schema else _cast_table(table, schema)
+
+    if len(first.columns):
+        store.save_tables(dataset_id, version, schema, tables())
+    else:
+        index.extend(chunk.index.to_numpy() for chunk in chunks)
+    return np.concatenate(index)
+
+
+def write_snapshot(store, dataset_id, version):
+    """
+    Snapshot ``version`` as a delta against its nearest snapshotted ancestor.
+    Out-of-core frames are evaluated and written a chunk at a time.
+    """
+    if store.has_snapshot(dataset_id, version):
+        return
+    base_version, steps = _steps_since_snapshot(store, dataset_id, version)
+    source = SnapshotSource(store, dataset_id, store.load_snapshot(dataset_id, base_version))
+    frame = open_frame(source, steps)
+    columns = list(frame.columns)
+
+    written = set(columns) - set(source.columns)
+    for step in steps:
+        written |= step.written_columns()
+    written_columns = [c for c in columns if c in written]
+
+    # Only the rewritten columns are evaluated; the index gives each row's position in the base snapshot
+    if frame.out_of_core:
+        positions = _save_chunks(store, dataset_id, version, frame.chunks(written_columns))
+        num_rows = len(positions)
+    else:
+        df = frame.collect(columns=written_columns)
+        positions = df.index.to_numpy()
+        num_rows = len(df)
+        if written_columns:
+            store.save(dataset_id, version, df.reset_index(drop=True), preserve_index=False)
+    same_rows = len(positions) == source.num_rows and bool((positions == np.arange(source.num_rows)).all())
+
+    row_maps, new_positions = {}, {}
+    for name in columns:
+        file_version = source.refs.get(name)
+        if name in written or file_version in row_maps:
+            continue
+        if same_rows:
+            if file_version in source.row_maps:
+                row_maps[file_version] = source.row_maps[file_version] # Reuse the older rows file
+            continue
+        older = source.positions(file_version)
+        new_positions[str(file_version)] = _narrow_positions(positions if older is None else older[positions])
+        row_maps[file_version] = version
+    if new_positions:
+        store.save_rows(dataset_id, version, new_positions)
+
+    store.save_snapshot(dataset_id, version, {
+        'num_rows': num_rows,
+        'columns': [{'name': c, 'file': version if c in written else source.refs[c]} for c in columns],
+        'row_maps': {str(k): v for k, v in row_maps.items()},
+    })
+
+
+def collect_garbage(store, dataset_id):
+    """Delete data and rows files no snapshot refers to any more, and stats of forgotten versions."""
+    versions = store.versions(dataset_id)
+    data_refs, rows_refs = set(), set()
+    for version, parts in versions.items():
+        if 'snapshot' in parts:
+            manifest = store.load_snapshot(dataset_id, version)
+            data_refs.update(c['file'] for c in manifest['columns'])
+            data_refs.update(int(k) for k in manifest['row_maps'])
+            rows_refs.update(manifest['row_maps'].values())
+    for version, parts in versions.items():
+        unused = set()
+        if 'data' in parts and version not in data_refs:
+            unused.add('data')
+        if 'rows' in parts and version not in rows_refs:
+            unused.add('rows')
+        if 'stats' in parts and not parts & {'step', 'snapshot'}:
+            unused.add('stats')
+        if unused:
+            store.delete(dataset_id, version, parts=unused)
+
+
+# -----------------------------------------
+# Timeline
+# -----------------------------------------
+
+def ancestors(store, dataset_id, version):
+    """Versions from the root of the history up to and including ``version``."""
+    chain = [version]
+    while store.has_step(dataset_id, chain[-1]):
+        chain.append(store.load_step(dataset_id, chain[-1])['parent'])
+    chain.reverse()
+    return chain
+
+
+def session_timeline(session):
+    store = get_dataset_store()
+    head = session[SESSION_DATASET_VERSION_KEY]
+    return ancestors(store, session[SESSION_DATASET_ID_KEY], head) + list(session.get(SESSION_DATASET_REDO_KEY, []))
+
+
+def describe_timeline(session):
+    store = get_dataset_store()
+    dataset_id = session[SESSION_DATASET_ID_KEY]
+    head = session[SESSION_DATASET_VERSION_KEY]
+    entries = []
+    for version in session_timeline(session):
+        if store.has_step(dataset_id, version):
+            record = store.load_step(dataset_id, version)
+            step = step_from_dict(record['step'])
+            rows, columns = record['shape']
+            operation = step.op
+            details = {k: v for k, v in step.params().items() if k not in step.fitted}
+        else:
+            manifest = store.load_snapshot(dataset_id, version)
+            rows, columns = manifest['num_rows'], len(manifest['columns'])
+            operation, details = 'original', {}
+        entries.append({
+            "version": version, "operation": operation, "details": details,
+            "rows": rows, "columns": columns,
+            "current": version == head, "snapshot": store.has_snapshot(dataset_id, version),
+        })
+    return entries
+
+
+def jump_to_version(session, version):
+    timeline = session_timeline(session)
+    if version not in timeline:
+        raise HistoryError(f"Version {version} is not in this dataset's history.")
+    index = timeline.index(version)
+    session[SESSION_DATASET_VERSION_KEY] = version
+    session[SESSION_DATASET_REDO_KEY] = timeline[index + 1:]
+
+
+def undo(session):
+    timeline = session_timeline(session)
+    index = timeline.index(session[SESSION_DATASET_VERSION_KEY])
+    if index == 0:
+        raise HistoryError("Nothing to undo.")
+    jump_to_version(session, timeline[index - 1])
+
+
+def redo(session):
+    redo_versions = session.get(SESSION_DATASET_REDO_KEY) or []
+    if not redo_versions:
+        raise HistoryError("Nothing to redo.")
+    jump_to_version(session, redo_versions[0])
+
+
+# -----------------------------------------
+# Recording and pruning
+# -----------------------------------------
+
+def append_session_step(session, frame, step):
+    """
+    Record ``step`` on top of the session's current version without
+    materializing it, dropping any undone versions it replaces. ``frame``
+    is the session's current LazyFrame. Returns the new version's LazyFrame.
+    """
+    new_frame = frame.then(step)
+    # Counting rows evaluates the filters, so a bad step fails here before anything is stored
+    append_session_steps(session, [(step, [len(new_frame), len(new_frame.columns)])])
+    return cache_when_collected(session, new_frame, session[SESSION_DATASET_ID_KEY], session[SESSION_DATASET_VERSION_KEY])
+
+
+def append_session_steps(session, steps, df=None):
+    """
+    Record already evaluated ``(step, [rows, columns])`` pairs on top of the
+    session's current version, one version each, dropping any undone
+    versions they replace. ``df``, when given, is the frame after the last
+    step and is cached for the new current version.
+
+    A background job's session copy only adds the new versions; dropping
+    undone ones, snapshotting and pruning wait until its result is applied
+    (see jobs.py), as the real session may still need them.
+    """
+    store = get_dataset_store()
+    dataset_id = session[SESSION_DATASET_ID_KEY]
+    record_versions = getattr(session, 'record_versions', None)
+    if record_versions is None:
+        drop_undone_versions(session)
+    versions = []
+    for step, shape in steps:
+        version = store.allocate_version(dataset_id)
+        store.save_step(dataset_id, version, {
+            'parent': session[SESSION_DATASET_VERSION_KEY], 'step': step.to_dict(), 'shape': list(shape),
+        })
+        session[SESSION_DATASET_VERSION_KEY] = version
+        versions.append(version)
+    session[SESSION_DATASET_REDO_KEY] = []
+    if df is not None:
+        cache_session_dataset(session, df)
+    if record_versions is not None:
+        record_versions(dataset_id, versions)
+        return
+    maintain_history(session)
+
+
+def drop_undone_versions(session):
+    """Delete the session's undone versions, which a new operation replaces."""
+    store = get_dataset_store()
+    for undone in session.get(SESSION_DATASET_REDO_KEY) or []:
+        store.delete(session[SESSION_DATASET_ID_KEY], undone, parts={'step', 'snapshot'})
+
+
+def maintain_history(session):
+    """Snapshot the session's current version if its replay got long, then enforce the history limits."""
+    store = get_dataset_store()
+    dataset_id = session[SESSION_DATASET_ID_KEY]
+    _, replay = _steps_since_snapshot(store, dataset_id, session[SESSION_DATASET_VERSION_KEY])
+    if len(replay) >= _config()['SNAPSHOT_INTERVAL']:
+        write_snapshot(store, dataset_id, session[SESSION_DATASET_VERSION_KEY])
+    enforce_history_limits(session)
+
+
+def lineage(store, dataset_id, version):
+    """
+    The uploaded columns and every step from the upload to ``version``, as
+    ``{'columns': [...], 'steps': [step dict, ...]}``, including steps the
+    history limits have since forgotten.
+    """
+    chain = ancestors(store, dataset_id, version)
+    manifest = store.load_snapshot(dataset_id, chain[0])
+    root = manifest.get('lineage') or {'columns': [c['name'] for c in manifest['columns']], 'steps': []}
+    steps = [store.load_step(dataset_id, v)['step'] for v in chain[1:]]
+    return {'columns': root['columns'], 'steps': root['steps'] + steps}
+
+
+def _rebase(store, dataset_id, timeline, new_root):
+    """Make ``new_root`` the first version of the history, forgetting everything older."""
+    write_snapshot(store, dataset_id, new_root)
+    manifest = store.load_snapshot(dataset_id, new_root)
+    manifest['lineage'] = lineage(store, dataset_id, new_root) # What the forgotten versions did, for recipes
+    store.save_snapshot(dataset_id, new_root, manifest)
+    for version in timeline[:timeline.index(new_root)]:
+        store.delete(dataset_id, version, parts={'step', 'snapshot'})
+    store.delete(dataset_id, new_root, parts={'step'})
+
+
+def enforce_history_limits(session):
+    config = _config()
+    max_bytes = min(config['MAX_BYTES'], session_max_bytes())
+    store = get_dataset_store()
+    dataset_id = session[SESSION_DATASET_ID_KEY]
+    head = session[SESSION_DATASET_VERSION_KEY]
+
+    timeline = session_timeline(session)
+    excess = len(timeline) - config['MAX_DEPTH']
+    if excess > 0:
+        _rebase(store, dataset_id, timeline, timeline[min(excess, timeline.index(head))])
+        timeline = session_timeline(session)
+    collect_garbage(store, dataset_id)
+
+    # Over the byte cap: drop intermediate snapshots furthest from the current version first,
+    # then shorten the history from the oldest end
+    if store.nbytes(dataset_id) <= max_bytes:
+        return
+    head_index = timeline.index(head)
+    evictable = [v for v in timeline[1:] if v != head and store.has_snapshot(dataset_id, v)]
+    evictable.sort(key=lambda v: abs(timeline.index(v) - head_index), reverse=True)
+    for version in evictable:
+        store.delete(dataset_id, version, parts={'snapshot'})
+        collect_garbage(store, dataset_id)
+        if store.nbytes(dataset_id) <= max_bytes:
+            return
+    while timeline[0] != head and store.nbytes(dataset_id) > max_bytes:
+        nbytes = store.nbytes(dataset_id)
+        _rebase(store, dataset_id, timeline, timeline[1])
+        collect_garbage(store, dataset_id)
+        timeline = session_timeline(session)
+        if store.nbytes(dataset_id) >= nbytes:
+            break # The remaining bytes are shared by the current version itself
@@ -0,0 +1,456 @@
+"""
+Chunked CSV and Excel ingestion straight into the dataset store.
+
+Parsing a whole upload with ``pd.read_csv`` holds the parsed frame, the
+parser's buffers and the Arrow copy in memory at the same time. Here the
+file is parsed CSV_CHUNK_ROWS rows at a time; every chunk has its integer
+columns narrowed and is spooled to a temporary Arrow file. Once all chunks
+are seen, each column's type is the narrowest one that holds every chunk
+(ints widen to bigger ints, then to float; anything else mixed becomes
+text) and the spooled chunks are cast and streamed into the store one by
+one. Peak memory is a couple of chunks, not a few copies of the file.
+On the way in, every column is also given its memory-lean type (see
+dtypes.py), and the memory pandas would have used is recorded.
+
+.xlsx sheets go through the same steps, read in chunks by excel.py. When
+several sheets are loaded at once, each is parsed and spooled by a worker
+process of its own and the sheets are stacked. A header-plus-sample read
+(``read_sample``) lets a preview go out before the whole file is parsed.
+
+An upload whose content hash matches an earlier one is not parsed at all:
+its dataset starts from the earlier upload's data file (see uploads.py).
+
+While an upload is being parsed its progress (bytes and rows so far) is
+kept in Django's cache under the upload id the client sent, for the
+progress endpoint to report.
+"""
+import concurrent.futures
+import contextlib
+import functools
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+
+import pandas as pd
+import pyarrow as pa
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache import get_dataframe_cache
+from .dtypes import (
+    column_memory, convert_table, merge_column_memory, optimized_schema, profile_tables, target_dtypes,
+)
+from .excel import SheetError, list_sheets, resolve_engine, select_sheets, sheet_chunks, sheet_names
+from .jobs import _worker_init, report_progress
+from .lifecycle import check_session_quota
+from .storage import _to_arrow_table, attach_session_dataset, base_manifest, get_dataset_store, get_session_frame
+from .uploads import UploadCache, get_upload_cache
+
+DEFAULT_INGEST = {
+    'CSV_CHUNK_ROWS': 100_000,
+    'EXCEL_ENGINE': 'auto',
+    'EXCEL_CHUNK_ROWS': 50_000,
+    'EXCEL_SHEET_WORKERS': 4,
+    'SAMPLE_ROWS': 1000,
+    'PROGRESS_TTL': 60 * 60,
+}
+SHEET_COLUMN = 'sheet'
+
+
+def _config():
+    return {**DEFAULT_INGEST, **getattr(settings, 'DATASET_INGEST', {})}
+
+
+# -----------------------------------------
+# Progress
+# -----------------------------------------
+
+def _progress_key(upload_id):
+    return f"data_cleaning_app:upload-progress:{upload_id}"
+
+
+def set_upload_progress(upload_id, **progress):
+    report_progress(**progress) # When parsing in a background job
+    if upload_id:
+        cache.set(_progress_key(upload_id), {"upload_id": upload_id, **progress}, _config()['PROGRESS_TTL'])
+
+
+def get_upload_progress(upload_id):
+    return cache.get(_progress_key(upload_id))
+
+
+# -----------------------------------------
+# Types
+# -----------------------------------------
+
+def _narrow_chunk(chunk):
+    """Downcast the chunk's integer columns to the smallest type holding its values."""
+    for column in chunk.columns:
+        if pd.api.types.is_signed_integer_dtype(chunk[column].dtype):
+            chunk[column] = pd.to_numeric(chunk[column], downcast='integer')
+    return chunk
+
+
+def _common_type(a, b):
+    """The narrowest type both an ``a`` and a ``b`` column convert to without losing values."""
+    if a == b:
+        return a
+    if pa.types.is_null(a):
+        return b
+    if pa.types.is_null(b):
+        return a
+    if pa.types.is_integer(a) and pa.types.is_integer(b) and pa.types.is_signed_integer(a) == pa.types.is_signed_integer(b):
+        return a if a.bit_width >= b.bit_width else b
+    if (pa.types.is_integer(a) or pa.types.is_floating(a)) and (pa.types.is_integer(b) or pa.types.is_floating(b)):
+        return pa.float64()
+    return pa.string()
+
+
+def _cast_column(array, target):
+    if array.type == target:
+        return array
+    if pa.types.is_string(target):
+        # Through pandas so numbers and booleans read the way a whole-file read_csv shows them ("1.0", "True")
+        values = array.to_pandas()
+        return pa.array(values.where(values.isna(), values.astype(str)), type=target, from_pandas=True)
+    return array.cast(target)
+
+
+def _cast_table(table, schema):
+    """``table`` cast to ``schema``; columns it lacks (another sheet's) are all null."""
+    return pa.table([
+        _cast_column(table.column(f.name), f.type) if f.name in table.column_names else pa.nulls(table.num_rows, f.type)
+        for f in schema
+    ], schema=schema)
+
+
+# -----------------------------------------
+# Ingestion
+# -----------------------------------------
+
+def _ingest_report(default_memory, num_rows):
+    return {
+        'num_rows': num_rows,
+        'columns': {name: {'dtype': dtype, 'bytes': nbytes} for name, (dtype, nbytes) in default_memory.items()},
+    }
+
+
+def _spool_chunks(chunks, spool_dir, prefix, progress=None):
+    """
+    Write each DataFrame chunk, integers narrowed, to its own Arrow file in
+    ``spool_dir``. Returns the files, the common type of each column so far,
+    the row count and the memory pandas would have used.
+    """
+    spool = {'parts': [], 'types': {}, 'num_rows': 0, 'default_memory': {}}
+    for chunk in chunks:
+        chunk.columns = [str(c) for c in chunk.columns] # Headers come back from the frontend as strings
+        merge_column_memory(spool['default_memory'], column_memory(chunk))
+        table = _to_arrow_table(_narrow_chunk(chunk), preserve_index=False)
+        for field in table.schema:
+            spool['types'][field.name] = _common_type(spool['types'].get(field.name, pa.null()), field.type)
+
+        path = os.path.join(spool_dir, f"{prefix}-{len(spool['parts']):06d}.arrow")
+        with pa.OSFile(path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        spool['parts'].append(path)
+        spool['num_rows'] += table.num_rows
+        if progress:
+            progress(spool['num_rows'])
+    return spool
+
+
+def _merge_spools(spools):
+    """One spool of the parts of several, in order, with the columns of all of them."""
+    merged = {'parts': [], 'types': {}, 'num_rows': 0, 'default_memory': {}}
+    for spool in spools:
+        merged['parts'].extend(spool['parts'])
+        for name, type_ in spool['types'].items():
+            merged['types'][name] = _common_type(merged['types'].get(name, pa.null()), type_)
+        merged['num_rows'] += spool['num_rows']
+        merge_column_memory(merged['default_memory'], spool['default_memory'])
+    return merged
+
+
+def _store_spool(store, dataset_id, version, spool):
+    """Cast the spooled parts to their common types, then to memory-lean ones, into the data file of ``version``."""
+    columns = list(spool['types'])
+    schema = pa.schema([(name, spool['types'][name]) for name in columns])
+
+    def cast_parts():
+        for path in spool['parts']:
+            with pa.memory_map(path, 'r') as source:
+                yield _cast_table(pa.ipc.open_file(source).read_all(), schema)
+
+    dtypes = target_dtypes(profile_tables(cast_parts(), columns))
+    if dtypes:
+        final_schema = optimized_schema(schema, dtypes)
+        parts = (convert_table(table, dtypes, final_schema) for table in cast_parts())
+    else:
+        final_schema, parts = schema, cast_parts()
+    store.save_tables(dataset_id, version, final_schema, parts)
+    store.save_ingest_report(dataset_id, _ingest_report(spool['default_memory'], spool['num_rows']))
+    return columns
+
+
+def ingest_csv(store, dataset_id, version, fileobj, total_bytes=None, upload_id=None):
+    """
+    Parse the CSV in ``fileobj`` chunk by chunk into the data file of
+    ``version``, with memory-lean column types. Returns the column names
+    and the number of rows.
+    """
+    config = _config()
+    set_upload_progress(upload_id, status="parsing", bytes_read=0, total_bytes=total_bytes, rows_parsed=0)
+    try:
+        with tempfile.TemporaryDirectory(prefix='ingest-', dir=store.root) as spool_dir:
+            spool = _spool_chunks(
+                pd.read_csv(fileobj, chunksize=config['CSV_CHUNK_ROWS']), spool_dir, 'part',
+                lambda rows: set_upload_progress(upload_id, status="parsing", bytes_read=fileobj.tell(), total_bytes=total_bytes, rows_parsed=rows),
+            )
+            set_upload_progress(upload_id, status="writing", bytes_read=total_bytes, total_bytes=total_bytes, rows_parsed=spool['num_rows'])
+            columns = _store_spool(store, dataset_id, version, spool)
+    except Exception as e:
+        set_upload_progress(upload_id, status="failed", error=str(e))
+        raise
+    num_rows = spool['num_rows']
+    set_upload_progress(upload_id, status="done", bytes_read=total_bytes, total_bytes=total_bytes, rows_parsed=num_rows)
+    return columns, num_rows
+
+
+# -----------------------------------------
+# Excel
+# -----------------------------------------
+
+def _sheet_chunks(path, sheet, engine, chunk_rows, labelled, nrows=None):
+    chunks = sheet_chunks(path, sheet, chunk_rows, engine, nrows=nrows)
+    if not labelled:
+        return chunks
+    return (_label_chunk(chunk, sheet) for chunk in chunks)
+
+
+def _label_chunk(chunk, sheet):
+    """Add the sheet's name as the first column, when several sheets are stacked."""
+    if SHEET_COLUMN in chunk.columns:
+        raise SheetError(f"Sheet {sheet!r} already has a {SHEET_COLUMN!r} column; load its sheets one at a time.")
+    chunk.insert(0, SHEET_COLUMN, sheet)
+    return chunk
+
+
+def _spool_sheet(path, sheet, index, spool_dir, engine, chunk_rows, labelled, progress=None):
+    """
+    Spool one sheet; runs in a sheet worker process when several sheets are
+    parsed at once. Of several (``labelled``) sheets, empty ones are skipped.
+    """
+    try:
+        return _spool_chunks(_sheet_chunks(path, sheet, engine, chunk_rows, labelled), spool_dir, f"sheet{index:04d}", progress)
+    except pd.errors.EmptyDataError:
+        if not labelled:
+            raise
+        return _merge_spools([])
+
+
+@functools.lru_cache(maxsize=None)
+def get_sheet_executor():
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=_config()['EXCEL_SHEET_WORKERS'],
+        mp_context=multiprocessing.get_context('spawn'), # Forking a threaded server is unsafe
+        initializer=_worker_init,
+    )
+
+
+def _spool_sheets_in_parallel(path, names, spool_dir, engine, chunk_rows, upload_id):
+    futures = {
+        get_sheet_executor().submit(_spool_sheet, path, name, i, spool_dir, engine, chunk_rows, True): i
+        for i, name in enumerate(names)
+    }
+    spools = [None] * len(names)
+    try:
+        for future in concurrent.futures.as_completed(futures):
+            spools[futures[future]] = future.result()
+            done = [spool for spool in spools if spool is not None]
+            set_upload_progress(upload_id, status="parsing", rows_parsed=sum(spool['num_rows'] for spool in done), sheets_parsed=len(done), sheets=len(names))
+    except concurrent.futures.process.BrokenProcessPool:
+        get_sheet_executor.cache_clear() # A worker died (e.g. killed for memory); the pool is unusable after that
+        raise
+    finally:
+        for future in futures:
+            future.cancel()
+    return _merge_spools(spools)
+
+
+def ingest_excel(store, dataset_id, version, path, sheets=None, upload_id=None):
+    """
+    Parse the chosen ``sheets`` (see ``excel.parse_sheet_selection``) of the
+    .xlsx file at ``path`` into the data file of ``version``, like
+    ``ingest_csv``. Several sheets are parsed at once in worker processes
+    and stacked, with a leading ``sheet`` column naming each row's sheet.
+    """
+    config = _config()
+    engine = excel_engine()
+    set_upload_progress(upload_id, status="parsing", rows_parsed=0)
+    try:
+        names = select_sheets(sheet_names(path, engine), sheets)
+        with tempfile.TemporaryDirectory(prefix='ingest-', dir=store.root) as spool_dir:
+            labelled = len(names) > 1
+            if labelled and config['EXCEL_SHEET_WORKERS'] > 1:
+                spool = _spool_sheets_in_parallel(path, names, spool_dir, engine, config['EXCEL_CHUNK_ROWS'], upload_id)
+            else:
+                spool = _merge_spools([
+                    _spool_sheet(
+                        path, name, i, spool_dir, engine, config['EXCEL_CHUNK_ROWS'], labelled,
+                        lambda rows: set_upload_progress(upload_id, status="parsing", rows_parsed=rows),
+                    ) for i, name in enumerate(names)
+                ])
+            if not spool['types']:
+                raise pd.errors.EmptyDataError("Every selected sheet is empty.")
+            set_upload_progress(upload_id, status="writing", rows_parsed=spool['num_rows'])
+            columns = _store_spool(store, dataset_id, version, spool)
+    except Exception as e:
+        set_upload_progress(upload_id, status="failed", error=str(e))
+        raise
+    set_upload_progress(upload_id, status="done", rows_parsed=spool['num_rows'])
+    return columns, spool['num_rows']
+
+
+def excel_upload_kind(sheets=None):
+    """The upload cache kind of an .xlsx upload read with the sheet selection ``sheets``."""
+    if sheets is None:
+        return 'xlsx'
+    return 'xlsx' + hashlib.sha256(json.dumps(sheets).encode()).hexdigest()[:16]
+
+
+@contextlib.contextmanager
+def upload_path(fileobj, suffix=''):
+    """A path to the uploaded file's content: its temporary file, or a copy of it."""
+    if hasattr(fileobj, 'temporary_file_path'):
+        yield fileobj.temporary_file_path()
+        return
+    with tempfile.NamedTemporaryFile(prefix='upload-', suffix=suffix, dir=get_dataset_store().root) as f:
+        for chunk in fileobj.chunks():
+            f.write(chunk)
+        f.flush()
+        fileobj.seek(0)
+        yield f.name
+
+
+def excel_engine():
+    return resolve_engine(_config()['EXCEL_ENGINE'])
+
+
+def list_upload_sheets(fileobj):
+    """The sheets of an uploaded .xlsx file (see ``excel.list_sheets``) and the engine reading them."""
+    engine = excel_engine()
+    with upload_path(fileobj, '.xlsx') as path:
+        return list_sheets(path, engine), engine
+
+
+def read_sample(fileobj, kind, sheets=None):
+    """The header and first SAMPLE_ROWS rows of an upload, for a preview while the whole file is parsed."""
+    config = _config()
+    nrows = config['SAMPLE_ROWS']
+    if kind == 'csv':
+        df = pd.read_csv(fileobj, nrows=nrows)
+        fileobj.seek(0)
+    else:
+        engine = excel_engine()
+        with upload_path(fileobj, '.xlsx') as path:
+            names = select_sheets(sheet_names(path, engine), sheets)
+            df = next(iter(_sheet_chunks(path, names[0], engine, nrows, len(names) > 1, nrows=nrows)))
+    df.columns = [str(c) for c in df.columns]
+    return df
+
+
+# -----------------------------------------
+# Session datasets
+# -----------------------------------------
+
+def _cache_upload(session, store, dataset_id, version):
+    """
+    Read the upload just stored back into the session's DataFrame cache, so
+    the first operation starts from memory. Skipped for uploads that are
+    opened out of core or would not fit the cache anyway.
+    """
+    if os.path.getsize(store.path_for(dataset_id, version)) > get_dataframe_cache().max_bytes:
+        return
+    frame = get_session_frame(session)
+    if not frame.out_of_core:
+        frame.collect() # Cached; see storage.cache_when_collected
+
+
+def _attach_shared_upload(session, digest, kind, total_bytes=None, upload_id=None):
+    """
+    Start a new dataset from the cached parse of an identical earlier upload
+    and make it the session's current one. Returns its id and version, or None.
+    """
+    upload_cache = get_upload_cache()
+    if upload_cache is None or digest is None:
+        return None
+    store = get_dataset_store()
+    dataset_id = store.new_dataset_id()
+    version = store.allocate_version(dataset_id)
+    try:
+        entry = upload_cache.attach(store, UploadCache.key(digest, kind), dataset_id, version)
+        if entry is not None:
+            store.save_snapshot(dataset_id, version, base_manifest(entry['columns'], entry['num_rows'], version))
+            check_session_quota(dataset_id)
+    except BaseException:
+        store.delete(dataset_id)
+        raise
+    if entry is None:
+        store.delete(dataset_id)
+        return None
+    set_upload_progress(upload_id, status="done", bytes_read=total_bytes, total_bytes=total_bytes, rows_parsed=entry['num_rows'], reused=True)
+    attach_session_dataset(session, dataset_id, version)
+    _cache_upload(session, store, dataset_id, version)
+    return dataset_id, version
+
+
+def _ingest_session(session, ingest, digest, kind, total_bytes=None, upload_id=None):
+    """
+    Parse an upload with ``ingest(store, dataset_id, version)`` into a new
+    dataset and make it the session's current one, or reuse the parse of an
+    identical earlier upload (same ``digest`` and ``kind``). Raises
+    QuotaExceeded, keeping the session's current dataset, if the new one is
+    over the per-session quota.
+    """
+    shared = _attach_shared_upload(session, digest, kind, total_bytes=total_bytes, upload_id=upload_id)
+    if shared is not None:
+        return shared
+    store = get_dataset_store()
+    dataset_id = store.new_dataset_id()
+    version = store.allocate_version(dataset_id)
+    try:
+        columns, num_rows = ingest(store, dataset_id, version)
+        store.save_snapshot(dataset_id, version, base_manifest(columns, num_rows, version))
+        check_session_quota(dataset_id)
+    except BaseException: # Including a cancelled background job, or an upload over quota
+        store.delete(dataset_id)
+        raise
+    upload_cache = get_upload_cache()
+    if upload_cache is not None and digest is not None:
+        upload_cache.add(store, UploadCache.key(digest, kind), dataset_id, version, columns, num_rows)
+    attach_session_dataset(session, dataset_id, version)
+    _cache_upload(session, store, dataset_id, version)
+    return dataset_id, version
+
+
+def ingest_session_csv(session, fileobj, total_bytes=None, upload_id=None, digest=None):
+    """
+    Parse an uploaded CSV into a new dataset and make it the session's
+    current one. ``digest``, the upload's SHA-256, lets an identical earlier
+    upload's parse be reused.
+    """
+    return _ingest_session(
+        session, lambda store, dataset_id, version: ingest_csv(store, dataset_id, version, fileobj, total_bytes=total_bytes, upload_id=upload_id),
+        digest, 'csv', total_bytes=total_bytes, upload_id=upload_id,
+    )
+
+
+def ingest_session_excel(session, fileobj, sheets=None, upload_id=None, digest=None):
+    """Parse the chosen sheets of an uploaded .xlsx file into a new dataset; see ``ingest_session_csv``."""
+    def ingest(store, dataset_id, version):
+        with upload_path(fileobj, '.xlsx') as path:
+            return ingest_excel(store, dataset_id, version, path, sheets=sheets, upload_id=upload_id)
+    return _ingest_session(session, ingest, digest, excel_upload_kind(sheets), upload_id=upload_id)
@@ -0,0 +1,437 @@
+"""
+Background jobs: run a view's handler in a local process pool.
+
+Any operation endpoint can be called with ``?async=true``. Instead of
+running, the view hands itself to ``submit_job``, which answers with a job
+id straight away. A pool worker then calls the same handler on a
+JobRequest: the request data, any uploaded file (spooled to disk) and a
+detached copy of the session. When it finishes, the job record keeps the
+response and the session keys the handler changed. Those changes are
+applied to the real session the next time its owner asks for the job,
+unless the session has moved to another dataset version in the meantime;
+then the result is discarded as stale. Versions a job records on the
+session's dataset stay its own until then: undone versions are only
+dropped, and the history snapshotted and pruned, once the result is
+applied, and the versions of a discarded, failed or cancelled job are
+deleted.
+
+Job state lives in a small JSON record per job under
+BACKGROUND_JOBS['ROOT'], so any web process can report on any job. Handlers
+report progress and notice cancellation at checkpoints
+(``report_progress`` / ``check_cancelled``, called from ingestion and
+between pipeline steps). A queued job is cancelled outright; a running
+one stops at its next checkpoint, and its result is never applied.
+"""
+import concurrent.futures
+import contextlib
+import fcntl
+import functools
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import time
+import uuid
+
+from django.conf import settings
+from django.core.files import File
+from django.utils.module_loading import import_string
+
+from .cache import get_column_view_cache, get_dataframe_cache
+from .storage import SESSION_DATASET_ID_KEY, SESSION_DATASET_VERSION_KEY, SESSION_FULL_DATASET_KEY, get_dataset_store
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOBS = {
+    'MAX_WORKERS': 2,
+    'RESULT_TTL': 24 * 60 * 60,
+}
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = 'queued', 'running', 'succeeded', 'failed', 'cancelled'
+FINISHED_STATUSES = {SUCCEEDED, FAILED, CANCELLED}
+
+_MISSING = object()
+_current_job_id = None # Set inside a pool worker while it runs a job
+_futures = {} # job id -> Future, for the jobs submitted by this process
+
+
+class JobNotFound(Exception):
+    pass
+
+
+class JobCancelled(BaseException):
+    """Not an Exception, so the views' catch-all error handling lets it through."""
+
+
+def _config():
+    config = {**DEFAULT_JOBS, **getattr(settings, 'BACKGROUND_JOBS', {})}
+    config.setdefault('ROOT', os.path.join(settings.BASE_DIR, 'jobs'))
+    return config
+
+
+def wants_background(request):
+    return str(request.query_params.get('async', '')).lower() in ('1', 'true', 'yes')
+
+
+def in_background_job():
+    """Whether this code runs inside a background job."""
+    return _current_job_id is not None
+
+
+# -----------------------------------------
+# Job records
+# -----------------------------------------
+
+def _job_dir(job_id):
+    if not (len(str(job_id)) == 32 and str(job_id).isalnum()):
+        raise JobNotFound(f"Invalid job id: {job_id!r}")
+    return os.path.join(_config()['ROOT'], job_id)
+
+
+def _record_path(job_id):
+    return os.path.join(_job_dir(job_id), 'job.json')
+
+
+def _cancel_path(job_id):
+    return os.path.join(_job_dir(job_id), 'cancel')
+
+
+def load_job(job_id):
+    try:
+        with open(_record_path(job_id)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise JobNotFound(f"Job {job_id} not found.")
+
+
+def _save_job(job):
+    path = _record_path(job['id'])
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(job, f, default=str)
+    os.replace(tmp_path, path)
+
+
+@contextlib.contextmanager
+def _job_lock(job_id):
+    """Hold the job's lock around a read-modify-write of its record, across processes (workers and requests)."""
+    try:
+        f = open(os.path.join(_job_dir(job_id), 'job.lock'), 'a')
+    except FileNotFoundError:
+        raise JobNotFound(f"Job {job_id} not found.")
+    with f:
+        fcntl.flock(f, fcntl.LOCK_EX) # Released when the file is closed
+        yield
+
+
+def _update_job(job_id, **fields):
+    with _job_lock(job_id):
+        job = load_job(job_id)
+        job.update(fields)
+        _save_job(job)
+    return job
+
+
+def describe_job(job):
+    """The public view of a job record."""
+    finished_at = job.get('finished_at') or time.time()
+    started_at = job.get('started_at')
+    described = {
+        "job_id": job['id'],
+        "operation": job['operation'],
+        "status": job['status'],
+        "progress": job.get('progress', {}),
+        "submitted_at": job['submitted_at'],
+        "elapsed_seconds": round(finished_at - started_at, 3) if started_at else 0.0,
+        "error": job.get('error'),
+    }
+    result = job.get('result')
+    if job['status'] == SUCCEEDED and result is not None:
+        described["result_status_code"] = result['status_code']
+        if 'file' in result:
+            described["result_file"] = result['filename']
+        else:
+            described["result"] = result['data']
+        described["applied"] = job.get('applied')
+    return described
+
+
+# -----------------------------------------
+# Inside a job
+# -----------------------------------------
+
+def check_cancelled():
+    """Raise JobCancelled if the job running in this process was cancelled. No-op outside jobs."""
+    if _current_job_id is not None and os.path.exists(_cancel_path(_current_job_id)):
+        raise JobCancelled()
+
+
+def report_progress(**progress):
+    """Publish progress for the job running in this process. No-op outside jobs."""
+    if _current_job_id is None:
+        return
+    check_cancelled()
+    _update_job(_current_job_id, progress=progress)
+
+
+class JobSession(dict):
+    """
+    A detached copy of a session. Datasets it would delete are only noted,
+    since the real session still points at them until the result is applied.
+    Versions it records are noted too: they belong to the job alone until
+    then, and history maintenance waits for ``apply_job_result``.
+    """
+
+    def __init__(self, data, session_key):
+        super().__init__(data)
+        self.session_key = session_key
+        self.retired_datasets = []
+        self.created_versions = {} # dataset id -> versions the job recorded
+
+    def save(self):
+        pass
+
+    def retire_dataset(self, dataset_id):
+        self.retired_datasets.append(dataset_id)
+
+    def record_versions(self, dataset_id, versions):
+        self.created_versions.setdefault(dataset_id, []).extend(versions)
+
+
+class JobRequest:
+    """The parts of a DRF request the operation views use."""
+
+    def __init__(self, path, session, data, query_params, files):
+        self.path = path
+        self.session = session
+        self.data = data
+        self.query_params = query_params
+        self.FILES = files
+
+
+# -----------------------------------------
+# Pool workers
+# -----------------------------------------
+
+def _worker_init():
+    import django
+    django.setup()
+
+
+def _save_file_result(job_id, response):
+    """Write a file response (a download) next to the job record."""
+    path = os.path.join(_job_dir(job_id), 'result')
+    with open(path, 'wb') as f:
+        for chunk in (response.streaming_content if response.streaming else [response.content]):
+            f.write(chunk)
+    disposition = response.get('Content-Disposition', '')
+    return {
+        'status_code': response.status_code,
+        'file': path,
+        'content_type': response['Content-Type'],
+        'filename': disposition.partition('filename=')[2].strip('"'),
+    }
+
+
+def _run_job(job_id, view_path, method, state, args, kwargs):
+    global _current_job_id
+    if os.path.exists(_cancel_path(job_id)):
+        return _update_job(job_id, status=CANCELLED, finished_at=time.time())
+    _current_job_id = job_id
+    _update_job(job_id, status=RUNNING, started_at=time.time())
+    opened, session = [], None
+    try:
+        files = {}
+        for name, (path, filename) in state['files'].items():
+            opened.append(open(path, 'rb'))
+            files[name] = File(opened[-1], name=filename)
+        session = JobSession(state['session'], state['session_key'])
+        request = JobRequest(state['path'], session, state['data'], state['query_params'], files)
+        view = import_string(view_path)()
+        view.request = request # As dispatch() would
+        response = getattr(view, method)(request, *args, **kwargs)
+        check_cancelled()
+
+        if hasattr(response, 'data'): # A DRF Response
+            result = {'status_code': response.status_code, 'data': response.data}
+        else:
+            result = _save_file_result(job_id, response)
+        original = state['session']
+        return _update_job(
+            job_id, status=SUCCEEDED, finished_at=time.time(), result=result,
+            session_updates={k: v for k, v in session.items() if original.get(k, _MISSING) != v},
+            session_removed=[k for k in original if k not in session],
+            retired_datasets=session.retired_datasets, created_versions=session.created_versions,
+        )
+    except JobCancelled:
+        _discard_versions(session.created_versions if session is not None else {})
+        return _update_job(job_id, status=CANCELLED, finished_at=time.time())
+    except Exception as e:
+        logger.exception("Background job failed", extra={'job_id': job_id})
+        _discard_versions(session.created_versions if session is not None else {})
+        return _update_job(job_id, status=FAILED, finished_at=time.time(), error=str(e))
+    finally:
+        _current_job_id = None
+        for f in opened:
+            f.close()
+        for path, _ in state['files'].values():
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+
+# -----------------------------------------
+# Submitting, cancelling, applying
+# -----------------------------------------
+
+@functools.lru_cache(maxsize=None)
+def get_job_executor():
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=_config()['MAX_WORKERS'],
+        mp_context=multiprocessing.get_context('spawn'), # Forking a threaded server is unsafe
+        initializer=_worker_init,
+    )
+
+
+def _job_done(job_id, future):
+    _futures.pop(job_id, None)
+    if future.cancelled():
+        _update_job(job_id, status=CANCELLED, finished_at=time.time())
+    elif future.exception() is not None:
+        # The worker died (e.g. killed for memory); the pool is unusable after that
+        if isinstance(future.exception(), concurrent.futures.process.BrokenProcessPool):
+            get_job_executor.cache_clear()
+        _update_job(job_id, status=FAILED, finished_at=time.time(), error=str(future.exception()) or "Worker process died.")
+
+
+def _purge_expired_jobs():
+    root = _config()['ROOT']
+    cutoff = time.time() - _config()['RESULT_TTL']
+    try:
+        names = os.listdir(root)
+    except FileNotFoundError:
+        return
+    for name in names:
+        try:
+            job = load_job(name)
+        except (JobNotFound, ValueError):
+            continue
+        if job['status'] in FINISHED_STATUSES and (job.get('finished_at') or 0) < cutoff:
+            shutil.rmtree(_job_dir(name), ignore_errors=True)
+
+
+def submit_job(request, view, method, args=(), kwargs=None):
+    """Queue ``view.<method>(request, *args, **kwargs)`` on the pool. Returns the job record."""
+    _purge_expired_jobs()
+    job_id = uuid.uuid4().hex
+    os.makedirs(_job_dir(job_id))
+    if not request.session.session_key:
+        request.session.save()
+
+    files = {}
+    for name, uploaded in request.FILES.items():
+        path = os.path.join(_job_dir(job_id), f"upload-{name}")
+        with open(path, 'wb') as f:
+            for chunk in uploaded.chunks():
+                f.write(chunk)
+        files[name] = (path, uploaded.name)
+    state = {
+        'path': request.path,
+        'session': dict(request.session.items()),
+        'session_key': request.session.session_key,
+        'data': {k: v for k, v in request.data.items() if k not in request.FILES},
+        'query_params': {k: v for k, v in request.query_params.items() if k != 'async'},
+        'files': files,
+    }
+    job = {
+        'id': job_id,
+        'session_key': request.session.session_key,
+        'operation': f"{type(view).__name__}.{method}",
+        'status': QUEUED,
+        'submitted_at': time.time(),
+        'base': [request.session.get(SESSION_DATASET_ID_KEY), request.session.get(SESSION_DATASET_VERSION_KEY)],
+    }
+    _save_job(job)
+
+    view_path = f"{type(view).__module__}.{type(view).__qualname__}"
+    future = get_job_executor().submit(_run_job, job_id, view_path, method, state, tuple(args), dict(kwargs or {}))
+    _futures[job_id] = future
+    future.add_done_callback(functools.partial(_job_done, job_id))
+    return job
+
+
+def get_session_job(session, job_id):
+    """The job record, if ``job_id`` belongs to ``session``."""
+    job = load_job(job_id)
+    if job['session_key'] != session.session_key:
+        raise JobNotFound(f"Job {job_id} not found.")
+    return job
+
+
+def cancel_job(job):
+    if job['status'] in FINISHED_STATUSES:
+        return job
+    open(_cancel_path(job['id']), 'w').close()
+    future = _futures.get(job['id'])
+    if future is not None:
+        future.cancel() # Only succeeds while the job is still queued
+    return load_job(job['id'])
+
+
+def _discard_dataset(dataset_id):
+    get_dataset_store().delete(dataset_id)
+    get_dataframe_cache().discard_dataset(dataset_id)
+    get_column_view_cache().discard_dataset(dataset_id)
+
+
+def _discard_versions(created_versions):
+    """Delete versions a job recorded whose result will never be applied; no timeline reaches them."""
+    store = get_dataset_store()
+    for dataset_id, versions in created_versions.items():
+        for version in versions:
+            store.delete(dataset_id, version)
+
+
+def apply_job_result(session, job):
+    """
+    Carry a finished job's session changes over to ``session``, once. Returns
+    the job record. If the session moved on while the job ran, the result
+    is discarded instead (``applied`` is False).
+    """
+    if job['status'] != SUCCEEDED or job.get('applied') is not None:
+        return job
+    with _job_lock(job['id']):
+        job = load_job(job['id']) # Another request may have applied it meanwhile
+        if job['status'] != SUCCEEDED or job.get('applied') is not None:
+            return job
+        job.update(_apply_job_result(session, job))
+        _save_job(job)
+    return job
+
+
+def _apply_job_result(session, job):
+    """The body of ``apply_job_result``, under the job's lock. Returns the fields to update the record with."""
+    from .history import drop_undone_versions, maintain_history # history -> ingest -> jobs
+    current = [session.get(SESSION_DATASET_ID_KEY), session.get(SESSION_DATASET_VERSION_KEY)]
+    updates = job.get('session_updates', {})
+    created = job.get('created_versions', {})
+    if current == job['base']:
+        if created.get(current[0]):
+            drop_undone_versions(session) # The job's new versions replace them
+        for key, value in updates.items():
+            session[key] = value
+        for key in job.get('session_removed', []):
+            session.pop(key, None)
+        for dataset_id in job.get('retired_datasets', []):
+            _discard_dataset(dataset_id)
+        if session.get(SESSION_DATASET_ID_KEY) in created:
+            maintain_history(session) # Snapshots and pruning the job left for now
+        return {'applied': True}
+
+    new_dataset_id = updates.get(SESSION_DATASET_ID_KEY)
+    # Not the full dataset of a sample, though: a commit job moves the session onto it (see sampling.py)
+    kept = {current[0], (session.get(SESSION_FULL_DATASET_KEY) or {}).get('id')}
+    if new_dataset_id and new_dataset_id not in kept:
+        _discard_dataset(new_dataset_id) # Nothing will ever point at it
+    _discard_versions(created)
+    return {'applied': False, 'error': "The data changed while this job ran; its result was discarded."}
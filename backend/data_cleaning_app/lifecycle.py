@@ -0,0 +1,226 @@
+"""
+Lifecycle of stored datasets: idle expiry, byte quotas and sweeping.
+
+Sessions only hold the id of their dataset; the data itself lives in the
+dataset store (see storage.py), and nothing deletes it when a session is
+abandoned. The sweeper does, by the DATASET_LIFECYCLE setting:
+
+- expired sessions are cleared from the session backend first
+- datasets not opened for IDLE_TTL seconds are deleted
+- orphaned datasets, whose owning session no longer exists, are deleted
+  once unused for ORPHAN_GRACE seconds, which covers background jobs still
+  working on them; datasets with no recorded owner only expire when idle
+- a session over SESSION_MAX_BYTES loses its least recently used datasets,
+  and so does the whole store over MAX_BYTES; the most recently used
+  dataset is never evicted
+
+Each dataset records its owner's session key and is touched whenever the
+session opens it. A session whose dataset was deleted is asked to upload
+its file again. Besides the sweep every SWEEP_INTERVAL seconds after an
+upload, ``manage.py sweep_datasets`` runs it, e.g. from cron.
+
+Uploads larger than SESSION_MAX_BYTES once stored are refused, and history
+is pruned to stay within it (see history.py).
+"""
+import functools
+import logging
+import threading
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.db import connections
+from django.template.defaultfilters import filesizeformat
+
+from .cache import get_column_view_cache, get_dataframe_cache
+from .storage import get_dataset_store
+from .uploads import get_upload_cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIFECYCLE = {
+    'IDLE_TTL': 7 * 24 * 60 * 60,
+    'ORPHAN_GRACE': 60 * 60,
+    'SESSION_MAX_BYTES': 4 * 1024 * 1024 * 1024,
+    'MAX_BYTES': 50 * 1024 * 1024 * 1024,
+    'SWEEP_INTERVAL': 15 * 60,
+}
+
+_sweep_lock = threading.Lock()
+_last_sweep = {'at': None, 'result': None}
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+def _config():
+    return {**DEFAULT_LIFECYCLE, **getattr(settings, 'DATASET_LIFECYCLE', {})}
+
+
+def session_max_bytes():
+    return _config()['SESSION_MAX_BYTES']
+
+
+def check_session_quota(dataset_id):
+    """Raise QuotaExceeded if ``dataset_id`` alone takes more than SESSION_MAX_BYTES on disk."""
+    nbytes, max_bytes = get_dataset_store().nbytes(dataset_id), session_max_bytes()
+    if nbytes > max_bytes:
+        raise QuotaExceeded(
+            f"The dataset takes {filesizeformat(nbytes)} once stored, over the limit of "
+            f"{filesizeformat(max_bytes)} per session."
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def _session_store_class():
+    return import_module(settings.SESSION_ENGINE).SessionStore
+
+
+def _sessions_enumerable():
+    # Cookie-based sessions live in the browser: the server cannot tell whether one still exists
+    return not settings.SESSION_ENGINE.endswith('signed_cookies')
+
+
+# -----------------------------------------
+# Sweeping
+# -----------------------------------------
+
+def dataset_usage():
+    """Every stored dataset with its owner, size on disk and last use, least recently used first."""
+    store = get_dataset_store()
+    datasets = []
+    for dataset_id in store.dataset_ids():
+        last_used = store.last_used(dataset_id)
+        if last_used is None: # Deleted meanwhile
+            continue
+        datasets.append({
+            'id': dataset_id, 'owner': store.owner(dataset_id),
+            'bytes': store.nbytes(dataset_id), 'last_used': last_used,
+        })
+    datasets.sort(key=lambda d: d['last_used'])
+    return datasets
+
+
+def _evictions(datasets, config, now):
+    """The datasets the sweep deletes, by id, with the reason for each."""
+    evicted = {}
+    session_store = _session_store_class()
+    live = {}
+    for d in datasets:
+        if d['last_used'] < now - config['IDLE_TTL']:
+            evicted[d['id']] = 'idle'
+        elif d['owner'] is not None and d['last_used'] < now - config['ORPHAN_GRACE'] and _sessions_enumerable():
+            if d['owner'] not in live:
+                live[d['owner']] = session_store().exists(d['owner'])
+            if not live[d['owner']]:
+                evicted[d['id']] = 'orphaned'
+
+    # Least recently used first, over each session's quota and then over the store's
+    kept = [d for d in datasets if d['id'] not in evicted]
+    by_owner = {}
+    for d in kept:
+        if d['owner'] is not None:
+            by_owner.setdefault(d['owner'], []).append(d)
+    for owned in by_owner.values():
+        nbytes = sum(d['bytes'] for d in owned)
+        for d in owned[:-1]:
+            if nbytes <= config['SESSION_MAX_BYTES']:
+                break
+            evicted[d['id']] = 'session quota'
+            nbytes -= d['bytes']
+    kept = [d for d in kept if d['id'] not in evicted]
+    nbytes = sum(d['bytes'] for d in kept)
+    for d in kept[:-1]:
+        if nbytes <= config['MAX_BYTES']:
+            break
+        evicted[d['id']] = 'store quota'
+        nbytes -= d['bytes']
+    return evicted
+
+
+def sweep_datasets(dry_run=False):
+    """
+    Delete expired sessions, then idle, orphaned and over-quota datasets; see
+    the module docstring. Returns what was (or, with ``dry_run``, would be) deleted.
+    """
+    config = _config()
+    now = time.time()
+    if not dry_run:
+        _session_store_class().clear_expired()
+    datasets = dataset_usage()
+    evicted = _evictions(datasets, config, now)
+
+    store = get_dataset_store()
+    reasons, freed_bytes = {}, 0
+    for d in datasets:
+        reason = evicted.get(d['id'])
+        if reason is None:
+            continue
+        if not dry_run:
+            store.delete(d['id'])
+            get_dataframe_cache().discard_dataset(d['id'])
+            get_column_view_cache().discard_dataset(d['id'])
+            logger.info("Dataset evicted", extra={'dataset_id': d['id'], 'reason': reason, 'bytes': d['bytes']})
+        reasons[reason] = reasons.get(reason, 0) + 1
+        freed_bytes += d['bytes']
+    upload_cache = get_upload_cache()
+    if upload_cache is not None and not dry_run:
+        upload_cache.evict()
+
+    result = {
+        'finished_at': time.time(), 'dry_run': dry_run,
+        'datasets': len(datasets), 'deleted': len(evicted), 'reasons': reasons, 'freed_bytes': freed_bytes,
+        'seconds': round(time.time() - now, 4),
+    }
+    if not dry_run:
+        _last_sweep.update(at=now, result=result)
+    return result
+
+
+def schedule_sweep():
+    """Sweep in a background thread if this process has not for SWEEP_INTERVAL seconds (0 disables)."""
+    interval = _config()['SWEEP_INTERVAL']
+    if not interval or (_last_sweep['at'] is not None and time.time() - _last_sweep['at'] < interval):
+        return
+    if not _sweep_lock.acquire(blocking=False): # Already sweeping
+        return
+    _last_sweep['at'] = time.time()
+
+    def sweep():
+        try:
+            sweep_datasets()
+        except Exception:
+            logger.exception("Dataset sweep failed")
+        finally:
+            connections.close_all() # This thread's own, opened by clearing expired sessions
+            _sweep_lock.release()
+    threading.Thread(target=sweep, name='dataset-sweep', daemon=True).start()
+
+
+def storage_usage():
+    """Disk used by the dataset store, for the storage endpoint."""
+    config = _config()
+    datasets = dataset_usage()
+    sizes = {}
+    for d in datasets:
+        if d['owner'] is not None:
+            sizes[d['owner']] = sizes.get(d['owner'], 0) + d['bytes']
+    upload_cache = get_upload_cache()
+    return {
+        'datasets': len(datasets),
+        'sessions': len(sizes),
+        'bytes': sum(d['bytes'] for d in datasets),
+        'max_bytes': config['MAX_BYTES'],
+        'largest_session_bytes': max(sizes.values(), default=0),
+        'session_max_bytes': config['SESSION_MAX_BYTES'],
+        'idle_ttl': config['IDLE_TTL'],
+        'oldest_last_used': datasets[0]['last_used'] if datasets else None,
+        # Session keys are credentials: datasets are listed by id only
+        'largest_datasets': [
+            {'id': d['id'], 'bytes': d['bytes'], 'last_used': d['last_used']}
+            for d in sorted(datasets, key=lambda d: d['bytes'], reverse=True)[:10]
+        ],
+        'upload_cache': upload_cache.stats() if upload_cache else {'enabled': False},
+        'last_sweep': _last_sweep['result'],
+    }
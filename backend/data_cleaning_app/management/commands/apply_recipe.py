@@ -0,0 +1,86 @@
+"""
+Apply a recipe exported from a cleaning session to every CSV/XLSX file in
+a directory, one file per worker process.
+
+    python manage.py apply_recipe recipe.json incoming/ cleaned/ --format parquet --workers 4
+"""
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from data_cleaning_app.export import CONTENT_TYPES
+from data_cleaning_app.recipes import RecipeError, apply_recipe_to_file, input_files, load_recipe
+
+
+def _worker_init():
+    import django
+    django.setup()
+
+
+def _apply(recipe, path, output_dir, output_format):
+    columns, steps = load_recipe(recipe)
+    try:
+        return apply_recipe_to_file(columns, steps, path, output_dir, output_format)
+    except Exception as e: # One bad file should not stop the batch
+        return {'file': path, 'error': f"{type(e).__name__}: {e}"}
+
+
+class Command(BaseCommand):
+    help = "Apply a cleaning recipe to every CSV/XLSX file in a directory."
+
+    def add_arguments(self, parser):
+        parser.add_argument('recipe', help="Recipe JSON downloaded from a cleaning session.")
+        parser.add_argument('input_dir')
+        parser.add_argument('output_dir')
+        parser.add_argument('--format', dest='output_format', default='csv', choices=sorted(CONTENT_TYPES))
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+
+    def handle(self, *args, recipe, input_dir, output_dir, output_format, workers, **options):
+        try:
+            with open(recipe) as f:
+                recipe_data = json.load(f)
+            load_recipe(recipe_data) # Fail before starting any worker
+        except (OSError, ValueError, RecipeError) as e:
+            raise CommandError(f"Cannot read recipe '{recipe}': {e}")
+        if not os.path.isdir(input_dir):
+            raise CommandError(f"Input directory '{input_dir}' does not exist.")
+        paths = input_files(input_dir)
+        if not paths:
+            raise CommandError(f"No .csv or .xlsx files in '{input_dir}'.")
+        os.makedirs(output_dir, exist_ok=True)
+        workers = max(1, min(workers, len(paths)))
+        self.stdout.write(f"Applying {len(recipe_data['steps'])} step(s) to {len(paths)} file(s) with {workers} worker(s)")
+
+        start = time.perf_counter()
+        results = []
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_worker_init,
+        ) as executor:
+            futures = [executor.submit(_apply, recipe_data, path, output_dir, output_format) for path in paths]
+            for future in concurrent.futures.as_completed(futures):
+                result = future.result()
+                results.append(result)
+                name = os.path.basename(result['file'])
+                if result.get('error'):
+                    self.stderr.write(f"  FAILED {name}: {result['error']}")
+                else:
+                    self.stdout.write(
+                        f"  {name}: {result['rows_in']} -> {result['rows_out']} rows, {result['columns_out']} columns "
+                        f"in {result['seconds']:.2f}s (read {result['read_seconds']:.2f}s)"
+                    )
+        elapsed = time.perf_counter() - start
+
+        done = [r for r in results if not r.get('error')]
+        rows = sum(r['rows_in'] for r in done)
+        self.stdout.write(
+            f"{len(done)}/{len(paths)} file(s), {rows} rows in {elapsed:.2f}s: "
+            f"{rows / elapsed:,.0f} rows/s, {len(done) / elapsed:.2f} files/s"
+        )
+        if len(done) < len(paths):
+            raise CommandError(f"{len(paths) - len(done)} file(s) failed.")
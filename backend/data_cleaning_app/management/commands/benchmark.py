@@ -0,0 +1,92 @@
+"""
+Benchmark every endpoint over synthetic datasets and save the timings.
+
+    python manage.py benchmark --sizes 10k,100k,1m,5m --shapes narrow-numeric,wide-text
+    python manage.py benchmark --sizes 1m --engine out-of-core
+    python manage.py benchmark --compare benchmarks/results/<older>.json
+
+See data_cleaning_app/benchmarks.py for what is measured.
+"""
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from data_cleaning_app.benchmarks import SHAPES, SIZES, build_report, compare, read_report, run_benchmarks, write_report
+from data_cleaning_app.outofcore import ENGINES
+
+
+def _choices(value, known, option):
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in known]
+    if unknown or not names:
+        raise CommandError(f"{option}: unknown {', '.join(unknown) or 'empty list'}; choose from {', '.join(known)}.")
+    return names
+
+
+class Command(BaseCommand):
+    help = "Time every endpoint, per phase and with peak memory, over generated datasets."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10k,100k,1m', help=f"Comma-separated, of: {', '.join(SIZES)}.")
+        parser.add_argument('--shapes', default=','.join(SHAPES), help=f"Comma-separated, of: {', '.join(SHAPES)}.")
+        parser.add_argument('--repeat', type=int, default=1, help="Runs per dataset; comparisons use the median.")
+        parser.add_argument('--cold', action='store_true', help="Clear the DataFrame cache before every request.")
+        parser.add_argument('--engine', choices=['auto', *ENGINES],
+                            help="Execution engine for every dataset (default: the DATASET_ENGINE setting).")
+        parser.add_argument('--skip', default='', help="Comma-separated endpoint or URL names not to call (e.g. download-xlsx).")
+        parser.add_argument('--data-dir', default=os.path.join(settings.BASE_DIR, 'benchmarks', 'data'),
+                            help="Where generated datasets are kept between runs.")
+        parser.add_argument('--output', help="Result JSON path (default: benchmarks/results/<time>-<commit>.json).")
+        parser.add_argument('--compare', metavar='BASELINE', help="Result JSON of an earlier run to compare against.")
+        parser.add_argument('--threshold', type=float, default=0.2, help="Slowdown flagged as a regression (0.2 = 20%%).")
+
+    def handle(self, *args, **options):
+        sizes = _choices(options['sizes'], SIZES, '--sizes')
+        shapes = _choices(options['shapes'], SHAPES, '--shapes')
+        if options['repeat'] < 1:
+            raise CommandError("--repeat must be at least 1.")
+        baseline = None
+        if options['compare']:
+            try:
+                baseline = read_report(options['compare'])
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Cannot read '{options['compare']}': {e}")
+
+        def progress(dataset, run, results):
+            total = sum(r['seconds'] for r in results)
+            peak = max((r['peak_rss_mb'] for r in results), default=0)
+            self.stdout.write(f"{dataset} run {run + 1}: {len(results)} requests in {total:.2f}s, peak RSS {peak:.0f} MB")
+            for r in results:
+                phases = ', '.join(f"{name} {seconds:.3f}" for name, seconds in r['phases'].items())
+                self.stdout.write(f"  {r['endpoint']:<26} {r['status']} {r['seconds']:8.3f}s  {r['rss_growth_mb']:+8.1f} MB  ({phases})")
+
+        skip = [name.strip() for name in options['skip'].split(',') if name.strip()]
+        results, uncovered = run_benchmarks(
+            shapes, sizes, options['data_dir'], repeat=options['repeat'], cold=options['cold'], skip=skip, progress=progress,
+            engine=options['engine'],
+        )
+        if uncovered:
+            self.stderr.write(f"Endpoints the benchmark does not call: {', '.join(uncovered)}")
+
+        report = build_report(
+            {'sizes': sizes, 'shapes': shapes, 'repeat': options['repeat'], 'cold': options['cold'], 'skip': skip,
+             'engine': options['engine']},
+            results, uncovered,
+        )
+        output = options['output'] or os.path.join(
+            settings.BASE_DIR, 'benchmarks', 'results',
+            f"{time.strftime('%Y%m%d-%H%M%S')}-{(report['environment']['commit'] or 'unknown')[:10]}.json",
+        )
+        write_report(output, report)
+        failed = [r for r in results if r['status'] >= 400]
+        self.stdout.write(f"{len(results)} requests, {len(failed)} failed; results in {output}")
+
+        if baseline is not None:
+            rows = compare(baseline, report, options['threshold'])
+            regressions = [row for row in rows if row[-1]]
+            for dataset, endpoint, before, after, ratio, regressed in rows:
+                flag = '  REGRESSION' if regressed else ''
+                self.stdout.write(f"{dataset:<24} {endpoint:<26} {before:8.3f}s -> {after:8.3f}s  x{ratio:5.2f}{flag}")
+            self.stdout.write(f"{len(regressions)} of {len(rows)} requests more than {options['threshold']:.0%} slower than the baseline")
@@ -0,0 +1,28 @@
+"""
+Delete expired sessions and the idle, orphaned and over-quota datasets of
+the dataset store (see data_cleaning_app/lifecycle.py), e.g. from cron:
+
+    python manage.py sweep_datasets
+    python manage.py sweep_datasets --dry-run
+"""
+from django.core.management.base import BaseCommand
+
+from data_cleaning_app.lifecycle import storage_usage, sweep_datasets
+
+
+class Command(BaseCommand):
+    help = "Delete expired, orphaned and over-quota datasets from the dataset store."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would be deleted.")
+
+    def handle(self, *args, dry_run, **options):
+        result = sweep_datasets(dry_run=dry_run)
+        reasons = ', '.join(f"{count} {reason}" for reason, count in sorted(result['reasons'].items())) or 'nothing to delete'
+        verb = 'Would delete' if dry_run else 'Deleted'
+        self.stdout.write(
+            f"{verb} {result['deleted']} of {result['datasets']} dataset(s) ({reasons}), "
+            f"{result['freed_bytes'] / 2 ** 20:.1f} MB, in {result['seconds']:.2f}s"
+        )
+        usage = storage_usage()
+        self.stdout.write(f"Store: {usage['datasets']} dataset(s), {usage['bytes'] / 2 ** 20:.1f} MB of {usage['max_bytes'] / 2 ** 20:.0f} MB")
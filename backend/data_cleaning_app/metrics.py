@@ -0,0 +1,370 @@
+"""
+Per-request timings, sizes and dataset shapes, as Prometheus histograms.
+
+RequestMetricsMiddleware times every request end to end. While it runs,
+the views and the pipeline mark where the time goes with ``phase(name)``:
+
+- ``deserialize``: parsing the request body, uploads included
+- ``operation``: ingesting uploads, evaluating the pipeline, computing stats
+- ``session_write``: recording steps and storing the session's dataset
+- ``preview``: building preview rows
+- ``serialize``: rendering the response, or encoding a download as it streams
+- ``queued``: waiting for a thread of a view executor (see executors.py)
+
+Phases nest, and each counts only its own time (a preview that has to
+evaluate a filter first counts that part as ``operation``); whatever is
+left over is ``other``. Together with request and response bytes and the
+shape of the dataset the request worked on, they are observed into
+histograms labelled by URL name, served by the metrics endpoint in the
+Prometheus text format. Like the DataFrame cache counters, histograms are
+kept per worker process.
+
+Each finished request is also logged as one structured line on the
+``data_cleaning_app.requests`` logger; StructuredFormatter renders any
+log record, with its ``extra`` fields, as a JSON object.
+"""
+import bisect
+import collections
+import contextlib
+import contextvars
+import datetime
+import functools
+import json
+import logging
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+DEFAULT_METRICS = {
+    'SECONDS_BUCKETS': [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300],
+    'BYTES_BUCKETS': [1024 * 4 ** i for i in range(12)], # 1 KiB to 4 GiB
+    'ROWS_BUCKETS': [1_000, 10_000, 100_000, 1_000_000, 5_000_000, 10_000_000, 100_000_000],
+    'COLUMNS_BUCKETS': [5, 10, 25, 50, 100, 250, 1000, 10_000],
+    'LOG_REQUESTS': True,
+}
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+request_logger = logging.getLogger('data_cleaning_app.requests')
+_current = contextvars.ContextVar('data_cleaning_app_request_metrics', default=None)
+
+
+def _config():
+    return {**DEFAULT_METRICS, **getattr(settings, 'REQUEST_METRICS', {})}
+
+
+# -----------------------------------------
+# Phases
+# -----------------------------------------
+
+class PhaseTimer:
+    """Exclusive time per phase: time spent in a nested phase is not counted again by the outer one."""
+
+    def __init__(self):
+        self.totals = collections.defaultdict(float)
+        self._stack = []
+
+    def reset(self):
+        self.totals.clear()
+        self._stack.clear()
+
+    def start(self):
+        self._stack.append([time.perf_counter(), 0.0])
+
+    def stop(self, name):
+        started, nested = self._stack.pop()
+        elapsed = time.perf_counter() - started
+        self.totals[name] += elapsed - nested
+        if self._stack:
+            self._stack[-1][1] += elapsed
+
+    def add(self, name, seconds):
+        """Count ``seconds`` measured elsewhere toward ``name`` (and not toward the enclosing phase)."""
+        self.totals[name] += seconds
+        if self._stack:
+            self._stack[-1][1] += seconds
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        self.start()
+        try:
+            yield
+        finally:
+            self.stop(name)
+
+    def wrap(self, name, func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            with self.phase(name):
+                return func(*args, **kwargs)
+        return timed
+
+    def wrap_iterator(self, name, func):
+        """Like ``wrap``, for functions returning an iterator that does the work as it is consumed."""
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            with self.phase(name):
+                blocks = iter(func(*args, **kwargs))
+            while True:
+                with self.phase(name):
+                    block = next(blocks, None)
+                if block is None:
+                    return
+                yield block
+        return timed
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Count the block's time toward phase ``name`` of the current request. Also usable as a decorator."""
+    metrics = _current.get()
+    if metrics is None: # Outside a request, e.g. in a background job or a management command
+        yield
+        return
+    with metrics.timer.phase(name):
+        yield
+
+
+def record_phase(name, seconds):
+    """Add ``seconds`` spent outside any other phase (e.g. waiting in a queue) to phase ``name``."""
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.timer.add(name, seconds)
+
+
+def observe_dataset(num_rows, num_columns):
+    """Record the shape of the dataset the current request worked on."""
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.shape = (num_rows, num_columns)
+
+
+# -----------------------------------------
+# Histograms
+# -----------------------------------------
+
+def _number(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram:
+    """A Prometheus histogram with labels, safe to observe from several threads."""
+
+    def __init__(self, name, documentation, labelnames, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = sorted(float(b) for b in buckets)
+        self._series = {} # label values -> [per-bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value) # First bucket with le >= value
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, (list(counts), total, count)) for labels, (counts, total, count) in self._series.items())
+        for labels, (counts, total, count) in series:
+            label_text = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labels))
+            prefix = f"{label_text}," if label_text else ''
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{_number(bound)}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {_number(total)}")
+            lines.append(f"{self.name}_count{{{label_text}}} {count}")
+        return '\n'.join(lines)
+
+
+@functools.lru_cache(maxsize=None)
+def get_histograms():
+    config = _config()
+    seconds, size = config['SECONDS_BUCKETS'], config['BYTES_BUCKETS']
+    return {
+        'request': Histogram('data_cleaning_request_duration_seconds', "Wall time of requests, including streaming the response.",
+                             ('endpoint', 'method', 'status'), seconds),
+        'phase': Histogram('data_cleaning_request_phase_seconds', "Wall time of requests by phase.", ('endpoint', 'phase'), seconds),
+        'request_bytes': Histogram('data_cleaning_request_size_bytes', "Request body sizes.", ('endpoint',), size),
+        'response_bytes': Histogram('data_cleaning_response_size_bytes', "Response body sizes.", ('endpoint',), size),
+        'rows': Histogram('data_cleaning_dataset_rows', "Rows of the dataset a request worked on.", ('endpoint',), config['ROWS_BUCKETS']),
+        'columns': Histogram('data_cleaning_dataset_columns', "Columns of the dataset a request worked on.", ('endpoint',), config['COLUMNS_BUCKETS']),
+    }
+
+
+def render_gauges(name, documentation, samples):
+    """Prometheus text for a gauge with ``samples`` of ``({label: value}, value)``."""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} gauge"]
+    for labels, value in samples:
+        label_text = ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+        lines.append(f"{name}{{{label_text}}} {_number(value)}")
+    return '\n'.join(lines)
+
+
+def render_metrics():
+    return '\n'.join(histogram.render() for histogram in get_histograms().values()) + '\n'
+
+
+# -----------------------------------------
+# Middleware
+# -----------------------------------------
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timer = PhaseTimer()
+        self.shape = None
+
+    def stream(self, content, request, response):
+        """Pass ``content`` through, timing its blocks as serialization; the request is done when it is exhausted."""
+        size = 0
+        blocks = iter(content)
+        try:
+            while True:
+                token = _current.set(self) # Phases marked while a block is produced belong to this request
+                try:
+                    with self.timer.phase('serialize'):
+                        block = next(blocks, None)
+                finally:
+                    _current.reset(token)
+                if block is None:
+                    return
+                size += len(block)
+                yield block
+        finally:
+            self.finish(request, response, size)
+
+    async def astream(self, content, request, response):
+        """``stream`` for async iterators (downloads under ASGI)."""
+        size = 0
+        blocks = aiter(content)
+        try:
+            while True:
+                token = _current.set(self)
+                try:
+                    self.timer.start()
+                    try:
+                        block = await anext(blocks, None)
+                    finally:
+                        self.timer.stop('serialize')
+                finally:
+                    _current.reset(token)
+                if block is None:
+                    return
+                size += len(block)
+                yield block
+        finally:
+            self.finish(request, response, size)
+
+    def finish(self, request, response, response_bytes):
+        seconds = time.perf_counter() - self.started
+        match = getattr(request, 'resolver_match', None)
+        endpoint = match.url_name if match is not None and match.url_name else 'unmatched'
+        try:
+            request_bytes = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            request_bytes = 0
+        phases = dict(self.timer.totals)
+        phases['other'] = max(0.0, seconds - sum(phases.values()))
+
+        histograms = get_histograms()
+        histograms['request'].observe(seconds, endpoint, request.method, str(response.status_code))
+        for name, phase_seconds in phases.items():
+            histograms['phase'].observe(phase_seconds, endpoint, name)
+        histograms['request_bytes'].observe(request_bytes, endpoint)
+        histograms['response_bytes'].observe(response_bytes, endpoint)
+        if self.shape is not None:
+            histograms['rows'].observe(self.shape[0], endpoint)
+            histograms['columns'].observe(self.shape[1], endpoint)
+
+        if _config()['LOG_REQUESTS']:
+            request_logger.info("%s %s %s", request.method, request.path, response.status_code, extra={
+                'endpoint': endpoint, 'method': request.method, 'status': response.status_code,
+                'seconds': round(seconds, 6), 'phases': {name: round(s, 6) for name, s in phases.items()},
+                'request_bytes': request_bytes, 'response_bytes': response_bytes,
+                'rows': self.shape[0] if self.shape else None, 'columns': self.shape[1] if self.shape else None,
+            })
+
+
+class RequestMetricsMiddleware:
+    """Times each request and its phases; see the module docstring. Works under WSGI and ASGI."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self._acall(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._done(metrics, request, response)
+
+    async def _acall(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._done(metrics, request, response)
+
+    def _done(self, metrics, request, response):
+        if response.streaming and response.is_async:
+            response.streaming_content = metrics.astream(response.streaming_content, request, response)
+        elif response.streaming:
+            response.streaming_content = metrics.stream(response.streaming_content, request, response)
+        else:
+            metrics.finish(request, response, len(response.content))
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns; time that as serialization
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.timer.start()
+            response.add_post_render_callback(lambda rendered: metrics.timer.stop('serialize'))
+        return response
+
+
+# -----------------------------------------
+# Structured logs
+# -----------------------------------------
+
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class StructuredFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message and any ``extra`` fields."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname, 'logger': record.name, 'message': record.getMessage(),
+        }
+        entry.update((k, v) for k, v in vars(record).items() if k not in _RECORD_ATTRIBUTES)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
@@ -0,0 +1,137 @@
+"""
+Execution engines for lazy frames, and out-of-core evaluation for datasets
+larger than memory.
+
+A session's dataset is a base source on disk plus recorded steps (see
+pipeline.py). The ``memory`` engine, LazyFrame itself, evaluates them with
+whole columns in pandas wherever a step or a query needs it: fitting a
+step, counting filtered rows, a sorted preview. The ``out-of-core`` engine,
+OutOfCoreFrame, never holds more than CHUNK_ROWS rows of the dataset at a
+time. It reads the memory-mapped Arrow data files a chunk at a time, with
+only the columns the plan needs:
+
+- fitted state is merged chunk by chunk: running sums for means, merged
+  value counts for modes and categories, a uniform sample for medians
+- row counts are summed over chunks of just the filter columns
+- preview windows keep the best ``offset + limit`` rows while scanning, and
+  stop early when unsorted
+- downloads, snapshots and column statistics stream chunk by chunk
+
+Steps that need the whole dataset at once (forward/backward filling,
+interpolation, duplicate removal) are refused on out-of-core frames.
+
+DATASET_ENGINE['ENGINE'] picks the engine: ``memory``, ``out-of-core``, the
+dotted path of a LazyFrame subclass, or ``auto`` for out of core once the
+data files a version reads pass OUT_OF_CORE_BYTES on disk. Out-of-core
+evaluation relies on the Arrow store's memory-mapped files; the Parquet
+store decompresses each data file it reads whole.
+"""
+import functools
+
+import pandas as pd
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .metrics import phase
+from .pipeline import FillMissing, FrameSource, LazyFrame, StepError, _run, _sort
+
+DEFAULT_ENGINE = {
+    'ENGINE': 'auto',
+    'OUT_OF_CORE_BYTES': 2 * 1024 * 1024 * 1024,
+    'CHUNK_ROWS': 250_000,
+}
+
+
+def _config():
+    return {**DEFAULT_ENGINE, **getattr(settings, 'DATASET_ENGINE', {})}
+
+
+class OutOfCoreFrame(LazyFrame):
+    """A LazyFrame evaluated CHUNK_ROWS rows at a time; see the module docstring."""
+    out_of_core = True
+
+    @property
+    def chunk_rows(self):
+        return _config()['CHUNK_ROWS']
+
+    def chunks(self, columns=None):
+        """The frame's ``columns`` chunk by chunk; an empty frame yields one empty chunk."""
+        found = False
+        for chunk in self.iter_chunks(self.chunk_rows, columns):
+            found = True
+            yield chunk
+        if not found:
+            empty = self._empty()
+            yield empty if columns is None else empty[list(columns)]
+
+    @phase('operation')
+    def then(self, step):
+        if not step.row_local:
+            hint = " Use a statistic or a constant instead." if isinstance(step, FillMissing) else ""
+            raise StepError(
+                f"'{step.op}' with these parameters needs the whole dataset in memory, which is not available "
+                f"for a dataset this large.{hint}"
+            )
+        fit_columns = step.fit_columns()
+        if fit_columns is not None:
+            step.fit_chunks(self.chunks(fit_columns), len(self))
+        return type(self)(self.source, self.steps + [step])
+
+    @phase('operation')
+    def window(self, offset, limit, columns=None, sort_by=None, ascending=True):
+        _, steps = self.plan()
+        if not all(step.row_local for step in steps) or (sort_by is None and not any(step.is_mask for step in steps)):
+            return super().window(offset, limit, columns, sort_by, ascending)
+        columns = list(self.columns) if columns is None else list(columns)
+        base_columns, steps = self.plan(columns)
+
+        # Scan the filter and sort columns, keeping the source positions of the first offset + limit rows
+        key_columns = [] if sort_by is None else [sort_by]
+        key_base, key_steps = self.plan(key_columns)
+        wanted = offset + limit
+        kept = None
+        for start in range(0, self.source.num_rows, self.chunk_rows):
+            base = self.source.read(key_base, start, self.chunk_rows)
+            keys = _run(key_steps, base.set_axis(pd.RangeIndex(start, start + len(base)), axis=0))[key_columns]
+            kept = keys if kept is None else pd.concat([kept, keys])
+            if sort_by is None:
+                if len(kept) >= wanted:
+                    break
+            else: # Stable, so ties stay in source order as in a sort of the whole column
+                kept = _sort(kept, sort_by, ascending).head(wanted)
+        rows = [] if kept is None else kept.index.to_numpy()[offset:wanted]
+        return _run(steps, self.source.take(base_columns, rows))[columns]
+
+    @phase('operation')
+    def __len__(self):
+        if self._num_rows is None:
+            if any(step.drops_rows for step in self.steps):
+                self._num_rows = sum(len(chunk) for chunk in self.iter_chunks(self.chunk_rows, columns=[]))
+            else:
+                self._num_rows = self.source.num_rows
+        return self._num_rows
+
+
+ENGINES = {
+    'memory': LazyFrame,
+    'out-of-core': OutOfCoreFrame,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _engine_class(name):
+    return ENGINES[name] if name in ENGINES else import_string(name)
+
+
+def open_frame(source, steps=(), num_rows=None):
+    """
+    A lazy frame over ``source`` with the engine DATASET_ENGINE picks. Frames
+    already in memory (FrameSource) always use the memory engine.
+    """
+    config = _config()
+    name = config['ENGINE']
+    if isinstance(source, FrameSource):
+        name = 'memory'
+    elif name == 'auto':
+        name = 'out-of-core' if source.nbytes() > config['OUT_OF_CORE_BYTES'] else 'memory'
+    return _engine_class(name)(source, steps, num_rows=num_rows)
@@ -0,0 +1,1340 @@
+"""
+Lazy operation pipeline.
+
+A session's dataset is an immutable base frame plus the list of cleaning
+steps recorded on top of it. Steps are only evaluated when something needs
+their output (a preview, a row count, a download), and the plan is
+optimized before it runs:
+
+* consecutive row filters are fused into one boolean mask,
+* column drops are pushed down ahead of the steps that don't touch them,
+* only the columns the caller asked for, plus whatever the filters read,
+  are pulled out of the base frame,
+* a preview evaluates the plan over just enough leading rows to fill it
+  when every step is row-local.
+
+Steps that depend on the data as a whole (a column mean, the set of
+categories to encode) are fitted once when they are recorded, so they
+replay deterministically and stay row-local afterwards.
+"""
+import logging
+import re
+
+import numpy as np
+import pandas as pd
+
+from .metrics import phase
+
+logger = logging.getLogger(__name__)
+
+
+class StepError(ValueError):
+    """Invalid operation parameters; views report these to the client as a 400."""
+
+
+STEP_TYPES = {}
+
+
+def register_step(cls):
+    STEP_TYPES[cls.op] = cls
+    return cls
+
+
+def step_from_dict(data):
+    data = dict(data)
+    op = data.pop('op')
+    if op not in STEP_TYPES:
+        raise StepError(f"Unknown operation: '{op}'.")
+    return STEP_TYPES[op](**data)
+
+
+def _json_values(index):
+    """Category values as JSON-friendly Python scalars."""
+    if pd.api.types.is_datetime64_any_dtype(index.dtype):
+        # str() rather than isoformat() so "{column}_{value}" matches get_dummies' column names
+        return [str(value) for value in index]
+    return index.tolist()
+
+
+def _present_categories(series):
+    """The values in ``series`` as categories, in the order ``astype('category')`` gives them."""
+    # Categorical columns may list categories that filters have since removed
+    return series.astype('category').cat.remove_unused_categories().cat.categories
+
+
+def _merged_value_counts(chunks, columns):
+    """
+    Value counts of each of ``columns`` over a frame given as ``chunks``,
+    most frequent first, with the column's dtype: ``{column: (counts, dtype)}``.
+    """
+    counts, dtypes = {}, {}
+    for chunk in chunks:
+        for column in columns:
+            found = chunk[column].value_counts(dropna=True)
+            found = found[found > 0]
+            counts[column] = found if column not in counts else counts[column].add(found, fill_value=0)
+            dtypes[column] = chunk[column].dtype
+    merged = {}
+    for column in columns:
+        found = counts.get(column, pd.Series(dtype='int64'))
+        merged[column] = (found.astype('int64').sort_values(ascending=False, kind='stable'), dtypes.get(column, object))
+    return merged
+
+
+def _categories_for(series, values):
+    """Rebuild fitted category values with the dtype of ``series``."""
+    categories = pd.Index(values)
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        dtype = dtype.categories.dtype
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        categories = pd.to_datetime(categories).astype(dtype)
+    return categories
+
+
+class Step:
+    """
+    One recorded operation.
+
+    ``row_local`` steps compute output row i from input row i alone (fitted
+    state aside), which lets previews be evaluated on leading rows only.
+    ``is_mask`` steps only remove rows and can be fused together; any step
+    that may remove rows sets ``drops_rows``. ``fitted``
+    names the parameters filled in by ``fit()``. Steps must keep the index
+    of the rows they pass through; snapshots rely on it to track row origins.
+    """
+    op = None
+    row_local = True
+    is_mask = False
+    drops_rows = False
+    fitted = ()
+
+    def params(self):
+        raise NotImplementedError
+
+    def to_dict(self):
+        return {'op': self.op, **self.params()}
+
+    def referenced_columns(self):
+        """Columns this step reads or writes; None means every column."""
+        return set()
+
+    def required_columns(self, needed):
+        """Input columns needed to produce the ``needed`` output columns (None = all)."""
+        return needed
+
+    def written_columns(self):
+        """Output columns whose values this step creates or changes."""
+        return set()
+
+    def fit_columns(self):
+        """Columns to fit on when the step is recorded, or None if it has no fitted state."""
+        return None
+
+    def fit(self, df):
+        pass
+
+    def fit_chunks(self, chunks, num_rows):
+        """
+        ``fit`` on a frame of ``num_rows`` rows given as a sequence of chunks
+        (see outofcore.py). Steps whose state can be merged chunk by chunk
+        override this; others are fitted on the chunks put back together.
+        """
+        self.fit(pd.concat(list(chunks)))
+
+    def apply(self, df):
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.params()})"
+
+
+class MaskStep(Step):
+    is_mask = True
+    drops_rows = True
+
+    def mask(self, df, views=None):
+        """Boolean row mask. ``views`` is a ColumnViews shared by filters evaluated together."""
+        raise NotImplementedError
+
+    def required_columns(self, needed):
+        referenced = self.referenced_columns()
+        if needed is None or referenced is None:
+            return None
+        return needed | referenced
+
+    def apply(self, df):
+        return df[self.mask(df)]
+
+
+# -----------------------------------------
+# Column operations
+# -----------------------------------------
+
+@register_step
+class DropColumns(Step):
+    op = 'drop-columns'
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+
+    def params(self):
+        return {'columns': self.columns}
+
+    def referenced_columns(self):
+        return set(self.columns)
+
+    def apply(self, df):
+        return df.drop(columns=[c for c in self.columns if c in df.columns])
+
+
+# -----------------------------------------
+# Row filters
+# -----------------------------------------
+
+@register_step
+class DropMissingRows(MaskStep):
+    op = 'drop-missing-rows'
+
+    def __init__(self, how='any'):
+        if how not in ('any', 'all'):
+            raise StepError("Invalid 'strategy' parameter. Must be 'any' or 'all'.")
+        self.how = how
+
+    def params(self):
+        return {'how': self.how}
+
+    def referenced_columns(self):
+        return None
+
+    def mask(self, df, views=None):
+        present = df.notna()
+        return present.all(axis=1) if self.how == 'any' else present.any(axis=1)
+
+
+FILTER_OPERATORS = ('>', '>=', '<', '<=', '==', '!=', 'contains', 'not_contains')
+EXPRESSION_OPERATORS = FILTER_OPERATORS + ('in', 'not_in', 'between', 'is_null', 'not_null', 'regex')
+COLUMN_OPERATORS = ('>', '>=', '<', '<=', '==', '!=') # Allowed against an 'other_column'
+MAX_EXPRESSION_DEPTH = 32
+TRUTHY_STRINGS = ['true', '1', 'yes']
+
+_COMPARISONS = {
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+}
+
+
+def _known(matches):
+    """Comparisons on nullable columns give <NA> for missing values; those rows don't match."""
+    return matches if matches.dtype == bool else matches.fillna(False).astype(bool)
+
+
+def _text(series):
+    """``series`` as str values; through object, as categorical columns can't always go straight to str."""
+    return series.astype(object).astype(str)
+
+
+def _is_text_dtype(dtype):
+    return pd.api.types.is_string_dtype(dtype) or dtype == object or isinstance(dtype, pd.CategoricalDtype)
+
+
+class ColumnViews:
+    """
+    The typed forms of a frame's columns that filter conditions compare
+    against. Each is converted once per evaluation, however many conditions
+    read it.
+
+    ``shared``, when given, keeps the views of the base source ``df`` holds
+    every row of across evaluations (see SourceColumnViews in storage.py);
+    it is consulted for every column except the ``written`` ones, which
+    earlier steps of the plan changed. Text is then kept as codes into its
+    distinct values, so text conditions test each distinct value once.
+    """
+    shared_kinds = ('numeric', 'datetime', 'codes', 'truthy')
+
+    def __init__(self, df, shared=None, written=()):
+        self.df = df
+        self.shared = shared
+        self.written = written
+        self._views = {}
+
+    def column(self, name):
+        if name not in self.df.columns:
+            raise StepError(f"Column '{name}' not found in the data.")
+        return self.df[name]
+
+    def _view(self, kind, name, convert):
+        if (kind, name) in self._views:
+            return self._views[kind, name]
+        shared = self.shared if kind in self.shared_kinds and name not in self.written else None
+        view = shared.get(kind, name) if shared is not None else None
+        if view is None:
+            view = convert(self.column(name))
+            if shared is not None:
+                shared.put(kind, name, view)
+        elif isinstance(view, pd.Series) and view.index is not self.df.index:
+            view = pd.Series(view.array, index=self.df.index, name=view.name, copy=False) # Same rows, in order
+        self._views[kind, name] = view
+        return view
+
+    def numeric(self, name):
+        return self._view('numeric', name, lambda s: pd.to_numeric(s, errors='coerce'))
+
+    def datetime(self, name):
+        return self._view('datetime', name, lambda s: pd.to_datetime(s, errors='coerce'))
+
+    def codes(self, name):
+        """``(codes, values)``: the column's text as positions into its distinct text values."""
+        return self._view('codes', name, lambda s: pd.factorize(_text(s)))
+
+    def _coded(self, name):
+        return self.shared is not None or ('codes', name) in self._views
+
+    def text(self, name):
+        if not self._coded(name):
+            return self._view('text', name, _text)
+        codes, values = self.codes(name)
+        return self._view('text', name, lambda s: pd.Series(values.take(codes), index=s.index, name=s.name))
+
+    def text_matches(self, name, test):
+        """Boolean Series of the rows whose text passes ``test``, a vectorized test on a Series of text."""
+        if not self._coded(name):
+            return test(self.text(name))
+        codes, values = self.codes(name)
+        passed = np.asarray(test(pd.Series(values)), dtype=bool)
+        return pd.Series(passed[codes], index=self.df.index, name=name)
+
+    def truthy(self, name):
+        return self._view('truthy', name, lambda s: self.text_matches(name, lambda text: text.str.lower().isin(TRUTHY_STRINGS)))
+
+
+def filter_mask(views, column, operator, value=None):
+    """Boolean mask of the rows whose ``column`` matches ``operator value``."""
+    series = views.column(column)
+    col_dtype = series.dtype
+    if operator in ['>', '>=', '<', '<=']:
+        try:
+            # Try to convert both column and value to numeric for comparison
+            numeric_value = float(value)
+        except (TypeError, ValueError):
+            raise StepError(f"Cannot perform numeric comparison on column '{column}' with value '{value}'. Ensure data types are compatible.")
+        return _known(_COMPARISONS[operator](views.numeric(column), numeric_value))
+
+    elif operator in ['==', '!=']:
+        # For (in)equality, try to match type if possible, otherwise string comparison
+        try:
+            if pd.api.types.is_numeric_dtype(col_dtype):
+                matches = views.numeric(column) == pd.to_numeric(value)
+            elif pd.api.types.is_datetime64_any_dtype(col_dtype):
+                matches = views.datetime(column) == pd.to_datetime(value)
+            elif pd.api.types.is_bool_dtype(col_dtype):
+                matches = views.truthy(column) == (str(value).lower() in TRUTHY_STRINGS)
+            else: # Default to string comparison
+                matches = views.text_matches(column, lambda text: text == str(value))
+        except Exception as e_conv:
+            logger.debug("Comparing as text", extra={'operator': operator, 'error': str(e_conv)})
+            # Fallback to string comparison if conversion fails
+            matches = views.text_matches(column, lambda text: text == str(value))
+        matches = _known(matches)
+        return matches if operator == '==' else ~matches
+
+    elif operator in ['contains', 'not_contains', 'regex']:
+        if not _is_text_dtype(col_dtype):
+            raise StepError(f"'{operator}' operator is only for text columns.")
+        if operator == 'regex':
+            return _known(views.text_matches(column, lambda text: text.str.contains(str(value), regex=True, na=False))) & series.notna()
+        matches = _known(views.text_matches(column, lambda text: text.str.contains(str(value), case=False, na=False)))
+        return matches if operator == 'contains' else ~matches
+
+    elif operator in ['in', 'not_in']:
+        values = list(value)
+        if pd.api.types.is_numeric_dtype(col_dtype) and not pd.api.types.is_bool_dtype(col_dtype):
+            matches = views.numeric(column).isin(pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').dropna())
+        elif pd.api.types.is_datetime64_any_dtype(col_dtype):
+            matches = views.datetime(column).isin(pd.to_datetime(pd.Series(values, dtype=object), errors='coerce').dropna())
+        elif pd.api.types.is_bool_dtype(col_dtype):
+            matches = views.truthy(column).isin({str(v).lower() in TRUTHY_STRINGS for v in values}) & series.notna()
+        else:
+            matches = views.text_matches(column, lambda text: text.isin([str(v) for v in values])) & series.notna()
+        matches = _known(matches)
+        return matches if operator == 'in' else ~matches
+
+    elif operator == 'between': # Inclusive at both ends
+        low, high = value
+        try:
+            if pd.api.types.is_datetime64_any_dtype(col_dtype):
+                typed, low, high = views.datetime(column), pd.to_datetime(low), pd.to_datetime(high)
+            else:
+                typed, low, high = views.numeric(column), float(low), float(high)
+        except (TypeError, ValueError):
+            raise StepError(f"Invalid 'between' bounds for column '{column}': {value!r}.")
+        return _known(typed >= low) & _known(typed <= high)
+
+    elif operator in ['is_null', 'not_null']:
+        missing = series.isna()
+        return missing if operator == 'is_null' else ~missing
+
+    raise StepError(f"Unsupported operator: '{operator}'.")
+
+
+def column_comparison_mask(views, column, operator, other_column):
+    """Boolean mask of the rows where ``column operator other_column`` holds."""
+    left, right = views.column(column), views.column(other_column)
+    if operator not in COLUMN_OPERATORS:
+        raise StepError(f"'{operator}' operator can't compare two columns.")
+    if pd.api.types.is_datetime64_any_dtype(left.dtype) and pd.api.types.is_datetime64_any_dtype(right.dtype):
+        left, right = views.datetime(column), views.datetime(other_column)
+    elif operator in ['==', '!='] and not (pd.api.types.is_numeric_dtype(left.dtype) and pd.api.types.is_numeric_dtype(right.dtype)):
+        matches = (views.text(column) == views.text(other_column)) & left.notna() & right.notna()
+        return matches if operator == '==' else ~matches
+    else:
+        left, right = views.numeric(column), views.numeric(other_column)
+    if operator in ['==', '!=']:
+        matches = _known(left == right)
+        return matches if operator == '==' else ~matches
+    return _known(_COMPARISONS[operator](left, right))
+
+
+def _combine(masks, all_of):
+    """AND (``all_of``) or OR the masks together in one buffer, stopping once the result is settled."""
+    result = None
+    for mask in masks:
+        mask = np.asarray(mask, dtype=bool)
+        if result is None:
+            result = mask.copy()
+        elif all_of:
+            np.logical_and(result, mask, out=result)
+        else:
+            np.logical_or(result, mask, out=result)
+        if (all_of and not result.any()) or (not all_of and result.all()):
+            break
+    return result
+
+
+@register_step
+class FilterRows(MaskStep):
+    op = 'filter-rows'
+
+    def __init__(self, column, operator, value):
+        if operator not in FILTER_OPERATORS:
+            raise StepError(f"Unsupported operator: '{operator}'.")
+        if operator in _COMPARISONS:
+            try:
+                float(value)
+            except (TypeError, ValueError):
+                raise StepError(f"Cannot perform numeric comparison on column '{column}' with value '{value}'. Ensure data types are compatible.")
+        self.column = column
+        self.operator = operator
+        self.value = value
+
+    def params(self):
+        return {'column': self.column, 'operator': self.operator, 'value': self.value}
+
+    def referenced_columns(self):
+        return {self.column}
+
+    def describe(self):
+        return f"{self.column} {self.operator} {self.value}"
+
+    def mask(self, df, views=None):
+        return filter_mask(views or ColumnViews(df), self.column, self.operator, self.value)
+
+
+def _check_expression(node, depth=0):
+    """Validate a filter expression tree. Returns the columns it reads."""
+    if depth > MAX_EXPRESSION_DEPTH:
+        raise StepError(f"Filter expression is nested more than {MAX_EXPRESSION_DEPTH} levels deep.")
+    if not isinstance(node, dict):
+        raise StepError(f"Filter expression nodes must be objects, got {node!r}.")
+    for key in ('and', 'or'):
+        if key in node:
+            children = node[key]
+            if len(node) != 1 or not isinstance(children, list) or not children:
+                raise StepError(f"'{key}' takes a non-empty list of expressions and nothing else.")
+            return set().union(*(_check_expression(child, depth + 1) for child in children))
+    if 'not' in node:
+        if len(node) != 1:
+            raise StepError("'not' takes a single expression and nothing else.")
+        return _check_expression(node['not'], depth + 1)
+
+    column, operator = node.get('column'), node.get('operator')
+    if not isinstance(column, str) or not column:
+        raise StepError(f"Condition {node!r} needs a 'column'.")
+    if operator not in EXPRESSION_OPERATORS:
+        raise StepError(f"Unsupported operator: '{operator}'.")
+    other_column = node.get('other_column')
+    if other_column is not None:
+        if operator not in COLUMN_OPERATORS:
+            raise StepError(f"'{operator}' operator can't compare two columns.")
+        return {column, other_column}
+    if operator in ('is_null', 'not_null'):
+        return {column}
+    if 'value' not in node:
+        raise StepError(f"Condition on '{column}' needs a 'value' or an 'other_column'.")
+    value = node['value']
+    if operator in _COMPARISONS:
+        try:
+            float(value)
+        except (TypeError, ValueError):
+            raise StepError(f"Cannot perform numeric comparison on column '{column}' with value '{value}'.")
+    if operator in ('in', 'not_in') and not isinstance(value, list):
+        raise StepError(f"'{operator}' needs a list of values.")
+    if operator == 'between' and not (isinstance(value, list) and len(value) == 2):
+        raise StepError("'between' needs a [low, high] pair.")
+    if operator == 'regex':
+        try:
+            re.compile(str(value))
+        except re.error as e:
+            raise StepError(f"Invalid regular expression {value!r}: {e}.")
+    return {column}
+
+
+def _expression_mask(node, views):
+    if 'and' in node or 'or' in node:
+        children = node.get('and', node.get('or'))
+        return _combine((_expression_mask(child, views) for child in children), all_of='and' in node)
+    if 'not' in node:
+        return ~np.asarray(_expression_mask(node['not'], views), dtype=bool)
+    if node.get('other_column') is not None:
+        return column_comparison_mask(views, node['column'], node['operator'], node['other_column'])
+    return filter_mask(views, node['column'], node['operator'], node.get('value'))
+
+
+def describe_expression(node):
+    """A readable one-line form of a filter expression, for messages."""
+    if 'and' in node or 'or' in node:
+        key = 'and' if 'and' in node else 'or'
+        return '(' + f" {key.upper()} ".join(describe_expression(child) for child in node[key]) + ')'
+    if 'not' in node:
+        return f"NOT {describe_expression(node['not'])}"
+    if node.get('other_column') is not None:
+        return f"{node['column']} {node['operator']} [{node['other_column']}]"
+    if node['operator'] in ('is_null', 'not_null'):
+        return f"{node['column']} {node['operator']}"
+    return f"{node['column']} {node['operator']} {node['value']!r}"
+
+
+@register_step
+class FilterExpression(MaskStep):
+    """
+    Rows matching a tree of conditions, e.g.
+    ``{'and': [{'column': 'a', 'operator': '>', 'value': 5},
+    {'not': {'column': 'b', 'operator': 'in', 'value': ['x', 'y']}},
+    {'column': 'c', 'operator': '<', 'other_column': 'd'}]}``,
+    evaluated as one vectorized mask.
+    """
+    op = 'filter-expression'
+
+    def __init__(self, expression):
+        self.columns = _check_expression(expression)
+        self.expression = expression
+
+    def params(self):
+        return {'expression': self.expression}
+
+    def referenced_columns(self):
+        return set(self.columns)
+
+    def describe(self):
+        return describe_expression(self.expression)
+
+    def mask(self, df, views=None):
+        return _expression_mask(self.expression, views or ColumnViews(df))
+
+
+class FusedMask(MaskStep):
+    """Several consecutive filters evaluated against the same input and applied as one mask."""
+    op = 'fused-mask'
+
+    def __init__(self, steps):
+        self.steps = list(steps)
+
+    def params(self):
+        return {'steps': [step.to_dict() for step in self.steps]}
+
+    def referenced_columns(self):
+        columns = set()
+        for step in self.steps:
+            referenced = step.referenced_columns()
+            if referenced is None:
+                return None
+            columns |= referenced
+        return columns
+
+    def mask(self, df, views=None):
+        views = views or ColumnViews(df) # Shared, so a column several filters read is converted once
+        return _combine((step.mask(df, views) for step in self.steps), all_of=True)
+
+
+# -----------------------------------------
+# Missing values
+# -----------------------------------------
+
+def _is_number_dtype(dtype):
+    return pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)
+
+
+def _fill_value_for(series, value):
+    """``value`` converted to fill ``series`` without changing its type where possible."""
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        value = _categories_for(series, [value])[0]
+        return value, None if value in dtype.categories else pd.CategoricalDtype(list(dtype.categories) + [value])
+    if pd.api.types.is_bool_dtype(dtype):
+        if str(value).lower() not in ('true', 'false', '1', '0', '1.0', '0.0'):
+            raise StepError(f"Cannot fill boolean column '{series.name}' with '{value}'.")
+        return str(value).lower() in ('true', '1', '1.0'), None
+    if pd.api.types.is_numeric_dtype(dtype):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            raise StepError(f"Cannot fill numeric column '{series.name}' with '{value}'.")
+        # Integer columns (nullable since ingest) can't hold a fractional value
+        upcast = 'float64' if pd.api.types.is_integer_dtype(dtype) and not value.is_integer() else None
+        return value, upcast
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        try:
+            return pd.Timestamp(value), None
+        except (TypeError, ValueError):
+            raise StepError(f"Cannot fill datetime column '{series.name}' with '{value}'.")
+    return (value if isinstance(value, str) or dtype == object else str(value)), None
+
+
+@register_step
+class FillMissing(Step):
+    """
+    Fill the missing values of ``columns``.
+
+    - ``mean``, ``median``: numeric (not boolean) columns only; ``mode``: any column. The
+      statistic is fitted for all columns in one aggregation. With
+      ``group_by`` (mean and median), it is taken within each group of that
+      column, and groups without values fall back to the overall one.
+      Median is fitted on the sample approximate column statistics use
+      (DATASET_STATS' SAMPLE_ROWS rows above APPROXIMATE_ROWS; see stats.py).
+    - ``constant``: ``fill_value``, converted to each column's type.
+    - ``ffill``, ``bfill``: the previous / next value in the current row order.
+    - ``linear``: numeric columns interpolated by row position; ``time``: by
+      the timestamps in ``time_column``.
+
+    The last two depend on neighbouring rows, so they aren't row-local.
+    """
+    op = 'fill-missing'
+    statistics = ('mean', 'median', 'mode')
+    strategies = statistics + ('constant', 'ffill', 'bfill', 'linear', 'time')
+    fitted = ('values', 'group_values')
+
+    def __init__(self, strategy, columns, values=None, fill_value=None, group_by=None, group_values=None,
+                 time_column=None):
+        if strategy not in self.strategies:
+            raise StepError(f"Unsupported fill strategy: '{strategy}'.")
+        if strategy == 'constant' and fill_value is None:
+            raise StepError("The 'constant' strategy needs a 'fill_value'.")
+        if group_by is not None and strategy not in ('mean', 'median'):
+            raise StepError("Group-wise filling is only supported for the 'mean' and 'median' strategies.")
+        if strategy == 'time' and not time_column:
+            raise StepError("The 'time' strategy needs a 'time_column'.")
+        self.strategy = strategy
+        self.columns = list(columns)
+        self.values = values # Fitted {column: fill value}; columns missing here were skipped
+        self.fill_value = fill_value
+        self.group_by = group_by
+        self.group_values = group_values # Fitted {'groups': [...], 'values': {column: [value per group]}}
+        self.time_column = time_column
+        self.row_local = strategy not in ('ffill', 'bfill', 'linear', 'time')
+
+    def params(self):
+        params = {'strategy': self.strategy, 'columns': self.columns, 'values': self.values}
+        for name in ('fill_value', 'group_by', 'group_values', 'time_column'):
+            if getattr(self, name) is not None:
+                params[name] = getattr(self, name)
+        return params
+
+    def _inputs(self):
+        return {c for c in (self.group_by, self.time_column) if c is not None}
+
+    def referenced_columns(self):
+        return set(self.columns) | self._inputs()
+
+    def written_columns(self):
+        if self.strategy in self.statistics:
+            return set(self.values or ())
+        return set(self.columns)
+
+    def required_columns(self, needed):
+        if needed is None or not needed & self.written_columns():
+            return needed
+        return needed | self._inputs()
+
+    def fit_columns(self):
+        if self.strategy not in self.statistics or self.values is not None:
+            return None
+        return self.columns + [c for c in self._inputs() if c not in self.columns]
+
+    def fit(self, df):
+        if self.strategy == 'mode':
+            modes = df[self.columns].mode(dropna=True)
+            first = modes.iloc[0] if len(modes) else pd.Series(dtype=object)
+            self.values = {c: _json_values(pd.Index([first[c]]))[0] for c in self.columns if c in first and pd.notna(first[c])}
+            return
+        numeric = [c for c in self.columns if _is_number_dtype(df[c].dtype)]
+        if self.strategy == 'median':
+            from .stats import sample_frame # stats -> pipeline
+            df = sample_frame(df)
+        block = df[numeric]
+        overall = getattr(block, self.strategy)() if numeric else pd.Series(dtype=float)
+        self.values = {c: float(overall[c]) for c in numeric}
+        if self.group_by is not None:
+            grouped = getattr(block.groupby(df[self.group_by], observed=True, sort=True), self.strategy)()
+            self.group_values = {
+                'groups': _json_values(grouped.index),
+                'values': {c: [None if pd.isna(v) else float(v) for v in grouped[c]] for c in numeric},
+            }
+
+    def fit_chunks(self, chunks, num_rows):
+        """
+        ``fit`` one chunk at a time: modes from merged value counts, means from
+        running sums and counts, medians from the chunked form of the same
+        sample ``fit`` takes (see stats.chunk_sampler).
+        """
+        if self.strategy == 'mode':
+            self.values = {}
+            for column, (counts, dtype) in _merged_value_counts(chunks, self.columns).items():
+                if not len(counts):
+                    continue
+                tied = pd.Series(counts.index[counts.to_numpy() == counts.iloc[0]]).astype(dtype)
+                try:
+                    tied = tied.sort_values() # DataFrame.mode lists tied modes in order
+                except TypeError:
+                    pass
+                self.values[column] = _json_values(pd.Index([tied.iloc[0]]))[0]
+            return
+        if self.strategy == 'median':
+            from .stats import chunk_sampler # stats -> pipeline
+            sampler = chunk_sampler(num_rows)
+            self.fit(pd.concat([sampler(chunk) for chunk in chunks]))
+            return
+
+        sums = counts = group_sums = group_counts = None
+        for chunk in chunks:
+            numeric = [c for c in self.columns if _is_number_dtype(chunk[c].dtype)]
+            block = chunk[numeric].astype('float64')
+            sums = block.sum() if sums is None else sums + block.sum()
+            counts = block.count() if counts is None else counts + block.count()
+            if self.group_by is not None:
+                grouped = block.groupby(chunk[self.group_by], observed=True, sort=True)
+                part_sums, part_counts = grouped.sum(), grouped.count()
+                group_sums = part_sums if group_sums is None else group_sums.add(part_sums, fill_value=0)
+                group_counts = part_counts if group_counts is None else group_counts.add(part_counts, fill_value=0)
+        self.values = {c: float(sums[c] / counts[c]) if counts[c] else float('nan') for c in numeric}
+        if self.group_by is not None:
+            means = (group_sums / group_counts).sort_index() # 0 / 0 for groups without values
+            self.group_values = {
+                'groups': _json_values(means.index),
+                'values': {c: [None if pd.isna(v) else float(v) for v in means[c]] for c in numeric},
+            }
+
+    def _group_fills(self, df, columns):
+        """Per-row fill values: the group's statistic, or the overall one."""
+        groups = _categories_for(df[self.group_by], self.group_values['groups'])
+        positions = groups.get_indexer(df[self.group_by])
+        fills = {}
+        for col in columns:
+            table = np.append(np.array(self.group_values['values'][col], dtype='float64'), np.nan)
+            values = pd.Series(table[positions], index=df.index) # Position -1 (unknown group) picks the NaN
+            fills[col] = values.fillna(self.values[col])
+        return fills
+
+    def _interpolated(self, df, columns):
+        block = df[columns].astype('float64')
+        if self.strategy == 'linear':
+            return dict(block.interpolate(method='linear').items())
+        times = pd.to_datetime(df[self.time_column], errors='coerce')
+        valid = times.notna().to_numpy()
+        if not valid.any():
+            if not len(df):
+                return {}
+            raise StepError(f"Column '{self.time_column}' has no values that can be read as times.")
+        block = block[valid].set_axis(pd.DatetimeIndex(times[valid]))
+        order = np.argsort(block.index.to_numpy(), kind='stable')
+        result = block.iloc[order].interpolate(method='time').iloc[np.argsort(order)]
+        return dict(result.set_axis(df.index[valid]).items())
+
+    def apply(self, df):
+        columns = [c for c in self.columns if c in df.columns]
+        numeric = [c for c in columns if _is_number_dtype(df[c].dtype)]
+        if self.strategy in ('ffill', 'bfill'):
+            filled = getattr(df[columns], self.strategy)()
+            return df.fillna(dict(filled.items())) if columns else df
+        if self.strategy in ('linear', 'time'):
+            if not numeric:
+                return df
+            fills = self._interpolated(df, numeric)
+            upcast = {c: 'float64' for c in numeric if pd.api.types.is_integer_dtype(df[c].dtype)}
+            return df.astype(upcast).fillna(fills)
+
+        if self.strategy == 'constant':
+            values = {c: self.fill_value for c in columns}
+        else:
+            values = {c: v for c, v in (self.values or {}).items() if c in df.columns}
+        if not values:
+            return df
+        fills, upcast = {}, {}
+        for col, value in values.items():
+            if value is None or value != value: # All missing when fitted
+                continue
+            fills[col], dtype = _fill_value_for(df[col], value)
+            if dtype is not None:
+                upcast[col] = dtype
+        if self.group_by is not None and self.group_by in df.columns:
+            group_fills = self._group_fills(df, list(fills))
+            for col, series in group_fills.items():
+                fractional = series.dropna() % 1 != 0
+                if pd.api.types.is_integer_dtype(df[col].dtype) and fractional.any():
+                    upcast[col] = 'float64'
+            fills.update(group_fills)
+        return (df.astype(upcast) if upcast else df).fillna(fills)
+
+
+# -----------------------------------------
+# Duplicates
+# -----------------------------------------
+
+def _hashable(df):
+    """
+    ``df`` with columns whose hash could differ between equal values replaced:
+    float columns normalise -0.0 and NaN, which are hashed bit by bit, and
+    object and extension columns become their factorized codes (-1 for missing).
+    """
+    hashable = df.copy(deep=False)
+    for position, dtype in enumerate(df.dtypes):
+        if isinstance(dtype, pd.CategoricalDtype):
+            continue
+        if not isinstance(dtype, np.dtype) or dtype.kind == 'O':
+            hashable.isetitem(position, pd.factorize(df.iloc[:, position])[0])
+        elif dtype.kind in 'fc':
+            values = df.iloc[:, position].to_numpy() + 0 # -0.0 becomes 0.0
+            values[np.isnan(values)] = np.nan
+            hashable.isetitem(position, values)
+    return hashable
+
+
+def _rows_equal(df, rows, other_rows):
+    """Whether each of ``rows`` equals the matching one of ``other_rows`` in the ``_hashable`` frame ``df``."""
+    for column in range(len(df.columns)):
+        values = df.iloc[:, column].array
+        values = values.codes if isinstance(values.dtype, pd.CategoricalDtype) else np.asarray(values)
+        left, right = values[rows], values[other_rows]
+        equal = left == right
+        if values.dtype.kind in 'fcmM': # NaN and NaT never equal themselves
+            equal |= pd.isna(left) & pd.isna(right)
+        if not equal.all():
+            return False
+    return True
+
+
+def duplicate_groups(df):
+    """
+    A group number for each row of ``df``: rows with equal values share one,
+    and groups are numbered in order of first appearance.
+
+    Rows are hashed to 64 bits, vectorized, and grouped by hash through a
+    hash table, with no sort and no pairwise comparison. Each row sharing a
+    hash is then checked against the first row with that hash; on a hash
+    collision the rows are grouped by value instead.
+    """
+    if not len(df.columns):
+        return np.zeros(len(df), dtype='int64')
+    hashable = _hashable(df)
+    codes, _ = pd.factorize(pd.util.hash_pandas_object(hashable, index=False).to_numpy())
+    first_rows = np.flatnonzero(np.diff(np.maximum.accumulate(codes), prepend=-1) > 0) # Indexed by group
+    repeated = np.flatnonzero(first_rows[codes] != np.arange(len(codes)))
+    if len(repeated) and not _rows_equal(hashable, repeated, first_rows[codes[repeated]]):
+        logger.info("Row hash collision, grouping duplicates by value", extra={'rows': len(df)})
+        codes = df.groupby(list(df.columns), dropna=False, sort=False, observed=True).ngroup().to_numpy()
+    return codes
+
+
+def duplicated_rows(df, keep='first'):
+    """Boolean mask of the rows equal to an earlier (``keep='first'``) or later (``'last'``) row."""
+    return pd.Series(duplicate_groups(df)).duplicated(keep=keep).to_numpy()
+
+
+@register_step
+class DropDuplicates(Step):
+    """
+    Drop duplicate rows, or flag them in a new boolean ``flag_column``:
+    rows equal on ``columns`` (default: all of them) to an earlier row, with
+    ``keep='first'``, or to a later one, with ``keep='last'``. See
+    ``duplicate_groups`` for how rows are compared.
+
+    Whether a row is a duplicate depends on the other rows, so the step
+    isn't row-local.
+    """
+    op = 'drop-duplicates'
+    row_local = False
+    keeps = ('first', 'last')
+    actions = ('drop', 'flag')
+
+    def __init__(self, columns=None, keep='first', action='drop', flag_column='is_duplicate'):
+        if keep not in self.keeps:
+            raise StepError("Invalid 'keep' parameter. Must be 'first' or 'last'.")
+        if action not in self.actions:
+            raise StepError("Invalid 'action' parameter. Must be 'drop' or 'flag'.")
+        if columns is not None and not columns:
+            raise StepError("'columns' must list at least one column, or be left out to compare whole rows.")
+        if action == 'flag' and not flag_column:
+            raise StepError("The 'flag' action needs a 'flag_column' name.")
+        self.columns = None if columns is None else list(columns)
+        self.keep = keep
+        self.action = action
+        self.flag_column = flag_column
+        self.drops_rows = action == 'drop'
+
+    def params(self):
+        params = {'columns': self.columns, 'keep': self.keep, 'action': self.action}
+        if self.action == 'flag':
+            params['flag_column'] = self.flag_column
+        return params
+
+    def referenced_columns(self):
+        if self.columns is None:
+            return None
+        return set(self.columns) | set(self.written_columns())
+
+    def written_columns(self):
+        return {self.flag_column} if self.action == 'flag' else set()
+
+    def required_columns(self, needed):
+        if needed is None:
+            return None
+        if self.action == 'flag':
+            if self.flag_column not in needed:
+                return needed
+            needed = needed - {self.flag_column}
+        return None if self.columns is None else needed | set(self.columns)
+
+    def apply(self, df):
+        columns = [c for c in df.columns if c != self.flag_column] if self.columns is None else self.columns
+        duplicated = duplicated_rows(df[columns], self.keep)
+        if self.action == 'drop':
+            return df[~duplicated]
+        return df.assign(**{self.flag_column: duplicated})
+
+
+# -----------------------------------------
+# Encoding
+# -----------------------------------------
+
+class _CategoricalStep(Step):
+    """Shared fitting for encoders: the categories of each column at record time."""
+    fitted = ('categories',)
+
+    def __init__(self, columns, categories=None):
+        self.columns = list(columns)
+        self.categories = categories # Fitted {column: [category, ...]}
+
+    def params(self):
+        return {'columns': self.columns, 'categories': self.categories}
+
+    def fit_columns(self):
+        return None if self.categories is not None else self.columns
+
+    def fit(self, df):
+        self.categories = {c: _json_values(_present_categories(df[c])) for c in self.columns}
+
+    def fit_chunks(self, chunks, num_rows):
+        self.categories = {
+            c: _json_values(_present_categories(pd.Series(counts.index).astype(dtype)))
+            for c, (counts, dtype) in _merged_value_counts(chunks, self.columns).items()
+        }
+
+    def _categorical(self, series):
+        return pd.Categorical(series, categories=_categories_for(series, self.categories[series.name]))
+
+
+@register_step
+class LabelEncode(_CategoricalStep):
+    op = 'label-encode'
+
+    def referenced_columns(self):
+        return set(self.columns)
+
+    def written_columns(self):
+        return set(self.columns)
+
+    def apply(self, df):
+        present = [c for c in self.columns if c in df.columns]
+        if not present:
+            return df
+        df = df.copy(deep=False)
+        for col in present:
+            df[col] = self._categorical(df[col]).codes
+        return df
+
+
+@register_step
+class OneHotEncode(_CategoricalStep):
+    """
+    One 0/1 column per fitted category, as ``uint8`` or, with ``sparse``,
+    ``Sparse[uint8, 0]`` (one stored entry per row instead of one per
+    category). With ``max_categories`` only the most frequent categories
+    get a column of their own and the rest share ``{column}__other__``.
+
+    Fitting refuses encodings estimated at more than ``max_output_columns``
+    columns or ``max_output_bytes`` in memory.
+    """
+    op = 'one-hot-encode'
+    fitted = ('categories', 'other')
+    max_output_columns = 10_000
+    max_output_bytes = 1024 * 1024 * 1024
+    other_suffix = '__other__'
+
+    def __init__(self, columns, categories=None, sparse=False, max_categories=None, other=None):
+        if max_categories is not None and (not isinstance(max_categories, int) or max_categories < 1):
+            raise StepError("'max_categories' must be a positive integer.")
+        super().__init__(columns, categories)
+        self.sparse = bool(sparse)
+        self.max_categories = max_categories
+        self.other = other # Fitted list of the columns whose rarer categories were grouped
+
+    def params(self):
+        params = super().params()
+        if self.sparse:
+            params['sparse'] = True
+        if self.max_categories is not None:
+            params.update(max_categories=self.max_categories, other=self.other)
+        return params
+
+    def output_columns(self, column):
+        names = [f"{column}_{value}" for value in self.categories[column]]
+        if column in (self.other or ()):
+            names.append(f"{column}{self.other_suffix}")
+        return names
+
+    def referenced_columns(self):
+        return set(self.columns) | self.written_columns()
+
+    def written_columns(self):
+        columns = set()
+        for col in self.columns:
+            columns.update(self.output_columns(col))
+        return columns
+
+    def required_columns(self, needed):
+        if needed is None:
+            return None
+        required = set(needed)
+        for col in self.columns:
+            outputs = set(self.output_columns(col))
+            if needed & outputs:
+                required -= outputs
+                required.add(col)
+        return required
+
+    def fit(self, df):
+        if self.max_categories is None:
+            super().fit(df)
+            self.other = None
+        else:
+            self._keep_most_frequent({col: (df[col].value_counts(sort=True), df[col]) for col in self.columns})
+        self._check_output_size(len(df))
+
+    def fit_chunks(self, chunks, num_rows):
+        if self.max_categories is None:
+            super().fit_chunks(chunks, num_rows)
+            self.other = None
+        else:
+            self._keep_most_frequent({
+                col: (counts, pd.Series(counts.index).astype(dtype))
+                for col, (counts, dtype) in _merged_value_counts(chunks, self.columns).items()
+            })
+        self._check_output_size(num_rows)
+
+    def _keep_most_frequent(self, found):
+        """Fit on ``{column: (value counts, values)}``, keeping ``max_categories`` categories per column."""
+        self.categories, self.other = {}, []
+        for col, (counts, values) in found.items():
+            counts = counts[counts > 0]
+            # Kept categories stay in their usual order; only which ones survive depends on frequency
+            categories = _present_categories(values)
+            self.categories[col] = _json_values(categories[categories.isin(counts.index[:self.max_categories])])
+            if len(counts) > self.max_categories:
+                self.other.append(col)
+
+    def _check_output_size(self, num_rows):
+        num_columns = sum(len(self.output_columns(col)) for col in self.columns)
+        # uint8 per cell when dense; a uint8 value and an int32 position per row and column when sparse
+        nbytes = num_rows * len(self.columns) * 5 if self.sparse else num_rows * num_columns
+        if num_columns > self.max_output_columns or nbytes > self.max_output_bytes:
+            raise StepError(
+                f"One-hot encoding would create {num_columns} columns (about {nbytes / 1024 ** 2:,.0f} MB for "
+                f"{num_rows} rows), over the limit of {self.max_output_columns} columns / "
+                f"{self.max_output_bytes / 1024 ** 2:,.0f} MB. Set 'max_categories' to keep only the most frequent "
+                "categories" + ("." if self.sparse else ", or use sparse output.")
+            )
+
+    def _indicators(self, series):
+        """The output columns of ``series`` as one uint8 (or sparse) block."""
+        categories = _categories_for(series, self.categories[series.name])
+        codes = pd.Categorical(series, categories=categories).codes.astype(np.int64)
+        width = len(categories)
+        if series.name in (self.other or ()):
+            codes[(codes < 0) & series.notna().to_numpy()] = width
+            width += 1
+        rows = np.flatnonzero(codes >= 0)
+        codes = codes[rows]
+        names = self.output_columns(series.name)
+        if self.sparse:
+            from scipy import sparse
+            matrix = sparse.csc_matrix((np.ones(len(rows), dtype=np.uint8), (rows, codes)), shape=(len(series), width))
+            return pd.DataFrame.sparse.from_spmatrix(matrix, index=series.index, columns=names)
+        values = np.zeros((len(series), width), dtype=np.uint8)
+        values[rows, codes] = 1
+        return pd.DataFrame(values, index=series.index, columns=names)
+
+    def apply(self, df):
+        present = [c for c in self.columns if c in df.columns]
+        if not present:
+            return df
+        # Like get_dummies: the other columns first, then each encoded column's indicators
+        return pd.concat([df.drop(columns=present)] + [self._indicators(df[col]) for col in present], axis=1)
+
+
+# -----------------------------------------
+# Plan optimization
+# -----------------------------------------
+
+def _push_down_drops(steps):
+    """Move column drops ahead of every earlier step that doesn't touch those columns."""
+    result = []
+    for step in steps:
+        if not isinstance(step, DropColumns):
+            result.append(step)
+            continue
+        dropped = set(step.columns)
+        position = len(result)
+        while position > 0:
+            previous = result[position - 1]
+            if isinstance(previous, DropColumns):
+                result[position - 1] = DropColumns(previous.columns + [c for c in step.columns if c not in previous.columns])
+                break
+            referenced = previous.referenced_columns()
+            if referenced is None or referenced & dropped:
+                result.insert(position, step)
+                break
+            position -= 1
+        else:
+            result.insert(0, step)
+    return result
+
+
+def _fuse_masks(steps):
+    result = []
+    for step in steps:
+        if step.is_mask and result and result[-1].is_mask:
+            previous = result.pop()
+            fused = previous.steps if isinstance(previous, FusedMask) else [previous]
+            step = FusedMask(fused + [step])
+        result.append(step)
+    return result
+
+
+def optimize(steps):
+    return _fuse_masks(_push_down_drops(list(steps)))
+
+
+def _run(steps, df, shared=None):
+    """
+    Apply ``steps`` to ``df``. ``shared`` keeps typed column views of the
+    base source ``df`` was read from, in order (see ColumnViews); masks use
+    them while ``df`` still holds every row of the source.
+    """
+    from .jobs import check_cancelled # jobs -> storage -> pipeline
+    written = set()
+    for step in steps:
+        check_cancelled()
+        if step.is_mask and shared is not None and len(df) == shared.num_rows:
+            df = df[step.mask(df, ColumnViews(df, shared, written))]
+        else:
+            df = step.apply(df)
+        written |= step.written_columns()
+    return df
+
+
+def fit_and_apply(step, df):
+    """Evaluate ``step`` on ``df`` right away, fitting it on ``df`` first if it needs it."""
+    fit_columns = step.fit_columns()
+    if fit_columns is not None:
+        step.fit(df[fit_columns])
+    return _run([step], df)
+
+
+def _sort(df, column, ascending):
+    try:
+        return df.sort_values(column, ascending=ascending, kind='stable', na_position='last')
+    except TypeError:
+        raise StepError(f"Column '{column}' mixes values that cannot be ordered against each other.")
+
+
+# -----------------------------------------
+# Base frame sources
+# -----------------------------------------
+
+class FrameSource:
+    """A base frame already in memory (e.g. from the DataFrame cache)."""
+    column_views = None # Set by whoever knows which dataset version the frame is
+
+    def __init__(self, df):
+        self.df = df
+        self.columns = list(df.columns)
+        self.num_rows = len(df)
+
+    def read(self, columns=None, offset=0, length=None):
+        df = self.df if columns is None else self.df[columns]
+        if offset or length is not None:
+            df = df.iloc[offset:None if length is None else offset + length]
+        return df
+
+    def take(self, columns, rows):
+        df = self.df if columns is None else self.df[columns]
+        return df.iloc[rows]
+
+
+# -----------------------------------------
+# Lazy frames
+# -----------------------------------------
+
+class LazyFrame:
+    """
+    A base source plus recorded steps, evaluated on demand.
+
+    Quacks enough like a DataFrame (``columns``, ``head()``, ``len()``) to be
+    handed to the preview helpers directly.
+    """
+    preview_chunk_rows = 1000
+    out_of_core = False
+    on_collect = None # Called with the frame whenever it is collected in full; see storage.cache_when_collected
+
+    def __init__(self, source, steps=(), num_rows=None):
+        self.source = source
+        self.steps = list(steps)
+        self._num_rows = num_rows
+        self._schema = None
+
+    @phase('operation')
+    def then(self, step):
+        """Fit ``step`` against this frame if it needs it and return the extended frame."""
+        fit_columns = step.fit_columns()
+        if fit_columns is not None:
+            step.fit(self.collect(columns=fit_columns))
+        return type(self)(self.source, self.steps + [step])
+
+    def plan(self, columns=None):
+        """Optimized steps plus the base columns they need to produce ``columns``."""
+        steps = optimize(self.steps)
+        needed = None if columns is None else set(columns)
+        for step in reversed(steps):
+            if needed is None:
+                break
+            needed = step.required_columns(needed)
+        base_columns = None if needed is None else [c for c in self.source.columns if c in needed]
+        return base_columns, steps
+
+    @phase('operation')
+    def collect(self, columns=None):
+        base_columns, steps = self.plan(columns)
+        df = _run(steps, self.source.read(base_columns), self.source.column_views)
+        if columns is not None:
+            return df[list(columns)]
+        if self.on_collect is not None:
+            self.on_collect(df)
+        return df
+
+    @phase('operation')
+    def head(self, n=5):
+        base_columns, steps = self.plan()
+        if not all(step.row_local for step in steps):
+            return self.collect().head(n)
+        parts, found, offset = [], 0, 0
+        chunk_rows = max(n, self.preview_chunk_rows)
+        while found < n and offset < self.source.num_rows:
+            part = _run(steps, self.source.read(base_columns, offset, chunk_rows), self.source.column_views)
+            parts.append(part)
+            found += len(part)
+            offset += chunk_rows
+            chunk_rows *= 2 # Selective filters need more input rows per output row
+        if not parts:
+            return self._empty()
+        return pd.concat(parts).head(n)
+
+    def iter_chunks(self, chunk_rows, columns=None):
+        """
+        Evaluate the frame (or only its ``columns``) ``chunk_rows`` base rows
+        at a time, yielding the resulting frames (filtered chunks come out
+        smaller). Only one chunk is in memory at once when every step is
+        row-local.
+        """
+        base_columns, steps = self.plan(columns)
+        if not all(step.row_local for step in steps):
+            df = self.collect(columns)
+            for offset in range(0, len(df), chunk_rows):
+                yield df.iloc[offset:offset + chunk_rows]
+            return
+        for offset in range(0, self.source.num_rows, chunk_rows):
+            df = _run(steps, self.source.read(base_columns, offset, chunk_rows), self.source.column_views)
+            yield df if columns is None else df[list(columns)]
+
+    @phase('operation')
+    def window(self, offset, limit, columns=None, sort_by=None, ascending=True):
+        """
+        Rows ``offset`` up to ``offset + limit`` of the frame, restricted to
+        ``columns`` and optionally ordered by ``sort_by`` first (stable,
+        missing values last).
+
+        With row-local steps, only the filter and sort columns are evaluated
+        over the whole frame to find which source rows land in the window;
+        every other column is evaluated for those rows alone.
+        """
+        columns = list(self.columns) if columns is None else list(columns)
+        base_columns, steps = self.plan(columns)
+        if not all(step.row_local for step in steps):
+            df = self.collect()
+            if sort_by is not None:
+                df = _sort(df, sort_by, ascending)
+            return df[columns].iloc[offset:offset + limit]
+        if sort_by is None and not any(step.is_mask for step in steps):
+            return _run(steps, self.source.read(base_columns, offset, limit))[columns]
+
+        key_columns = [] if sort_by is None else [sort_by]
+        key_base, key_steps = self.plan(key_columns)
+        base = self.source.read(key_base)
+        keys = _run(key_steps, base.set_axis(pd.RangeIndex(len(base)), axis=0), self.source.column_views)[key_columns] # Indexed by source position
+        if sort_by is not None:
+            keys = _sort(keys, sort_by, ascending)
+        rows = keys.index.to_numpy()[offset:offset + limit]
+        return _run(steps, self.source.take(base_columns, rows))[columns]
+
+    def _empty(self):
+        if self._schema is None:
+            _, steps = self.plan()
+            self._schema = _run(steps, self.source.read(None, 0, 0))
+        return self._schema
+
+    @property
+    def columns(self):
+        return self._empty().columns
+
+    @property
+    def dtypes(self):
+        return self._empty().dtypes
+
+    @phase('operation')
+    def __len__(self):
+        if self._num_rows is None:
+            if any(step.drops_rows for step in self.steps):
+                self._num_rows = len(self.collect(columns=[]))
+            else:
+                self._num_rows = self.source.num_rows
+        return self._num_rows
@@ -0,0 +1,107 @@
+"""
+Recipes: a session's cleaning steps, fitted state included, replayed on
+other files.
+
+A recipe is the JSON of everything done since the upload: the uploaded
+column names and every step record (see ``history.lineage``), whose fitted
+parameters (fill values, encoder categories) come along as they were
+fitted on the session's data. Applying it to another file does not refit
+anything, so every file gets exactly the session's transformation.
+
+Files are read the way uploads are (chunk by chunk through a private
+dataset store; the first sheet of an Excel file), the steps are evaluated lazily and the
+result is written with the streaming exporters, so a file never needs to
+fit in memory more than an upload of it would.
+"""
+import os
+import tempfile
+import time
+
+from .export import export_blocks
+from .history import lineage
+from .ingest import ingest_csv, ingest_excel
+from .pipeline import LazyFrame, StepError, step_from_dict
+from .storage import (
+    SESSION_DATASET_ID_KEY, SESSION_DATASET_VERSION_KEY, ArrowDatasetStore, SnapshotSource, base_manifest,
+    get_dataset_store,
+)
+
+RECIPE_VERSION = 1
+INPUT_EXTENSIONS = ('.csv', '.xlsx')
+
+
+class RecipeError(Exception):
+    pass
+
+
+def session_recipe(session, filename=None):
+    """The recipe of the session's current version."""
+    store = get_dataset_store()
+    history = lineage(store, session[SESSION_DATASET_ID_KEY], session[SESSION_DATASET_VERSION_KEY])
+    return {'recipe': RECIPE_VERSION, 'source': filename, **history}
+
+
+def load_recipe(data):
+    """Validate recipe JSON; returns the uploaded columns it expects and its steps."""
+    if not isinstance(data, dict) or data.get('recipe') != RECIPE_VERSION:
+        raise RecipeError(f"Not a version {RECIPE_VERSION} recipe.")
+    if not isinstance(data.get('columns'), list) or not isinstance(data.get('steps'), list):
+        raise RecipeError("A recipe needs 'columns' and 'steps' lists.")
+    try:
+        steps = [step_from_dict(step) for step in data['steps']]
+    except (StepError, TypeError, KeyError) as e:
+        raise RecipeError(f"Invalid step in recipe: {e}")
+    return data['columns'], steps
+
+
+def _output_path(path, output_dir, output_format):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(output_dir, f"{stem}_cleaned.{output_format}")
+
+
+def apply_recipe_to_file(columns, steps, path, output_dir, output_format='csv'):
+    """
+    Apply recipe ``steps`` to the CSV/XLSX file at ``path`` and write the
+    result to ``output_dir``. Returns the file's timings and row counts.
+    """
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix='recipe-') as work_dir:
+        store = ArrowDatasetStore(work_dir)
+        dataset_id = store.new_dataset_id()
+        version = store.allocate_version(dataset_id)
+        if path.lower().endswith('.xlsx'):
+            file_columns, num_rows = ingest_excel(store, dataset_id, version, path)
+        else:
+            with open(path, 'rb') as f:
+                file_columns, num_rows = ingest_csv(store, dataset_id, version, f)
+        source = SnapshotSource(store, dataset_id, base_manifest(file_columns, num_rows, version))
+        read_seconds = time.perf_counter() - start
+
+        missing = [c for c in columns if c not in source.columns]
+        if missing:
+            raise RecipeError(f"Missing column(s) the recipe expects: {', '.join(missing)}")
+        frame = LazyFrame(source, steps)
+        output = _output_path(path, output_dir, output_format)
+        tmp_output = f"{output}.tmp"
+        try:
+            with open(tmp_output, 'wb') as f:
+                for block in export_blocks(frame, output_format):
+                    f.write(block)
+            os.replace(tmp_output, output)
+        except BaseException:
+            if os.path.exists(tmp_output):
+                os.remove(tmp_output)
+            raise
+        return {
+            'file': path, 'output': output,
+            'rows_in': source.num_rows, 'rows_out': len(frame), 'columns_out': len(frame.columns),
+            'read_seconds': round(read_seconds, 4), 'seconds': round(time.perf_counter() - start, 4),
+        }
+
+
+def input_files(input_dir):
+    """The CSV/XLSX files directly inside ``input_dir``, sorted by name."""
+    return sorted(
+        os.path.join(input_dir, name) for name in os.listdir(input_dir)
+        if name.lower().endswith(INPUT_EXTENSIONS) and os.path.isfile(os.path.join(input_dir, name))
+    )
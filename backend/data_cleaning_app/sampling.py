@@ -0,0 +1,207 @@
+"""
+Sampling mode: explore a large upload on a sample, then commit.
+
+An upload made with ``sampling=reservoir`` (or ``true``) or with
+``sampling=stratified`` and a ``stratify_by`` column keeps the full dataset
+aside and points the session at a second, small dataset of SAMPLE_ROWS rows
+drawn from it (``sample_rows`` overrides the size per upload):
+
+- reservoir: a uniform sample without replacement, the rows a reservoir
+  over the whole file would end up holding
+- stratified: each distinct value of ``stratify_by`` (missing values
+  included) gets a share of the sample proportional to its rows, and at
+  least one row, so rare values are not lost
+
+Sampled rows keep their order in the file. Operations, previews, profiles
+and undo/redo then run against the sample, and preview responses report the
+sampled and full row counts. Committing replays the sample's operations on
+the full dataset, refitting statistics and categories on all of its rows, and
+records them in its history; discarding goes back to the full upload as it
+was. The full dataset is never modified until then.
+
+Uploads with no more rows than the sample would have are loaded in full.
+"""
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from .history import append_session_steps, lineage
+from .jobs import report_progress
+from .outofcore import open_frame
+from .pipeline import STEP_TYPES, StepError, fit_and_apply, step_from_dict
+from .storage import (
+    SESSION_DATASET_ID_KEY, SESSION_DATASET_VERSION_KEY, SESSION_FULL_DATASET_KEY, SnapshotSource,
+    attach_session_dataset, base_manifest, get_dataset_store, get_session_frame,
+)
+
+DEFAULT_SAMPLING = {
+    'SAMPLE_ROWS': 100_000,
+    'SEED': None, # None draws a new sample on every upload
+}
+
+METHODS = ('reservoir', 'stratified')
+
+
+class SamplingError(Exception):
+    pass
+
+
+def _config():
+    return {**DEFAULT_SAMPLING, **getattr(settings, 'DATASET_SAMPLING', {})}
+
+
+def sampling_options(data):
+    """
+    The ``(method, stratify_by, sample_rows)`` an upload's ``data`` asks for, or
+    None without ``sampling``. Raises SamplingError for invalid parameters.
+    """
+    method = str(data.get('sampling', '')).lower()
+    if method in ('', '0', 'false', 'no'):
+        return None
+    if method in ('1', 'true', 'yes'):
+        method = 'reservoir'
+    if method not in METHODS:
+        raise SamplingError("Invalid 'sampling' parameter. Must be 'reservoir' or 'stratified'.")
+    stratify_by = data.get('stratify_by') or None
+    if method == 'stratified' and stratify_by is None:
+        raise SamplingError("Stratified sampling needs a 'stratify_by' column.")
+    sample_rows = data.get('sample_rows')
+    if sample_rows in (None, ''):
+        sample_rows = _config()['SAMPLE_ROWS']
+    else:
+        try:
+            sample_rows = int(sample_rows)
+        except (TypeError, ValueError):
+            sample_rows = 0
+        if sample_rows < 1:
+            raise SamplingError("'sample_rows' must be a positive integer.")
+    return method, stratify_by if method == 'stratified' else None, sample_rows
+
+
+def _stratified_positions(rng, values, sample_rows):
+    """Positions of about ``sample_rows`` rows, allocated across the distinct ``values`` by their share."""
+    codes, _ = pd.factorize(values, use_na_sentinel=False)
+    counts = np.bincount(codes)
+    if len(counts) > sample_rows:
+        raise SamplingError(
+            f"'{values.name}' has {len(counts)} distinct values, more than the {sample_rows} rows of the sample; "
+            "stratify by a column with fewer."
+        )
+    quotas = np.minimum(np.maximum(np.rint(counts * (sample_rows / len(codes))), 1), counts).astype(np.int64)
+    # Shuffle within each stratum by sorting on random keys, then keep the first rows of each
+    order = np.lexsort((rng.random(len(codes), dtype=np.float32), codes))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    ranks = np.arange(len(codes)) - starts[codes[order]]
+    return np.sort(order[ranks < quotas[codes[order]]])
+
+
+def sample_positions(source, sample_rows, stratify_by=None, seed=None):
+    """Sorted positions of the rows of ``source`` to sample."""
+    rng = np.random.default_rng(seed)
+    if stratify_by is None:
+        return np.sort(rng.choice(source.num_rows, size=sample_rows, replace=False))
+    return _stratified_positions(rng, source.read([stratify_by])[stratify_by], sample_rows)
+
+
+def start_sampling(session, method, stratify_by, sample_rows):
+    """
+    Point the session, just given a freshly uploaded dataset, at a sample of
+    it. Returns the sampling record kept in the session, or None if the
+    upload has no more than ``sample_rows`` rows.
+    """
+    frame = get_session_frame(session)
+    if frame.steps:
+        raise SamplingError("Sampling starts from an upload, before any operation.")
+    if stratify_by is not None and stratify_by not in frame.columns:
+        raise SamplingError(f"Column '{stratify_by}' not found in the data.")
+    num_rows = frame.source.num_rows
+    if num_rows <= sample_rows:
+        return None
+
+    seed = _config()['SEED']
+    if seed is None:
+        seed = int(np.random.SeedSequence().entropy % 2 ** 32) # Recorded, so a sample can be drawn again
+    positions = sample_positions(frame.source, sample_rows, stratify_by, seed)
+    df = frame.source.take(None, positions).reset_index(drop=True)
+
+    store = get_dataset_store()
+    sample_id = store.new_dataset_id()
+    version = store.allocate_version(sample_id)
+    store.save(sample_id, version, df)
+    store.save_snapshot(sample_id, version, base_manifest(df.columns, len(df), version))
+    full_dataset = {
+        'id': session[SESSION_DATASET_ID_KEY], 'version': session[SESSION_DATASET_VERSION_KEY],
+        'num_rows': num_rows, 'sample_rows': len(df),
+        'method': method, 'stratify_by': stratify_by, 'seed': seed,
+    }
+    attach_session_dataset(session, sample_id, version, df=df, full_dataset=full_dataset)
+    return full_dataset
+
+
+def sampling_summary(session, num_rows):
+    """What the preview responses report while the session explores a sample of ``num_rows`` rows, or None."""
+    full = session.get(SESSION_FULL_DATASET_KEY)
+    if not full:
+        return None
+    return {
+        'method': full['method'], 'stratify_by': full['stratify_by'],
+        'sample_rows': num_rows, 'full_rows': full['num_rows'],
+        # As many rows of the full dataset would be left, if the sample's operations kept the same share
+        'estimated_full_rows': round(num_rows * full['num_rows'] / full['sample_rows']) if full['sample_rows'] else 0,
+    }
+
+
+def _full_dataset(session):
+    full = session.get(SESSION_FULL_DATASET_KEY)
+    if not full:
+        raise SamplingError("This session is not exploring a sample.")
+    store = get_dataset_store()
+    return full, SnapshotSource(store, full['id'], store.load_snapshot(full['id'], full['version']))
+
+
+def _unfitted(step_dict):
+    """The step of ``step_dict`` without its fitted state, so it is fitted again where it is applied."""
+    fitted = STEP_TYPES[step_dict['op']].fitted
+    return step_from_dict({k: v for k, v in step_dict.items() if k not in fitted})
+
+
+def commit_sampling(session):
+    """
+    Replay the sample's operations on the full dataset and point the session
+    at the result, one version per operation. Raises StepError, leaving the
+    session on the sample, if an operation fails on the full data, and
+    DatasetNotFound if the full dataset has been deleted meanwhile.
+    """
+    full, source = _full_dataset(session)
+    store = get_dataset_store()
+    steps = [_unfitted(s) for s in lineage(store, session[SESSION_DATASET_ID_KEY], session[SESSION_DATASET_VERSION_KEY])['steps']]
+    sample_rows = len(get_session_frame(session))
+
+    frame = open_frame(source)
+    df = None if frame.out_of_core else frame.collect()
+    recorded = []
+    for index, step in enumerate(steps, start=1):
+        try:
+            if frame.out_of_core: # Fitted a chunk at a time; non-row-local steps are refused
+                frame = frame.then(step)
+                shape = [len(frame), len(frame.columns)]
+            else:
+                df = fit_and_apply(step, df)
+                shape = [len(df), len(df.columns)]
+        except (StepError, KeyError) as e: # KeyError: a column only the sample had, e.g. from one-hot encoding
+            raise StepError(f"Operation {index} ({step.op}) failed on the full dataset: {e}")
+        recorded.append((step, shape))
+        report_progress(operations_done=index, operations_total=len(steps)) # When run as a background job
+
+    attach_session_dataset(session, full['id'], full['version'], df=df if not recorded else None)
+    if recorded:
+        append_session_steps(session, recorded, df=df)
+    num_rows, num_columns = recorded[-1][1] if recorded else [source.num_rows, len(source.columns)]
+    return {'operations': len(recorded), 'sample_rows': sample_rows, 'rows': num_rows, 'columns': num_columns}
+
+
+def discard_sampling(session):
+    """Point the session back at the full upload, forgetting the sample and its operations."""
+    full, source = _full_dataset(session)
+    attach_session_dataset(session, full['id'], full['version'])
+    return {'rows': source.num_rows, 'columns': len(source.columns)}
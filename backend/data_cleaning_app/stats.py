@@ -0,0 +1,429 @@
+"""
+Per-column statistics of a dataset version, cached next to it on disk.
+
+For every column: its type, non-missing and missing counts, distinct
+count and most frequent values; numeric columns also get min, max, mean,
+standard deviation and quantiles (datetimes get min and max). The
+reductions run over all numeric columns as one block rather than column
+by column; sparse columns are summarized from their stored values.
+
+Stats are saved per version as ``v{n}.stats.json``. A version that has
+none yet starts from its nearest ancestor that does: every column the
+steps in between did not write is carried over as long as no rows were
+removed on the way, so only the written columns are evaluated.
+
+Above APPROXIMATE_ROWS rows, distinct counts come from a HyperLogLog
+sketch of the column's hashes, and quantiles and top values from a
+uniform sample of SAMPLE_ROWS rows; those columns are marked
+``approximate``. Means and counts stay exact. FillMissing's median is
+taken from the same sample (see ``sample_frame``), so a fill can reuse
+the cached median.
+
+Out-of-core frames (see outofcore.py) are summarized a chunk at a time,
+merging the same statistics across chunks.
+"""
+import math
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from .pipeline import step_from_dict
+from .storage import SESSION_DATASET_ID_KEY, SESSION_DATASET_VERSION_KEY, get_dataset_store
+
+DEFAULT_STATS = {
+    'TOP_VALUES': 5,
+    'QUANTILES': [0.25, 0.5, 0.75],
+    'APPROXIMATE_ROWS': 1_000_000,
+    'SAMPLE_ROWS': 100_000,
+    'HLL_PRECISION': 14, # 2**14 registers, about 0.8% standard error
+}
+
+
+def _config():
+    return {**DEFAULT_STATS, **getattr(settings, 'DATASET_STATS', {})}
+
+
+def _json_scalar(value):
+    if value is None or value is pd.NA or value is pd.NaT:
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+# -----------------------------------------
+# Sampling
+# -----------------------------------------
+
+def _sampled(num_rows, config):
+    return num_rows > max(config['APPROXIMATE_ROWS'], config['SAMPLE_ROWS'])
+
+
+def sample_frame(df):
+    """The uniform sample of ``df`` approximate statistics are taken from; ``df`` itself up to APPROXIMATE_ROWS rows."""
+    config = _config()
+    if not _sampled(len(df), config):
+        return df
+    return df.sample(n=config['SAMPLE_ROWS'], random_state=0)
+
+
+def chunk_sampler(num_rows):
+    """
+    ``sample_frame`` for a frame of ``num_rows`` rows read in chunks (see
+    outofcore.py): a function taking each chunk, in order, to its part of a
+    uniform sample of about SAMPLE_ROWS rows.
+    """
+    config = _config()
+    if not _sampled(num_rows, config):
+        return lambda chunk: chunk
+    fraction = config['SAMPLE_ROWS'] / num_rows
+    rng = np.random.default_rng(0)
+    return lambda chunk: chunk[rng.random(len(chunk)) < fraction]
+
+
+# -----------------------------------------
+# Sketches
+# -----------------------------------------
+
+def hll_registers(series, precision):
+    """
+    The HyperLogLog registers of the non-missing values in ``series``;
+    registers of several chunks combine with ``np.maximum``.
+    """
+    m = 1 << precision
+    maxima = np.zeros(m, dtype=np.int64)
+    hashes = pd.util.hash_pandas_object(series.dropna(), index=False).to_numpy()
+    if len(hashes) == 0:
+        return maxima
+    registers = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+    rest = hashes << np.uint64(precision)
+    # Rank of the first set bit in what is left of the hash, 1-based
+    ranks = np.full(len(rest), 64 - precision + 1, dtype=np.int64)
+    nonzero = rest != 0
+    ranks[nonzero] = 64 - np.floor(np.log2(rest[nonzero].astype(np.float64))).astype(np.int64)
+    per_register = pd.Series(ranks).groupby(registers).max()
+    maxima[per_register.index.to_numpy()] = per_register.to_numpy()
+    return maxima
+
+
+def hll_estimate(maxima):
+    """The number of distinct values the HyperLogLog registers ``maxima`` estimate."""
+    m = len(maxima)
+    if not maxima.any():
+        return 0
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.ldexp(1.0, -maxima))
+    empty = int((maxima == 0).sum())
+    if estimate <= 2.5 * m and empty:
+        estimate = m * math.log(m / empty) # Linear counting is more accurate for small sets
+    return int(round(estimate))
+
+
+def approximate_distinct(series, precision):
+    """HyperLogLog estimate of the number of distinct non-missing values in ``series``."""
+    return hll_estimate(hll_registers(series, precision))
+
+
+# -----------------------------------------
+# Computing
+# -----------------------------------------
+
+def _top_values(counts, limit, scale=1.0):
+    counts = counts[counts > 0] # Categoricals list unused categories too
+    return [{'value': _json_scalar(value), 'count': int(round(count * scale))} for value, count in counts.head(limit).items()]
+
+
+def _value_at_rank(values, cumulative, rank):
+    return values[np.searchsorted(cumulative, rank, side='right')]
+
+
+def _sparse_column_stats(series, config):
+    """Exact stats of a sparse column, from its stored values and how many rows hold the fill value."""
+    array = series.array
+    num_rows = len(array)
+    stored = np.asarray(array.sp_values)
+    counts = pd.Series(stored).value_counts()
+    if num_rows > len(stored):
+        counts = counts.add(pd.Series({array.fill_value: num_rows - len(stored)}), fill_value=0).astype(np.int64)
+    counts = counts.sort_values(ascending=False, kind='stable')
+    column = {
+        'dtype': str(series.dtype), 'count': num_rows, 'null_count': 0, 'distinct': len(counts),
+        'top_values': _top_values(counts, config['TOP_VALUES']), 'approximate': False,
+    }
+    if not num_rows:
+        return column
+    by_value = counts.sort_index()
+    values, weights = by_value.index.to_numpy(dtype=np.float64), by_value.to_numpy()
+    mean = float((values * weights).sum() / num_rows)
+    variance = float((weights * (values - mean) ** 2).sum() / (num_rows - 1)) if num_rows > 1 else math.nan
+    column.update(
+        mean=_json_scalar(mean), std=_json_scalar(math.sqrt(variance)),
+        min=_json_scalar(values[0]), max=_json_scalar(values[-1]),
+        quantiles=_quantiles_from_counts(by_value, config['QUANTILES']),
+    )
+    return column
+
+
+def compute_column_stats(df, approximate=False):
+    """{column: stats} for every column of ``df``."""
+    config = _config()
+    sparse = {c for c in df.columns if isinstance(df[c].dtype, pd.SparseDtype)}
+    if sparse:
+        stats = compute_column_stats(df.drop(columns=list(sparse)), approximate)
+        stats.update({str(c): _sparse_column_stats(df[c], config) for c in sparse})
+        return {str(c): stats[str(c)] for c in df.columns}
+    present = df.count()
+    numeric = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c].dtype)]
+    datetimes = [c for c in df.columns if pd.api.types.is_datetime64_any_dtype(df[c].dtype)]
+    quantile_columns = [c for c in numeric if not pd.api.types.is_bool_dtype(df[c].dtype)]
+
+    sample = sample_frame(df) if approximate else df
+    scale = len(df) / len(sample) if len(sample) else 1.0
+
+    summary = {}
+    if numeric:
+        block = df[numeric]
+        summary.update(mean=block.mean(), std=block.std())
+    if numeric or datetimes:
+        block = df[numeric + datetimes]
+        summary.update(min=block.min(), max=block.max())
+    quantiles = sample[quantile_columns].quantile(config['QUANTILES']) if quantile_columns else None
+
+    stats = {}
+    for name in df.columns:
+        series = df[name]
+        is_categorical = isinstance(series.dtype, pd.CategoricalDtype)
+        if approximate:
+            counts = sample[name].value_counts()
+            if is_categorical:
+                distinct = int((series.value_counts() > 0).sum()) # Cheap on the codes
+            else:
+                distinct = approximate_distinct(series, config['HLL_PRECISION'])
+        else:
+            counts = series.value_counts()
+            distinct = int((counts > 0).sum())
+        column = {
+            'dtype': str(series.dtype),
+            'count': int(present[name]),
+            'null_count': int(len(df) - present[name]),
+            'distinct': distinct,
+            'top_values': _top_values(counts, config['TOP_VALUES'], scale if approximate else 1.0),
+            'approximate': approximate,
+        }
+        for key, values in summary.items():
+            if name in values.index:
+                column[key] = _json_scalar(values[name])
+        if quantiles is not None and name in quantiles.columns:
+            column['quantiles'] = {f"{q:g}": _json_scalar(quantiles.at[q, name]) for q in config['QUANTILES']}
+        stats[str(name)] = column
+    return stats
+
+
+def _quantiles_from_counts(counts, quantiles):
+    """Quantiles of the values ``counts`` counts, interpolated between ranks like Series.quantile."""
+    by_value = counts[counts > 0].sort_index()
+    values, cumulative = by_value.index.to_numpy(dtype=np.float64), np.cumsum(by_value.to_numpy())
+    found = {}
+    for q in quantiles:
+        if not len(values):
+            found[f"{q:g}"] = None
+            continue
+        position = (cumulative[-1] - 1) * q
+        low = _value_at_rank(values, cumulative, math.floor(position))
+        high = _value_at_rank(values, cumulative, math.ceil(position))
+        found[f"{q:g}"] = _json_scalar(low + (high - low) * (position - math.floor(position)))
+    return found
+
+
+class _ColumnSummary:
+    """
+    One column's stats merged over chunks: count, mean and variance (Chan et
+    al.'s pairwise update), minimum and maximum, and either every value's
+    count or the HyperLogLog registers of its values.
+    """
+
+    def __init__(self, dtype, exact_counts, precision):
+        self.dtype = dtype
+        self.numeric = pd.api.types.is_numeric_dtype(dtype)
+        self.ordered = self.numeric or pd.api.types.is_datetime64_any_dtype(dtype)
+        self.quantiles = self.numeric and not pd.api.types.is_bool_dtype(dtype)
+        self.precision = precision
+        self.count = 0
+        self.mean, self.m2 = 0.0, 0.0
+        self.minima, self.maxima = [], []
+        self.counts = pd.Series(dtype='int64') if exact_counts else None
+        self.registers = None if exact_counts else np.zeros(1 << precision, dtype=np.int64)
+
+    def add(self, series):
+        if isinstance(series.dtype, pd.SparseDtype):
+            series = series.sparse.to_dense()
+        count = int(series.count())
+        if self.numeric and count:
+            values = series.dropna().to_numpy(dtype=np.float64)
+            mean = float(values.mean())
+            m2 = float(((values - mean) ** 2).sum())
+            total = self.count + count
+            delta = mean - self.mean
+            self.m2 += m2 + delta * delta * self.count * count / total
+            self.mean += delta * count / total
+        self.count += count
+        if self.ordered and count:
+            self.minima.append(series.min())
+            self.maxima.append(series.max())
+        if self.counts is not None:
+            self.counts = self.counts.add(series.value_counts(), fill_value=0)
+        else:
+            np.maximum(self.registers, hll_registers(series, self.precision), out=self.registers)
+
+    def stats(self, num_rows, sample, scale, approximate, config):
+        if sample is not None and isinstance(sample.dtype, pd.SparseDtype):
+            sample = sample.sparse.to_dense()
+        counts = None if self.counts is None else self.counts[self.counts > 0].astype(np.int64).sort_values(ascending=False, kind='stable')
+        column = {
+            'dtype': str(self.dtype),
+            'count': self.count,
+            'null_count': num_rows - self.count,
+            'distinct': len(counts) if counts is not None else hll_estimate(self.registers),
+            'top_values': _top_values(sample.value_counts(), config['TOP_VALUES'], scale) if approximate else _top_values(counts, config['TOP_VALUES']),
+            'approximate': approximate,
+        }
+        if self.numeric:
+            column['mean'] = _json_scalar(self.mean if self.count else None)
+            column['std'] = _json_scalar(math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else None)
+        if self.ordered:
+            column['min'] = _json_scalar(pd.Series(self.minima, dtype=object).min() if self.minima else None)
+            column['max'] = _json_scalar(pd.Series(self.maxima, dtype=object).max() if self.maxima else None)
+        if self.quantiles:
+            if approximate:
+                found = sample.quantile(config['QUANTILES'])
+                column['quantiles'] = {f"{q:g}": _json_scalar(found[q]) for q in config['QUANTILES']}
+            else:
+                column['quantiles'] = _quantiles_from_counts(counts, config['QUANTILES'])
+        return column
+
+
+def compute_column_stats_chunks(chunks, num_rows, approximate=False):
+    """
+    ``compute_column_stats`` of a frame of ``num_rows`` rows given as chunks
+    (see outofcore.py), one chunk in memory at a time. Counts, means,
+    standard deviations, minima and maxima are merged exactly. Exact stats
+    take distinct counts, top values and quantiles from every value's count;
+    approximate ones from HyperLogLog registers and a uniform sample of
+    about SAMPLE_ROWS rows (categorical columns are always counted).
+    """
+    config = _config()
+    sampler = chunk_sampler(num_rows)
+    summaries, samples = None, []
+    for chunk in chunks:
+        if summaries is None:
+            summaries = {
+                name: _ColumnSummary(chunk[name].dtype, not approximate or isinstance(chunk[name].dtype, pd.CategoricalDtype), config['HLL_PRECISION'])
+                for name in chunk.columns
+            }
+        for name, summary in summaries.items():
+            summary.add(chunk[name])
+        if approximate:
+            samples.append(sampler(chunk))
+    sample = pd.concat(samples) if samples else None
+    scale = num_rows / len(sample) if sample is not None and len(sample) else 1.0
+    return {
+        str(name): summary.stats(num_rows, None if sample is None else sample[name], scale, approximate, config)
+        for name, summary in (summaries or {}).items()
+    }
+
+
+# -----------------------------------------
+# Per-version cache
+# -----------------------------------------
+
+def _num_rows(store, dataset_id, version):
+    if store.has_step(dataset_id, version):
+        return store.load_step(dataset_id, version)['shape'][0]
+    return store.load_snapshot(dataset_id, version)['num_rows']
+
+
+def _carried_over(store, dataset_id, version, approximate):
+    """
+    Stats still valid for ``version`` from its nearest ancestor with cached
+    stats: the columns no step in between wrote, or nothing if a step
+    removed rows.
+    """
+    written = set()
+    while store.has_step(dataset_id, version):
+        record = store.load_step(dataset_id, version)
+        parent = record['parent']
+        if record['shape'][0] != _num_rows(store, dataset_id, parent):
+            return {}
+        written |= step_from_dict(record['step']).written_columns()
+        cached = store.load_stats(dataset_id, parent)
+        if cached is not None and cached['approximate'] == approximate:
+            return {name: column for name, column in cached['columns'].items() if name not in written}
+        version = parent
+    return {}
+
+
+def session_column_stats(session, frame, exact=False):
+    """
+    Stats of the session's current version (LazyFrame ``frame``), from the
+    cache where possible. Returns ``{'num_rows', 'approximate', 'columns':
+    {column: stats}, 'computed': [columns evaluated for this call]}``.
+    """
+    store = get_dataset_store()
+    dataset_id = session[SESSION_DATASET_ID_KEY]
+    version = session[SESSION_DATASET_VERSION_KEY]
+    num_rows = len(frame)
+    approximate = not exact and num_rows > _config()['APPROXIMATE_ROWS']
+    columns = [str(c) for c in frame.columns]
+
+    cached = store.load_stats(dataset_id, version)
+    stats = cached['columns'] if cached is not None and cached['approximate'] == approximate else {}
+    missing = [c for c in columns if c not in stats]
+    if missing:
+        carried = _carried_over(store, dataset_id, version, approximate)
+        stats.update({c: carried[c] for c in missing if c in carried})
+        missing = [c for c in columns if c not in stats]
+        if missing and frame.out_of_core:
+            stats.update(compute_column_stats_chunks(frame.chunks(missing), num_rows, approximate))
+        elif missing:
+            stats.update(compute_column_stats(frame.collect(columns=missing), approximate))
+        store.save_stats(dataset_id, version, {
+            'num_rows': num_rows, 'approximate': approximate, 'columns': {c: stats[c] for c in columns},
+        })
+    return {'num_rows': num_rows, 'approximate': approximate, 'columns': {c: stats[c] for c in columns}, 'computed': missing}
+
+
+def cached_fill_values(session, strategy, columns):
+    """
+    ``{column: value}`` to fill the numeric ones of ``columns`` with under
+    the ``mean`` or ``median`` strategy, from the current version's cached
+    stats; None unless all of them are cached (or for other strategies).
+    Medians are only reused from stats sampled exactly like FillMissing
+    samples (see ``sample_frame``): approximate ones above APPROXIMATE_ROWS
+    rows, exact ones below.
+    """
+    if strategy not in ('mean', 'median'):
+        return None
+    store = get_dataset_store()
+    cached = store.load_stats(session[SESSION_DATASET_ID_KEY], session[SESSION_DATASET_VERSION_KEY])
+    if cached is None or any(c not in cached['columns'] for c in columns):
+        return None
+    if strategy == 'median' and cached['approximate'] != (cached['num_rows'] > _config()['APPROXIMATE_ROWS']):
+        return None # E.g. exact stats of a large frame, asked for with ?exact=true
+    values = {}
+    for name in columns:
+        column = cached['columns'][name]
+        if 'mean' not in column or column['dtype'] in ('bool', 'boolean'):
+            continue # Not numeric; FillMissing skips it too
+        if strategy == 'mean':
+            value = column['mean']
+        elif '0.5' in column.get('quantiles', {}):
+            value = column['quantiles']['0.5']
+        else:
+            return None
+        values[name] = float('nan') if value is None else float(value)
+    return values
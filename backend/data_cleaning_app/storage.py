@@ -0,0 +1,778 @@
+"""
+Persistent storage for session DataFrames.
+
+The DataFrame itself lives on disk in a binary columnar format; the Django
+session only holds a small dataset id and version number pointing at it.
+A version is either a stored data file (the upload) or a small JSON step
+record pointing at its parent version; see pipeline.py for how the chain
+of steps is evaluated.
+"""
+import contextlib
+import fcntl
+import functools
+import json
+import os
+import re
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .cache import get_column_view_cache, get_dataframe_cache
+from .outofcore import open_frame
+from .pipeline import FrameSource, step_from_dict
+
+SESSION_DATASET_ID_KEY = 'current_dataset_id'
+SESSION_DATASET_VERSION_KEY = 'current_dataset_version'
+SESSION_DATASET_REDO_KEY = 'current_dataset_redo'
+SESSION_FULL_DATASET_KEY = 'full_dataset' # Kept aside while the session explores a sample; see sampling.py
+LEGACY_SESSION_JSON_KEY = 'current_dataframe_json'
+
+DEFAULT_STORE_BACKEND = 'data_cleaning_app.storage.ArrowDatasetStore'
+
+_DATASET_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+_VERSION_FILE_RE = re.compile(r'^v(\d+)\.')
+
+
+class DatasetNotFound(Exception):
+    pass
+
+
+_SPARSE_METADATA_KEY = b'data_cleaning_app:sparse'
+
+
+def _sparse_to_run_ends(array):
+    """A pandas SparseArray as an Arrow run-end encoded array: one run per stored value or gap."""
+    positions = np.asarray(array.sp_index.indices, dtype=np.int64)
+    values = np.asarray(array.sp_values)
+    fill = np.array(array.fill_value, dtype=values.dtype)
+    ends = np.empty(2 * len(positions), dtype=np.int64)
+    ends[0::2], ends[1::2] = positions, positions + 1
+    run_values = np.empty(2 * len(positions), dtype=values.dtype)
+    run_values[0::2], run_values[1::2] = fill, values
+    keep = np.ones(len(ends), dtype=bool)
+    keep[0::2] = positions > np.r_[0, positions[:-1] + 1] # A gap before this value
+    ends, run_values = ends[keep], run_values[keep]
+    if len(array) and (not len(ends) or ends[-1] < len(array)):
+        ends, run_values = np.r_[ends, len(array)], np.r_[run_values, fill]
+    end_type = pa.int32() if len(array) < 2 ** 31 else pa.int64()
+    return pa.RunEndEncodedArray.from_arrays(pa.array(ends, type=end_type), pa.array(run_values))
+
+
+def _stored_entries(chunked, fill_value):
+    """Positions and values of the non-fill entries of a run-end encoded (or plain) column."""
+    if not pa.types.is_run_end_encoded(chunked.type):
+        values = chunked.to_numpy()
+        positions = np.flatnonzero(values != fill_value)
+        return positions, values[positions]
+    all_positions, all_values, base = [], [], 0
+    for chunk in chunked.chunks:
+        ends = chunk.run_ends.to_numpy().astype(np.int64)
+        values = chunk.values.to_numpy(zero_copy_only=False)
+        starts = np.r_[0, ends[:-1]]
+        stored = np.flatnonzero(values != fill_value)
+        lengths = ends[stored] - starts[stored]
+        firsts = np.repeat(starts[stored], lengths)
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        positions = firsts + offsets
+        inside = (positions >= chunk.offset) & (positions < chunk.offset + len(chunk)) # Sliced chunks
+        all_positions.append(positions[inside] - chunk.offset + base)
+        all_values.append(np.repeat(values[stored], lengths)[inside])
+        base += len(chunk)
+    if not all_positions:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=chunked.type.value_type.to_pandas_dtype())
+    return np.concatenate(all_positions), np.concatenate(all_values)
+
+
+def _sparse_frame(columns, num_rows, rows, index):
+    """
+    Sparse columns (``{name: chunked array}``) as DataFrames, restricted to
+    ``rows`` (None, a slice or an array of positions). Columns of one value
+    type are built together from a single CSC matrix.
+    """
+    from scipy import sparse
+    length = num_rows
+    if isinstance(rows, slice):
+        length = rows.stop - rows.start
+    elif rows is not None:
+        rows = np.asarray(rows, dtype=np.int64)
+        length = len(rows)
+    by_type = {}
+    for name, chunked in columns.items():
+        positions, values = _stored_entries(chunked, 0)
+        if isinstance(rows, slice):
+            inside = (positions >= rows.start) & (positions < rows.stop)
+            positions, values = positions[inside] - rows.start, values[inside]
+        elif rows is not None:
+            found = np.minimum(np.searchsorted(positions, rows), max(len(positions) - 1, 0))
+            hit = np.flatnonzero(positions[found] == rows) if len(positions) else np.empty(0, dtype=np.int64)
+            positions, values = hit, values[found[hit]]
+        by_type.setdefault(values.dtype, []).append((name, positions, values))
+    frames = []
+    for dtype, entries in by_type.items():
+        indptr = np.r_[0, np.cumsum([len(positions) for _, positions, _ in entries])]
+        matrix = sparse.csc_matrix((
+            np.concatenate([values for _, _, values in entries]).astype(dtype),
+            np.concatenate([positions for _, positions, _ in entries]),
+            indptr,
+        ), shape=(length, len(entries)))
+        frames.append(pd.DataFrame.sparse.from_spmatrix(matrix, index=index, columns=[name for name, _, _ in entries]))
+    return frames
+
+
+def _to_arrow_table(df, preserve_index=None, sparse_as='run-end'):
+    """
+    Convert a DataFrame to an Arrow table, stringifying mixed-type object
+    columns. Sparse columns are written run-end encoded (or ``sparse_as=
+    'dense'``) and listed in the schema metadata, so ``_table_to_pandas``
+    brings them back sparse.
+    """
+    sparse_columns = [c for c in df.columns if isinstance(df[c].dtype, pd.SparseDtype)]
+    if sparse_columns:
+        dense = _to_arrow_table(df.drop(columns=sparse_columns), preserve_index=preserve_index)
+        arrays = {}
+        for name in df.columns:
+            if name in sparse_columns:
+                series = df[name]
+                arrays[str(name)] = _sparse_to_run_ends(series.array) if sparse_as == 'run-end' else pa.array(series.sparse.to_dense())
+            else:
+                arrays[str(name)] = dense.column(str(name))
+        for name in dense.column_names: # Index columns come last
+            arrays.setdefault(name, dense.column(name))
+        metadata = {**(dense.schema.metadata or {}), _SPARSE_METADATA_KEY: json.dumps([str(c) for c in sparse_columns]).encode()}
+        return pa.Table.from_arrays(list(arrays.values()), names=list(arrays), metadata=metadata)
+    try:
+        return pa.Table.from_pandas(df, preserve_index=preserve_index)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        pass
+    df = df.copy(deep=False)
+    for column in df.columns[df.dtypes == object]:
+        try:
+            pa.array(df[column], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Excel sheets often mix numbers and text in one column; keep them as text
+            df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+    return pa.Table.from_pandas(df, preserve_index=preserve_index)
+
+
+def _table_to_pandas(table, rows=None, index=None):
+    """
+    ``table`` as a DataFrame, optionally only its ``rows`` (a slice or an
+    array of positions), with the columns ``_to_arrow_table`` stored sparse
+    rebuilt as sparse columns.
+    """
+    sparse_names = set(json.loads((table.schema.metadata or {}).get(_SPARSE_METADATA_KEY, b'[]')))
+    names = [n for n in table.column_names if n in sparse_names]
+    dense = table.drop_columns(names) if names else table
+    if isinstance(rows, slice):
+        dense = dense.slice(rows.start, rows.stop - rows.start)
+    elif rows is not None:
+        dense = dense.take(rows)
+    df = dense.to_pandas()
+    if index is not None:
+        df.index = index
+    if not names:
+        return df
+    df = pd.concat([df] + _sparse_frame({n: table.column(n) for n in names}, table.num_rows, rows, df.index), axis=1)
+    return df[[c for c in table.column_names if c in df.columns]]
+
+
+class DatasetStore:
+    """
+    Base class for on-disk dataset stores.
+
+    Each dataset gets its own directory under ``root``. A version in it can
+    have any of: a data file (the upload, or the columns a snapshot had to
+    rewrite), a rows file (row positions into older data files), a step
+    record and a snapshot manifest; see history.py for how they combine.
+    Subclasses only decide the data file format through ``_open_writer`` /
+    ``_read_table``, and whether sparse columns are stored run-end encoded
+    or dense (``sparse_as``).
+    """
+    extension = None
+    sparse_as = 'run-end'
+
+    def __init__(self, root):
+        self.root = str(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def new_dataset_id(self):
+        return uuid.uuid4().hex
+
+    def _dataset_dir(self, dataset_id):
+        if not _DATASET_ID_RE.match(str(dataset_id)):
+            raise ValueError(f"Invalid dataset id: {dataset_id!r}")
+        return os.path.join(self.root, dataset_id)
+
+    def path_for(self, dataset_id, version):
+        return os.path.join(self._dataset_dir(dataset_id), f"v{int(version)}.{self.extension}")
+
+    def rows_path_for(self, dataset_id, version):
+        return os.path.join(self._dataset_dir(dataset_id), f"v{int(version)}.rows.{self.extension}")
+
+    def step_path_for(self, dataset_id, version):
+        return os.path.join(self._dataset_dir(dataset_id), f"v{int(version)}.step.json")
+
+    def snapshot_path_for(self, dataset_id, version):
+        return os.path.join(self._dataset_dir(dataset_id), f"v{int(version)}.snapshot.json")
+
+    def stats_path_for(self, dataset_id, version):
+        return os.path.join(self._dataset_dir(dataset_id), f"v{int(version)}.stats.json")
+
+    def _parts(self, dataset_id, version):
+        return {
+            'data': self.path_for(dataset_id, version),
+            'rows': self.rows_path_for(dataset_id, version),
+            'step': self.step_path_for(dataset_id, version),
+            'snapshot': self.snapshot_path_for(dataset_id, version),
+            'stats': self.stats_path_for(dataset_id, version),
+        }
+
+    def exists(self, dataset_id, version):
+        return os.path.exists(self.path_for(dataset_id, version))
+
+    def has_step(self, dataset_id, version):
+        return os.path.exists(self.step_path_for(dataset_id, version))
+
+    def has_snapshot(self, dataset_id, version):
+        return os.path.exists(self.snapshot_path_for(dataset_id, version))
+
+    def _meta_path(self, dataset_id):
+        return os.path.join(self._dataset_dir(dataset_id), 'meta.json')
+
+    def _read_meta(self, dataset_id):
+        try:
+            return self._read_json(self._meta_path(dataset_id))
+        except FileNotFoundError:
+            return {'next_version': 1}
+
+    @contextlib.contextmanager
+    def _meta_lock(self, dataset_id):
+        """Hold the dataset's lock around a read-modify-write of meta.json, across processes (e.g. background jobs)."""
+        os.makedirs(self._dataset_dir(dataset_id), exist_ok=True)
+        with open(os.path.join(self._dataset_dir(dataset_id), 'meta.lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX) # Released when the file is closed
+            yield
+
+    def allocate_version(self, dataset_id):
+        """Reserve the next version number. Numbers are never reused, even after pruning."""
+        with self._meta_lock(dataset_id):
+            meta = self._read_meta(dataset_id)
+            version = meta['next_version']
+            self._write_json(self._meta_path(dataset_id), {**meta, 'next_version': version + 1})
+        return version
+
+    def has_dataset(self, dataset_id):
+        """Whether the dataset exists at all, as opposed to one of its versions."""
+        return os.path.exists(self._meta_path(dataset_id))
+
+    def dataset_ids(self):
+        """Ids of every dataset in the store."""
+        try:
+            return [name for name in os.listdir(self.root) if _DATASET_ID_RE.match(name)]
+        except FileNotFoundError:
+            return []
+
+    def set_owner(self, dataset_id, session_key):
+        """Record the session key the dataset belongs to (see lifecycle.py)."""
+        with self._meta_lock(dataset_id):
+            self._write_json(self._meta_path(dataset_id), {**self._read_meta(dataset_id), 'owner': session_key})
+
+    def owner(self, dataset_id):
+        return self._read_meta(dataset_id).get('owner')
+
+    def touch(self, dataset_id):
+        """Mark the dataset as used now; see ``last_used``."""
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(self._meta_path(dataset_id))
+
+    def last_used(self, dataset_id):
+        """When the dataset was last opened or written, as a timestamp; None if it does not exist."""
+        for path in (self._meta_path(dataset_id), self._dataset_dir(dataset_id)):
+            with contextlib.suppress(FileNotFoundError):
+                return os.stat(path).st_mtime
+        return None
+
+    def versions(self, dataset_id):
+        """Map of version -> set of parts ('data', 'rows', 'step', 'snapshot', 'stats') on disk."""
+        try:
+            names = os.listdir(self._dataset_dir(dataset_id))
+        except FileNotFoundError:
+            return {}
+        found = {}
+        for name in names:
+            match = _VERSION_FILE_RE.match(name)
+            if not match or name.endswith('.tmp'):
+                continue
+            version = int(match.group(1))
+            for part, path in self._parts(dataset_id, version).items():
+                if os.path.basename(path) == name:
+                    found.setdefault(version, set()).add(part)
+        return found
+
+    def nbytes(self, dataset_id):
+        """Total bytes on disk used by ``dataset_id``."""
+        try:
+            entries = list(os.scandir(self._dataset_dir(dataset_id)))
+        except FileNotFoundError:
+            return 0
+        return sum(entry.stat().st_size for entry in entries if entry.is_file())
+
+    def save(self, dataset_id, version, df, preserve_index=None):
+        """Write ``df`` as the data file of ``version``. Returns the file size in bytes."""
+        path = self.path_for(dataset_id, version)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        self._write_table(_to_arrow_table(df, preserve_index=preserve_index, sparse_as=self.sparse_as), tmp_path)
+        os.replace(tmp_path, path) # Readers never see a half-written file
+        return os.path.getsize(path)
+
+    def save_tables(self, dataset_id, version, schema, tables):
+        """
+        Stream ``tables`` (Arrow tables matching ``schema``) into the data file
+        of ``version`` one at a time. Returns the file size in bytes.
+        """
+        path = self.path_for(dataset_id, version)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        try:
+            with self._open_writer(tmp_path, schema) as writer:
+                for table in tables:
+                    writer.write_table(table)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, path)
+        return os.path.getsize(path)
+
+    def open(self, dataset_id, version):
+        """Return the stored version as an Arrow table without converting it to pandas."""
+        path = self.path_for(dataset_id, version)
+        if not os.path.exists(path):
+            raise DatasetNotFound(f"Dataset {dataset_id} version {version} not found.")
+        return self._read_table(path)
+
+    def load(self, dataset_id, version):
+        return _table_to_pandas(self.open(dataset_id, version))
+
+    def save_rows(self, dataset_id, version, positions):
+        """Write ``{name: row position array}`` as the rows file of ``version``."""
+        path = self.rows_path_for(dataset_id, version)
+        tmp_path = f"{path}.tmp"
+        self._write_table(pa.table({name: pa.array(array) for name, array in positions.items()}), tmp_path)
+        os.replace(tmp_path, path)
+
+    def open_rows(self, dataset_id, version):
+        return self._read_table(self.rows_path_for(dataset_id, version))
+
+    def save_step(self, dataset_id, version, record):
+        """Write a step record (``{'parent': ..., 'step': ..., 'shape': ...}``) for ``version``."""
+        self._write_json(self.step_path_for(dataset_id, version), record)
+
+    def load_step(self, dataset_id, version):
+        return self._load_record(self.step_path_for(dataset_id, version), dataset_id, version)
+
+    def save_snapshot(self, dataset_id, version, manifest):
+        self._write_json(self.snapshot_path_for(dataset_id, version), manifest)
+
+    def load_snapshot(self, dataset_id, version):
+        return self._load_record(self.snapshot_path_for(dataset_id, version), dataset_id, version)
+
+    def save_stats(self, dataset_id, version, stats):
+        """Write the column statistics of ``version`` (see stats.py)."""
+        self._write_json(self.stats_path_for(dataset_id, version), stats)
+
+    def load_stats(self, dataset_id, version):
+        """The cached column statistics of ``version``, or None."""
+        try:
+            return self._read_json(self.stats_path_for(dataset_id, version))
+        except FileNotFoundError:
+            return None
+
+    def save_ingest_report(self, dataset_id, report):
+        """Write what ingestion found out about the upload (see dtypes.py)."""
+        self._write_json(os.path.join(self._dataset_dir(dataset_id), 'ingest.json'), report)
+
+    def load_ingest_report(self, dataset_id):
+        """The dataset's ingest report, or None if it was stored without one."""
+        try:
+            return self._read_json(os.path.join(self._dataset_dir(dataset_id), 'ingest.json'))
+        except FileNotFoundError:
+            return None
+
+    def delete(self, dataset_id, version=None, parts=None):
+        """
+        Delete ``parts`` (default: all) of a single version, or the whole
+        dataset when ``version`` is None.
+        """
+        if version is None:
+            shutil.rmtree(self._dataset_dir(dataset_id), ignore_errors=True)
+            return
+        for part, path in self._parts(dataset_id, version).items():
+            if parts is not None and part not in parts:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _load_record(self, path, dataset_id, version):
+        try:
+            return self._read_json(path)
+        except FileNotFoundError:
+            raise DatasetNotFound(f"Dataset {dataset_id} version {version} not found.")
+
+    def _write_json(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp" # Concurrent requests may write the same record (e.g. stats)
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def _read_json(self, path):
+        with open(path) as f:
+            return json.load(f)
+
+    def _write_table(self, table, path):
+        with self._open_writer(path, table.schema) as writer:
+            writer.write_table(table)
+
+    def _open_writer(self, path, schema):
+        """Context manager yielding an object with ``write_table(table)``."""
+        raise NotImplementedError
+
+    def _read_table(self, path):
+        raise NotImplementedError
+
+
+class ArrowDatasetStore(DatasetStore):
+    """Arrow IPC files, memory-mapped on read."""
+    extension = 'arrow'
+
+    @contextlib.contextmanager
+    def _open_writer(self, path, schema):
+        with pa.OSFile(path, 'wb') as sink:
+            with pa.ipc.new_file(sink, schema) as writer:
+                yield writer
+
+    def _read_table(self, path):
+        with pa.memory_map(path, 'r') as source:
+            return pa.ipc.open_file(source).read_all()
+
+
+class ParquetDatasetStore(DatasetStore):
+    """Compressed Parquet files; smaller on disk, slower to read than Arrow IPC."""
+    extension = 'parquet'
+    sparse_as = 'dense' # Parquet has no run-end encoded type; its own encodings keep zeros small on disk
+
+    @contextlib.contextmanager
+    def _open_writer(self, path, schema):
+        with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+            yield writer
+
+    def _read_table(self, path):
+        return pq.read_table(path, memory_map=True)
+
+
+class SnapshotSource:
+    """
+    A stored snapshot read as a pipeline base source.
+
+    A snapshot manifest lists, for each column, the version whose data file
+    holds it; ``row_maps`` names the rows file with this snapshot's row
+    positions into each data file that was written before later filters.
+    Data files without a row map line up with the snapshot row for row.
+    The frames returned are indexed by row position within the snapshot.
+    """
+    column_views = None # Set by get_session_frame; see SourceColumnViews
+
+    def __init__(self, store, dataset_id, manifest):
+        self.store = store
+        self.dataset_id = dataset_id
+        self.manifest = manifest
+        self.columns = [c['name'] for c in manifest['columns']]
+        self.refs = {c['name']: c['file'] for c in manifest['columns']}
+        self.row_maps = {int(k): v for k, v in manifest.get('row_maps', {}).items()}
+        self.num_rows = manifest['num_rows']
+        self._tables = {}
+        self._positions = {}
+
+    def table(self, file_version):
+        if file_version not in self._tables:
+            self._tables[file_version] = self.store.open(self.dataset_id, file_version)
+        return self._tables[file_version]
+
+    def nbytes(self):
+        """Bytes on disk of the data and rows files this snapshot reads."""
+        paths = {self.store.path_for(self.dataset_id, v) for v in set(self.refs.values())}
+        paths |= {self.store.rows_path_for(self.dataset_id, v) for v in self.row_maps.values()}
+        return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+    def positions(self, file_version):
+        """Row positions into ``file_version``'s data file, or None if it lines up already."""
+        if file_version not in self.row_maps:
+            return None
+        if file_version not in self._positions:
+            rows = self.store.open_rows(self.dataset_id, self.row_maps[file_version])
+            self._positions[file_version] = rows.column(str(file_version)).to_numpy()
+        return self._positions[file_version]
+
+    def read(self, columns=None, offset=0, length=None):
+        stop = self.num_rows if length is None else min(self.num_rows, offset + length)
+        start = min(offset, stop)
+        return self._assemble(columns, pd.RangeIndex(start, stop), lambda positions: (
+            slice(start, stop) if positions is None else positions[start:stop]
+        ))
+
+    def take(self, columns, rows):
+        """The snapshot rows at positions ``rows`` (in that order)."""
+        rows = np.asarray(rows, dtype=np.int64)
+        return self._assemble(columns, pd.Index(rows), lambda positions: (
+            rows if positions is None else positions[rows]
+        ))
+
+    def _assemble(self, columns, index, pick):
+        columns = self.columns if columns is None else list(columns)
+        by_file = {}
+        for name in columns:
+            by_file.setdefault(self.refs[name], []).append(name)
+        parts = []
+        for file_version, names in by_file.items():
+            rows = pick(self.positions(file_version)) # Rows of this data file, as a slice or positions
+            parts.append(_table_to_pandas(self.table(file_version).select(names), rows, index))
+        if not parts:
+            return pd.DataFrame(index=index)
+        df = parts[0] if len(parts) == 1 else pd.concat(parts, axis=1)
+        return df[columns] if len(parts) > 1 else df
+
+
+class SourceColumnViews:
+    """
+    The typed column views (see ColumnViews in pipeline.py) of the dataset
+    version a base source holds, kept in the column view cache across
+    requests. A column's views are filed under the earliest version its
+    values and rows are unchanged since, so versions whose steps kept every
+    row and didn't write the column share them; a step that writes a column
+    or may drop rows starts that column (or every column) over.
+    """
+
+    def __init__(self, store, dataset_id, version, num_rows):
+        self.store = store
+        self.dataset_id = dataset_id
+        self.version = version
+        self.num_rows = num_rows
+        self._origins = {}
+
+    def _origin(self, name):
+        if name not in self._origins:
+            version = self.version
+            with contextlib.suppress(DatasetNotFound):
+                while self.store.has_step(self.dataset_id, version):
+                    record = self.store.load_step(self.dataset_id, version)
+                    step = step_from_dict(record['step'])
+                    if step.drops_rows or name in step.written_columns():
+                        break
+                    version = record['parent']
+            self._origins[name] = version
+        return self._origins[name]
+
+    def get(self, kind, name):
+        return get_column_view_cache().get((kind, self.dataset_id, self._origin(name), name))
+
+    def put(self, kind, name, view):
+        get_column_view_cache().put((kind, self.dataset_id, self._origin(name), name), view)
+
+
+def base_manifest(columns, num_rows, version):
+    """Snapshot manifest for a frame stored whole as the data file of ``version``."""
+    return {
+        'num_rows': num_rows,
+        'columns': [{'name': name, 'file': version} for name in columns],
+        'row_maps': {},
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def get_dataset_store():
+    config = getattr(settings, 'DATASET_STORE', {})
+    backend = import_string(config.get('BACKEND', DEFAULT_STORE_BACKEND))
+    root = config.get('ROOT', os.path.join(settings.BASE_DIR, 'datasets'))
+    return backend(root)
+
+
+# -----------------------------------------
+# Session <-> store glue
+# -----------------------------------------
+
+def _cache_key(session, dataset_id, version):
+    return (session.session_key, dataset_id, version)
+
+
+def get_session_frame(session):
+    """
+    Return the session's current version as a LazyFrame, or None if it has none.
+    Large versions are opened out of core (see outofcore.py).
+
+    Walks back through the step records until it reaches a version that is
+    cached in memory or snapshotted on disk, and replays the steps from there.
+    """
+    dataset_id = session.get(SESSION_DATASET_ID_KEY)
+    version = requested = session.get(SESSION_DATASET_VERSION_KEY)
+    if not dataset_id or not version:
+        return None
+    store = get_dataset_store()
+    cache = get_dataframe_cache()
+    store.touch(dataset_id) # Idle datasets expire; see lifecycle.py
+    full = session.get(SESSION_FULL_DATASET_KEY)
+    if full:
+        store.touch(full['id'])
+
+    steps, num_rows = [], None
+    while True:
+        # Only the requested version counts towards the hit ratio, not the ancestors walked through
+        df = cache.get(_cache_key(session, dataset_id, version), count=not steps)
+        if df is not None:
+            source = FrameSource(df)
+            break
+        if store.has_snapshot(dataset_id, version):
+            source = SnapshotSource(store, dataset_id, store.load_snapshot(dataset_id, version))
+            break
+        record = store.load_step(dataset_id, version)
+        if not steps:
+            num_rows = record['shape'][0]
+        steps.append(step_from_dict(record['step']))
+        version = record['parent']
+    steps.reverse()
+    source.column_views = SourceColumnViews(store, dataset_id, version, source.num_rows)
+    frame = open_frame(source, steps, num_rows=num_rows)
+    if steps or not isinstance(source, FrameSource):
+        cache_when_collected(session, frame, dataset_id, requested)
+    return frame
+
+
+def recover_session_version(session):
+    """
+    Point a session whose current version went missing (e.g. a stale copy of
+    the session written back after the version was dropped) at the newest
+    version of its dataset that can still be opened. Returns that version, or
+    None if there is none; the redo stack is cleared either way.
+    """
+    dataset_id = session[SESSION_DATASET_ID_KEY]
+    store = get_dataset_store()
+    session[SESSION_DATASET_REDO_KEY] = []
+    for version in sorted(store.versions(dataset_id), reverse=True):
+        ancestor = version
+        try:
+            while not store.has_snapshot(dataset_id, ancestor):
+                ancestor = store.load_step(dataset_id, ancestor)['parent']
+        except DatasetNotFound:
+            continue # A leftover part, or a version whose history is broken too
+        session[SESSION_DATASET_VERSION_KEY] = version
+        return version
+    return None
+
+
+def load_session_dataset(session):
+    """
+    Return the session's current version fully materialized, or None.
+
+    The returned frame may be shared with the in-process cache, so callers
+    must not modify it in place.
+    """
+    frame = get_session_frame(session)
+    if frame is None:
+        return None
+    if not frame.steps and isinstance(frame.source, FrameSource):
+        return frame.source.df
+    return frame.collect() # Cached for the next request; see cache_when_collected
+
+
+def cache_when_collected(session, frame, dataset_id, version):
+    """
+    Have ``frame``, ``version`` of the session's dataset, put itself in the
+    in-process cache once something collects it in full, so the next request
+    for that version starts from memory. Out-of-core frames are not cached.
+    """
+    if not frame.out_of_core:
+        frame.on_collect = functools.partial(get_dataframe_cache().put, _cache_key(session, dataset_id, version))
+    return frame
+
+
+def cache_session_dataset(session, df):
+    """Cache ``df`` as the materialized frame of the session's current version."""
+    key = _cache_key(session, session[SESSION_DATASET_ID_KEY], session[SESSION_DATASET_VERSION_KEY])
+    get_dataframe_cache().put(key, df)
+
+
+def save_session_dataset(session, df):
+    """
+    Store ``df`` as a brand new dataset and point the session at it; the
+    session's previous dataset is removed. Writes go through the in-process
+    cache so the next request can skip the load.
+    """
+    store = get_dataset_store()
+    dataset_id = store.new_dataset_id()
+    version = store.allocate_version(dataset_id)
+    store.save(dataset_id, version, df)
+    store.save_snapshot(dataset_id, version, base_manifest(df.columns, len(df), version))
+    attach_session_dataset(session, dataset_id, version, df=df)
+    return dataset_id, version
+
+
+def attach_session_dataset(session, dataset_id, version, df=None, full_dataset=None):
+    """
+    Point the session at an already stored dataset and remove its previous
+    one. ``df``, when given, is the dataset's frame and is cached. For a
+    sample, ``full_dataset`` is the record of the dataset it was drawn from,
+    which the session keeps (see sampling.py).
+    """
+    if not session.session_key:
+        session.save() # Cache entries are keyed by session key
+    kept = {dataset_id, full_dataset['id'] if full_dataset else None}
+    old_dataset_ids = [session.get(SESSION_DATASET_ID_KEY), (session.get(SESSION_FULL_DATASET_KEY) or {}).get('id')]
+    store = get_dataset_store()
+    store.set_owner(dataset_id, session.session_key)
+
+    session[SESSION_DATASET_ID_KEY] = dataset_id
+    session[SESSION_DATASET_VERSION_KEY] = version
+    session[SESSION_DATASET_REDO_KEY] = []
+    session.pop(LEGACY_SESSION_JSON_KEY, None)
+    if full_dataset:
+        store.set_owner(full_dataset['id'], session.session_key)
+        session[SESSION_FULL_DATASET_KEY] = full_dataset
+    else:
+        session.pop(SESSION_FULL_DATASET_KEY, None)
+    if df is not None:
+        get_dataframe_cache().put(_cache_key(session, dataset_id, version), df)
+
+    for old_dataset_id in old_dataset_ids:
+        if old_dataset_id and old_dataset_id not in kept:
+            _retire_dataset(session, old_dataset_id)
+
+
+def clear_session_dataset(session):
+    dataset_id = session.pop(SESSION_DATASET_ID_KEY, None)
+    session.pop(SESSION_DATASET_VERSION_KEY, None)
+    session.pop(SESSION_DATASET_REDO_KEY, None)
+    session.pop(LEGACY_SESSION_JSON_KEY, None)
+    full = session.pop(SESSION_FULL_DATASET_KEY, None)
+    for old_dataset_id in (dataset_id, full['id'] if full else None):
+        if old_dataset_id:
+            _retire_dataset(session, old_dataset_id)
+
+
+def _retire_dataset(session, dataset_id):
+    """Delete a dataset the session no longer points at."""
+    retire = getattr(session, 'retire_dataset', None)
+    if retire is not None:
+        retire(dataset_id) # A background job's session copy; deleted once its result is applied
+        return
+    get_dataset_store().delete(dataset_id)
+    get_dataframe_cache().discard_dataset(dataset_id)
+    get_column_view_cache().discard_dataset(dataset_id)
@@ -0,0 +1,85 @@
+"""Shared set-up for the app's tests: a throwaway dataset store per test, and small generated uploads."""
+import io
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from ..cache import get_column_view_cache, get_dataframe_cache
+from ..storage import get_dataset_store, load_session_dataset
+from ..uploads import get_upload_cache
+
+# Getters that build their object from settings once; cleared around every test
+CACHED_GETTERS = (get_dataframe_cache, get_column_view_cache, get_dataset_store, get_upload_cache)
+
+
+def make_frame(n=1000, seed=0):
+    """A mixed frame: numbers with gaps, a text column with gaps, timestamps and floats."""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'a': rng.integers(0, 100, n).astype(float),
+        'b': rng.choice(['x', 'y', 'z', None], n),
+        'c': pd.date_range('2020-01-01', periods=n, freq='h'),
+        'd': rng.normal(size=n),
+    })
+    df.loc[::7, 'a'] = np.nan
+    return df
+
+
+def csv_file(df, name='data.csv'):
+    f = io.BytesIO(df.to_csv(index=False).encode())
+    f.name = name
+    return f
+
+
+class StoreTestCase(TransactionTestCase):
+    """
+    Runs every test against its own dataset store and job root in a
+    temporary directory. A TransactionTestCase, because the views run on
+    the executor threads (see executors.py), which do not share the test's
+    transaction.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        settings_override = override_settings(
+            DATASET_STORE={'ROOT': os.path.join(self.root, 'datasets')},
+            BACKGROUND_JOBS={'ROOT': os.path.join(self.root, 'jobs')},
+            DATASET_LIFECYCLE={'SWEEP_INTERVAL': 0},
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.clear_cached_getters()
+        self.addCleanup(self.clear_cached_getters)
+        self.client = APIClient()
+
+    def clear_cached_getters(self):
+        for getter in CACHED_GETTERS:
+            getter.cache_clear()
+
+    def url(self, name, **kwargs):
+        return reverse(name, kwargs=kwargs or None)
+
+    def upload(self, df=None, name='data.csv', **extra):
+        return self.client.post(self.url('manage-dataframe'), {'file': csv_file(make_frame() if df is None else df, name), **extra}, format='multipart')
+
+    def op(self, name, data=None, **kwargs):
+        return self.client.post(self.url(name, **kwargs), data or {}, format='json')
+
+    def preview(self, **params):
+        return self.client.get(self.url('preview'), params)
+
+    def download(self, download_format='csv'):
+        response = self.client.get(self.url(f"download-{download_format.replace('.', '-')}"))
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+    def session_frame(self):
+        """The session's current version, loaded the way the views load it."""
+        return load_session_dataset(self.client.session)
@@ -0,0 +1,160 @@
+import io
+
+import numpy as np
+import pandas as pd
+from django.test import override_settings
+
+from ..cache import get_dataframe_cache
+from ..storage import get_dataset_store
+from .base import StoreTestCase, make_frame
+
+
+class RoundTripTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.df = make_frame()
+        response = self.upload(self.df)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['total_rows_in_file'], len(self.df))
+
+    def test_upload_preview(self):
+        response = self.preview(limit=5)
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body['headers'], ['a', 'b', 'c', 'd'])
+        self.assertEqual(body['total_rows'], len(self.df))
+        np.testing.assert_allclose([row[3] for row in body['rows']], self.df['d'].head(5)) # Through CSV text
+
+    def test_upload_rows_match_preview(self):
+        seeded = self.op('op-filter-rows', {'column_name': 'a', 'operator': '>=', 'value': '0'}).json()['rows']
+        self.assertEqual(seeded, self.preview(offset=0, limit=100).json()['rows'])
+
+    def test_operation_then_download(self):
+        response = self.op('op-filter-rows', {'column_name': 'a', 'operator': '>', 'value': '50'})
+        self.assertEqual(response.status_code, 200)
+        expected = self.df[self.df['a'] > 50]
+        self.assertEqual(response.json()['total_rows_in_file'], len(expected))
+
+        downloaded = pd.read_csv(io.BytesIO(self.download()))
+        self.assertEqual(list(downloaded.columns), ['a', 'b', 'c', 'd'])
+        np.testing.assert_array_equal(downloaded['a'].to_numpy(), expected['a'].to_numpy())
+        np.testing.assert_allclose(downloaded['d'].to_numpy(), expected['d'].to_numpy())
+
+    def test_drop_column(self):
+        response = self.client.put(self.url('manage-dataframe'), {'column_name': 'b'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['headers'], ['a', 'c', 'd'])
+        self.assertEqual(list(self.session_frame().columns), ['a', 'c', 'd'])
+
+    def test_undo_redo(self):
+        self.op('op-filter-rows', {'column_name': 'a', 'operator': '>', 'value': '50'})
+        self.op('op-replace-missing-rows', {'fill_strategy': 'constant', 'columns_to_fill': ['b'], 'fill_value': 'none'})
+        filtered = len(self.df[self.df['a'] > 50])
+
+        response = self.op('history-undo')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.session_frame()['b'].isna().sum(), self.df[self.df['a'] > 50]['b'].isna().sum())
+        response = self.op('history-undo')
+        self.assertEqual(response.json()['total_rows_in_file'], len(self.df))
+        response = self.op('history-redo')
+        self.assertEqual(response.json()['total_rows_in_file'], filtered)
+        response = self.op('history-redo')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.session_frame()['b'].isna().sum(), 0)
+
+        operations = [v['operation'] for v in self.client.get(self.url('history')).json()['versions']]
+        self.assertEqual(operations, ['original', 'filter-rows', 'fill-missing'])
+        self.assertEqual(self.op('history-redo').status_code, 400) # Nothing left to redo
+
+    def test_batch(self):
+        response = self.op('op-batch', {'operations': [
+            {'operation': 'filter-rows', 'column_name': 'a', 'operator': '>', 'value': '50'},
+            {'operation': 'drop-duplicates', 'columns': ['b']},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        expected = self.df[self.df['a'] > 50].drop_duplicates(subset=['b'])
+        self.assertEqual(response.json()['total_rows_in_file'], len(expected))
+        self.assertEqual(len(response.json()['steps']), 2)
+
+
+class ErrorTests(StoreTestCase):
+    def test_no_session(self):
+        for response in (
+            self.preview(),
+            self.op('op-filter-rows', {'column_name': 'a', 'operator': '>', 'value': '1'}),
+            self.op('history-undo'),
+            self.client.get(self.url('history')),
+        ):
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('upload a file first', response.json()['error'])
+
+    def test_bad_parameters(self):
+        self.upload()
+        for data in (
+            {'column_name': 'zz', 'operator': '>', 'value': '1'},
+            {'column_name': 'a', 'operator': 'between', 'value': '1'},
+            {'column_name': 'a', 'operator': 'nope', 'value': '1'},
+            {},
+        ):
+            response = self.op('op-filter-rows', data)
+            self.assertEqual(response.status_code, 400, data)
+            self.assertIn('error', response.json())
+        response = self.op('op-replace-missing-rows', {'fill_strategy': 'constant', 'columns_to_fill': ['a']})
+        self.assertEqual(response.status_code, 400)
+        response = self.op('op-drop-duplicates', {'keep': 'middle'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.op('history-jump', {'version': 'x'}).status_code, 400)
+        # None of it touched the data
+        self.assertEqual(len(self.session_frame()), 1000)
+
+    def test_upload_over_quota(self):
+        self.upload()
+        dataset_id = self.client.session['current_dataset_id']
+        with override_settings(DATASET_LIFECYCLE={'SWEEP_INTERVAL': 0, 'SESSION_MAX_BYTES': 1000}):
+            response = self.upload(make_frame(seed=1))
+        self.assertEqual(response.status_code, 413)
+        self.assertIn('per session', response.json()['error'])
+        # The session keeps its previous dataset
+        self.assertEqual(self.client.session['current_dataset_id'], dataset_id)
+        self.assertEqual(self.preview().status_code, 200)
+
+    def test_download_while_sampling(self):
+        response = self.upload(make_frame(5000), sampling='reservoir', sample_rows=500)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['total_rows_in_file'], 500)
+        response = self.client.get(self.url('download-csv'))
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('sample', response.json()['error'])
+
+        self.op('op-filter-rows', {'column_name': 'a', 'operator': '>', 'value': '50'})
+        response = self.op('sampling-commit')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(self.url('download-csv')).status_code, 200)
+        df = make_frame(5000)
+        self.assertEqual(len(self.session_frame()), int((df['a'] > 50).sum()))
+
+    def test_dataset_gone(self):
+        self.upload()
+        dataset_id = self.client.session['current_dataset_id']
+        get_dataset_store().delete(dataset_id) # As an expiry sweep would, from any worker
+        get_dataframe_cache().discard_dataset(dataset_id)
+        response = self.preview()
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn('current_dataset_id', self.client.session)
+
+    def test_version_gone(self):
+        self.upload()
+        self.op('op-filter-rows', {'column_name': 'a', 'operator': '>', 'value': '10'})
+        self.op('op-filter-rows', {'column_name': 'a', 'operator': '>', 'value': '20'})
+        self.op('history-undo')
+        self.client.put(self.url('manage-dataframe'), {'column_name': 'd'}, format='json') # Drops the undone version 3
+        dataset_id, version = self.client.session['current_dataset_id'], self.client.session['current_dataset_version']
+
+        session = self.client.session # A stale copy of the session, still on version 3
+        session['current_dataset_version'] = 3
+        session.save()
+        response = self.preview()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['headers'], ['a', 'b', 'c'])
+        self.assertEqual(self.client.session['current_dataset_version'], version)
+        self.assertTrue(get_dataset_store().has_dataset(dataset_id))
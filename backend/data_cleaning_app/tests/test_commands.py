@@ -0,0 +1,102 @@
+import io
+import json
+import os
+
+import pandas as pd
+from django.core.management import CommandError, call_command
+from django.test import override_settings
+
+from ..storage import get_dataset_store
+from .base import StoreTestCase, make_frame
+
+
+def run_command(*args, **options):
+    stdout, stderr = io.StringIO(), io.StringIO()
+    call_command(*args, stdout=stdout, stderr=stderr, **options)
+    return stdout.getvalue(), stderr.getvalue()
+
+
+class ApplyRecipeTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.input_dir = os.path.join(self.root, 'incoming')
+        self.output_dir = os.path.join(self.root, 'cleaned')
+        os.makedirs(self.input_dir)
+        self.upload()
+        self.op('op-filter-rows', {'column_name': 'a', 'operator': '>', 'value': '50'})
+        self.op('op-replace-missing-rows', {'fill_strategy': 'constant', 'columns_to_fill': ['b'], 'fill_value': 'none'})
+        self.recipe = os.path.join(self.root, 'recipe.json')
+        with open(self.recipe, 'w') as f:
+            json.dump(self.client.get(self.url('download-recipe')).json(), f)
+
+    def test_applies_the_session_steps(self):
+        for seed in (1, 2):
+            make_frame(seed=seed).to_csv(os.path.join(self.input_dir, f"part{seed}.csv"), index=False)
+        stdout, _ = run_command('apply_recipe', self.recipe, self.input_dir, self.output_dir, workers=1)
+        self.assertIn('2/2 file(s)', stdout)
+        for seed in (1, 2):
+            df = make_frame(seed=seed)
+            expected = df[df['a'] > 50].fillna({'b': 'none'})
+            cleaned = pd.read_csv(os.path.join(self.output_dir, f"part{seed}_cleaned.csv"))
+            self.assertEqual(len(cleaned), len(expected))
+            self.assertEqual(cleaned['b'].tolist(), expected['b'].tolist())
+
+    def test_bad_file_fails_the_batch(self):
+        make_frame().to_csv(os.path.join(self.input_dir, 'good.csv'), index=False)
+        pd.DataFrame({'other': [1, 2]}).to_csv(os.path.join(self.input_dir, 'bad.csv'), index=False)
+        with self.assertRaisesMessage(CommandError, '1 file(s) failed'):
+            run_command('apply_recipe', self.recipe, self.input_dir, self.output_dir, workers=1)
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, 'good_cleaned.csv')))
+
+    def test_bad_arguments(self):
+        with open(os.path.join(self.root, 'not-a-recipe.json'), 'w') as f:
+            json.dump({'steps': []}, f)
+        with self.assertRaisesMessage(CommandError, 'Cannot read recipe'):
+            run_command('apply_recipe', os.path.join(self.root, 'not-a-recipe.json'), self.input_dir, self.output_dir)
+        with self.assertRaisesMessage(CommandError, 'does not exist'):
+            run_command('apply_recipe', self.recipe, os.path.join(self.root, 'missing'), self.output_dir)
+        with self.assertRaisesMessage(CommandError, 'No .csv or .xlsx files'):
+            run_command('apply_recipe', self.recipe, self.input_dir, self.output_dir)
+
+
+class SweepDatasetsTests(StoreTestCase):
+    def test_dry_run_then_sweep(self):
+        self.upload()
+        dataset_id = self.client.session['current_dataset_id']
+        store = get_dataset_store()
+        with override_settings(DATASET_LIFECYCLE={'SWEEP_INTERVAL': 0, 'IDLE_TTL': -1}):
+            stdout, _ = run_command('sweep_datasets', dry_run=True)
+            self.assertIn('Would delete 1 of 1 dataset(s) (1 idle)', stdout)
+            self.assertTrue(store.has_dataset(dataset_id))
+
+            stdout, _ = run_command('sweep_datasets')
+            self.assertIn('Deleted 1 of 1 dataset(s) (1 idle)', stdout)
+            self.assertFalse(store.has_dataset(dataset_id))
+        self.assertEqual(self.preview().status_code, 400)
+
+    def test_nothing_to_delete(self):
+        self.upload()
+        stdout, _ = run_command('sweep_datasets')
+        self.assertIn('Deleted 0 of 1 dataset(s) (nothing to delete)', stdout)
+
+
+class BenchmarkTests(StoreTestCase):
+    def test_runs_every_endpoint(self):
+        output = os.path.join(self.root, 'result.json')
+        skip = 'op-filter-rows-async,excel-sheets,upload-xlsx-sample,upload-xlsx,download-xlsx' # Job workers and Excel are slow
+        stdout, _ = run_command(
+            'benchmark', sizes='10k', shapes='narrow-numeric', skip=skip,
+            data_dir=os.path.join(self.root, 'bench'), output=output,
+        )
+        self.assertIn(', 0 failed;', stdout)
+        with open(output) as f:
+            report = json.load(f)
+        endpoints = {r['endpoint'] for r in report['results']}
+        self.assertTrue({'upload', 'preview', 'op-filter-rows', 'history-undo', 'download-csv', 'sampling-commit'} <= endpoints)
+        self.assertFalse(endpoints & set(skip.split(',')))
+
+    def test_bad_arguments(self):
+        with self.assertRaisesMessage(CommandError, '--sizes: unknown 3k'):
+            run_command('benchmark', sizes='3k')
+        with self.assertRaisesMessage(CommandError, '--repeat must be at least 1'):
+            run_command('benchmark', sizes='10k', repeat=0)
@@ -0,0 +1,78 @@
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from django.test import SimpleTestCase
+
+from ..pipeline import DropDuplicates, duplicate_groups, duplicated_rows
+
+LOGGER = 'data_cleaning_app.pipeline'
+
+
+def make_frame(n=3000, seed=0):
+    """Few distinct values per column, so that rows repeat, with gaps of every kind."""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'f': rng.choice([0.0, -0.0, 1.5, np.nan], n),
+        'i': pd.array(rng.integers(0, 3, n), dtype='Int64'),
+        't': rng.choice(['x', 'y', None], n),
+        'k': pd.Categorical(rng.choice(['lo', 'hi', None], n)),
+        'dt': pd.to_datetime(rng.choice(['2021-01-01', '2021-06-01', None], n)),
+        'bl': rng.choice([True, False], n),
+    })
+    df.loc[df.index[::5], 'i'] = None
+    return df
+
+
+class DuplicatedRowsTests(SimpleTestCase):
+    subsets = (None, ['f'], ['t', 'k'], ['i', 'dt', 'bl'], ['f', 'i', 't', 'k', 'dt'])
+
+    def test_same_as_pandas(self):
+        df = make_frame()
+        for columns in self.subsets:
+            subset = df if columns is None else df[columns]
+            for keep in ('first', 'last'):
+                with self.subTest(columns=columns, keep=keep), self.assertNoLogs(LOGGER, 'INFO'):
+                    np.testing.assert_array_equal(duplicated_rows(subset, keep), subset.duplicated(keep=keep).to_numpy())
+
+    def test_groups_numbered_by_first_appearance(self):
+        df = pd.DataFrame({'a': [3, 1, 3, 2, 1, 3]})
+        np.testing.assert_array_equal(duplicate_groups(df), [0, 1, 0, 2, 1, 0])
+        np.testing.assert_array_equal(duplicate_groups(df[[]]), np.zeros(6))
+
+    def test_negative_zero_and_nan_payloads(self):
+        other_nan = np.frombuffer(np.uint64(0x7FF8000000000001).tobytes(), dtype=np.float64)[0]
+        self.assertTrue(np.isnan(other_nan))
+        df = pd.DataFrame({
+            'f': [0.0, -0.0, np.nan, other_nan, -np.nan, 1.0],
+            'c': np.array([0j, -0j, complex(np.nan, 0), complex(other_nan, 0), 1j, 1j]),
+        })
+        # Bit by bit, -0.0 and the NaNs hash differently
+        raw = pd.util.hash_pandas_object(df[['f']], index=False).to_numpy()
+        self.assertNotEqual(raw[0], raw[1])
+        with self.assertNoLogs(LOGGER, 'INFO'): # Normalised before hashing, so no collision check fails
+            np.testing.assert_array_equal(duplicate_groups(df[['f']]), [0, 0, 1, 1, 1, 2])
+            np.testing.assert_array_equal(duplicated_rows(df[['f']]), df[['f']].duplicated().to_numpy())
+            np.testing.assert_array_equal(duplicate_groups(df), [0, 0, 1, 1, 2, 3])
+
+    def test_hash_collision_falls_back_to_values(self):
+        df = make_frame(500)
+        for hashes in (
+            lambda obj, index=False: pd.Series(np.zeros(len(obj), dtype='uint64')), # Every row collides
+            lambda obj, index=False: pd.Series(np.arange(len(obj), dtype='uint64') % 7), # Unrelated rows collide
+        ):
+            with mock.patch.object(pd.util, 'hash_pandas_object', hashes), self.assertLogs(LOGGER, 'INFO') as logs:
+                for keep in ('first', 'last'):
+                    np.testing.assert_array_equal(duplicated_rows(df, keep), df.duplicated(keep=keep).to_numpy())
+            self.assertIn('hash collision', logs.output[0])
+
+    def test_step(self):
+        df = make_frame()
+        kept = DropDuplicates(['t', 'k'], keep='last').apply(df)
+        pd.testing.assert_frame_equal(kept, df.drop_duplicates(['t', 'k'], keep='last'))
+
+        flagged = DropDuplicates(action='flag', flag_column='dup').apply(df)
+        np.testing.assert_array_equal(flagged['dup'].to_numpy(), df.duplicated().to_numpy())
+        # Flagging again compares rows without the previous flag
+        again = DropDuplicates(action='flag', flag_column='dup').apply(flagged)
+        np.testing.assert_array_equal(again['dup'].to_numpy(), flagged['dup'].to_numpy())
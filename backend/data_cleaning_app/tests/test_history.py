@@ -0,0 +1,122 @@
+from django.test import override_settings
+
+from ..history import enforce_history_limits
+from ..storage import get_dataset_store
+from .base import StoreTestCase, make_frame
+
+
+class HistoryTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.df = make_frame()
+        self.upload(self.df)
+        self.dataset_id = self.client.session['current_dataset_id']
+        self.store = get_dataset_store()
+
+    def filter_above(self, value):
+        response = self.op('op-filter-rows', {'column_name': 'a', 'operator': '>', 'value': str(value)})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def versions(self):
+        return self.client.get(self.url('history')).json()['versions']
+
+    def test_new_operation_clears_redo(self):
+        self.filter_above(10)
+        self.filter_above(20)
+        undone = self.client.session['current_dataset_version']
+        self.op('history-undo')
+        self.op('op-drop-duplicates', {'columns': ['b']})
+
+        self.assertEqual([v['operation'] for v in self.versions()], ['original', 'filter-rows', 'drop-duplicates'])
+        self.assertEqual(self.op('history-redo').status_code, 400)
+        self.assertFalse(self.store.has_step(self.dataset_id, undone))
+        self.assertEqual(self.op('history-jump', {'version': undone}).status_code, 400)
+
+    def test_max_depth_rebases_onto_the_oldest_kept_version(self):
+        with override_settings(DATASET_HISTORY={'MAX_DEPTH': 3}):
+            for value in (10, 20, 30, 40):
+                self.filter_above(value)
+        versions = self.versions()
+        self.assertEqual([v['operation'] for v in versions], ['original', 'filter-rows', 'filter-rows'])
+        self.assertEqual(versions[0]['rows'], int((self.df['a'] > 20).sum()))
+        self.assertTrue(versions[0]['snapshot'])
+        self.assertEqual(versions[-1]['details']['value'], '40')
+
+        # The current data and the recipe still cover every step, forgotten ones included
+        self.assertEqual(len(self.session_frame()), int((self.df['a'] > 40).sum()))
+        recipe = self.client.get(self.url('download-recipe')).json()
+        self.assertEqual(len(recipe['steps']), 4)
+
+        # The versions before the new root are gone
+        response = self.op('history-jump', {'version': versions[0]['version'] - 1})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('not in this dataset', response.json()['error'])
+        undone = self.op('history-jump', {'version': versions[0]['version']})
+        self.assertEqual(undone.json()['total_rows_in_file'], versions[0]['rows'])
+
+    def test_max_depth_keeps_the_current_version(self):
+        self.filter_above(10)
+        self.filter_above(20)
+        self.op('history-jump', {'version': self.versions()[0]['version']})
+        with override_settings(DATASET_HISTORY={'MAX_DEPTH': 1}):
+            self.op('op-replace-missing-rows', {'fill_strategy': 'constant', 'columns_to_fill': ['b'], 'fill_value': 'none'})
+        self.assertEqual([v['operation'] for v in self.versions()], ['original'])
+        frame = self.session_frame()
+        self.assertEqual(len(frame), len(self.df))
+        self.assertEqual(frame['b'].isna().sum(), 0)
+
+    def enforce_limits(self, max_bytes):
+        session = self.client.session
+        with override_settings(DATASET_HISTORY={'MAX_BYTES': max_bytes}):
+            enforce_history_limits(session)
+        session.save()
+
+    def test_max_bytes_drops_snapshots_far_from_the_current_version_first(self):
+        with override_settings(DATASET_HISTORY={'SNAPSHOT_INTERVAL': 1}):
+            for column in ('a', 'd'):
+                self.op('op-replace-missing-rows', {'fill_strategy': 'constant', 'columns_to_fill': [column], 'fill_value': '0'})
+            for value in (10, 20, 30):
+                self.filter_above(value)
+        self.assertTrue(all(v['snapshot'] for v in self.versions()))
+        max_bytes = self.store.nbytes(self.dataset_id) - 1
+        self.enforce_limits(max_bytes)
+        self.assertLessEqual(self.store.nbytes(self.dataset_id), max_bytes)
+
+        versions = self.versions()
+        self.assertEqual(len(versions), 6)
+        self.assertTrue(versions[0]['snapshot'] and versions[-1]['snapshot'])
+        self.assertFalse(versions[1]['snapshot']) # Furthest from the current version
+        self.assertTrue(versions[-2]['snapshot'])
+        # Versions without a snapshot are replayed from an older one
+        response = self.op('history-jump', {'version': versions[1]['version']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.session_frame()['a'].isna().sum(), 0)
+
+    def test_max_bytes_shortens_the_history(self):
+        # One column, rewritten by the first step, so that forgetting the upload frees its data
+        self.df = make_frame(20000)[['a']]
+        self.upload(self.df)
+        self.dataset_id = self.client.session['current_dataset_id']
+        with override_settings(DATASET_HISTORY={'SNAPSHOT_INTERVAL': 1}):
+            self.op('op-replace-missing-rows', {'fill_strategy': 'constant', 'columns_to_fill': ['a'], 'fill_value': '0'})
+            self.filter_above(10)
+            self.filter_above(20)
+        nbytes = self.store.nbytes(self.dataset_id)
+        self.enforce_limits(1) # Less than the current version needs on its own
+        self.assertLess(self.store.nbytes(self.dataset_id), nbytes)
+
+        versions = self.versions()
+        self.assertEqual(versions[0]['operation'], 'original')
+        self.assertLess(len(versions), 4)
+        self.assertGreater(versions[0]['version'], 2) # The upload and the fill that replaced its data are forgotten
+        self.assertEqual(versions[-1]['details']['value'], '20')
+        self.assertTrue(versions[-1]['current'])
+        self.assertEqual(len(self.session_frame()), int((self.df['a'].fillna(0) > 20).sum()))
+
+        response = self.op('history-jump', {'version': 1})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('not in this dataset', response.json()['error'])
+        self.assertEqual(self.op('history-jump', {'version': versions[0]['version']}).status_code, 200)
+        self.assertEqual(self.session_frame()['a'].isna().sum(), 0)
+        self.assertEqual(self.op('history-undo').status_code, 400)
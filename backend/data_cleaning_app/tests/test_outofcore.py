@@ -0,0 +1,78 @@
+import io
+
+import numpy as np
+import pandas as pd
+from django.test import override_settings
+from rest_framework.test import APIClient
+
+from ..outofcore import OutOfCoreFrame
+from ..storage import get_session_frame
+from .base import StoreTestCase, make_frame
+
+PLAN = [
+    ('op-filter-rows', {'expression': {'or': [{'column': 'a', 'operator': '>', 'value': '5'}, {'column': 'b', 'operator': 'is_null'}]}}),
+    ('op-replace-missing-rows', {'fill_strategy': 'mean', 'columns_to_fill': ['a'], 'group_by': 'b'}),
+    ('op-replace-missing-rows', {'fill_strategy': 'median', 'columns_to_fill': ['d']}),
+    ('op-replace-missing-rows', {'fill_strategy': 'mode', 'columns_to_fill': ['b']}),
+    ('op-encode', {'encoding_strategy': 'one-hot', 'columns_to_encode': ['b']}),
+    ('op-drop-missing', {'strat': 'any'}),
+]
+
+
+def engine(name):
+    return override_settings(DATASET_ENGINE={'ENGINE': name, 'CHUNK_ROWS': 500})
+
+
+class OutOfCoreTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.df = make_frame(3000)
+        self.df.loc[::13, 'd'] = np.nan
+
+    def run_plan(self, name):
+        """Upload and apply PLAN on a fresh session with the ``name`` engine; returns its results."""
+        self.client = APIClient()
+        with engine(name):
+            self.assertEqual(self.upload(self.df).status_code, 200)
+            self.assertEqual(isinstance(get_session_frame(self.client.session), OutOfCoreFrame), name == 'out-of-core')
+            for op, data in PLAN:
+                response = self.op(op, data)
+                self.assertEqual(response.status_code, 200, (name, op, response.json()))
+            return {
+                'rows': response.json()['total_rows_in_file'],
+                'sorted': self.preview(sort_by='d', descending='true', offset=40, limit=20).json()['rows'],
+                'download': pd.read_csv(io.BytesIO(self.download())),
+                'steps': self.client.get(self.url('download-recipe')).json()['steps'],
+            }
+
+    def test_same_results_as_in_memory(self):
+        memory, out_of_core = self.run_plan('memory'), self.run_plan('out-of-core')
+        self.assertEqual(out_of_core['rows'], memory['rows'])
+        self.assertEqual(out_of_core['sorted'], memory['sorted'])
+        pd.testing.assert_frame_equal(out_of_core['download'], memory['download'])
+        self.assertEqual(out_of_core['steps'], memory['steps']) # Fitted the same way, chunk by chunk
+
+        expected = self.df[(self.df['a'] > 5) | self.df['b'].isna()]
+        self.assertEqual(memory['rows'], len(expected))
+        self.assertEqual(memory['download']['a'].isna().sum() + memory['download']['d'].isna().sum(), 0)
+        self.assertIn('b_x', memory['download'].columns)
+
+    def test_whole_dataset_steps_refused(self):
+        with engine('out-of-core'):
+            self.upload(self.df)
+            for op, data in (
+                ('op-replace-missing-rows', {'fill_strategy': 'ffill', 'columns_to_fill': ['a']}),
+                ('op-replace-missing-rows', {'fill_strategy': 'bfill', 'columns_to_fill': ['a']}),
+                ('op-replace-missing-rows', {'fill_strategy': 'linear', 'columns_to_fill': ['a']}),
+                ('op-replace-missing-rows', {'fill_strategy': 'time', 'columns_to_fill': ['a'], 'time_column': 'c'}),
+                ('op-drop-duplicates', {'columns': ['b']}),
+            ):
+                response = self.op(op, data)
+                self.assertEqual(response.status_code, 400, data)
+                self.assertIn('needs the whole dataset in memory', response.json()['error'])
+            versions = self.client.get(self.url('history')).json()['versions']
+            self.assertEqual([v['operation'] for v in versions], ['original'])
+
+            # The same steps work in memory
+            with engine('memory'):
+                self.assertEqual(self.op('op-drop-duplicates', {'columns': ['b']}).status_code, 200)
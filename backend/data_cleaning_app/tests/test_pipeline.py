@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+from django.test import SimpleTestCase
+
+from ..pipeline import (
+    DropColumns, DropDuplicates, DropMissingRows, FillMissing, FilterExpression, FilterRows, FrameSource, FusedMask,
+    LazyFrame, OneHotEncode, fit_and_apply, optimize,
+)
+
+
+def make_frame(n=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'a': rng.integers(0, 100, n).astype(float),
+        'g': rng.choice(['p', 'q', 'r'], n),
+        'b': rng.choice(['x', 'y', 'z', None], n),
+        'd': rng.normal(size=n),
+        'e': rng.integers(0, 5, n),
+    })
+    df.loc[::7, 'a'] = np.nan
+    df.loc[::11, 'd'] = np.nan
+    return df
+
+
+class CountingSource(FrameSource):
+    """A FrameSource that counts the base rows read from it."""
+
+    def __init__(self, df):
+        super().__init__(df)
+        self.rows_read = 0
+
+    def read(self, columns=None, offset=0, length=None):
+        df = super().read(columns, offset, length)
+        self.rows_read += len(df)
+        return df
+
+
+def lazy(df, make_steps):
+    frame = LazyFrame(FrameSource(df))
+    for step in make_steps():
+        frame = frame.then(step)
+    return frame
+
+
+def eager(df, make_steps):
+    for step in make_steps():
+        df = fit_and_apply(step, df)
+    return df
+
+
+class OptimizerTests(SimpleTestCase):
+    """The optimized plan of a lazy frame gives what applying its steps one by one does."""
+
+    def assertSameFrame(self, got, expected):
+        pd.testing.assert_frame_equal(got.reset_index(drop=True), expected.reset_index(drop=True))
+
+    def test_masks_fuse(self):
+        def steps():
+            return [
+                FilterRows('a', '>', '20'),
+                FilterRows('b', '!=', 'x'),
+                FilterExpression({'or': [{'column': 'd', 'operator': '<', 'value': '0.5'}, {'column': 'g', 'operator': '==', 'value': 'p'}]}),
+                DropMissingRows('any'),
+            ]
+        df = make_frame()
+        frame = lazy(df, steps)
+        plan = optimize(frame.steps)
+        self.assertEqual(len(plan), 1)
+        self.assertIsInstance(plan[0], FusedMask)
+        self.assertSameFrame(frame.collect(), eager(df, steps))
+
+    def test_masks_fuse_around_other_steps(self):
+        def steps():
+            return [FilterRows('a', '>', '20'), FilterRows('a', '<', '80'), FillMissing('mean', ['d']), FilterRows('d', '>', '0')]
+        df = make_frame()
+        frame = lazy(df, steps)
+        self.assertEqual([type(s) for s in optimize(frame.steps)], [FusedMask, FillMissing, FilterRows])
+        self.assertSameFrame(frame.collect(), eager(df, steps))
+
+    def test_drop_pushed_past_steps_not_using_it(self):
+        def steps():
+            return [
+                FillMissing('median', ['a', 'd'], group_by='g'),
+                OneHotEncode(['b']),
+                DropDuplicates(['g', 'a']),
+                DropColumns(['e']),
+            ]
+        df = make_frame()
+        frame = lazy(df, steps) # Plans are made of fitted steps
+        self.assertEqual([type(s) for s in optimize(frame.steps)], [DropColumns, FillMissing, OneHotEncode, DropDuplicates])
+        self.assertSameFrame(frame.collect(), eager(df, steps))
+
+    def test_drop_stops_at_a_step_using_it(self):
+        def steps():
+            return [FillMissing('mean', ['a'], group_by='e'), DropDuplicates(['e']), DropColumns(['e'])]
+        df = make_frame()
+        frame = lazy(df, steps)
+        self.assertEqual([type(s) for s in optimize(frame.steps)], [FillMissing, DropDuplicates, DropColumns])
+        self.assertSameFrame(frame.collect(), eager(df, steps))
+
+    def test_drop_not_pushed_past_full_row_duplicates(self):
+        def steps():
+            return [DropDuplicates(), DropColumns(['e'])]
+        df = make_frame()
+        frame = lazy(df, steps)
+        self.assertEqual([type(s) for s in optimize(frame.steps)], [DropDuplicates, DropColumns])
+        self.assertSameFrame(frame.collect(), eager(df, steps))
+
+
+class HeadTests(SimpleTestCase):
+    def frame(self, steps):
+        df = make_frame()
+        source = CountingSource(df)
+        frame = LazyFrame(source)
+        for step in steps:
+            frame = frame.then(step) # Fitting reads the source; only count what head reads
+        frame.preview_chunk_rows = 10
+        source.rows_read = 0
+        return df, source, frame
+
+    def test_row_local_plan_reads_n_rows(self):
+        steps = [FillMissing('mean', ['a']), OneHotEncode(['g']), DropColumns(['e'])]
+        df, source, frame = self.frame(steps)
+        head = frame.head(10)
+        self.assertEqual(source.rows_read, 10)
+        pd.testing.assert_frame_equal(head, eager(df, lambda: [FillMissing('mean', ['a']), OneHotEncode(['g']), DropColumns(['e'])]).head(10))
+
+    def test_filters_read_until_n_rows_pass(self):
+        df, source, frame = self.frame([FilterRows('a', '>', '50')])
+        head = frame.head(10)
+        self.assertEqual(len(head), 10)
+        self.assertLess(source.rows_read, 200)
+        pd.testing.assert_frame_equal(head, df[df['a'] > 50].head(10))
+
+    def test_other_plans_evaluate_every_row(self):
+        df, source, frame = self.frame([FillMissing('ffill', ['a'])])
+        head = frame.head(10)
+        self.assertEqual(source.rows_read, len(df))
+        pd.testing.assert_frame_equal(head, df.assign(a=df['a'].ffill()).head(10))
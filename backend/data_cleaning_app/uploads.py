@@ -0,0 +1,207 @@
+"""
+Uploads deduplicated by content hash.
+
+Team members often upload the very same export. Every uploaded file is
+hashed (SHA-256) while it streams in, by HashingUploadHandler, and the
+parsed data file of each upload is kept in a shared cache under
+``<dataset store root>/uploads/<hash>-<kind>/``. When an upload's hash is
+already there, the new dataset gets the cached data file and ingest report
+instead of parsing the file again.
+
+Cached data files are immutable and shared through hard links: the
+dataset's ``v1`` data file and the cache entry's ``data`` file are the same
+file on disk, so a shared upload costs its disk space once. The link count
+is the reference count. Deleting a dataset, or history dropping its
+original data file, releases its reference, however that happens. Entries
+no dataset refers to any more are evicted after UNUSED_TTL seconds, or
+sooner, least recently used first, once they take more than
+MAX_UNUSED_BYTES. Where the filesystem has no hard links, the file is
+copied instead: the parse is still saved, the disk space is not.
+"""
+import contextlib
+import functools
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler
+
+from .storage import get_dataset_store
+
+DEFAULT_UPLOAD_CACHE = {
+    'ENABLED': True,
+    'MAX_UNUSED_BYTES': 4 * 1024 * 1024 * 1024,
+    'UNUSED_TTL': 24 * 60 * 60,
+}
+UPLOAD_DIGESTS_ATTR = 'upload_digests'
+
+_KEY_RE = re.compile(r'^[0-9a-f]{64}-[a-z0-9]+$')
+
+
+def _config():
+    return {**DEFAULT_UPLOAD_CACHE, **getattr(settings, 'UPLOAD_CACHE', {})}
+
+
+# -----------------------------------------
+# Hashing
+# -----------------------------------------
+
+class HashingUploadHandler(FileUploadHandler):
+    """
+    Hashes each uploaded file as its chunks arrive and passes them on to
+    the next handlers, which still store the file. The digests end up in
+    ``request.upload_digests``, by form field name.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hasher = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hasher.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        digests = getattr(self.request, UPLOAD_DIGESTS_ATTR, None)
+        if digests is None:
+            digests = {}
+            setattr(self.request, UPLOAD_DIGESTS_ATTR, digests)
+        digests[self.field_name] = self.hasher.hexdigest()
+        return None # Let the next handler build the file object
+
+
+def upload_digest(request, field_name, uploaded_file):
+    """The SHA-256 of an uploaded file: as hashed while it arrived, or by reading it now."""
+    digest = (getattr(request, UPLOAD_DIGESTS_ATTR, None) or {}).get(field_name)
+    if digest is not None:
+        return digest
+    hasher = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        hasher.update(chunk)
+    uploaded_file.seek(0)
+    return hasher.hexdigest()
+
+
+# -----------------------------------------
+# Shared cache
+# -----------------------------------------
+
+class UploadCache:
+    """Parsed uploads by content hash, shared with datasets through hard links; see the module docstring."""
+
+    def __init__(self, root, max_unused_bytes, unused_ttl):
+        self.root = str(root)
+        self.max_unused_bytes = max_unused_bytes
+        self.unused_ttl = unused_ttl
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def key(digest, kind):
+        return f"{digest}-{kind}"
+
+    def _entry_dir(self, key):
+        if not _KEY_RE.match(key):
+            raise ValueError(f"Invalid upload cache key: {key!r}")
+        return os.path.join(self.root, key)
+
+    def attach(self, store, key, dataset_id, version):
+        """
+        Make the cached upload ``key`` the data file of ``version`` and copy its
+        ingest report. Returns the entry (columns, num_rows, ...) or None.
+        """
+        entry_dir = self._entry_dir(key)
+        try:
+            with open(os.path.join(entry_dir, 'entry.json')) as f:
+                entry = json.load(f)
+            _link(os.path.join(entry_dir, 'data'), store.path_for(dataset_id, version))
+        except FileNotFoundError: # Not cached, or evicted just now
+            return None
+        os.utime(entry_dir) # Most recently used
+        if entry.get('ingest') is not None:
+            store.save_ingest_report(dataset_id, entry['ingest'])
+        return entry
+
+    def add(self, store, key, dataset_id, version, columns, num_rows):
+        """Share the freshly parsed data file of ``version`` as the cached upload ``key``."""
+        entry_dir = self._entry_dir(key)
+        if os.path.exists(entry_dir):
+            return
+        tmp_dir = os.path.join(self.root, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(tmp_dir)
+        try:
+            _link(store.path_for(dataset_id, version), os.path.join(tmp_dir, 'data'))
+            with open(os.path.join(tmp_dir, 'entry.json'), 'w') as f:
+                json.dump({
+                    'columns': list(columns), 'num_rows': num_rows,
+                    'ingest': store.load_ingest_report(dataset_id), 'created_at': time.time(),
+                }, f)
+            os.rename(tmp_dir, entry_dir)
+        except OSError: # Another process cached the same upload first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict()
+
+    def discard(self, key):
+        """Drop the cached upload ``key``; datasets using it keep their data files."""
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    def entries(self):
+        """Every cached upload with its size, reference count and last use."""
+        found = []
+        for key in os.listdir(self.root):
+            if not _KEY_RE.match(key):
+                continue
+            with contextlib.suppress(FileNotFoundError):
+                data = os.stat(os.path.join(self.root, key, 'data'))
+                found.append({
+                    'key': key, 'bytes': data.st_size, 'references': data.st_nlink - 1,
+                    'last_used': os.stat(os.path.join(self.root, key)).st_mtime,
+                })
+        return found
+
+    def evict(self):
+        """Delete unreferenced entries past UNUSED_TTL, then the least recently used ones over MAX_UNUSED_BYTES."""
+        unused = sorted((e for e in self.entries() if e['references'] == 0), key=lambda e: e['last_used'])
+        cutoff = time.time() - self.unused_ttl
+        unused_bytes = sum(e['bytes'] for e in unused)
+        for entry in unused:
+            if entry['last_used'] >= cutoff and unused_bytes <= self.max_unused_bytes:
+                break
+            shutil.rmtree(os.path.join(self.root, entry['key']), ignore_errors=True)
+            unused_bytes -= entry['bytes']
+
+    def stats(self):
+        entries = self.entries()
+        unused = [e for e in entries if e['references'] == 0]
+        return {
+            'entries': len(entries),
+            'shared_entries': sum(e['references'] > 1 for e in entries),
+            'references': sum(e['references'] for e in entries),
+            'bytes': sum(e['bytes'] for e in entries),
+            'unused_entries': len(unused),
+            'unused_bytes': sum(e['bytes'] for e in unused),
+            'max_unused_bytes': self.max_unused_bytes,
+        }
+
+
+def _link(source, destination):
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    try:
+        os.link(source, destination)
+    except FileNotFoundError:
+        raise
+    except OSError: # No hard links on this filesystem
+        shutil.copyfile(source, destination)
+
+
+@functools.lru_cache(maxsize=None)
+def get_upload_cache():
+    """The shared upload cache of the dataset store, or None when UPLOAD_CACHE['ENABLED'] is off."""
+    config = _config()
+    if not config['ENABLED']:
+        return None
+    return UploadCache(os.path.join(get_dataset_store().root, 'uploads'), config['MAX_UNUSED_BYTES'], config['UNUSED_TTL'])
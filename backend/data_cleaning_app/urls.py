@@ -1,13 +1,48 @@
 # backend/data_cleaning_app/urls.py
 from django.urls import path
-from .views import EncodingView, FilterRowsView, ManageDataFrameView, HandleMissingRowsView, ReplaceMissingValuesView
+from .executors import async_view
+from .views import BatchOperationsView, CacheStatsView, ColumnViewCacheStatsView, DropDuplicatesView, EncodingView, ExcelSheetsView, ExecutorsView, HistoryView, FilterRowsView, ManageDataFrameView, HandleMissingRowsView, JobView, MemoryReportView, MetricsView, PreviewView, ProfileView, RecipeView, ReplaceMissingValuesView, SamplingView, StorageView, UploadCacheStatsView, UploadProgressView
+
+# pandas work runs on the bounded 'heavy' executor, cheap requests on 'light' (see executors.py)
+manage_dataframe = async_view(ManageDataFrameView.as_view(), 'heavy', methods={'GET': 'light'}) # GET is a preview
+download = async_view(ManageDataFrameView.as_view(), 'heavy')
+history = async_view(HistoryView.as_view(), 'light')
+sampling = async_view(SamplingView.as_view(), 'heavy', methods={'GET': 'light'}) # A commit replays on the full data
+job = async_view(JobView.as_view(), 'light')
 
 urlpatterns = [
-    path('dataframe/', ManageDataFrameView.as_view(), name='manage-dataframe'), # For POST, PUT, GET (preview)
-    path('dataframe/download/csv/', ManageDataFrameView.as_view(), {'download_format': 'csv'}, name='download-csv'),
-    path('dataframe/download/xlsx/', ManageDataFrameView.as_view(), {'download_format': 'xlsx'}, name='download-xlsx'),
-    path('dataframe/ops/drop-missing-rows/', HandleMissingRowsView.as_view(), name='op-drop-missing'),
-    path('dataframe/ops/filter-rows/', FilterRowsView.as_view(), name='op-filter-rows'),
-    path('dataframe/ops/replace-missing-rows/', ReplaceMissingValuesView.as_view(), name='op-replace-missing-rows'),
-    path('dataframe/ops/encode/', EncodingView.as_view(), name='op-encode'),
-]
\ No newline at end of file
+    path('dataframe/', manage_dataframe, name='manage-dataframe'), # For POST, PUT, GET (preview)
+    path('dataframe/download/csv/', download, {'download_format': 'csv'}, name='download-csv'),
+    path('dataframe/download/xlsx/', download, {'download_format': 'xlsx'}, name='download-xlsx'),
+    path('dataframe/download/csv.gz/', download, {'download_format': 'csv.gz'}, name='download-csv-gz'),
+    path('dataframe/download/parquet/', download, {'download_format': 'parquet'}, name='download-parquet'),
+    path('dataframe/download/recipe/', async_view(RecipeView.as_view(), 'light'), name='download-recipe'),
+    path('dataframe/preview/', async_view(PreviewView.as_view(), 'light'), name='preview'),
+    path('dataframe/upload-progress/', async_view(UploadProgressView.as_view(), 'light'), name='upload-progress'),
+    path('dataframe/sheets/', async_view(ExcelSheetsView.as_view()), name='excel-sheets'),
+    path('dataframe/ops/drop-missing-rows/', async_view(HandleMissingRowsView.as_view()), name='op-drop-missing'),
+    path('dataframe/ops/filter-rows/', async_view(FilterRowsView.as_view()), name='op-filter-rows'),
+    path('dataframe/ops/replace-missing-rows/', async_view(ReplaceMissingValuesView.as_view()), name='op-replace-missing-rows'),
+    path('dataframe/ops/encode/', async_view(EncodingView.as_view()), name='op-encode'),
+    path('dataframe/ops/drop-duplicates/', async_view(DropDuplicatesView.as_view()), name='op-drop-duplicates'),
+    path('dataframe/ops/batch/', async_view(BatchOperationsView.as_view()), name='op-batch'),
+    path('dataframe/history/', history, name='history'),
+    path('dataframe/history/undo/', history, {'action': 'undo'}, name='history-undo'),
+    path('dataframe/history/redo/', history, {'action': 'redo'}, name='history-redo'),
+    path('dataframe/history/jump/', history, {'action': 'jump'}, name='history-jump'),
+    path('dataframe/sampling/', sampling, name='sampling'),
+    path('dataframe/sampling/commit/', sampling, {'action': 'commit'}, name='sampling-commit'),
+    path('dataframe/sampling/discard/', sampling, {'action': 'discard'}, name='sampling-discard'),
+    path('jobs/<str:job_id>/', job, name='job-status'),
+    path('jobs/<str:job_id>/result/', job, {'action': 'result'}, name='job-result'),
+    path('jobs/<str:job_id>/cancel/', job, {'action': 'cancel'}, name='job-cancel'),
+    path('dataframe/cache-stats/', async_view(CacheStatsView.as_view(), 'light'), name='cache-stats'),
+    path('dataframe/upload-cache-stats/', async_view(UploadCacheStatsView.as_view(), 'light'), name='upload-cache-stats'),
+    path('dataframe/column-view-cache-stats/', async_view(ColumnViewCacheStatsView.as_view(), 'light'), name='column-view-cache-stats'),
+    path('dataframe/memory/', async_view(MemoryReportView.as_view()), name='memory-report'),
+    path('storage/', async_view(StorageView.as_view()), name='storage'),
+    path('dataframe/profile/', async_view(ProfileView.as_view()), name='profile'),
+    # Served directly, so that they answer even when every executor is busy
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('executors/', ExecutorsView.as_view(), name='executors'),
+]
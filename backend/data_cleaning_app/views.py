@@ -1,61 +1,174 @@
-from django.http import HttpResponse
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import parse_etags, quote_etag
+from rest_framework.permissions import IsAdminUser
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
+import hashlib
+import json
+import logging
+import numpy as np
 import pandas as pd
-import io
-import traceback 
+import time
 from sklearn.preprocessing import LabelEncoder
 
+from .cache import get_column_view_cache, get_dataframe_cache
+from .dtypes import column_memory, merge_column_memory
+from .executors import executor_stats, render_executor_metrics
+from .export import CONTENT_TYPES, export_blocks
+from .history import (
+    HistoryError, append_session_step, append_session_steps, describe_timeline, jump_to_version, redo, undo,
+)
+from .excel import SheetError, parse_sheet_selection
+from .ingest import get_upload_progress, ingest_session_csv, ingest_session_excel, list_upload_sheets, read_sample
+from .jobs import (
+    JobNotFound, apply_job_result, cancel_job, describe_job, get_session_job, in_background_job, report_progress,
+    submit_job, wants_background,
+)
+from .lifecycle import QuotaExceeded, schedule_sweep, storage_usage, sweep_datasets
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, observe_dataset, phase, render_metrics
+from .pipeline import (
+    DropColumns, DropDuplicates, DropMissingRows, FillMissing, FilterExpression, FilterRows, LabelEncode, OneHotEncode,
+    StepError, duplicate_groups, fit_and_apply,
+)
+from .recipes import session_recipe
+from .sampling import (
+    SamplingError, commit_sampling, discard_sampling, sampling_options, sampling_summary, start_sampling,
+)
+from .stats import cached_fill_values, session_column_stats
+from .storage import (
+    SESSION_DATASET_ID_KEY, SESSION_DATASET_VERSION_KEY, SESSION_FULL_DATASET_KEY, DatasetNotFound, clear_session_dataset,
+    get_dataset_store, get_session_frame, load_session_dataset, recover_session_version, save_session_dataset,
+)
+from .uploads import HashingUploadHandler, get_upload_cache, upload_digest
+
+logger = logging.getLogger(__name__)
+
 # --------------
 # Helpers
 # --------------
 
+class DatasetUnavailable(Exception):
+    """The session's dataset is stored but could not be opened; it is left as it is."""
+
+
+class DatasetVersionMissing(DatasetUnavailable):
+    """The session's dataset is stored but none of its versions can be opened."""
+
+
 class Helpers:
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        with phase('deserialize'):
+            request.data # DRF parses the body on first access; do it here so it is timed on its own
+
+    def handle_exception(self, exc):
+        if isinstance(exc, DatasetVersionMissing):
+            return Response({"error": str(exc)}, status=status.HTTP_409_CONFLICT)
+        if isinstance(exc, DatasetUnavailable):
+            return Response({"error": str(exc)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return super().handle_exception(exc)
+
+    def _get_frame_from_session(self, request):
+        """Helper to get the session's current version as a LazyFrame (nothing is evaluated yet)."""
+        return self._open_session_dataset(request, get_session_frame, "open")
+
     def _get_df_from_session(self, request):
-        """Helper to retrieve and deserialize DataFrame from session."""
-        serialized_df = request.session.get('current_dataframe_json')
-        if serialized_df:
-            try:
-                df = pd.read_json(serialized_df, orient='split')
-                return df
-            except Exception as e:
-                print(f"MIXIN _get_df_from_session: ERROR deserializing DataFrame: {e}")
-                if 'current_dataframe_json' in request.session:
-                    del request.session['current_dataframe_json']
-                    request.session.save()
-                return None
-        return None
+        """Helper to load the session's DataFrame from the dataset store, fully materialized."""
+        return self._open_session_dataset(request, load_session_dataset, "load")
 
+    def _open_session_dataset(self, request, opener, verb):
+        recovered = False
+        while True:
+            try:
+                return opener(request.session)
+            except DatasetNotFound as e:
+                if recovered: # The version it was moved to went missing as well
+                    raise DatasetVersionMissing(f"Could not {verb} the session's dataset: {e}") from e
+                if not self._recover_session_version(request, e):
+                    return None
+                recovered = True
+            except Exception as e: # E.g. an I/O error: the dataset may well be fine, so keep it
+                logger.exception(f"Could not {verb} the session's dataset", extra={'error': str(e)})
+                raise DatasetUnavailable(f"Could not {verb} the session's dataset: {e}") from e
+
+    def _recover_session_version(self, request, error):
+        """
+        Helper for a DatasetNotFound from the session's dataset. If only the
+        session's version is missing, move the session to the newest version
+        left and return True; if the dataset itself is gone (expired or
+        evicted, see lifecycle.py), forget it and return False.
+        """
+        dataset_id = request.session.get(SESSION_DATASET_ID_KEY)
+        if dataset_id and get_dataset_store().has_dataset(dataset_id):
+            missing = request.session.get(SESSION_DATASET_VERSION_KEY)
+            version = recover_session_version(request.session)
+            request.session.save()
+            if version is None:
+                logger.error("No version of the session's dataset can be opened",
+                             extra={'dataset_id': dataset_id, 'error': str(error)})
+                raise DatasetVersionMissing("The current version of the dataset is missing; please upload the file again.") from error
+            logger.warning("The session's version is gone; moved to the newest one left",
+                           extra={'dataset_id': dataset_id, 'missing_version': missing, 'version': version})
+            return True
+        logger.info("The session's dataset is gone", extra={'error': str(error)})
+        clear_session_dataset(request.session)
+        request.session.save()
+        return False
+
+    @phase('session_write')
+    def _record_step(self, request, frame, step):
+        """Helper to append an operation to the session's plan. Raises StepError for bad parameters."""
+        new_frame = append_session_step(request.session, frame, step)
+        request.session.save()
+        return new_frame
+
+    @phase('session_write')
     def _save_df_to_session(self, request, df, filename=None):
-        """Helper to serialize and save DataFrame and filename to session."""
+        """Helper to write a new DataFrame to the dataset store and save its id and filename to session."""
         if df is not None:
             try:
-                serialized_df = df.to_json(orient='split')
-                request.session['current_dataframe_json'] = serialized_df
+                save_session_dataset(request.session, df)
                 if filename: # Only update filename if explicitly provided
                     request.session['current_filename'] = filename
                 elif 'current_filename' not in request.session and filename is None: # Fallback if never set
                      request.session['current_filename'] = 'edited_file.xlsx'
 
                 request.session.save()
-                # print(f"MIXIN _save_df_to_session: Saved data. Session keys: {list(request.session.keys())}")
             except Exception as e:
-                print(f"MIXIN _save_df_to_session: ERROR serializing or saving: {e}")
+                logger.exception("Could not store the session's dataset", extra={'error': str(e)})
         else: # Clear session data if df is None
-            if 'current_dataframe_json' in request.session:
-                del request.session['current_dataframe_json']
+            clear_session_dataset(request.session)
             if 'current_filename' in request.session: # Optionally clear filename too or leave it
                 del request.session['current_filename']
             request.session.save()
-            # print(f"MIXIN _save_df_to_session: Cleared session data.")
+
+    def _submit_background_job(self, request, method, *args, **kwargs):
+        """Helper to queue this handler in the background job pool instead of running it now."""
+        job = submit_job(request, self, method, args, kwargs)
+        logger.info("Queued background job", extra={'job_id': job['id'], 'operation': job['operation']})
+        return Response({
+            "job_id": job['id'], "status": job['status'],
+            "message": "Operation queued. Poll the job for its progress and result.",
+        }, status=status.HTTP_202_ACCEPTED)
 
     def _get_current_filename_from_session(self, request):
         return request.session.get('current_filename')
 
+    @phase('preview')
+    @phase('preview')
+    def _json_rows(self, df):
+        """Row values as JSON-ready Python objects: numbers stay numbers, missing values become null."""
+        values = df.astype(object).where(df.notna(), None)
+        for column in df.columns[[pd.api.types.is_float_dtype(t) for t in df.dtypes]]:
+            infinite = np.isinf(df[column].to_numpy(dtype=float, na_value=np.nan))
+            if infinite.any(): # Strict JSON has no infinity
+                values.loc[infinite, column] = df.loc[infinite, column].astype(str)
+        return values.values.tolist()
+
     def _prepare_preview_response(self, df, filename, message="Preview updated."):
-        """Helper to create the JSON response for the frontend."""
+        """Helper to create the JSON response for the frontend. ``df`` may be a DataFrame or a LazyFrame."""
         if df is None or filename is None:
             return {
                 "filename": filename or "N/A", "headers": [], "rows": [],
@@ -64,87 +177,144 @@ class Helpers:
             }
         num_preview_rows = 100
         headers = df.columns.tolist()
-        df_preview = df.head(num_preview_rows)
-        rows_data = df_preview.fillna('').astype(str).values.tolist()
-        return {
+        total_rows = len(df)
+        observe_dataset(total_rows, len(headers))
+        # Typed like the preview endpoint's rows, since the frontend shows these as its first page
+        rows_data = self._json_rows(df.head(num_preview_rows))
+        response_data = {
             "filename": filename, "headers": headers, "rows": rows_data,
-            "total_rows_in_file": len(df), "preview_rows_shown": len(rows_data),
+            "total_rows_in_file": total_rows, "preview_rows_shown": len(rows_data),
             "message": message
         }
+        sampling = sampling_summary(self.request.session, total_rows)
+        if sampling: # The rows are a sample's; see sampling.py
+            response_data["sampling"] = sampling
+        return response_data
     
+# -----------------------------------------
+# Operation parameters -> pipeline steps
+# -----------------------------------------
+# Shared by the single-operation views and the batch view, so an operation takes
+# the same parameters either way. Each builder gets the request data and the
+# current column names and raises StepError for invalid parameters.
+
+def _check_columns_exist(requested, columns):
+    for col in requested:
+        if col not in columns:
+            raise StepError(f"Column '{col}' not found in the data.")
+
+
+def build_drop_column_step(data, columns):
+    column_to_drop = data.get('column_name')
+    if not column_to_drop:
+        raise StepError("No column_name provided to drop.")
+    _check_columns_exist([column_to_drop], columns)
+    return DropColumns([column_to_drop])
+
+
+def build_drop_missing_rows_step(data, columns):
+    # 'any': drop row if any NA values are present
+    # 'all': drop row only if all values are NA
+    drop_strategy = str(data.get('strat', 'any')).lower()
+    if drop_strategy not in ['any', 'all']:
+        raise StepError("Invalid 'strategy' parameter. Must be 'any' or 'all'.")
+    return DropMissingRows(how=drop_strategy)
+
+
+def build_filter_rows_step(data, columns):
+    expression = data.get('expression') # A tree of conditions, evaluated as one mask
+    if expression is not None:
+        step = FilterExpression(expression)
+        missing = sorted(c for c in step.referenced_columns() if c not in columns)
+        if missing:
+            raise StepError(f"Column(s) not found in the data: {', '.join(missing)}")
+        return step
+
+    column_name = data.get('column_name')
+    operator = data.get('operator')
+    value_to_filter = data.get('value') # This will be a string from JSON
+    if not all([column_name, operator, value_to_filter is not None]): # value_to_filter can be 0 or False
+        raise StepError("Missing parameters: expression, or column_name, operator and value required.")
+    _check_columns_exist([column_name], columns)
+    return FilterRows(column_name, operator, value_to_filter)
+
+
+def build_replace_missing_step(data, columns):
+    fill_strategy = data.get('fill_strategy')
+    columns_to_fill = data.get('columns_to_fill') # Expected as a list
+    if not fill_strategy:
+        raise StepError("Missing 'fill_strategy' parameter.")
+    if not columns_to_fill or not isinstance(columns_to_fill, list):
+        raise StepError("Missing or invalid 'columns_to_fill' parameter. It should be a list of column names.")
+    group_by = data.get('group_by') or None
+    time_column = data.get('time_column') or None
+    _check_columns_exist(columns_to_fill + [c for c in (group_by, time_column) if c], columns)
+    return FillMissing(
+        str(fill_strategy).lower(), columns_to_fill,
+        fill_value=data.get('fill_value'), group_by=group_by, time_column=time_column,
+    )
+
+
+def build_encode_step(data, columns):
+    encoding_strategy = data.get('encoding_strategy')
+    columns_to_encode = data.get('columns_to_encode')
+    if not encoding_strategy or str(encoding_strategy).lower() not in ['label', 'one-hot']:
+        raise StepError("Invalid or missing 'encoding_strategy'. Must be 'label' or 'one-hot'.")
+    if not columns_to_encode or not isinstance(columns_to_encode, list) or len(columns_to_encode) == 0:
+        raise StepError("Missing or invalid 'columns_to_encode'. It should be a non-empty list of column names.")
+    _check_columns_exist(columns_to_encode, columns)
+    if str(encoding_strategy).lower() == 'label':
+        return LabelEncode(columns_to_encode)
+    max_categories = data.get('max_categories')
+    if max_categories not in (None, ''):
+        try:
+            max_categories = int(max_categories)
+        except (TypeError, ValueError):
+            raise StepError("'max_categories' must be a positive integer.")
+    return OneHotEncode(
+        columns_to_encode, sparse=str(data.get('sparse', '')).lower() in ('1', 'true', 'yes'),
+        max_categories=max_categories or None,
+    )
+
+
+def build_drop_duplicates_step(data, columns):
+    subset = data.get('columns') or None # Compare whole rows by default
+    if subset is not None:
+        if not isinstance(subset, list):
+            raise StepError("Invalid 'columns' parameter. It should be a list of column names.")
+        _check_columns_exist(subset, columns)
+    action = str(data.get('action', 'drop')).lower()
+    flag_column = data.get('flag_column') or 'is_duplicate'
+    if action == 'flag' and flag_column in columns:
+        raise StepError(f"Column '{flag_column}' already exists. Choose another 'flag_column'.")
+    return DropDuplicates(subset, keep=str(data.get('keep', 'first')).lower(), action=action, flag_column=flag_column)
+
+
+# Batch operation name -> builder; the names follow the single-operation URLs
+STEP_BUILDERS = {
+    'drop-column': build_drop_column_step,
+    'drop-missing-rows': build_drop_missing_rows_step,
+    'filter-rows': build_filter_rows_step,
+    'replace-missing-rows': build_replace_missing_step,
+    'encode': build_encode_step,
+    'drop-duplicates': build_drop_duplicates_step,
+}
+
 # -----------------------------------------
 # DataFrame state management
 # -----------------------------------------
 
 # Manage DataFrame & drop columns
-class ManageDataFrameView(APIView):
+class ManageDataFrameView(Helpers, APIView):
     parser_classes = (MultiPartParser, FormParser, JSONParser)
 
-    def _get_df_from_session(self, request):
-        """Helper to retrieve and deserialize DataFrame from session."""
-        print(f"DJANGO _get_df_from_session: Attempting to get. Session ID: {request.session.session_key}")
-        print(f"DJANGO _get_df_from_session: Session keys on get: {list(request.session.keys())}")
-        serialized_df = request.session.get('current_dataframe_json')
-        if serialized_df:
-            try:
-                df = pd.read_json(serialized_df, orient='split')
-                print("DJANGO _get_df_from_session: DataFrame successfully deserialized from session.")
-                return df
-            except Exception as e:
-                print(f"DJANGO _get_df_from_session: ERROR deserializing DataFrame from session: {e}")
-                if 'current_dataframe_json' in request.session:
-                    del request.session['current_dataframe_json']
-                    request.session.save()
-                return None
-        else:
-            print("DJANGO _get_df_from_session: 'current_dataframe_json' not found in session.")
-        return None
-
-    def _save_df_to_session(self, request, df, filename=None):
-        """Helper to serialize and save DataFrame and filename to session."""
-        print(f"DJANGO _save_df_to_session: Attempting to save. Session ID before save: {request.session.session_key}")
-        if df is not None:
-            try:
-                serialized_df = df.to_json(orient='split')
-                # print(f"DJANGO _save_df_to_session: Serialized DF (first 100 chars): {serialized_df[:100]}")
-                request.session['current_dataframe_json'] = serialized_df
-                if filename:
-                    request.session['current_filename'] = filename
-                elif 'current_filename' not in request.session:
-                     request.session['current_filename'] = 'edited_file.xlsx'
-
-                request.session.save()
-                print(f"DJANGO _save_df_to_session: Saved 'current_dataframe_json' and 'current_filename'. Session ID after save: {request.session.session_key}")
-                print(f"DJANGO _save_df_to_session: Session keys after save: {list(request.session.keys())}")
-            except Exception as e:
-                print(f"DJANGO _save_df_to_session: ERROR serializing or saving to session: {e}")
-        else:
-            if 'current_dataframe_json' in request.session:
-                del request.session['current_dataframe_json']
-            if 'current_filename' in request.session:
-                del request.session['current_filename']
-            request.session.save()
-            print(f"DJANGO _save_df_to_session: Cleared session data. Session ID after clear: {request.session.session_key}")
-
-    def _prepare_preview_response(self, df, filename, message="Preview updated."):
-        if df is None or filename is None:
-            return {
-                "filename": filename or "N/A", "headers": [], "rows": [],
-                "total_rows_in_file": 0, "preview_rows_shown": 0,
-                "message": "No data to display or filename missing."
-            }
-        num_preview_rows = 100
-        headers = df.columns.tolist()
-        df_preview = df.head(num_preview_rows)
-        rows_data = df_preview.fillna('').astype(str).values.tolist()
-        return {
-            "filename": filename, "headers": headers, "rows": rows_data,
-            "total_rows_in_file": len(df), "preview_rows_shown": len(rows_data),
-            "message": message
-        }
+    def initial(self, request, *args, **kwargs):
+        request.upload_handlers.insert(0, HashingUploadHandler(request._request)) # Before the body is parsed
+        super().initial(request, *args, **kwargs)
 
     def post(self, request, *args, **kwargs):
-        print(f"DJANGO POST: Received request. Session ID on entry: {request.session.session_key}")
+        if wants_background(request):
+            return self._submit_background_job(request, 'post', *args, **kwargs)
         if 'file' not in request.FILES:
             return Response({"error": "No file provided."}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -153,85 +323,124 @@ class ManageDataFrameView(APIView):
 
         if not (filename_lower.endswith('.xlsx') or filename_lower.endswith('.csv')):
             return Response({"error": "Invalid file type. Please upload .xlsx or .csv."}, status=status.HTTP_400_BAD_REQUEST)
-
         try:
-            print(f"DJANGO POST: Reading file: {uploaded_file.name}")
-            if filename_lower.endswith('.xlsx'):
-                df = pd.read_excel(uploaded_file, engine='openpyxl')
-            else: # .csv
-                df = pd.read_csv(uploaded_file)
-            print(f"DJANGO POST: File read into DataFrame. Shape: {df.shape}")
+            sheets = parse_sheet_selection(request.data.get('sheet'))
+            sampling = sampling_options(request.data)
+        except (SheetError, SamplingError) as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        # sample=true: answer with the first rows now and parse the whole file as a background job
+        if str(request.data.get('sample', '')).lower() in ('1', 'true', 'yes') and not in_background_job():
+            return self._sample_response(request, uploaded_file, sheets, *args, **kwargs)
 
-            self._save_df_to_session(request, df, uploaded_file.name) # Pass filename
+        try:
+            with phase('operation'):
+                digest = upload_digest(request, 'file', uploaded_file)
+                if filename_lower.endswith('.xlsx'):
+                    ingest_session_excel(request.session, uploaded_file, sheets=sheets, upload_id=request.data.get('upload_id'), digest=digest)
+                else: # .csv, parsed in chunks straight into the dataset store
+                    ingest_session_csv(request.session, uploaded_file, total_bytes=uploaded_file.size, upload_id=request.data.get('upload_id'), digest=digest)
+                message = "File processed successfully."
+                if sampling is not None: # Explore a sample; the full upload is kept for the commit
+                    try:
+                        sampled = start_sampling(request.session, *sampling)
+                    except SamplingError as e:
+                        sampled, message = None, f"{message} Sampling mode was not started: {e} All rows were loaded."
+                    if sampled:
+                        message = (f"{message} Exploring a {sampled['method']} sample of {sampled['sample_rows']} of its "
+                                   f"{sampled['num_rows']} rows; commit to apply your operations to all of them.")
+                        logger.info("Sampling started", extra={k: sampled[k] for k in ('method', 'stratify_by', 'sample_rows', 'num_rows')})
+            with phase('session_write'):
+                request.session['current_filename'] = uploaded_file.name
+                request.session.save()
+            df = self._get_frame_from_session(request)
+            logger.info("Upload stored", extra={'upload_filename': uploaded_file.name, 'bytes': uploaded_file.size})
+            schedule_sweep()
 
-            response_data = self._prepare_preview_response(df, uploaded_file.name, "File processed successfully.")
-            print("DJANGO POST: Prepared response, returning to client.")
+            response_data = self._prepare_preview_response(df, uploaded_file.name, message)
             return Response(response_data, status=status.HTTP_200_OK)
 
+        except QuotaExceeded as e: # The session keeps its current dataset
+            logger.info("Upload over quota", extra={'upload_filename': uploaded_file.name, 'error': str(e)})
+            return Response({"error": str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
         except pd.errors.EmptyDataError:
-            print("DJANGO POST: Error - EmptyDataError")
+            logger.info("Empty upload", extra={'upload_filename': uploaded_file.name})
             self._save_df_to_session(request, None)
             return Response({"error": "The uploaded file is empty."}, status=status.HTTP_400_BAD_REQUEST)
+        except SheetError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except DatasetUnavailable:
+            raise # Stored fine; only reading it back failed
         except Exception as e:
-            print(f"DJANGO POST: Error processing upload: {e}")
-            traceback.print_exc()
+            logger.exception("Upload failed", extra={'upload_filename': uploaded_file.name})
             self._save_df_to_session(request, None)
             return Response({"error": f"Error processing file: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    def _sample_response(self, request, uploaded_file, sheets, *args, **kwargs):
+        """A preview of the upload's first rows, and the id of the background job parsing all of it."""
+        kind = 'xlsx' if uploaded_file.name.lower().endswith('.xlsx') else 'csv'
+        try:
+            with phase('operation'):
+                df = read_sample(uploaded_file, kind, sheets)
+        except pd.errors.EmptyDataError:
+            return Response({"error": "The uploaded file is empty."}, status=status.HTTP_400_BAD_REQUEST)
+        except SheetError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.exception("Upload sample failed", extra={'upload_filename': uploaded_file.name})
+            return Response({"error": f"Error processing file: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        job = submit_job(request, self, 'post', args, kwargs)
+        logger.info("Queued background job", extra={'job_id': job['id'], 'operation': job['operation']})
+        response_data = self._prepare_preview_response(df, uploaded_file.name, f"Showing the first {len(df)} rows while the whole file is parsed.")
+        response_data.pop("sampling", None) # The session's current dataset is still the previous upload
+        response_data.update({"total_rows_in_file": None, "sample": True, "job_id": job['id'], "status": job['status']})
+        return Response(response_data, status=status.HTTP_202_ACCEPTED)
+
     def put(self, request, *args, **kwargs):
-        print(f"DJANGO PUT: Received request. Session ID on entry: {request.session.session_key}")
-        print(f"DJANGO PUT: Request data: {request.data}")
+        if wants_background(request):
+            return self._submit_background_job(request, 'put', *args, **kwargs)
+        logger.debug("Drop column requested", extra={'data': request.data})
         column_to_drop = request.data.get('column_name')
 
         if not column_to_drop:
-            print("DJANGO PUT: Error - No column_name provided.")
             return Response({"error": "No column_name provided to drop."}, status=status.HTTP_400_BAD_REQUEST)
 
-        df = self._get_df_from_session(request)
+        frame = self._get_frame_from_session(request)
         filename = request.session.get('current_filename')
 
-        if df is None: 
+        if frame is None: 
             return Response({"error": "No active DataFrame in session. Please upload a file first."}, status=status.HTTP_400_BAD_REQUEST)
         if filename is None: 
-             print("DJANGO PUT: Error - 'current_filename' not found in session, though DataFrame exists.")
+             logger.warning("Session has a dataset but no filename")
              return Response({"error": "Session inconsistency: Filename missing. Please re-upload."}, status=status.HTTP_400_BAD_REQUEST)
 
-        print(f"DJANGO PUT: DataFrame columns before drop: {df.columns.tolist()}")
-        if column_to_drop not in df.columns:
-            print(f"DJANGO PUT: Column '{column_to_drop}' not found in DataFrame.")
-            response_data = self._prepare_preview_response(df, filename, f"Column '{column_to_drop}' not found in the current data.")
-            self._save_df_to_session(request, df, filename) 
+        if column_to_drop not in frame.columns:
+            response_data = self._prepare_preview_response(frame, filename, f"Column '{column_to_drop}' not found in the current data.")
             return Response(response_data, status=status.HTTP_200_OK)
 
         try:
-            df.drop(columns=[column_to_drop], inplace=True)
-            print(f"DJANGO PUT: DataFrame columns after drop: {df.columns.tolist()}")
-            self._save_df_to_session(request, df, filename) 
+            frame = self._record_step(request, frame, DropColumns([column_to_drop]))
+            logger.info("Column dropped", extra={'column': column_to_drop})
 
-            response_data = self._prepare_preview_response(df, filename, f"Column '{column_to_drop}' dropped successfully.")
-            print("DJANGO PUT: Prepared response, returning to client.")
+            response_data = self._prepare_preview_response(frame, filename, f"Column '{column_to_drop}' dropped successfully.")
             return Response(response_data, status=status.HTTP_200_OK)
         except Exception as e:
-            print(f"DJANGO PUT: Error during df.drop or save: {e}")
-            traceback.print_exc()
+            logger.exception("Dropping a column failed", extra={'column': column_to_drop})
             return Response({"error": f"Error dropping column: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
     def get(self, request, *args, **kwargs):
-        print(f"DJANGO GET: Received request. Path: {request.path}, Session ID: {request.session.session_key}")
-        print(f"DJANGO GET: kwargs from URL: {kwargs}")
+        if wants_background(request):
+            return self._submit_background_job(request, 'get', *args, **kwargs)
 
-        df = self._get_df_from_session(request)
+        frame = self._get_frame_from_session(request)
         filename_in_session = request.session.get('current_filename')
 
         download_format = kwargs.get('download_format') 
 
-        if df is None or filename_in_session is None:
+        if frame is None or filename_in_session is None:
             if download_format: 
-                print(f"DJANGO GET ({download_format.upper()} Download): Error - No active data to download.")
                 return Response({"error": "No active data to download. Please upload a file first."}, status=status.HTTP_404_NOT_FOUND)
             else: 
-                print("DJANGO GET (Preview): No complete active data session found for preview.")
                 return Response(self._prepare_preview_response(None, None, "No active data session found."), status=status.HTTP_200_OK)
 
         if download_format: 
@@ -242,34 +451,112 @@ class ManageDataFrameView(APIView):
                     base_name = filename_in_session
                 output_filename = f"{base_name}_cleaned.{download_format}"
 
-                if download_format == 'xlsx':
-                    buffer = io.BytesIO()
-                    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                        df.to_excel(writer, index=False, sheet_name='Sheet1')
-                    file_content = buffer.getvalue()
-                    content_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-                elif download_format == 'csv':
-                    string_buffer = io.StringIO()
-                    df.to_csv(string_buffer, index=False)
-                    file_content = string_buffer.getvalue().encode('utf-8')
-                    content_type = 'text/csv'
-                else:
+                if download_format not in CONTENT_TYPES:
                     return Response({"error": "Internal server error: Invalid download format specified."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-                response = HttpResponse(file_content, content_type=content_type)
+                if request.session.get(SESSION_FULL_DATASET_KEY): # Only a sample of the rows is loaded
+                    return Response({"error": "Only a sample of the data is loaded. Commit (or discard) the sampled operations before downloading."}, status=status.HTTP_409_CONFLICT)
+                # Rows are evaluated and encoded chunk by chunk while the response is being sent
+                response = StreamingHttpResponse(export_blocks(frame, download_format), content_type=CONTENT_TYPES[download_format])
                 response['Content-Disposition'] = f'attachment; filename="{output_filename}"'
-                print(f"DJANGO GET ({download_format.upper()} Download): Sending file '{output_filename}'")
+                logger.info("Download started", extra={'download_format': download_format, 'download_filename': output_filename})
                 return response
 
             except Exception as e:
-                print(f"DJANGO GET ({download_format.upper()} Download): Error preparing file: {e}")
-                traceback.print_exc()
+                logger.exception("Preparing a download failed", extra={'download_format': download_format})
                 return Response({"error": f"Server error preparing file for download: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         else:
-            response_data = self._prepare_preview_response(df, filename_in_session, "Current data preview retrieved.")
-            print("DJANGO GET (Preview): Prepared response, returning to client.")
+            response_data = self._prepare_preview_response(frame, filename_in_session, "Current data preview retrieved.")
             return Response(response_data, status=status.HTTP_200_OK)
 
+# Poll how far the parsing of an upload has got
+class UploadProgressView(APIView):
+    def get(self, request, *args, **kwargs):
+        upload_id = request.query_params.get('upload_id')
+        if not upload_id:
+            return Response({"error": "Missing 'upload_id' parameter."}, status=status.HTTP_400_BAD_REQUEST)
+        progress = get_upload_progress(upload_id)
+        if progress is None:
+            return Response({"error": f"No upload in progress with id '{upload_id}'."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(progress, status=status.HTTP_200_OK)
+
+
+# List the sheets of an .xlsx file, to choose which to upload (the 'sheet' field of the upload)
+class ExcelSheetsView(APIView):
+    parser_classes = (MultiPartParser, FormParser)
+
+    def post(self, request, *args, **kwargs):
+        if 'file' not in request.FILES:
+            return Response({"error": "No file provided."}, status=status.HTTP_400_BAD_REQUEST)
+        uploaded_file = request.FILES['file']
+        if not uploaded_file.name.lower().endswith('.xlsx'):
+            return Response({"error": "Only .xlsx workbooks have sheets."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            with phase('operation'):
+                sheets, engine = list_upload_sheets(uploaded_file)
+        except Exception as e:
+            logger.info("Could not list sheets", extra={'upload_filename': uploaded_file.name, 'error': str(e)})
+            return Response({"error": f"Could not read the workbook: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"filename": uploaded_file.name, "engine": engine, "sheets": sheets}, status=status.HTTP_200_OK)
+
+
+# Windowed preview: offset/limit, column subset, server-side sort, typed values
+class PreviewView(Helpers, APIView):
+    default_limit = 100
+    max_limit = 1000
+
+    def get(self, request, *args, **kwargs):
+        params = request.query_params
+        try:
+            offset = int(params.get('offset', 0))
+            limit = int(params.get('limit', self.default_limit))
+        except ValueError:
+            return Response({"error": "'offset' and 'limit' must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+        if offset < 0 or not 0 < limit <= self.max_limit:
+            return Response({"error": f"'offset' must be >= 0 and 'limit' between 1 and {self.max_limit}."}, status=status.HTTP_400_BAD_REQUEST)
+        columns = params.getlist('columns') or None # Repeated: ?columns=a&columns=b
+        sort_by = params.get('sort_by') or None
+        descending = str(params.get('descending', '')).lower() in ('1', 'true', 'yes')
+
+        # A version never changes once written, so the window is fully identified by the version and the query
+        etag = quote_etag(hashlib.sha1(json.dumps([
+            request.session.get(SESSION_DATASET_ID_KEY), request.session.get(SESSION_DATASET_VERSION_KEY),
+            self._get_current_filename_from_session(request), offset, limit, columns, sort_by, descending,
+        ]).encode()).hexdigest())
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            response['ETag'] = etag
+            return response
+
+        frame = self._get_frame_from_session(request)
+        filename = self._get_current_filename_from_session(request)
+        if frame is None or filename is None:
+            return Response({"error": "No active data session. Please upload a file first."}, status=status.HTTP_400_BAD_REQUEST)
+        all_columns = frame.columns.tolist()
+        missing = [c for c in (columns or []) + ([sort_by] if sort_by else []) if c not in all_columns]
+        if missing:
+            return Response({"error": f"Column(s) not found: {', '.join(missing)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            window = frame.window(offset, limit, columns=columns, sort_by=sort_by, ascending=not descending)
+            total_rows = len(frame)
+        except StepError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        observe_dataset(total_rows, len(all_columns))
+
+        response = Response({
+            "filename": filename,
+            "version": request.session.get(SESSION_DATASET_VERSION_KEY),
+            "offset": offset, "limit": limit, "total_rows": total_rows,
+            "all_headers": all_columns,
+            "headers": window.columns.tolist(),
+            "dtypes": {c: str(t) for c, t in window.dtypes.items()},
+            "rows": self._json_rows(window),
+            "sort_by": sort_by, "descending": descending,
+        }, status=status.HTTP_200_OK)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache' # Revalidate with If-None-Match every time
+        return response
+
 # ------------------------------------
 # Missing value operations
 # ------------------------------------
@@ -279,59 +566,61 @@ class ReplaceMissingValuesView(Helpers, APIView): # Assuming Helpers is your Dat
     parser_classes = [JSONParser]
 
     def post(self, request, *args, **kwargs): 
-        print(f"DJANGO ReplaceMissingValuesView POST: Received request. Session ID: {request.session.session_key}")
-        print(f"DJANGO ReplaceMissingValuesView POST: Request data: {request.data}")
+        if wants_background(request):
+            return self._submit_background_job(request, 'post', *args, **kwargs)
+        logger.debug("Operation requested", extra={'view': 'ReplaceMissingValuesView', 'data': request.data})
 
-        df = self._get_df_from_session(request)
+        frame = self._get_frame_from_session(request)
         filename = self._get_current_filename_from_session(request)
 
-        if df is None or filename is None:
-            print("DJANGO ReplaceMissingValuesView POST: No active DataFrame or filename in session.")
+        if frame is None or filename is None:
             return Response({"error": "No active data session. Please upload a file first."}, status=status.HTTP_400_BAD_REQUEST)
 
-        fill_strategy = request.data.get('fill_strategy') # Expect 'fill_strategy' from frontend
-        columns_to_fill = request.data.get('columns_to_fill') # Expect 'columns_to_fill' as a list
-
-        if not fill_strategy:
-            return Response({"error": "Missing 'fill_strategy' parameter."}, status=status.HTTP_400_BAD_REQUEST)
-        if not columns_to_fill or not isinstance(columns_to_fill, list):
-            return Response({"error": "Missing or invalid 'columns_to_fill' parameter. It should be a list of column names."}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Validate that all specified columns exist in the DataFrame
-        for col in columns_to_fill:
-            if col not in df.columns:
-                return Response({"error": f"Column '{col}' not found in the data."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            step = build_replace_missing_step(request.data, frame.columns)
+        except StepError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        columns_to_fill = step.columns
+        if step.group_by is None:
+            step.values = cached_fill_values(request.session, step.strategy, columns_to_fill) # None: fitted below
 
         try:
-            df_cleaned = df.copy()
-            message_parts = []
+            frame = self._record_step(request, frame, step)
 
-            if fill_strategy.lower() == 'mean':
-                for column_name in columns_to_fill:
-                    if pd.api.types.is_numeric_dtype(df_cleaned[column_name]):
-                        col_mean = df_cleaned[column_name].mean()
-                        df_cleaned[column_name] = df[column_name].fillna(col_mean)
-                        message_parts.append(f"Column '{column_name}' filled with its mean ({col_mean:.2f}).")
-                    else:
-                        message_parts.append(f"Column '{column_name}' is not numeric; mean imputation skipped.")
-            ### Add elif for 'median', 'mode', 'constant' here later
- 
-            else:
-                return Response({"error": f"Unsupported fill strategy: '{fill_strategy}'."}, status=status.HTTP_400_BAD_REQUEST)
+            methods = {
+                'constant': f"the value '{step.fill_value}'", 'ffill': "the previous value", 'bfill': "the next value",
+                'linear': "linear interpolation", 'time': f"time interpolation along '{step.time_column}'",
+            }
+            dtypes = frame.dtypes
+            interpolated = [
+                c for c in columns_to_fill if pd.api.types.is_numeric_dtype(dtypes[c]) and not pd.api.types.is_bool_dtype(dtypes[c])
+            ]
+            message_parts = []
+            for column_name in columns_to_fill:
+                if step.strategy in ('linear', 'time') and column_name not in interpolated:
+                    message_parts.append(f"Column '{column_name}' is not numeric; interpolation skipped.")
+                elif step.strategy in methods:
+                    message_parts.append(f"Column '{column_name}' filled with {methods[step.strategy]}.")
+                elif column_name not in step.values:
+                    message_parts.append(f"Column '{column_name}' is not numeric; {step.strategy} imputation skipped.")
+                else:
+                    value = step.values[column_name]
+                    shown = f"{value:.2f}" if isinstance(value, float) else repr(value)
+                    within = f" within each '{step.group_by}' group (overall {shown})" if step.group_by else f" ({shown})"
+                    message_parts.append(f"Column '{column_name}' filled with its {step.strategy}{within}.")
 
-            self._save_df_to_session(request, df_cleaned) # Save the modified DataFrame
-            
             final_message = "Missing values processed. " + " ".join(message_parts)
             if not message_parts: # Should not happen if strategy is valid
                  final_message = "No changes made or strategy not fully implemented."
 
-            print(f"DJANGO ReplaceMissingValuesView POST: {final_message}")
-            response_data = self._prepare_preview_response(df_cleaned, filename, final_message)
+            logger.info("Missing values replaced", extra={'strategy': step.strategy, 'columns': columns_to_fill, 'group_by': step.group_by})
+            response_data = self._prepare_preview_response(frame, filename, final_message)
             return Response(response_data, status=status.HTTP_200_OK)
 
+        except StepError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
-            print(f"DJANGO ReplaceMissingValuesView POST: Error replacing missing values: {e}")
-            traceback.print_exc()
+            logger.exception("Replacing missing values failed")
             return Response({"error": f"An error occurred while replacing missing values: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
@@ -340,44 +629,38 @@ class HandleMissingRowsView(Helpers, APIView):
     parser_classes = [JSONParser]
 
     def post(self, request, *args, **kwargs):
-        print(f"DJANGO HandleMissingRowsView POST: Received request. Session ID: {request.session.session_key}")
-        print(f"DJANGO HandleMissingRowsView POST: Request data: {request.data}")
+        if wants_background(request):
+            return self._submit_background_job(request, 'post', *args, **kwargs)
+        logger.debug("Operation requested", extra={'view': 'HandleMissingRowsView', 'data': request.data})
 
-        df = self._get_df_from_session(request)
+        frame = self._get_frame_from_session(request)
         filename = self._get_current_filename_from_session(request)
 
-        if df is None or filename is None:
-            print("DJANGO HandleMissingRowsView POST: No active DataFrame or filename in session.")
+        if frame is None or filename is None:
             return Response({"error": "No active data session. Please upload a file first."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Get the strategy from the request data, default to 'any' if not provided
-        # 'any': drop row if any NA values are present
-        # 'all': drop row only if all values are NA
-        drop_strategy = request.data.get('strat', 'any').lower()
-
-        if drop_strategy not in ['any', 'all']:
-            return Response({"error": "Invalid 'strategy' parameter. Must be 'any' or 'all'."}, status=status.HTTP_400_BAD_REQUEST)
-
         try:
-            original_row_count = len(df)
-            # Apply dropna with the specified strategy
-            df_cleaned = df.dropna(how=drop_strategy, axis=0) # axis=0 for rows
-            rows_dropped = original_row_count - len(df_cleaned)
+            step = build_drop_missing_rows_step(request.data, frame.columns)
+        except StepError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        drop_strategy = step.how
 
-            self._save_df_to_session(request, df_cleaned) # Save the modified DataFrame
+        try:
+            original_row_count = len(frame)
+            frame = self._record_step(request, frame, step)
+            rows_dropped = original_row_count - len(frame)
 
             strategy_desc = "any missing values" if drop_strategy == 'any' else "all missing values"
             message = f"{rows_dropped} row(s) with {strategy_desc} dropped successfully."
             if rows_dropped == 0:
                 message = f"No rows found with {strategy_desc} to drop."
             
-            print(f"DJANGO HandleMissingRowsView POST: {message}")
-            response_data = self._prepare_preview_response(df_cleaned, filename, message)
+            logger.info("Rows with missing values dropped", extra={'how': drop_strategy, 'rows_dropped': rows_dropped})
+            response_data = self._prepare_preview_response(frame, filename, message)
             return Response(response_data, status=status.HTTP_200_OK)
 
         except Exception as e:
-            print(f"DJANGO HandleMissingRowsView POST: Error processing missing rows: {e}")
-            traceback.print_exc()
+            logger.exception("Dropping rows with missing values failed")
             return Response({"error": f"An error occurred while processing missing rows: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
@@ -389,121 +672,124 @@ class FilterRowsView(Helpers, APIView):
     parser_classes = [JSONParser]
 
     def post(self, request, *args, **kwargs):
-        print(f"DJANGO FilterRowsView POST: Received request. Session ID: {request.session.session_key}")
-        print(f"DJANGO FilterRowsView POST: Request data: {request.data}")
+        if wants_background(request):
+            return self._submit_background_job(request, 'post', *args, **kwargs)
+        logger.debug("Operation requested", extra={'view': 'FilterRowsView', 'data': request.data})
 
-        df = self._get_df_from_session(request)
+        frame = self._get_frame_from_session(request)
         filename = self._get_current_filename_from_session(request)
 
-        if df is None or filename is None:
-            print("DJANGO FilterRowsView POST: No active DataFrame or filename in session.")
+        if frame is None or filename is None:
             return Response({"error": "No active data session. Please upload a file first."}, status=status.HTTP_400_BAD_REQUEST)
 
-        column_name = request.data.get('column_name')
-        operator = request.data.get('operator')
-        value_to_filter = request.data.get('value') # This will be a string from JSON
-
-        if not all([column_name, operator, value_to_filter is not None]): # value_to_filter can be 0 or False
-            return Response({"error": "Missing parameters: column_name, operator, or value required."}, status=status.HTTP_400_BAD_REQUEST)
-
-        if column_name not in df.columns:
-            return Response({"error": f"Column '{column_name}' not found in the data."}, status=status.HTTP_400_BAD_REQUEST)
-
         try:
-            original_row_count = len(df)
-            col_dtype = df[column_name].dtype  
-            filtered_df = df.copy() 
-
-            if operator in ['>', '>=', '<', '<=']:
-                try:
-                    # Try to convert both column and value to numeric for comparison
-                    ### This might raise errors if conversion isn't possible
-                    numeric_column = pd.to_numeric(filtered_df[column_name], errors='coerce')
-                    numeric_value = float(value_to_filter) # Or int?
-
-                    if operator == '>':
-                        filtered_df = filtered_df[numeric_column > numeric_value]
-                    elif operator == '>=':
-                        filtered_df = filtered_df[numeric_column >= numeric_value]
-                    elif operator == '<':
-                        filtered_df = filtered_df[numeric_column < numeric_value]
-                    elif operator == '<=':
-                        filtered_df = filtered_df[numeric_column <= numeric_value]
-                except ValueError:
-                    return Response({"error": f"Cannot perform numeric comparison on column '{column_name}' with value '{value_to_filter}'. Ensure data types are compatible."}, status=status.HTTP_400_BAD_REQUEST)
-            
-            elif operator == '==':
-                # For equality, try to match type if possible, otherwise string comparison
-                try:
-                    if pd.api.types.is_numeric_dtype(col_dtype):
-                        typed_value = pd.to_numeric(value_to_filter)
-                        filtered_df = filtered_df[pd.to_numeric(filtered_df[column_name], errors='coerce') == typed_value]
-                    elif pd.api.types.is_datetime64_any_dtype(col_dtype):
-                        typed_value = pd.to_datetime(value_to_filter)
-                        filtered_df = filtered_df[pd.to_datetime(filtered_df[column_name], errors='coerce') == typed_value]
-                    elif pd.api.types.is_bool_dtype(col_dtype):
-                        typed_value = str(value_to_filter).lower() in ['true', '1', 'yes']
-                        # Be careful with boolean conversion from string
-                        bool_series = filtered_df[column_name].astype(str).str.lower().isin(['true', '1', 'yes'])
-                        filtered_df = filtered_df[bool_series == typed_value]
-                    else: # Default to string comparison
-                        filtered_df = filtered_df[filtered_df[column_name].astype(str) == str(value_to_filter)]
-                except Exception as e_conv:
-                     print(f"Type conversion error for '==' operator: {e_conv}")
-                     # Fallback to string comparison if conversion fails
-                     filtered_df = filtered_df[filtered_df[column_name].astype(str) == str(value_to_filter)]
-
-            elif operator == '!=':
-                try:
-                    if pd.api.types.is_numeric_dtype(col_dtype):
-                        typed_value = pd.to_numeric(value_to_filter)
-                        filtered_df = filtered_df[pd.to_numeric(filtered_df[column_name], errors='coerce') != typed_value]
-                    elif pd.api.types.is_datetime64_any_dtype(col_dtype):
-                        typed_value = pd.to_datetime(value_to_filter)
-                        filtered_df = filtered_df[pd.to_datetime(filtered_df[column_name], errors='coerce') != typed_value]
-                    elif pd.api.types.is_bool_dtype(col_dtype):
-                        typed_value = str(value_to_filter).lower() in ['true', '1', 'yes']
-                        bool_series = filtered_df[column_name].astype(str).str.lower().isin(['true', '1', 'yes'])
-                        filtered_df = filtered_df[bool_series != typed_value]
-                    else: # Default to string comparison
-                        filtered_df = filtered_df[filtered_df[column_name].astype(str) != str(value_to_filter)]
-                except Exception as e_conv:
-                     print(f"Type conversion error for '!=' operator: {e_conv}")
-                     filtered_df = filtered_df[filtered_df[column_name].astype(str) != str(value_to_filter)]
-
-            elif operator == 'contains':
-                if pd.api.types.is_string_dtype(col_dtype) or col_dtype == object :
-                    # Ensure column is string type for .str accessor
-                    filtered_df = filtered_df[filtered_df[column_name].astype(str).str.contains(str(value_to_filter), case=False, na=False)]
-                else:
-                    return Response({"error": "'contains' operator is only for text columns."}, status=status.HTTP_400_BAD_REQUEST)
-            
-            elif operator == 'not_contains':
-                if pd.api.types.is_string_dtype(col_dtype) or col_dtype == object :
-                    filtered_df = filtered_df[~filtered_df[column_name].astype(str).str.contains(str(value_to_filter), case=False, na=False)]
-                else:
-                    return Response({"error": "'not_contains' operator is only for text columns."}, status=status.HTTP_400_BAD_REQUEST)
-            else:
-                return Response({"error": f"Unsupported operator: '{operator}'."}, status=status.HTTP_400_BAD_REQUEST)
+            step = build_filter_rows_step(request.data, frame.columns)
+        except StepError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        condition = step.describe()
 
-            rows_remaining = len(filtered_df)
+        try:
+            original_row_count = len(frame)
+            # The mask is only evaluated to count the remaining rows; consecutive filters are fused later
+            frame = self._record_step(request, frame, step)
+            rows_remaining = len(frame)
             rows_filtered_out = original_row_count - rows_remaining
 
-            self._save_df_to_session(request, filtered_df)
-
-            message = f"{rows_filtered_out} row(s) filtered out based on condition: '{column_name} {operator} {value_to_filter}'. {rows_remaining} row(s) remaining."
+            message = f"{rows_filtered_out} row(s) filtered out based on condition: '{condition}'. {rows_remaining} row(s) remaining."
             if rows_filtered_out == 0 :
-                 message = f"No rows met the filter condition to be removed: '{column_name} {operator} {value_to_filter}'. All {original_row_count} rows remain."
+                 message = f"No rows met the filter condition to be removed: '{condition}'. All {original_row_count} rows remain."
             
-            print(f"DJANGO FilterRowsView POST: {message}")
-            response_data = self._prepare_preview_response(filtered_df, filename, message)
+            logger.info("Rows filtered", extra={'condition': condition, 'rows_removed': rows_filtered_out, 'rows_remaining': rows_remaining})
+            response_data = self._prepare_preview_response(frame, filename, message)
             return Response(response_data, status=status.HTTP_200_OK)
 
+        except StepError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
-            print(f"DJANGO FilterRowsView POST: Error filtering rows: {e}")
-            traceback.print_exc()
+            logger.exception("Filtering rows failed")
             return Response({"error": f"An error occurred while filtering rows: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+# -----------------------------
+# Duplicate rows
+# -----------------------------
+
+# Drop or flag duplicate rows; with dry_run, only report them
+class DropDuplicatesView(Helpers, APIView):
+    parser_classes = [JSONParser]
+    sample_groups = 5       # duplicate groups shown by a dry run
+    sample_group_rows = 10  # ...with at most this many row positions each
+
+    def post(self, request, *args, **kwargs):
+        if wants_background(request):
+            return self._submit_background_job(request, 'post', *args, **kwargs)
+        logger.debug("Operation requested", extra={'view': 'DropDuplicatesView', 'data': request.data})
+
+        frame = self._get_frame_from_session(request)
+        filename = self._get_current_filename_from_session(request)
+        if frame is None or filename is None:
+            return Response({"error": "No active data session. Please upload a file first."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            step = build_drop_duplicates_step(request.data, frame.columns)
+        except StepError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if frame.out_of_core:
+            return Response({"error": "Finding duplicate rows needs the whole dataset in memory, which is not available for a dataset this large."}, status=status.HTTP_400_BAD_REQUEST)
+        df = self._get_df_from_session(request)
+        if df is None:
+            return Response({"error": "No active data session. Please upload a file first."}, status=status.HTTP_400_BAD_REQUEST)
+        compared_on = f" (compared on: {', '.join(step.columns)})" if step.columns else ""
+
+        try:
+            if str(request.data.get('dry_run', '')).lower() in ('1', 'true', 'yes'):
+                return Response(self._dry_run(df, step, filename, compared_on), status=status.HTTP_200_OK)
+            with phase('operation'):
+                result = fit_and_apply(step, df)
+            with phase('session_write'):
+                append_session_steps(request.session, [(step, [len(result), len(result.columns)])], df=result)
+                request.session.save()
+
+            if step.action == 'drop':
+                duplicates = len(df) - len(result)
+                message = f"{duplicates} duplicate row(s) dropped, keeping the {step.keep} of each{compared_on}. {len(result)} row(s) remaining."
+            else:
+                duplicates = int(result[step.flag_column].sum())
+                message = f"{duplicates} duplicate row(s) flagged in column '{step.flag_column}', all but the {step.keep} of each{compared_on}."
+            if duplicates == 0:
+                message = f"No duplicate rows found{compared_on}. All {len(df)} rows remain."
+            logger.info("Duplicate rows handled", extra={'action': step.action, 'keep': step.keep, 'columns': step.columns, 'duplicates': duplicates})
+            response_data = self._prepare_preview_response(result, filename, message)
+            response_data["duplicate_rows"] = duplicates
+            return Response(response_data, status=status.HTTP_200_OK)
+
+        except StepError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.exception("Handling duplicate rows failed")
+            return Response({"error": f"An error occurred while handling duplicate rows: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    def _dry_run(self, df, step, filename, compared_on):
+        """How many rows the step would drop or flag, with the first few duplicate groups."""
+        columns = step.columns or list(df.columns)
+        with phase('operation'):
+            groups = duplicate_groups(df[columns])
+        counts = np.bincount(groups, minlength=1)
+        repeated = np.flatnonzero(counts > 1) # Numbered in order of first appearance
+        duplicates = int(counts[repeated].sum()) - len(repeated)
+        sample = []
+        for group in repeated[:self.sample_groups]:
+            rows = np.flatnonzero(groups == group)
+            first = df[columns].iloc[[rows[0]]]
+            values = first.astype(object).where(first.notna(), '').astype(str).iloc[0]
+            sample.append({"count": int(counts[group]), "rows": rows[:self.sample_group_rows].tolist(), "values": dict(values.items())})
+        verb = 'dropped' if step.action == 'drop' else 'flagged'
+        logger.info("Duplicate rows counted", extra={'keep': step.keep, 'columns': step.columns, 'duplicates': duplicates})
+        return {
+            "filename": filename, "dry_run": True,
+            "total_rows": len(df), "duplicate_rows": duplicates, "duplicate_groups": len(repeated),
+            "sample_groups": sample, # Row positions are 0-based in the current version
+            "message": f"{duplicates} duplicate row(s) in {len(repeated)} group(s) would be {verb}{compared_on}. Nothing was changed.",
+        }
+
 # -----------------------------
 # Encoding operations
 # -----------------------------
@@ -513,58 +799,369 @@ class EncodingView(Helpers, APIView):
     parser_classes = [JSONParser]
 
     def post(self, request, *args, **kwargs):
-        print(f"DJANGO EncodingView POST: Received request. Session ID: {request.session.session_key}")
-        print(f"DJANGO EncodingView POST: Request data: {request.data}")
+        if wants_background(request):
+            return self._submit_background_job(request, 'post', *args, **kwargs)
+        logger.debug("Operation requested", extra={'view': 'EncodingView', 'data': request.data})
 
-        df = self._get_df_from_session(request)
+        frame = self._get_frame_from_session(request)
         filename = self._get_current_filename_from_session(request)
 
-        if df is None or filename is None:
+        if frame is None or filename is None:
             return Response({"error": "No active data session. Please upload a file first."}, status=status.HTTP_400_BAD_REQUEST)
 
-        encoding_strategy = request.data.get('encoding_strategy')
-        columns_to_encode = request.data.get('columns_to_encode')
-
-        if not encoding_strategy or encoding_strategy.lower() not in ['label', 'one-hot']:
-            return Response({"error": "Invalid or missing 'encoding_strategy'. Must be 'label' or 'one-hot'."}, status=status.HTTP_400_BAD_REQUEST)
-        if not columns_to_encode or not isinstance(columns_to_encode, list) or len(columns_to_encode) == 0:
-            return Response({"error": "Missing or invalid 'columns_to_encode'. It should be a non-empty list of column names."}, status=status.HTTP_400_BAD_REQUEST)
-        for col in columns_to_encode:
-            if col not in df.columns:
-                return Response({"error": f"Column '{col}' not found in the data."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            step = build_encode_step(request.data, frame.columns)
+        except StepError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        columns_to_encode = step.columns
 
         try:
-            df_cleaned = df.copy()
-            strategy_lower = encoding_strategy.lower()
+            strategy_lower = 'label' if isinstance(step, LabelEncode) else 'one-hot'
 
             if strategy_lower == 'label':
-                print(f"DJANGO EncodingView: Applying Label Encoding to: {columns_to_encode}")
-                for col in columns_to_encode:
-                    # Ensure column is treated as categorical for encoding
-                    df_cleaned[col] = df_cleaned[col].astype('category')
-                    df_cleaned[col] = df_cleaned[col].cat.codes 
+                frame = self._record_step(request, frame, step)
                 message = f"Label Encoding applied to columns: {', '.join(columns_to_encode)}."
 
             elif strategy_lower == 'one-hot':
-                print(f"DJANGO EncodingView: Applying One-Hot Encoding to: {columns_to_encode}")
                 # Handle potential for too many new columns
-                original_col_count = len(df_cleaned.columns)
-                df_cleaned = pd.get_dummies(df_cleaned, columns=columns_to_encode, prefix=columns_to_encode, dtype=int)
-                new_col_count = len(df_cleaned.columns)
+                original_col_count = len(frame.columns)
+                frame = self._record_step(request, frame, step)
+                new_col_count = len(frame.columns)
                 cols_added = new_col_count - (original_col_count - len(columns_to_encode))
-                message = f"One-Hot Encoding applied to {len(columns_to_encode)} column(s), creating {cols_added} new columns."
+                message = f"One-Hot Encoding applied to {len(columns_to_encode)} column(s), creating {cols_added} new {'sparse ' if step.sparse else ''}columns."
+                if step.other:
+                    message += f" Categories beyond the {step.max_categories} most frequent were grouped into an 'other' column for: {', '.join(step.other)}."
             else:
                  # This case is already handled by initial validation, but as a safeguard:
                 return Response({"error": "Internal server error: Invalid encoding strategy reached logic block."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-
-            self._save_df_to_session(request, df_cleaned)
-            print(f"DJANGO EncodingView: {message}")
-            response_data = self._prepare_preview_response(df_cleaned, filename, message)
+            logger.info("Columns encoded", extra={'strategy': strategy_lower, 'columns': columns_to_encode})
+            response_data = self._prepare_preview_response(frame, filename, message)
             return Response(response_data, status=status.HTTP_200_OK)
 
+        except StepError as e: # Includes an encoding that would be too large
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
-            print(f"DJANGO EncodingView: Error encoding columns: {e}")
-            traceback.print_exc()
+            logger.exception("Encoding failed")
             return Response({"error": f"An error occurred while encoding data: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+
+# -----------------------------
+# Batch operations
+# -----------------------------
+
+# Several operations in one request: the data is loaded once, every step is applied in memory
+# and the steps are recorded together at the end. Out-of-core datasets are never loaded whole;
+# their steps are fitted and recorded lazily instead.
+class BatchOperationsView(Helpers, APIView):
+    parser_classes = [JSONParser]
+
+    def post(self, request, *args, **kwargs):
+        if wants_background(request):
+            return self._submit_background_job(request, 'post', *args, **kwargs)
+        logger.debug("Batch requested", extra={'data': request.data})
+
+        operations = request.data.get('operations')
+        if not operations or not isinstance(operations, list):
+            return Response({"error": "Missing or invalid 'operations'. It should be a non-empty list of operations."}, status=status.HTTP_400_BAD_REQUEST)
+        frame = self._get_frame_from_session(request)
+        out_of_core = frame is not None and frame.out_of_core
+        df = frame if frame is None or out_of_core else self._get_df_from_session(request)
+        filename = self._get_current_filename_from_session(request)
+        if df is None or filename is None:
+            return Response({"error": "No active data session. Please upload a file first."}, status=status.HTTP_400_BAD_REQUEST)
+
+        steps, results = [], []
+        started = time.perf_counter()
+        for index, operation in enumerate(operations, start=1):
+            name = operation.get('operation') if isinstance(operation, dict) else None
+            step_started = time.perf_counter()
+            try:
+                if name not in STEP_BUILDERS:
+                    raise StepError(f"Unknown operation {name!r}. Must be one of: {', '.join(STEP_BUILDERS)}.")
+                step = STEP_BUILDERS[name](operation, df.columns)
+                with phase('operation'):
+                    df = df.then(step) if out_of_core else fit_and_apply(step, df)
+            except StepError as e:
+                # Nothing has been recorded yet, so the session is unchanged
+                return Response({"error": f"Operation {index} ({name}): {e}", "steps": results}, status=status.HTTP_400_BAD_REQUEST)
+            except Exception as e:
+                logger.exception("Batch operation failed", extra={'index': index, 'operation': name})
+                return Response({"error": f"An error occurred in operation {index} ({name}): {str(e)}", "steps": results}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            steps.append((step, [len(df), len(df.columns)]))
+            results.append({
+                "operation": name, "rows": len(df), "columns": len(df.columns),
+                "seconds": round(time.perf_counter() - step_started, 4),
+            })
+            report_progress(operations_done=index, operations_total=len(operations)) # When run as a background job
+
+        with phase('session_write'):
+            append_session_steps(request.session, steps, df=None if out_of_core else df)
+            request.session.save()
+        message = f"{len(steps)} operation(s) applied. {len(df)} row(s) and {len(df.columns)} column(s) remaining."
+        logger.info("Batch applied", extra={'operations': [r['operation'] for r in results], 'rows': len(df), 'columns': len(df.columns)})
+        response_data = self._prepare_preview_response(df, filename, message)
+        response_data["steps"] = results
+        response_data["total_seconds"] = round(time.perf_counter() - started, 4)
+        return Response(response_data, status=status.HTTP_200_OK)
+
+
+# -----------------------------
+# History
+# -----------------------------
+
+# List versions, undo / redo, jump to a version
+class HistoryView(Helpers, APIView):
+    parser_classes = [JSONParser]
+
+    def get(self, request, *args, **kwargs):
+        if self._get_frame_from_session(request) is None:
+            return Response({"error": "No active data session. Please upload a file first."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"versions": describe_timeline(request.session)}, status=status.HTTP_200_OK)
+
+    def post(self, request, *args, **kwargs):
+        if wants_background(request):
+            return self._submit_background_job(request, 'post', *args, **kwargs)
+        action = kwargs.get('action')
+        filename = self._get_current_filename_from_session(request)
+
+        if self._get_frame_from_session(request) is None or filename is None:
+            return Response({"error": "No active data session. Please upload a file first."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            if action == 'undo':
+                undo(request.session)
+            elif action == 'redo':
+                redo(request.session)
+            elif action == 'jump':
+                try:
+                    version = int(request.data.get('version'))
+                except (TypeError, ValueError):
+                    return Response({"error": "Missing or invalid 'version' parameter."}, status=status.HTTP_400_BAD_REQUEST)
+                jump_to_version(request.session, version)
+            else:
+                return Response({"error": "Internal server error: Invalid history action specified."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        except HistoryError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        with phase('session_write'):
+            request.session.save()
+        version = request.session[SESSION_DATASET_VERSION_KEY]
+        message = f"Moved to version {version}." if action == 'jump' else f"{action.capitalize()} successful; now at version {version}."
+        logger.info("History moved", extra={'action': action, 'version': version})
+        response_data = self._prepare_preview_response(self._get_frame_from_session(request), filename, message)
+        return Response(response_data, status=status.HTTP_200_OK)
+
+
+# -----------------------------
+# Sampling
+# -----------------------------
+
+# Sampling mode status; commit the sample's operations to the full dataset, or discard them
+class SamplingView(Helpers, APIView):
+    parser_classes = [JSONParser]
+
+    def get(self, request, *args, **kwargs):
+        frame = self._get_frame_from_session(request)
+        if frame is None:
+            return Response({"error": "No active data session. Please upload a file first."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"sampling": sampling_summary(request.session, len(frame))}, status=status.HTTP_200_OK)
+
+    def post(self, request, *args, **kwargs):
+        if wants_background(request):
+            return self._submit_background_job(request, 'post', *args, **kwargs)
+        action = kwargs.get('action')
+        filename = self._get_current_filename_from_session(request)
+        if self._get_frame_from_session(request) is None or filename is None:
+            return Response({"error": "No active data session. Please upload a file first."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            with phase('operation'):
+                if action == 'commit':
+                    result = commit_sampling(request.session)
+                elif action == 'discard':
+                    result = discard_sampling(request.session)
+                else:
+                    return Response({"error": "Internal server error: Invalid sampling action specified."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        except (SamplingError, StepError) as e: # The session stays on the sample
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except DatasetNotFound as e:
+            logger.info("The full dataset of a sample is gone", extra={'error': str(e)})
+            return Response({"error": "The full dataset is no longer available. Please upload the file again."}, status=status.HTTP_410_GONE)
+        except Exception as e:
+            logger.exception("Sampling action failed", extra={'action': action})
+            return Response({"error": f"An error occurred while leaving sampling mode: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        with phase('session_write'):
+            request.session.save()
+        if action == 'commit':
+            message = (f"{result['operations']} operation(s) applied to the full dataset; {result['rows']} of its rows "
+                       f"remain, against {result['sample_rows']} in the sample.")
+        else:
+            message = f"Sample discarded; back to all {result['rows']} rows of the upload."
+        logger.info("Sampling ended", extra={'action': action, **result})
+        response_data = self._prepare_preview_response(self._get_frame_from_session(request), filename, message)
+        response_data.update(sample_rows=result.get('sample_rows'), full_rows=result['rows'])
+        return Response(response_data, status=status.HTTP_200_OK)
+
+
+# -----------------------------
+# Background jobs
+# -----------------------------
+
+# Job status / progress / result, cancellation
+class JobView(APIView):
+    def get(self, request, job_id, *args, **kwargs):
+        try:
+            job = apply_job_result(request.session, get_session_job(request.session, job_id))
+        except JobNotFound as e:
+            return Response({"error": str(e)}, status=status.HTTP_404_NOT_FOUND)
+        request.session.save()
+
+        if kwargs.get('action') != 'result':
+            return Response(describe_job(job), status=status.HTTP_200_OK)
+        result = job.get('result')
+        if job['status'] != 'succeeded' or result is None:
+            return Response({"error": f"Job {job_id} has no result (status: {job['status']})."}, status=status.HTTP_409_CONFLICT)
+        if 'file' in result:
+            return FileResponse(open(result['file'], 'rb'), as_attachment=True, filename=result['filename'], content_type=result['content_type'])
+        return Response(result['data'], status=result['status_code'])
+
+    def post(self, request, job_id, *args, **kwargs):
+        if kwargs.get('action') != 'cancel':
+            return Response({"error": "Internal server error: Invalid job action specified."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        try:
+            job = cancel_job(get_session_job(request.session, job_id))
+        except JobNotFound as e:
+            return Response({"error": str(e)}, status=status.HTTP_404_NOT_FOUND)
+        logger.info("Job cancellation requested", extra={'job_id': job_id, 'status': job['status']})
+        return Response(describe_job(job), status=status.HTTP_200_OK)
+
+
+# -----------------------------
+# Diagnostics
+# -----------------------------
+
+# Request timing, size and dataset shape histograms of this worker, for Prometheus to scrape
+class MetricsView(APIView):
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(render_metrics() + render_executor_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+
+# Queue depths of the view executors, answered without going through them
+class ExecutorsView(APIView):
+    def get(self, request, *args, **kwargs):
+        return Response({"executors": executor_stats()}, status=status.HTTP_200_OK)
+
+
+# Hit/miss/eviction counters for this worker's DataFrame cache
+class CacheStatsView(APIView):
+    def get(self, request, *args, **kwargs):
+        return Response(get_dataframe_cache().stats(), status=status.HTTP_200_OK)
+
+
+# Hit/miss/eviction counters for this worker's cache of typed column views (see ColumnViews)
+class ColumnViewCacheStatsView(APIView):
+    def get(self, request, *args, **kwargs):
+        return Response(get_column_view_cache().stats(), status=status.HTTP_200_OK)
+
+
+# Entries, references and unused bytes of the shared cache of parsed uploads
+class UploadCacheStatsView(APIView):
+    def get(self, request, *args, **kwargs):
+        upload_cache = get_upload_cache()
+        return Response(upload_cache.stats() if upload_cache else {"enabled": False}, status=status.HTTP_200_OK)
+
+
+# Disk used by stored datasets, for staff; POST sweeps expired and over-quota datasets now (dry_run=true, in the query or body, to preview)
+class StorageView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(storage_usage(), status=status.HTTP_200_OK)
+
+    def post(self, request, *args, **kwargs):
+        dry_run = request.data.get('dry_run', request.query_params.get('dry_run', ''))
+        dry_run = str(dry_run).lower() in ('1', 'true', 'yes')
+        result = sweep_datasets(dry_run=dry_run)
+        logger.info("Dataset sweep requested", extra={k: result[k] for k in ('dry_run', 'deleted', 'freed_bytes')})
+        return Response(result, status=status.HTTP_200_OK)
+
+
+# Per-column memory of the current version against what pandas' default types used at upload
+class MemoryReportView(Helpers, APIView):
+    def get(self, request, *args, **kwargs):
+        frame = self._get_frame_from_session(request)
+        # Out-of-core datasets are measured a chunk at a time
+        df = frame if frame is None or frame.out_of_core else self._get_df_from_session(request)
+        filename = self._get_current_filename_from_session(request)
+        if df is None or filename is None:
+            return Response({"error": "No active data session. Please upload a file first."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if frame.out_of_core:
+            memory = {}
+            for chunk in frame.chunks():
+                merge_column_memory(memory, column_memory(chunk))
+        else:
+            memory = column_memory(df)
+        report = get_dataset_store().load_ingest_report(request.session[SESSION_DATASET_ID_KEY]) or {'columns': {}}
+        columns = []
+        for name, (dtype, nbytes) in memory.items():
+            before = report['columns'].get(name) # None for columns added since the upload
+            columns.append({
+                "name": name, "dtype": dtype, "bytes": nbytes,
+                "default_dtype": before['dtype'] if before else None,
+                "default_bytes": before['bytes'] if before else None,
+            })
+        total_bytes = sum(c['bytes'] for c in columns)
+        default_bytes = sum(c['default_bytes'] for c in columns if c['default_bytes'] is not None)
+        compared_bytes = sum(c['bytes'] for c in columns if c['default_bytes'] is not None)
+        return Response({
+            "filename": filename,
+            "version": request.session.get(SESSION_DATASET_VERSION_KEY),
+            "total_rows": len(df), "uploaded_rows": report.get('num_rows'),
+            "columns": columns,
+            "total_bytes": total_bytes,
+            "default_total_bytes": default_bytes,
+            # Over the columns that still exist from the upload
+            "savings_ratio": round(1 - compared_bytes / default_bytes, 4) if default_bytes else None,
+        }, status=status.HTTP_200_OK)
+
+
+class ProfileView(Helpers, APIView):
+    def get(self, request, *args, **kwargs):
+        frame = self._get_frame_from_session(request)
+        filename = self._get_current_filename_from_session(request)
+        if frame is None or filename is None:
+            return Response({"error": "No active data session. Please upload a file first."}, status=status.HTTP_400_BAD_REQUEST)
+        exact = str(request.query_params.get('exact', '')).lower() in ('1', 'true', 'yes')
+
+        start = time.perf_counter()
+        try:
+            with phase('operation'):
+                stats = session_column_stats(request.session, frame, exact=exact)
+        except StepError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        observe_dataset(stats['num_rows'], len(stats['columns']))
+        return Response({
+            "filename": filename,
+            "version": request.session.get(SESSION_DATASET_VERSION_KEY),
+            "num_rows": stats['num_rows'],
+            "approximate": stats['approximate'],
+            "columns": [{"name": name, **column} for name, column in stats['columns'].items()],
+            "computed_columns": stats['computed'], # The rest came from the cache
+            "seconds": round(time.perf_counter() - start, 4),
+        }, status=status.HTTP_200_OK)
+
+
+# The session's steps with their fitted state, for `manage.py apply_recipe`
+class RecipeView(Helpers, APIView):
+    def get(self, request, *args, **kwargs):
+        filename = self._get_current_filename_from_session(request)
+        if filename is None or request.session.get(SESSION_DATASET_ID_KEY) is None:
+            return Response({"error": "No active data session. Please upload a file first."}, status=status.HTTP_404_NOT_FOUND)
+        recipe = session_recipe(request.session, filename)
+        base_name = filename.rsplit('.', 1)[0]
+        response = Response(recipe, status=status.HTTP_200_OK)
+        response['Content-Disposition'] = f'attachment; filename="{base_name}_recipe.json"'
+        return response
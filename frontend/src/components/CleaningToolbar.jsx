@@ -3,6 +3,9 @@ import DropMissingRowsButton from './DropMissing';
 import FilterRowsForm from './FilterRowsForm'; 
 import ReplaceMissingValuesForm from './ReplaceMissing'; 
 import EncodingForm from './EncodingForm';
+import DuplicateRowsForm from './DuplicateRows';
+import HistoryButtons from './HistoryButtons';
+import SamplingControls from './SamplingControls';
 
 // You'll pass API URLs or handler functions from HomePage
 // For simplicity, let's assume HomePage handles the API calls via callbacks
@@ -22,6 +25,7 @@ function CleaningToolbar({
     const [showFilterForm, setShowFilterForm] = useState(false);
     const [showImputeForm, setShowImputeForm] = useState(false);
     const [showEncodingForm, setShowEncodingForm] = useState(false);
+    const [showDuplicatesForm, setShowDuplicatesForm] = useState(false);
 
     const handleFilterSubmit = async (filterPayload) => {
         if (onFilterRows) { // Assuming onFilterRows is the actual API call handler from HomePage
@@ -44,10 +48,20 @@ function CleaningToolbar({
 
     return (
         <div style={toolbarStyle.container}>
+            <SamplingControls
+                currentSheetData={sheetData}
+                onOperationComplete={onOperationComplete}
+                onError={onError}
+                mainIsLoading={mainIsLoading}
+            />
+
             <div style={toolbarStyle.group}>
                 <span style={toolbarStyle.groupLabel}>File:</span>
                 <button onClick={() => onDownloadFile('csv')} disabled={mainIsLoading} style={toolbarStyle.button}>Download CSV</button>
                 <button onClick={() => onDownloadFile('xlsx')} disabled={mainIsLoading} style={toolbarStyle.button}>Download XLSX</button>
+                <button onClick={() => onDownloadFile('csv.gz')} disabled={mainIsLoading} style={toolbarStyle.button}>Download CSV (gzip)</button>
+                <button onClick={() => onDownloadFile('parquet')} disabled={mainIsLoading} style={toolbarStyle.button}>Download Parquet</button>
+                <button onClick={() => onDownloadFile('recipe')} disabled={mainIsLoading} style={toolbarStyle.button} title="The steps applied so far, to replay on other files">Download Recipe</button>
             </div>
 
             <div style={toolbarStyle.group}>
@@ -57,7 +71,12 @@ function CleaningToolbar({
                         {isTableInEditMode ? 'View Mode' : 'Edit Mode'}
                     </button>
                 )}
-
+                <HistoryButtons
+                    currentSheetData={sheetData}
+                    onOperationComplete={onOperationComplete}
+                    onError={onError}
+                    mainIsLoading={mainIsLoading}
+                />
             </div>
 
             <div style={toolbarStyle.group}>
@@ -78,6 +97,9 @@ function CleaningToolbar({
                 <button onClick={() => setShowFilterForm(!showFilterForm)} disabled={mainIsLoading} style={toolbarStyle.button}>
                     {showFilterForm ? 'Hide Filter Form' : 'Filter Rows'}
                 </button>
+                <button onClick={() => setShowDuplicatesForm(!showDuplicatesForm)} disabled={mainIsLoading} style={toolbarStyle.button}>
+                    {showDuplicatesForm ? 'Hide Duplicates Form' : 'Duplicate Rows'}
+                </button>
             </div>
 
             <div style={toolbarStyle.group}>
@@ -109,6 +131,16 @@ function CleaningToolbar({
                     />
                 </div>
             )}
+            {showDuplicatesForm && (
+                <div style={toolbarStyle.formContainer}>
+                    <DuplicateRowsForm
+                        columns={sheetData.headers || []}
+                        onOperationComplete={onOperationComplete} // Pass HomePage's handler
+                        onError={onError}
+                        mainIsLoading={mainIsLoading}
+                    />
+                </div>
+            )}
             {showEncodingForm && (
                 <div style={toolbarStyle.formContainer}>
                     <EncodingForm
@@ -1,6 +1,12 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import axios from 'axios';
 
+const API_PREVIEW_URL = 'http://localhost:8000/data_cleaning_app/dataframe/preview/';
+const ROW_HEIGHT = 36;       // px, fixed so the visible row range follows from scrollTop
+const VIEWPORT_HEIGHT = 600; // px
+const PAGE_SIZE = 100;       // rows per preview request
+const OVERSCAN = 10;         // rows rendered above and below the viewport
+
 // This component now assumes apiBaseUrl will be the endpoint for PUT requests
 // to drop a column, e.g., 'http://localhost:8000/data_cleaning_app/dataframe/'
 // The backend will expect { column_name: 'some_column' } in the PUT body.
@@ -8,12 +14,71 @@ import axios from 'axios';
 function DropColumn({ initialData, onDataUpdated, onError, apiBaseUrl, isEditMode }) {
     const [data, setData] = useState(initialData);
     const [isLoadingAction, setIsLoadingAction] = useState(false); // For the PUT request loading state
+    // Virtual scrolling: only the pages of rows around the viewport are fetched from the preview endpoint
+    const [pages, setPages] = useState({}); // page index -> rows
+    const [totalRows, setTotalRows] = useState(0);
+    const [scrollTop, setScrollTop] = useState(0);
+    const [sort, setSort] = useState({ by: null, descending: false });
+    const requestedPages = useRef(new Set());
+    const generation = useRef(0); // Bumped whenever the data or sort changes; older responses are ignored
+    const scrollContainer = useRef(null);
 
     useEffect(() => {
         console.log("[DropColumn] useEffect - initialData prop received:", initialData);
         setData(initialData);
     }, [initialData]);
 
+    useEffect(() => {
+        generation.current += 1;
+        // The upload / operation response already carries the first rows in natural order, typed like the preview's
+        // The upload / operation response already carries the first rows in natural order
+        const seeded = !sort.by && data && Array.isArray(data.rows) ? { 0: data.rows } : {};
+        if (seeded[0]) requestedPages.current.add(0);
+        setPages(seeded);
+        setTotalRows(data && data.total_rows_in_file ? data.total_rows_in_file : 0);
+    }, [data, sort]);
+
+    const firstRow = Math.max(0, Math.floor(scrollTop / ROW_HEIGHT) - OVERSCAN);
+    const lastRow = Math.min(totalRows, Math.floor(scrollTop / ROW_HEIGHT) + Math.ceil(VIEWPORT_HEIGHT / ROW_HEIGHT) + OVERSCAN);
+
+    useEffect(() => {
+        if (!data || !data.filename || lastRow <= firstRow) return;
+        const requestGeneration = generation.current;
+        for (let page = Math.floor(firstRow / PAGE_SIZE); page <= Math.floor((lastRow - 1) / PAGE_SIZE); page++) {
+            if (requestedPages.current.has(page)) continue;
+            requestedPages.current.add(page);
+            const params = new URLSearchParams({ offset: page * PAGE_SIZE, limit: PAGE_SIZE });
+            if (sort.by) {
+                params.append('sort_by', sort.by);
+                if (sort.descending) params.append('descending', 'true');
+            }
+            // The browser revalidates with the ETag, so windows it has seen come back as 304s
+            axios.get(`${API_PREVIEW_URL}?${params.toString()}`, { withCredentials: true })
+                .then((response) => {
+                    if (requestGeneration !== generation.current) return;
+                    setPages((previous) => ({ ...previous, [page]: response.data.rows }));
+                    setTotalRows(response.data.total_rows);
+                })
+                .catch((err) => {
+                    if (requestGeneration !== generation.current) return;
+                    requestedPages.current.delete(page);
+                    console.error('[DropColumn] Preview window request failed:', err);
+                    if (onError) onError(err.response?.data?.error || 'Failed to load rows.');
+                });
+        }
+    }, [data, sort, firstRow, lastRow, onError]);
+
+    const handleSort = (columnName) => {
+        if (isEditMode) return;
+        if (scrollContainer.current) scrollContainer.current.scrollTop = 0;
+        setScrollTop(0);
+        setSort((previous) => {
+            if (previous.by !== columnName) return { by: columnName, descending: false };
+            if (!previous.descending) return { by: columnName, descending: true };
+            return { by: null, descending: false };
+        });
+    };
+
     const handleDropColumn = async (columnName) => {
         if (!isEditMode || !data || !apiBaseUrl) {
             console.warn("DropColumn: Drop cancelled - not in edit mode, no data, or no apiBaseUrl.");
@@ -67,22 +132,28 @@ function DropColumn({ initialData, onDataUpdated, onError, apiBaseUrl, isEditMod
                 {isEditMode ? 'Editing Columns: ' : 'Data Preview: '}
                 {data.filename}
                 {/* Display row counts if available in the data object */}
-                {(data.preview_rows_shown !== undefined && data.total_rows_in_file !== undefined) && (
-                    <small style={{ marginLeft: '10px', fontWeight: 'normal', color: '#555' }}>
-                        (Displaying {data.preview_rows_shown} of {data.total_rows_in_file} total rows)
-                    </small>
-                )}
+                <small style={{ marginLeft: '10px', fontWeight: 'normal', color: '#555' }}>
+                    ({totalRows} total rows{sort.by ? `, sorted by ${sort.by} ${sort.descending ? 'descending' : 'ascending'}` : ''})
+                </small>
             </h3>
 
             {/* Only render table if there are headers */}
             {data.headers && data.headers.length > 0 ? (
-                <div className="table-responsive">
+                <div
+                    className="table-responsive"
+                    ref={scrollContainer}
+                    style={{ maxHeight: `${VIEWPORT_HEIGHT}px`, overflowY: 'auto' }}
+                    onScroll={(e) => setScrollTop(e.currentTarget.scrollTop)}
+                >
                     <table className="table table-striped table-bordered table-hover table-sm">
-                        <thead>
+                        <thead style={{ position: 'sticky', top: 0, zIndex: 20 }}>
                             <tr>
                                 {data.headers.map((header, index) => (
                                     <th key={`${header}-${index}-${data.filename}`} // More unique key
+                                        onClick={() => handleSort(header)}
+                                        title={isEditMode ? undefined : 'Click to sort'}
                                         style={{
+                                        cursor: isEditMode ? 'default' : 'pointer',
                                         paddingTop: isEditMode ? '30px' : '10px',
                                         paddingBottom: '10px',
                                         paddingLeft: '12px',
@@ -96,7 +167,7 @@ function DropColumn({ initialData, onDataUpdated, onError, apiBaseUrl, isEditMod
                                     }}>
                                         {isEditMode && ( // "X" button uses the isEditMode prop
                                             <button
-                                                onClick={() => handleDropColumn(header)}
+                                                onClick={(e) => { e.stopPropagation(); handleDropColumn(header); }}
                                                 disabled={isLoadingAction}
                                                 title={`Drop column: ${header}`}
                                                 style={{
@@ -112,36 +183,43 @@ function DropColumn({ initialData, onDataUpdated, onError, apiBaseUrl, isEditMod
                                                 onMouseOut={(e) => e.currentTarget.style.backgroundColor = 'rgba(220,53,69,0.8)'}
                                             >X</button>
                                         )}
-                                        <span style={{ display: 'block' }}>{header}</span>
+                                        <span style={{ display: 'block' }}>
+                                            {header}{sort.by === header ? (sort.descending ? ' ▼' : ' ▲') : ''}
+                                        </span>
                                     </th>
                                 ))}
                             </tr>
                         </thead>
                         <tbody>
-                            {/* Check if data.rows exists and is an array before mapping */}
-                            {data.rows && Array.isArray(data.rows) && data.rows.length > 0 ? (
-                                data.rows.map((row, rowIndex) => (
-                                    <tr key={`${data.filename}-row-${rowIndex}`} style={{ borderBottom: '1px solid #eee' }}>
-                                        {/* Ensure each 'row' is also an array before mapping its cells */}
-                                        {Array.isArray(row) ? (
-                                            row.map((cell, cellIndex) => (
-                                                <td key={`${data.filename}-row-${rowIndex}-cell-${cellIndex}`}
-                                                    style={{
-                                                    padding: '8px 12px', whiteSpace: 'nowrap',
-                                                    overflow: 'hidden', textOverflow: 'ellipsis', maxWidth: '300px',
-                                                    borderRight: cellIndex < row.length - 1 ? '1px solid #f0f0f0' : 'none',
-                                                }}>
-                                                    {/* Handle boolean display explicitly */}
-                                                    {typeof cell === 'boolean' ? cell.toString() : (cell === null || cell === undefined ? '' : cell)}
-                                                </td>
-                                            ))
-                                        ) : (
-                                            <td colSpan={data.headers.length} style={{color: 'red', padding: '8px 12px'}}>
-                                                Error: Row data at index {rowIndex} is not in the expected array format.
-                                            </td>
-                                        )}
-                                    </tr>
-                                ))
+                            {totalRows > 0 ? (
+                                <>
+                                    <tr style={{ height: `${firstRow * ROW_HEIGHT}px` }} />
+                                    {Array.from({ length: lastRow - firstRow }, (_, offset) => {
+                                        const rowIndex = firstRow + offset;
+                                        const page = pages[Math.floor(rowIndex / PAGE_SIZE)];
+                                        const row = page ? page[rowIndex % PAGE_SIZE] : undefined;
+                                        return (
+                                            <tr key={`${data.filename}-row-${rowIndex}`} style={{ height: `${ROW_HEIGHT}px`, borderBottom: '1px solid #eee' }}>
+                                                {data.headers.map((header, cellIndex) => {
+                                                    const cell = Array.isArray(row) ? row[cellIndex] : undefined;
+                                                    return (
+                                                        <td key={`${data.filename}-row-${rowIndex}-cell-${cellIndex}`}
+                                                            style={{
+                                                            padding: '8px 12px', whiteSpace: 'nowrap',
+                                                            overflow: 'hidden', textOverflow: 'ellipsis', maxWidth: '300px',
+                                                            borderRight: cellIndex < data.headers.length - 1 ? '1px solid #f0f0f0' : 'none',
+                                                            color: row === undefined ? '#bbb' : undefined,
+                                                        }}>
+                                                            {/* Handle boolean display explicitly; rows still loading show a placeholder */}
+                                                            {row === undefined ? '…' : (typeof cell === 'boolean' ? cell.toString() : (cell === null || cell === undefined ? '' : cell))}
+                                                        </td>
+                                                    );
+                                                })}
+                                            </tr>
+                                        );
+                                    })}
+                                    <tr style={{ height: `${(totalRows - lastRow) * ROW_HEIGHT}px` }} />
+                                </>
                             ) : (
                                 <tr>
                                     <td colSpan={data.headers.length} style={{ textAlign: 'center', padding: '20px', fontStyle: 'italic', color: '#777' }}>
@@ -0,0 +1,117 @@
+import React, { useState, useEffect } from 'react';
+import axios from 'axios';
+
+const API_DUPLICATES_URL = 'http://localhost:8000/data_cleaning_app/dataframe/ops/drop-duplicates/';
+
+function DuplicateRowsForm({ columns, onOperationComplete, onError, mainIsLoading }) {
+    const [selectedColumns, setSelectedColumns] = useState([]); // Empty compares whole rows
+    const [keep, setKeep] = useState('first');
+    const [report, setReport] = useState(null); // Last dry run
+    const [isProcessing, setIsProcessing] = useState(false);
+
+    // Reset the selection and the report if the available columns change
+    useEffect(() => {
+        setSelectedColumns([]);
+        setReport(null);
+    }, [columns]);
+
+    const handleColumnToggle = (columnName) => {
+        setReport(null);
+        setSelectedColumns(prevSelected =>
+            prevSelected.includes(columnName)
+                ? prevSelected.filter(col => col !== columnName)
+                : [...prevSelected, columnName]
+        );
+    };
+
+    const handleAction = async (action, dryRun) => {
+        setIsProcessing(true);
+        if (onError) onError('');
+
+        const payload = { action: action, keep: keep, dry_run: dryRun };
+        if (selectedColumns.length > 0) payload.columns = selectedColumns;
+
+        try {
+            console.log("DuplicateRowsForm: Sending:", payload);
+            const response = await axios.post(API_DUPLICATES_URL, payload, { withCredentials: true });
+            console.log("DuplicateRowsForm: Operation successful", response.data);
+            if (dryRun) {
+                setReport(response.data);
+            } else {
+                setReport(null);
+                if (onOperationComplete) onOperationComplete(response.data);
+            }
+        } catch (err) {
+            console.error("DuplicateRowsForm: Error during operation:", err);
+            const errorMessage = err.response?.data?.error || "Failed to process duplicate rows.";
+            if (onError) onError(errorMessage);
+        } finally {
+            setIsProcessing(false);
+        }
+    };
+
+    if (!columns || columns.length === 0) {
+        return <p>No columns available.</p>;
+    }
+
+    const isDisabled = mainIsLoading || isProcessing;
+
+    return (
+        <div style={{ border: '1px solid #ccc', padding: '15px', borderRadius: '5px', marginTop: '10px' }}>
+            <h4>Duplicate Rows</h4>
+            <div style={{ marginBottom: '10px' }}>
+                <p>Compare on these columns (none selected: whole rows):</p>
+                <div style={{ maxHeight: '150px', overflowY: 'auto', border: '1px solid #eee', padding: '5px' }}>
+                    {columns.map(col => (
+                        <div key={col}>
+                            <input
+                                type="checkbox"
+                                id={`col-check-duplicates-${col}`}
+                                value={col}
+                                checked={selectedColumns.includes(col)}
+                                onChange={() => handleColumnToggle(col)}
+                                disabled={isDisabled}
+                            />
+                            <label htmlFor={`col-check-duplicates-${col}`} style={{ marginLeft: '5px' }}>{col}</label>
+                        </div>
+                    ))}
+                </div>
+            </div>
+            <div style={{ marginBottom: '10px' }}>
+                <label htmlFor="duplicates-keep" style={{ marginRight: '5px' }}>Keep:</label>
+                <select id="duplicates-keep" value={keep} onChange={(e) => { setKeep(e.target.value); setReport(null); }} disabled={isDisabled}>
+                    <option value="first">First occurrence</option>
+                    <option value="last">Last occurrence</option>
+                </select>
+            </div>
+
+            <button onClick={() => handleAction('drop', true)} disabled={isDisabled}>
+                {isProcessing ? 'Processing...' : 'Find Duplicates'}
+            </button>
+            <button onClick={() => handleAction('drop', false)} disabled={isDisabled} style={{ marginLeft: '5px' }}>
+                Drop Duplicates
+            </button>
+            <button onClick={() => handleAction('flag', false)} disabled={isDisabled} style={{ marginLeft: '5px' }} title="Add an 'is_duplicate' column instead of dropping rows">
+                Flag Duplicates
+            </button>
+
+            {report && (
+                <div style={{ marginTop: '10px', fontSize: '0.9em' }}>
+                    <p>{report.message}</p>
+                    {report.sample_groups.length > 0 && (
+                        <ul>
+                            {report.sample_groups.map((group, index) => (
+                                <li key={index}>
+                                    {group.count} rows at positions {group.rows.join(', ')}{group.count > group.rows.length ? ', ...' : ''}:{' '}
+                                    {Object.entries(group.values).map(([col, value]) => `${col}=${value}`).join(', ')}
+                                </li>
+                            ))}
+                        </ul>
+                    )}
+                </div>
+            )}
+        </div>
+    );
+}
+
+export default DuplicateRowsForm;
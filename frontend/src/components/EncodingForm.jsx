@@ -6,6 +6,8 @@ const API_ENCODE_URL = 'http://localhost:8000/data_cleaning_app/dataframe/ops/en
 function EncodingForm({ columns, onOperationComplete, onError, mainIsLoading }) {
     const [selectedColumns, setSelectedColumns] = useState([]);
     const [encodingStrategy, setEncodingStrategy] = useState('label'); // Default strategy
+    const [sparse, setSparse] = useState(false); // One-hot only
+    const [maxCategories, setMaxCategories] = useState(''); // One-hot only; empty keeps every category
     const [isProcessing, setIsProcessing] = useState(false);
 
     // Reset selected columns if the available columns change
@@ -35,6 +37,10 @@ function EncodingForm({ columns, onOperationComplete, onError, mainIsLoading })
             encoding_strategy: encodingStrategy,
             columns_to_encode: selectedColumns,
         };
+        if (encodingStrategy === 'one-hot') {
+            payload.sparse = sparse;
+            if (maxCategories !== '') payload.max_categories = maxCategories;
+        }
 
         try {
             console.log("EncodingForm: Applying encoding:", payload);
@@ -105,6 +111,32 @@ function EncodingForm({ columns, onOperationComplete, onError, mainIsLoading })
                     <label htmlFor="one-hot-encoding" style={{ marginLeft: '5px' }}>One-Hot Encoding (creates new binary [0/1] columns for each category)</label>
                 </div>
             </div>
+            {encodingStrategy === 'one-hot' && (
+                <div style={{ marginBottom: '10px' }}>
+                    <div>
+                        <input
+                            type="checkbox"
+                            id="one-hot-sparse"
+                            checked={sparse}
+                            onChange={(e) => setSparse(e.target.checked)}
+                            disabled={mainIsLoading || isProcessing}
+                        />
+                        <label htmlFor="one-hot-sparse" style={{ marginLeft: '5px' }}>Sparse columns (for columns with many categories)</label>
+                    </div>
+                    <div>
+                        <label htmlFor="one-hot-max-categories" style={{ marginRight: '5px' }}>Keep only the most frequent categories:</label>
+                        <input
+                            type="number"
+                            min="1"
+                            id="one-hot-max-categories"
+                            value={maxCategories}
+                            onChange={(e) => setMaxCategories(e.target.value)}
+                            placeholder="all"
+                            disabled={mainIsLoading || isProcessing}
+                        />
+                    </div>
+                </div>
+            )}
 
             <button type="submit" disabled={mainIsLoading || isProcessing || selectedColumns.length === 0}>
                 {isProcessing ? 'Encoding...' : 'Apply Encoding'}
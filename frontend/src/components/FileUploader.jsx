@@ -2,14 +2,53 @@ import React, { useState } from 'react';
 import axios from 'axios';
 
 const API_UPLOAD_URL = 'http://localhost:8000/data_cleaning_app/dataframe/';
+const API_UPLOAD_PROGRESS_URL = 'http://localhost:8000/data_cleaning_app/dataframe/upload-progress/';
+const API_SHEETS_URL = 'http://localhost:8000/data_cleaning_app/dataframe/sheets/';
+const ALL_SHEETS = '*';
+const PROGRESS_POLL_MS = 500;
+
+function formatProgress(progress) {
+    if (!progress) return '';
+    if (progress.stage === 'uploading') return `Uploading... ${progress.percent}%`;
+    const rows = `${(progress.rows_parsed || 0).toLocaleString()} rows`;
+    if (progress.sheets) return `Parsing... ${progress.sheets_parsed || 0} of ${progress.sheets} sheets, ${rows}`;
+    if (progress.bytes_read === undefined) return `Parsing... ${rows}`; // Excel: no byte offsets
+    const mb = (progress.bytes_read / (1024 * 1024)).toFixed(1);
+    const totalMb = progress.total_bytes ? ` of ${(progress.total_bytes / (1024 * 1024)).toFixed(1)}` : '';
+    return `Parsing... ${mb}${totalMb} MB, ${rows}`;
+}
+
+const isExcel = (file) => file && file.name.toLowerCase().endsWith('.xlsx');
 
 function FileUploader({ onDataLoaded, onError, setIsLoading, isLoading }) { // Props from HomePage
     const [selectedFile, setSelectedFile] = useState(null);
+    const [progress, setProgress] = useState(null);
+    const [sheets, setSheets] = useState([]);
+    const [selectedSheet, setSelectedSheet] = useState('');
+    const [useSample, setUseSample] = useState(false); // Explore a sample; operations are applied to all rows on commit
 
-    const handleFileChange = (event) => {
-        setSelectedFile(event.target.files[0]);
+    const handleFileChange = async (event) => {
+        const file = event.target.files[0];
+        setSelectedFile(file);
+        setSheets([]);
+        setSelectedSheet('');
         if (onError) onError('');
         if (onDataLoaded) onDataLoaded(null);
+        if (!isExcel(file)) return;
+
+        // Let the user pick the sheet(s) to load before uploading the whole workbook
+        const formData = new FormData();
+        formData.append('file', file);
+        try {
+            const response = await axios.post(API_SHEETS_URL, formData, {
+                headers: { 'Content-Type': 'multipart/form-data' },
+                withCredentials: true,
+            });
+            setSheets(response.data.sheets);
+            if (response.data.sheets.length) setSelectedSheet(response.data.sheets[0].name);
+        } catch (err) {
+            if (onError) onError(err.response?.data?.error || 'Could not read the sheets of this workbook.');
+        }
     };
 
     const handleUpload = async () => {
@@ -21,15 +60,39 @@ function FileUploader({ onDataLoaded, onError, setIsLoading, isLoading }) { // P
         if (setIsLoading) setIsLoading(true);
         if (onError) onError(''); // Clear previous errors before new attempt
 
+        // The server reports parsing progress under this id while the upload request runs
+        const uploadId = window.crypto.randomUUID();
         const formData = new FormData();
+        formData.append('upload_id', uploadId);
+        if (isExcel(selectedFile) && selectedSheet) formData.append('sheet', selectedSheet);
+        if (useSample) formData.append('sampling', 'reservoir');
         formData.append('file', selectedFile);
 
+        const pollTimer = setInterval(async () => {
+            try {
+                const response = await axios.get(API_UPLOAD_PROGRESS_URL, {
+                    params: { upload_id: uploadId },
+                    withCredentials: true,
+                });
+                if (response.data.status === 'parsing' || response.data.status === 'writing') {
+                    setProgress({ stage: 'parsing', ...response.data });
+                }
+            } catch (err) {
+                // 404 until the server starts parsing; keep polling
+            }
+        }, PROGRESS_POLL_MS);
+
         try {
             const response = await axios.post(API_UPLOAD_URL, formData, {
                 headers: {
                     'Content-Type': 'multipart/form-data',
                 },
                 withCredentials: true,
+                onUploadProgress: (event) => {
+                    if (event.total) {
+                        setProgress({ stage: 'uploading', percent: Math.round((event.loaded * 100) / event.total) });
+                    }
+                },
             });
             console.log('FileUploader: Upload successful, response.data:', response.data);
             if (onDataLoaded) {
@@ -42,6 +105,8 @@ function FileUploader({ onDataLoaded, onError, setIsLoading, isLoading }) { // P
             if (onError) onError(errorMessage);
             if (onDataLoaded) onDataLoaded(null); // Clear any potentially stale data on error
         } finally {
+            clearInterval(pollTimer);
+            setProgress(null);
             if (setIsLoading) setIsLoading(false);
         }
     };
@@ -50,9 +115,24 @@ function FileUploader({ onDataLoaded, onError, setIsLoading, isLoading }) { // P
         <div>
             {/* <h2>Upload XLSX File</h2>  */}
             <input type="file" accept=".xlsx,.csv" onChange={handleFileChange} />
+            {sheets.length > 1 && (
+                <select value={selectedSheet} onChange={(e) => setSelectedSheet(e.target.value)} disabled={isLoading}>
+                    {sheets.map((sheet) => (
+                        <option key={sheet.index} value={sheet.name}>
+                            {sheet.name}{sheet.rows !== null ? ` (${sheet.rows.toLocaleString()} rows)` : ''}
+                        </option>
+                    ))}
+                    <option value={ALL_SHEETS}>All sheets</option>
+                </select>
+            )}
+            <label style={{ marginRight: '10px' }} title="For large files: operations run on a random sample until you apply them to the full data">
+                <input type="checkbox" checked={useSample} onChange={(e) => setUseSample(e.target.checked)} disabled={isLoading} />
+                {' '}Explore a sample
+            </label>
             <button onClick={handleUpload} disabled={isLoading || !selectedFile}>
                 {isLoading ? 'Uploading...' : 'Upload and Process'}
             </button>
+            {isLoading && progress && <span style={{ marginLeft: '10px' }}>{formatProgress(progress)}</span>}
         </div>
     );
 }
@@ -3,19 +3,22 @@ import axios from 'axios';
 
 const API_FILTER_ROWS_URL = 'http://localhost:8000/data_cleaning_app/dataframe/ops/filter-rows/';
 
+const newCondition = (column) => ({ column: column || '', operator: '==', value: '', negate: false });
+
+// Operators that take no value, and those whose value is a comma-separated list
+const NO_VALUE_OPERATORS = ['is_null', 'not_null'];
+const LIST_OPERATORS = ['in', 'not_in', 'between'];
+const COLUMN_OPERATORS = ['==', '!=', '>', '>=', '<', '<=']; // Can compare against another column
+
 function FilterRowsForm({ columns, onOperationComplete, onError, mainIsLoading }) {
-    const [selectedColumn, setSelectedColumn] = useState('');
-    const [operator, setOperator] = useState('=='); // Default operator
-    const [filterValue, setFilterValue] = useState('');
+    const [conditions, setConditions] = useState([newCondition('')]);
+    const [combinator, setCombinator] = useState('and'); // How the conditions combine
     const [isProcessing, setIsProcessing] = useState(false);
 
-    // Populate column dropdown when columns prop changes
+    // Populate column dropdowns when columns prop changes
     useEffect(() => {
-        if (columns && columns.length > 0) {
-            setSelectedColumn(columns[0]); // Default to first column
-        } else {
-            setSelectedColumn('');
-        }
+        const firstColumn = columns && columns.length > 0 ? columns[0] : '';
+        setConditions([newCondition(firstColumn)]);
     }, [columns]);
 
     const operators = [
@@ -27,28 +30,52 @@ function FilterRowsForm({ columns, onOperationComplete, onError, mainIsLoading }
         { value: '<=', label: 'Less Than or Equals (<=)' },
         { value: 'contains', label: 'Contains (text)' },
         { value: 'not_contains', label: 'Does Not Contain (text)' },
-        // Add more operators: 'isin', 'isnull', 'notnull', etc.
+        { value: 'regex', label: 'Matches Regex (text)' },
+        { value: 'in', label: 'Is One Of (a, b, ...)' },
+        { value: 'not_in', label: 'Is Not One Of (a, b, ...)' },
+        { value: 'between', label: 'Between (low, high)' },
+        { value: 'is_null', label: 'Is Missing' },
+        { value: 'not_null', label: 'Is Not Missing' },
     ];
 
+    const updateCondition = (index, changes) => {
+        setConditions(prev => prev.map((c, i) => (i === index ? { ...c, ...changes } : c)));
+    };
+
+    // One condition as an expression node; values starting with '=' name another column to compare with
+    const toNode = (c) => {
+        const node = { column: c.column, operator: c.operator };
+        const value = c.value.trim();
+        if (NO_VALUE_OPERATORS.includes(c.operator)) {
+            // No value needed
+        } else if (LIST_OPERATORS.includes(c.operator)) {
+            node.value = value.split(',').map(v => v.trim());
+        } else if (COLUMN_OPERATORS.includes(c.operator) && value.startsWith('=') && columns.includes(value.slice(1))) {
+            node.other_column = value.slice(1);
+        } else {
+            node.value = value;
+        }
+        return c.negate ? { not: node } : node;
+    };
+
     const handleSubmit = async (e) => {
         e.preventDefault();
-        if (!selectedColumn || !operator || filterValue.trim() === '') { // filterValue can be "0"
-            if (onError) onError("Please select a column, operator, and enter a value to filter by.");
+        const incomplete = conditions.some(c => !c.column || !c.operator || (!NO_VALUE_OPERATORS.includes(c.operator) && c.value.trim() === '')); // value can be "0"
+        if (incomplete) {
+            if (onError) onError("Please select a column, operator, and enter a value for every condition.");
             return;
         }
 
         setIsProcessing(true);
         if (onError) onError('');
 
+        const nodes = conditions.map(toNode);
+        const expression = nodes.length === 1 ? nodes[0] : { [combinator]: nodes };
         try {
-            console.log("FilterRowsForm: Applying filter:", { selectedColumn, operator, filterValue });
+            console.log("FilterRowsForm: Applying filter:", expression);
             const response = await axios.post(
                 API_FILTER_ROWS_URL,
-                {
-                    column_name: selectedColumn,
-                    operator: operator,
-                    value: filterValue,
-                },
+                { expression }, // All conditions are applied in one operation
                 { withCredentials: true }
             );
             console.log("FilterRowsForm: Filter operation successful", response.data);
@@ -71,39 +98,78 @@ function FilterRowsForm({ columns, onOperationComplete, onError, mainIsLoading }
     return (
         <form onSubmit={handleSubmit} style={{ border: '1px solid #ccc', padding: '15px', borderRadius: '5px', marginTop:'10px' }}>
             <h4>Filter Rows</h4>
-            <div style={{ marginBottom: '10px' }}>
-                <label htmlFor="filter-column" style={{ marginRight: '5px' }}>Column:</label>
-                <select
-                    id="filter-column"
-                    value={selectedColumn}
-                    onChange={(e) => setSelectedColumn(e.target.value)}
-                    disabled={mainIsLoading || isProcessing}
-                >
-                    {columns.map(col => <option key={col} value={col}>{col}</option>)}
-                </select>
-            </div>
-            <div style={{ marginBottom: '10px' }}>
-                <label htmlFor="filter-operator" style={{ marginRight: '5px' }}>Operator:</label>
-                <select
-                    id="filter-operator"
-                    value={operator}
-                    onChange={(e) => setOperator(e.target.value)}
-                    disabled={mainIsLoading || isProcessing}
-                >
-                    {operators.map(op => <option key={op.value} value={op.value}>{op.label}</option>)}
-                </select>
-            </div>
-            <div style={{ marginBottom: '10px' }}>
-                <label htmlFor="filter-value" style={{ marginRight: '5px' }}>Value:</label>
-                <input
-                    type="text" // Keep as text for now; backend handles conversion
-                    id="filter-value"
-                    value={filterValue}
-                    onChange={(e) => setFilterValue(e.target.value)}
-                    placeholder="Enter filter value"
-                    disabled={mainIsLoading || isProcessing}
-                />
-            </div>
+            {conditions.length > 1 && (
+                <div style={{ marginBottom: '10px' }}>
+                    <label htmlFor="filter-combinator" style={{ marginRight: '5px' }}>Keep rows matching:</label>
+                    <select
+                        id="filter-combinator"
+                        value={combinator}
+                        onChange={(e) => setCombinator(e.target.value)}
+                        disabled={mainIsLoading || isProcessing}
+                    >
+                        <option value="and">All conditions (AND)</option>
+                        <option value="or">Any condition (OR)</option>
+                    </select>
+                </div>
+            )}
+            {conditions.map((condition, index) => (
+                <div key={index} style={{ marginBottom: '10px' }}>
+                    <label style={{ marginRight: '5px' }}>
+                        <input
+                            type="checkbox"
+                            checked={condition.negate}
+                            onChange={(e) => updateCondition(index, { negate: e.target.checked })}
+                            disabled={mainIsLoading || isProcessing}
+                        />
+                        NOT
+                    </label>
+                    <select
+                        aria-label="Column"
+                        value={condition.column}
+                        onChange={(e) => updateCondition(index, { column: e.target.value })}
+                        disabled={mainIsLoading || isProcessing}
+                    >
+                        {columns.map(col => <option key={col} value={col}>{col}</option>)}
+                    </select>
+                    <select
+                        aria-label="Operator"
+                        value={condition.operator}
+                        onChange={(e) => updateCondition(index, { operator: e.target.value })}
+                        disabled={mainIsLoading || isProcessing}
+                        style={{ margin: '0 5px' }}
+                    >
+                        {operators.map(op => <option key={op.value} value={op.value}>{op.label}</option>)}
+                    </select>
+                    {!NO_VALUE_OPERATORS.includes(condition.operator) && (
+                        <input
+                            type="text" // Keep as text for now; backend handles conversion
+                            aria-label="Value"
+                            value={condition.value}
+                            onChange={(e) => updateCondition(index, { value: e.target.value })}
+                            placeholder="Value, or =column"
+                            disabled={mainIsLoading || isProcessing}
+                        />
+                    )}
+                    {conditions.length > 1 && (
+                        <button
+                            type="button"
+                            onClick={() => setConditions(prev => prev.filter((_, i) => i !== index))}
+                            disabled={mainIsLoading || isProcessing}
+                            style={{ marginLeft: '5px' }}
+                        >
+                            Remove
+                        </button>
+                    )}
+                </div>
+            ))}
+            <button
+                type="button"
+                onClick={() => setConditions(prev => [...prev, newCondition(columns[0])])}
+                disabled={mainIsLoading || isProcessing}
+                style={{ marginRight: '5px' }}
+            >
+                Add Condition
+            </button>
             <button type="submit" disabled={mainIsLoading || isProcessing}>
                 {isProcessing ? 'Filtering...' : 'Apply Filter'}
             </button>
@@ -0,0 +1,68 @@
+import React, { useState } from 'react';
+import axios from 'axios';
+
+const API_HISTORY_URL = 'http://localhost:8000/data_cleaning_app/dataframe/history/';
+
+function HistoryButtons({ currentSheetData, onOperationComplete, onError, mainIsLoading }) {
+    const [isProcessing, setIsProcessing] = useState(false);
+
+    // Handle undo / redo
+    const handleAction = async (action) => {
+        if (!currentSheetData || !currentSheetData.filename) {
+            if (onError) onError("No data loaded to perform this operation.");
+            return;
+        }
+
+        setIsProcessing(true);
+        if (onError) onError(''); // Clear previous errors
+
+        try {
+            console.log(`HistoryButtons: Calling ${action} endpoint.`);
+            const response = await axios.post(
+                `${API_HISTORY_URL}${action}/`,
+                {},
+                { withCredentials: true }
+            );
+
+            console.log("HistoryButtons: Operation successful", response.data);
+            if (onOperationComplete) {
+                onOperationComplete(response.data); // Pass the updated sheetData back to parent
+            }
+        } catch (err) {
+            console.error(`HistoryButtons: Error during ${action}:`, err);
+            let errorMessage = `Failed to ${action}.`;
+            if (err.response && err.response.data) {
+                if (err.response.data.error) errorMessage = err.response.data.error;
+                else if (err.response.data.detail) errorMessage = err.response.data.detail;
+            }
+            if (onError) onError(errorMessage);
+        } finally {
+            setIsProcessing(false);
+        }
+    };
+
+    const isDisabled = !currentSheetData || !currentSheetData.filename || mainIsLoading || isProcessing;
+
+    return (
+        <div>
+            <button
+                onClick={() => handleAction('undo')}
+                disabled={isDisabled}
+                style={{ padding: '8px 12px', cursor: isDisabled ? 'not-allowed' : 'pointer' }}
+                title="Revert the last operation"
+            >
+                Undo
+            </button>
+            <button
+                onClick={() => handleAction('redo')}
+                disabled={isDisabled}
+                style={{ padding: '8px 12px', cursor: isDisabled ? 'not-allowed' : 'pointer' }}
+                title="Re-apply the last undone operation"
+            >
+                Redo
+            </button>
+        </div>
+    );
+}
+
+export default HistoryButtons;
@@ -3,15 +3,31 @@ import axios from 'axios';
 
 const API_REPLACE_MISSING_URL = 'http://localhost:8000/data_cleaning_app/dataframe/ops/replace-missing-rows/';
 
+const STRATEGIES = [
+    { value: 'mean', label: 'Mean (numeric)' },
+    { value: 'median', label: 'Median (numeric)' },
+    { value: 'mode', label: 'Most frequent value' },
+    { value: 'constant', label: 'Constant value' },
+    { value: 'ffill', label: 'Previous value (forward fill)' },
+    { value: 'bfill', label: 'Next value (backward fill)' },
+    { value: 'linear', label: 'Linear interpolation (numeric)' },
+    { value: 'time', label: 'Time interpolation (numeric)' },
+];
+const GROUPED_STRATEGIES = ['mean', 'median']; // Can be computed within groups of another column
+
 function ReplaceMissingValuesForm({ columns, onOperationComplete, onError, mainIsLoading }) {
     const [selectedColumns, setSelectedColumns] = useState([]);
-    const [fillStrategy] = useState('mean'); // For now, only 'mean' is implemented on backend
-    // const [fillConstantValue, setFillConstantValue] = useState(''); // For 'constant' strategy later
+    const [fillStrategy, setFillStrategy] = useState('mean');
+    const [fillConstantValue, setFillConstantValue] = useState('');
+    const [groupBy, setGroupBy] = useState(''); // Optional, for 'mean' and 'median'
+    const [timeColumn, setTimeColumn] = useState('');
     const [isProcessing, setIsProcessing] = useState(false);
 
     // Reset selected columns if the available columns change (e.g., after a column drop)
     useEffect(() => {
         setSelectedColumns([]);
+        setGroupBy('');
+        setTimeColumn(columns && columns.length > 0 ? columns[0] : '');
     }, [columns]);
 
     const handleColumnToggle = (columnName) => {
@@ -32,6 +48,10 @@ function ReplaceMissingValuesForm({ columns, onOperationComplete, onError, mainI
             if (onError) onError("Please select a fill strategy.");
             return;
         }
+        if (fillStrategy === 'constant' && fillConstantValue === '') {
+            if (onError) onError("Please enter a value to fill with.");
+            return;
+        }
 
         setIsProcessing(true);
         if (onError) onError('');
@@ -41,9 +61,15 @@ function ReplaceMissingValuesForm({ columns, onOperationComplete, onError, mainI
             columns_to_fill: selectedColumns,
         };
 
-        // if (fillStrategy === 'constant') {
-        //     payload.fill_value = fillConstantValue;
-        // }
+        if (fillStrategy === 'constant') {
+            payload.fill_value = fillConstantValue;
+        }
+        if (GROUPED_STRATEGIES.includes(fillStrategy) && groupBy) {
+            payload.group_by = groupBy;
+        }
+        if (fillStrategy === 'time') {
+            payload.time_column = timeColumn;
+        }
 
         try {
             console.log("ReplaceMissingValuesForm: Applying replace missing:", payload);
@@ -69,7 +95,7 @@ function ReplaceMissingValuesForm({ columns, onOperationComplete, onError, mainI
         <form onSubmit={handleSubmit} style={{ border: '1px solid #ccc', padding: '15px', borderRadius: '5px', marginTop: '10px' }}>
             <h4>Replace Missing Values</h4>
             <div style={{ marginBottom: '10px' }}>
-                <p>Select columns to fill NaNs using their respective means (for numeric columns):</p>
+                <p>Select columns to fill missing values in:</p>
                 <div style={{ maxHeight: '150px', overflowY: 'auto', border: '1px solid #eee', padding: '5px' }}>
                     {columns.map(col => (
                         <div key={col}>
@@ -87,14 +113,10 @@ function ReplaceMissingValuesForm({ columns, onOperationComplete, onError, mainI
                 </div>
             </div>
 
-            {/* Strategy selection - currently hardcoded to 'mean' as only one implemented
             <div style={{ marginBottom: '10px' }}>
                 <label htmlFor="fill-strategy" style={{ marginRight: '5px' }}>Strategy:</label>
-                <select id="fill-strategy" value={fillStrategy} onChange={(e) => setFillStrategy(e.target.value)} disabled>
-                    <option value="mean">Mean</option>
-                    // <option value="median">Median</option>
-                    // <option value="mode">Mode</option>
-                    // <option value="constant">Constant Value</option>
+                <select id="fill-strategy" value={fillStrategy} onChange={(e) => setFillStrategy(e.target.value)} disabled={mainIsLoading || isProcessing}>
+                    {STRATEGIES.map(s => <option key={s.value} value={s.value}>{s.label}</option>)}
                 </select>
             </div>
             {fillStrategy === 'constant' && (
@@ -109,9 +131,25 @@ function ReplaceMissingValuesForm({ columns, onOperationComplete, onError, mainI
                     />
                 </div>
             )}
-            */}
+            {GROUPED_STRATEGIES.includes(fillStrategy) && (
+                <div style={{ marginBottom: '10px' }}>
+                    <label htmlFor="fill-group-by" style={{ marginRight: '5px' }}>Within groups of:</label>
+                    <select id="fill-group-by" value={groupBy} onChange={(e) => setGroupBy(e.target.value)} disabled={mainIsLoading || isProcessing}>
+                        <option value="">(whole column)</option>
+                        {columns.map(col => <option key={col} value={col}>{col}</option>)}
+                    </select>
+                </div>
+            )}
+            {fillStrategy === 'time' && (
+                <div style={{ marginBottom: '10px' }}>
+                    <label htmlFor="fill-time-column" style={{ marginRight: '5px' }}>Time column:</label>
+                    <select id="fill-time-column" value={timeColumn} onChange={(e) => setTimeColumn(e.target.value)} disabled={mainIsLoading || isProcessing}>
+                        {columns.map(col => <option key={col} value={col}>{col}</option>)}
+                    </select>
+                </div>
+            )}
             <button type="submit" disabled={mainIsLoading || isProcessing || selectedColumns.length === 0}>
-                {isProcessing ? 'Applying...' : 'Apply Mean Imputation'}
+                {isProcessing ? 'Applying...' : 'Fill Missing Values'}
             </button>
         </form>
     );
@@ -0,0 +1,51 @@
+import React, { useState } from 'react';
+import axios from 'axios';
+
+const API_SAMPLING_URL = 'http://localhost:8000/data_cleaning_app/dataframe/sampling/';
+
+// Shown while the session explores a sample of its upload: commit the operations to all rows, or discard them
+function SamplingControls({ currentSheetData, onOperationComplete, onError, mainIsLoading }) {
+    const [isProcessing, setIsProcessing] = useState(false);
+    const sampling = currentSheetData && currentSheetData.sampling;
+
+    const handleAction = async (action) => {
+        setIsProcessing(true);
+        if (onError) onError('');
+
+        try {
+            console.log(`SamplingControls: Calling ${action} endpoint.`);
+            const response = await axios.post(`${API_SAMPLING_URL}${action}/`, {}, { withCredentials: true });
+            console.log("SamplingControls: Operation successful", response.data);
+            if (onOperationComplete) onOperationComplete(response.data);
+        } catch (err) {
+            console.error(`SamplingControls: Error during ${action}:`, err);
+            const errorMessage = err.response?.data?.error || `Failed to ${action} the sample.`;
+            if (onError) onError(errorMessage);
+        } finally {
+            setIsProcessing(false);
+        }
+    };
+
+    if (!sampling) {
+        return null;
+    }
+
+    const isDisabled = mainIsLoading || isProcessing;
+
+    return (
+        <div style={{ border: '1px solid #e0c060', background: '#fff8e1', padding: '10px', borderRadius: '5px', marginBottom: '10px' }}>
+            <span>
+                Exploring a {sampling.method} sample: {sampling.sample_rows.toLocaleString()} of {sampling.full_rows.toLocaleString()} rows
+                {sampling.stratify_by ? ` (stratified by '${sampling.stratify_by}')` : ''}, about {sampling.estimated_full_rows.toLocaleString()} after these operations.
+            </span>
+            <button onClick={() => handleAction('commit')} disabled={isDisabled} style={{ marginLeft: '10px' }} title="Replay the operations on every row of the upload">
+                {isProcessing ? 'Processing...' : 'Apply to Full Data'}
+            </button>
+            <button onClick={() => handleAction('discard')} disabled={isDisabled} style={{ marginLeft: '5px' }} title="Go back to the full upload without these operations">
+                Discard Sample
+            </button>
+        </div>
+    );
+}
+
+export default SamplingControls;
@@ -7,8 +7,7 @@ import DropColumn from '../components/DropColumn'; // This will now be mainly fo
 import CleaningToolbar from '../components/CleaningToolbar'; // Import the new toolbar
 
 const API_DATAFRAME_BASE_URL = 'http://localhost:8000/data_cleaning_app/dataframe/';
-const API_DOWNLOAD_CSV_URL = `${API_DATAFRAME_BASE_URL}download/csv/`;
-const API_DOWNLOAD_XLSX_URL = `${API_DATAFRAME_BASE_URL}download/xlsx/`;
+const API_DOWNLOAD_URL = `${API_DATAFRAME_BASE_URL}download/`; // + format: csv, csv.gz, xlsx, parquet
 
 
 function HomePage() {
@@ -67,7 +66,7 @@ function HomePage() {
          }
          setIsDownloading(true);
          handleError('');
-         let downloadUrl = format === 'csv' ? API_DOWNLOAD_CSV_URL : API_DOWNLOAD_XLSX_URL;
+         let downloadUrl = `${API_DOWNLOAD_URL}${format}/`;
          try {
              const response = await axios.get(downloadUrl, {
                  responseType: 'blob',